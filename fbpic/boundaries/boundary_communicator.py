@@ -1072,6 +1072,105 @@ class BoundaryCommunicator(object):
             return(gathered_array)
 
 
+    def gather_grid_region( self, array, iz_min, iz_max, Nr_region,
+                            nz=1, nr=1, method='stride', root=0 ):
+        """
+        Gather on the root process a decimated sub-region of a grid array.
+        Each MPI rank only extracts (and sends) the decimated data of the
+        part of the region that it owns.
+
+        The region consists of the cells [iz_min, iz_max) along z (counted
+        from the first cell of the global physical domain) and [0, Nr_region)
+        along r. It is decimated by blocks of nz x nr cells, either by
+        picking the middle cell of each block (method='stride') or by
+        averaging over the block (method='average'). Incomplete blocks at
+        the upper end of the region are discarded.
+
+        Parameter:
+        -----------
+        array: 2darray (grid array)
+            The local grid of the current MPI rank (with guard and damp cells.)
+
+        iz_min, iz_max: ints
+            The indices that bound the region along z
+
+        Nr_region: int
+            The number of cells of the region along r
+
+        nz, nr: ints, optional
+            The decimation factors along z and r
+
+        method: string, optional
+            Either 'stride' or 'average'
+
+        root: int, optional
+            Process that gathers the data
+
+        Returns:
+        ---------
+        gathered_array: 2darray of shape (iz_max-iz_min)//nz, Nr_region//nr
+            (only on the process root)
+        """
+        N_blocks = (iz_max - iz_min)//nz
+        Nr_out = Nr_region//nr
+        _, iz_start_global = self.get_Nz_and_iz(
+                    local=False, with_damp=False, with_guard=False)
+
+        # Select the physical region of the local box
+        Nz_local, iz_start_local_domain = self.get_Nz_and_iz(
+            local=True, with_damp=False, with_guard=False, rank=self.rank )
+        _, iz_start_local_array = self.get_Nz_and_iz(
+            local=True, with_damp=True, with_guard=True, rank=self.rank )
+        iz_in_array = iz_start_local_domain - iz_start_local_array
+        local_array = array[ iz_in_array:iz_in_array+Nz_local, : ]
+
+        # Find the blocks to which each rank contributes
+        block_ranges = []
+        for k in range(self.size):
+            Nz_k, iz_k = self.get_Nz_and_iz( local=True, with_damp=False,
+                                              with_guard=False, rank=k )
+            iz_k = iz_k - iz_start_global
+            block_ranges.append( get_region_block_range(
+                iz_k, iz_k+Nz_k, iz_min, N_blocks, nz, method ) )
+        # Extract the decimated data of the local rank
+        k_start, k_end = block_ranges[self.rank]
+        local_blocks = np.ascontiguousarray( extract_region_blocks(
+            local_array, iz_start_local_domain - iz_start_global,
+            k_start, k_end, iz_min, nz, nr, Nr_out, method ) )
+        # Note: local_blocks needs to be contiguous since is is passed
+        # directly to MPI's `Gatherv`
+
+        if self.rank == root:
+            gathered_array = np.zeros( (N_blocks, Nr_out), dtype=array.dtype )
+        else:
+            gathered_array = None
+
+        # Then send the arrays
+        if self.size > 1:
+            N_procs = tuple( Nr_out*(k1-k0) for (k0, k1) in block_ranges )
+            istart_procs = tuple( np.cumsum( (0,) + N_procs[:-1] ) )
+            if self.rank == root:
+                recv_array = np.empty( sum(N_procs), dtype=array.dtype )
+            else:
+                recv_array = None
+            mpi_type = mpi_type_dict[ str(array.dtype) ]
+            sendbuf = [ local_blocks, N_procs[self.rank] ]
+            recvbuf = [ recv_array, N_procs, istart_procs, mpi_type ]
+            self.mpi_comm.Gatherv( sendbuf, recvbuf, root=root )
+            # Sum the contributions (when averaging, the blocks at the
+            # boundary between two ranks receive a contribution from both)
+            if self.rank == root:
+                for k, (k0, k1) in enumerate( block_ranges ):
+                    gathered_array[k0:k1] += recv_array[
+                        istart_procs[k]:istart_procs[k]+N_procs[k]
+                        ].reshape( k1-k0, Nr_out )
+        else:
+            gathered_array[k_start:k_end] = local_blocks
+
+        # Return the gathered_array only on process root
+        if self.rank == root:
+            return(gathered_array)
+
     def scatter_grid_array(self, array, root=0, with_damp=False):
         """
         Scatter an array that has the size of the global physical domain
@@ -1221,3 +1320,85 @@ class BoundaryCommunicator(object):
         if self.rank == root:
             return(gathered_array)
 
+
+def get_region_block_range( iz_lo, iz_hi, iz_min, N_blocks, nz, method ):
+    """
+    Return the indices (k_start, k_end) of the decimation blocks of a region
+    (see `BoundaryCommunicator.gather_grid_region`) which receive
+    a contribution from the cells [iz_lo, iz_hi)
+
+    Parameters:
+    -----------
+    iz_lo, iz_hi: ints
+        The indices that bound the cells considered along z
+
+    iz_min: int
+        The index of the first cell of the region
+
+    N_blocks: int
+        The number of blocks in the region
+
+    nz: int
+        The number of cells per block along z
+
+    method: string
+        Either 'stride' (only the middle cell of each block contributes)
+        or 'average' (all the cells contribute)
+    """
+    if method == 'stride':
+        iz_first = iz_min + nz//2
+        k_start = -( (iz_first - iz_lo)//nz )
+        k_end = -( (iz_first - iz_hi)//nz )
+    else:
+        k_start = (iz_lo - iz_min)//nz
+        k_end = (iz_hi - 1 - iz_min)//nz + 1
+    k_start = min( max( k_start, 0 ), N_blocks )
+    k_end = min( max( k_end, k_start ), N_blocks )
+    return( k_start, k_end )
+
+
+def extract_region_blocks( array, iz_lo, k_start, k_end, iz_min,
+                           nz, nr, Nr_out, method ):
+    """
+    Return the decimated data of the blocks [k_start, k_end) of a region
+    (see `BoundaryCommunicator.gather_grid_region`), as an array of shape
+    (k_end-k_start, Nr_out).
+
+    When averaging, a block that is only partially contained in `array`
+    receives the partial sum of its cells, divided by nz*nr.
+
+    Parameters:
+    -----------
+    array: 2darray
+        The grid array, whose first cell along z has the index `iz_lo`
+
+    k_start, k_end: ints
+        The blocks to extract (see `get_region_block_range`)
+
+    iz_min: int
+        The index of the first cell of the region
+
+    nz, nr: ints
+        The decimation factors along z and r
+
+    Nr_out: int
+        The number of blocks along r
+
+    method: string
+        Either 'stride' or 'average'
+    """
+    if method == 'stride':
+        iz = iz_min + nz//2 + nz*np.arange( k_start, k_end ) - iz_lo
+        return( array[ iz, nr//2:nr*Nr_out:nr ] )
+
+    if k_end == k_start:
+        return( np.zeros( (0, Nr_out), dtype=array.dtype ) )
+    # Sum over the blocks along r, then along z
+    iz_first = max( iz_min + k_start*nz, iz_lo ) - iz_lo
+    iz_last = min( iz_min + k_end*nz, iz_lo + array.shape[0] ) - iz_lo
+    summed_r = array[ iz_first:iz_last, :nr*Nr_out ].reshape(
+                            iz_last - iz_first, Nr_out, nr ).sum( axis=-1 )
+    block_starts = np.maximum( iz_min + nz*np.arange( k_start, k_end ),
+                               iz_lo ) - iz_lo - iz_first
+    blocks = np.add.reduceat( summed_r, block_starts, axis=0 )
+    return( blocks * (1./(nz*nr)) )
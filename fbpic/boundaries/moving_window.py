@@ -181,25 +181,67 @@ class MovingWindow(object):
                 shift_spect_array_gpu[tpb, bpg]( grid.Jm, shift, n_move )
                 shift_spect_array_gpu[tpb, bpg]( grid.Jz, shift, n_move )
         else:
-            shift = grid.field_shift
-            # Shift all the fields on the CPU
-            shift_spect_array_cpu( grid.Ep, shift, n_move )
-            shift_spect_array_cpu( grid.Em, shift, n_move )
-            shift_spect_array_cpu( grid.Ez, shift, n_move )
-            shift_spect_array_cpu( grid.Bp, shift, n_move )
-            shift_spect_array_cpu( grid.Bm, shift, n_move )
-            shift_spect_array_cpu( grid.Bz, shift, n_move )
+            # The PML arrays are not used by the kernel when use_pml is False
             if grid.use_pml:
-                shift_spect_array_cpu( grid.Ep_pml, shift, n_move )
-                shift_spect_array_cpu( grid.Em_pml, shift, n_move )
-                shift_spect_array_cpu( grid.Bp_pml, shift, n_move )
-                shift_spect_array_cpu( grid.Bm_pml, shift, n_move )
+                Ep_pml, Em_pml, Bp_pml, Bm_pml = \
+                    grid.Ep_pml, grid.Em_pml, grid.Bp_pml, grid.Bm_pml
+            else:
+                Ep_pml, Em_pml, Bp_pml, Bm_pml = \
+                    grid.Ep, grid.Em, grid.Bp, grid.Bm
+            # Shift all the fields on the CPU, in a single pass
+            shift_spect_grid_cpu( grid.Ep, grid.Em, grid.Ez,
+                grid.Bp, grid.Bm, grid.Bz, Ep_pml, Em_pml, Bp_pml, Bm_pml,
+                grid.rho_prev,
+                grid.Jp, grid.Jm, grid.Jz, grid.use_pml, shift_rho,
+                shift_currents, grid.field_shift, n_move )
+
+@njit_parallel
+def shift_spect_grid_cpu( Ep, Em, Ez, Bp, Bm, Bz,
+                          Ep_pml, Em_pml, Bp_pml, Bm_pml, rho_prev,
+                          Jp, Jm, Jz, use_pml, shift_rho, shift_currents,
+                          shift_factor, n_move ):
+    """
+    Shift all the fields of a spectral grid by n_move cells on CPU.
+
+    This is equivalent to calling `shift_spect_array_cpu` on each field,
+    but the shift factor exp(i*kz_true*dz)**n_move is only calculated
+    once per kz, and all the fields are shifted in the same loop.
+
+    See the docstring of `MovingWindow.shift_spect_grid` for the meaning
+    of use_pml, shift_rho and shift_currents, and the docstring of
+    `shift_spect_array_cpu` for the meaning of shift_factor and n_move.
+    """
+    Nz, Nr = Ep.shape
+
+    # Loop over the 2D array (in parallel over z if threading is enabled)
+    for iz in prange( Nz ):
+        power_shift = 1. + 0.j
+        # Calculate the shift factor (raising to the power n_move ;
+        # for negative n_move, we take the complex conjugate, since
+        # shift_factor is of the form e^{i k dz})
+        for i in range( abs(n_move) ):
+            power_shift *= shift_factor[iz]
+        if n_move < 0:
+            power_shift = power_shift.conjugate()
+        # Shift the fields
+        for ir in range( Nr ):
+            Ep[iz, ir] *= power_shift
+            Em[iz, ir] *= power_shift
+            Ez[iz, ir] *= power_shift
+            Bp[iz, ir] *= power_shift
+            Bm[iz, ir] *= power_shift
+            Bz[iz, ir] *= power_shift
+            if use_pml:
+                Ep_pml[iz, ir] *= power_shift
+                Em_pml[iz, ir] *= power_shift
+                Bp_pml[iz, ir] *= power_shift
+                Bm_pml[iz, ir] *= power_shift
             if shift_rho:
-                shift_spect_array_cpu( grid.rho_prev, shift, n_move )
+                rho_prev[iz, ir] *= power_shift
             if shift_currents:
-                shift_spect_array_cpu( grid.Jp, shift, n_move )
-                shift_spect_array_cpu( grid.Jm, shift, n_move )
-                shift_spect_array_cpu( grid.Jz, shift, n_move )
+                Jp[iz, ir] *= power_shift
+                Jm[iz, ir] *= power_shift
+                Jz[iz, ir] *= power_shift
 
 @njit_parallel
 def shift_spect_array_cpu( field_array, shift_factor, n_move ):
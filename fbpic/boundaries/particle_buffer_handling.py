@@ -52,6 +52,8 @@ def remove_outside_particles(species, fld, n_guard, left_proc, right_proc):
         # Remove outside particles on the CPU
         float_send_left, float_send_right, uint_send_left, uint_send_right = \
             remove_particles_cpu( species, fld, n_guard, left_proc, right_proc )
+        # The cached shape factors are not valid anymore
+        species.shape_factor_cache = None
 
     return(float_send_left, float_send_right, uint_send_left, uint_send_right)
 
@@ -344,6 +346,8 @@ def add_buffers_to_particles( species, float_recv_left, float_recv_right,
     else:
         add_buffers_cpu( species, float_recv_left, float_recv_right,
                                 uint_recv_left, uint_recv_right )
+        # The cached shape factors are not valid anymore
+        species.shape_factor_cache = None
 
     # Reallocate the particles auxiliary arrays. This needs to be done,
     # as the total number of particles in this domain has changed.
@@ -532,6 +536,8 @@ def shift_particles_periodic_subdomain( species, zmin, zmax ):
     # Perform the shift on the CPU
     else:
         shift_particles_periodic_numba( species.z, zmin, zmax )
+        # The cached shape factors are not valid anymore
+        species.shape_factor_cache = None
 
 @numba.jit(nopython=True)
 def shift_particles_periodic_numba( z, zmin, zmax ):
@@ -7,8 +7,9 @@ It defines the high-level Fields class.
 """
 import warnings
 import numpy as np
-from fbpic.utils.threading import nthreads
-from .numba_methods import sum_reduce_2d_array, numba_erase_threading_buffer
+from fbpic.utils.threading import nthreads, concurrent_calls_supported
+from .numba_methods import sum_reduce_2d_array, \
+    numba_erase_threading_buffer, reset_deposit_bounds
 from .utility_methods import get_modified_k
 from .spectral_transform import SpectralTransformer
 from .interpolation_grid import InterpolationGrid
@@ -16,6 +17,12 @@ from .spectral_grid import SpectralGrid
 from .psatd_coefs import PsatdCoeffs
 from fbpic.utils.cuda import cuda_installed
 from .smoothing import BinomialSmoother
+# Check if threadpoolctl is available (to control the BLAS threads)
+try:
+    from threadpoolctl import ThreadpoolController
+    threadpoolctl_installed = True
+except ImportError:
+    threadpoolctl_installed = False
 
 class Fields(object) :
     """
@@ -51,7 +58,8 @@ class Fields(object) :
                   n_order=-1, v_comoving=None, use_pml=False, use_galilean=True,
                   current_correction='cross-deposition', use_cuda=False,
                   smoother=None, create_threading_buffers=False,
-                  use_ruyten_shapes=True, use_modified_volume=True ):
+                  use_ruyten_shapes=True, use_modified_volume=True,
+                  psatd_coefs_on_the_fly=False, dht_tolerance=None ):
         """
         Initialize the components of the Fields object
 
@@ -120,6 +128,17 @@ class Fields(object) :
 
         use_modified_volume: bool, optional
             Whether to use the modified cell volume (only used for m=0)
+
+        psatd_coefs_on_the_fly: bool, optional
+            Whether to recompute the coefficients of the PSATD scheme inside
+            the push kernels at each timestep, instead of storing them
+            (saves 5 real arrays of size Nz x Nr per mode).
+            Only available for the standard PSATD, on CPU.
+
+        dht_tolerance: float or None, optional
+            If not None, the Hankel transforms use compressed matrices,
+            with this relative accuracy (see `HierarchicalMatrix`).
+            Only used on CPU.
         """
         # Register the arguments inside the object
         self.Nz = Nz
@@ -150,6 +169,29 @@ class Fields(object) :
             self.current_correction = current_correction
         else:
             raise ValueError('Unkown current correction:%s'%current_correction)
+        # Whether the filter, the current correction and the push can be
+        # performed in a single pass over the spectral grid
+        # (see `filter_correct_and_push`)
+        self.use_fused_spectral_kernel = (self.use_cuda is False) and \
+                                    (self.current_correction == 'curl-free')
+        # Whether the transforms of the different azimuthal modes are
+        # performed concurrently on CPU (see `execute_on_modes`)
+        self.use_mode_parallel_transforms = (self.use_cuda is False) and \
+                                    (Nm > 1) and (nthreads > 1)
+        self.transform_pool = None
+        self.blas_controller = None
+        # Whether to skip the transforms of the zero rows (or zero modes)
+        # of the sources, on CPU (see `SpectralTransformer.interp2spect_scal`)
+        self.skip_zero_sources = (self.use_cuda is False)
+        # Check whether the psatd coefficients can be computed on the fly
+        if psatd_coefs_on_the_fly and \
+                (self.use_cuda or (self.v_comoving is not None)):
+            warnings.warn(
+                'The psatd coefficients can only be computed on the fly '
+                'with the standard PSATD, on CPU.\n'
+                'Storing the psatd coefficients instead.' )
+            psatd_coefs_on_the_fly = False
+        self.psatd_coefs_on_the_fly = psatd_coefs_on_the_fly
 
         # Create the list of the transformers, which convert the fields
         # back and forth between the spatial and spectral grid
@@ -157,7 +199,8 @@ class Fields(object) :
         self.trans = []
         for m in range(Nm) :
             self.trans.append( SpectralTransformer(
-                Nz, Nr, m, rmax, use_cuda=self.use_cuda ) )
+                Nz, Nr, m, rmax, use_cuda=self.use_cuda,
+                dht_tolerance=dht_tolerance ) )
 
         # Create the interpolation grid for each modes
         # (one grid per azimuthal mode)
@@ -194,7 +237,8 @@ class Fields(object) :
                                 self.spect[m].kr, m, dt, Nz, Nr,
                                 V=self.v_comoving,
                                 use_galilean=self.use_galilean,
-                                use_cuda=self.use_cuda ) )
+                                use_cuda=self.use_cuda,
+                                coefs_on_the_fly=psatd_coefs_on_the_fly ) )
 
         # Record flags that indicates whether, for the sources *in
         # spectral space*, the guard cells have been exchanged via MPI
@@ -216,6 +260,16 @@ class Fields(object) :
                     shape=(nthreads, self.Nm, self.Nz+4, self.Nr+4) )
             self.Jz_global = np.zeros( dtype=np.complex128,
                     shape=(nthreads, self.Nm, self.Nz+4, self.Nr+4) )
+            # Region of each copy that was modified by the deposition since
+            # the last erase (iz_min, iz_max, ir_min, ir_max, for each thread ;
+            # one array for rho and one for J), so that only this region
+            # is erased and reduced
+            self.rho_deposit_bounds = np.zeros( (nthreads, 4), dtype=np.int64 )
+            self.J_deposit_bounds = np.zeros( (nthreads, 4), dtype=np.int64 )
+            reset_deposit_bounds( self.rho_deposit_bounds,
+                                  self.Nz+4, self.Nr+4 )
+            reset_deposit_bounds( self.J_deposit_bounds,
+                                  self.Nz+4, self.Nr+4 )
 
 
     def send_fields_to_gpu( self ):
@@ -275,6 +329,32 @@ class Fields(object) :
             self.spect[m].push_eb_with( self.psatd[m], use_true_rho )
             self.spect[m].push_rho()
 
+    def filter_correct_and_push( self, use_true_rho=False, use_filter=True ):
+        """
+        Filter rho_next and J (if use_filter is True), correct the currents,
+        push the fields E and B, and transfer rho_next to rho_prev,
+        in a single pass over the spectral grid of each azimuthal mode.
+
+        This is equivalent to calling `filter_spect('rho_next')`,
+        `filter_spect('J')`, `correct_currents` and `push`, but the
+        spectral arrays are only read and written once. This is only
+        available on CPU, with the curl-free current correction
+        (see `use_fused_spectral_kernel`), and should only be used when
+        J does not need to be exchanged via MPI between the current
+        correction and the push (i.e. with a single MPI rank).
+
+        Parameters
+        ----------
+        use_true_rho : bool, optional
+            Whether to use the rho projected on the grid
+            (see the docstring of `push`)
+        use_filter: bool, optional
+            Whether to filter rho_next and J
+        """
+        for m in range(self.Nm) :
+            self.spect[m].filter_correct_and_push( self.psatd[m],
+                                        use_true_rho, use_filter )
+
     def correct_currents(self, check_exchanges=False) :
         """
         Correct the currents so that they satisfy the
@@ -321,51 +401,53 @@ class Fields(object) :
             A string which represents the kind of field to transform
             (either 'E', 'B', 'E_pml', 'B_pml', 'J', 'rho_next', 'rho_prev')
         """
+        if fieldtype not in ['E', 'B', 'E_pml', 'B_pml', 'J', 'rho_prev',
+                             'rho_next', 'rho_next_z', 'rho_next_xy']:
+            raise ValueError( 'Invalid string for fieldtype: %s' %fieldtype )
+        # Transform each azimuthal grid individually
+        self.execute_on_modes( self.interp2spect_mode, fieldtype )
+
+    def interp2spect_mode(self, m, fieldtype) :
+        """
+        Transform the fields `fieldtype` of the azimuthal mode `m`
+        from the interpolation grid to the spectral grid
+
+        See the docstring of `interp2spect`
+        """
         # Use the appropriate transformation depending on the fieldtype.
         if fieldtype == 'E' :
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm) :
-                self.trans[m].interp2spect_scal(
-                    self.interp[m].Ez, self.spect[m].Ez )
-                self.trans[m].interp2spect_vect(
-                    self.interp[m].Er, self.interp[m].Et,
-                    self.spect[m].Ep, self.spect[m].Em )
+            self.trans[m].interp2spect_scal(
+                self.interp[m].Ez, self.spect[m].Ez )
+            self.trans[m].interp2spect_vect(
+                self.interp[m].Er, self.interp[m].Et,
+                self.spect[m].Ep, self.spect[m].Em )
         elif fieldtype == 'B' :
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm) :
-                self.trans[m].interp2spect_scal(
-                    self.interp[m].Bz, self.spect[m].Bz )
-                self.trans[m].interp2spect_vect(
-                    self.interp[m].Br, self.interp[m].Bt,
-                    self.spect[m].Bp, self.spect[m].Bm )
+            self.trans[m].interp2spect_scal(
+                self.interp[m].Bz, self.spect[m].Bz )
+            self.trans[m].interp2spect_vect(
+                self.interp[m].Br, self.interp[m].Bt,
+                self.spect[m].Bp, self.spect[m].Bm )
         elif fieldtype == 'E_pml':
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm):
-                self.trans[m].interp2spect_vect(
-                    self.interp[m].Er_pml, self.interp[m].Et_pml,
-                    self.spect[m].Ep_pml, self.spect[m].Em_pml )
+            self.trans[m].interp2spect_vect(
+                self.interp[m].Er_pml, self.interp[m].Et_pml,
+                self.spect[m].Ep_pml, self.spect[m].Em_pml )
         elif fieldtype == 'B_pml':
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm):
-                self.trans[m].interp2spect_vect(
-                    self.interp[m].Br_pml, self.interp[m].Bt_pml,
-                    self.spect[m].Bp_pml, self.spect[m].Bm_pml )
+            self.trans[m].interp2spect_vect(
+                self.interp[m].Br_pml, self.interp[m].Bt_pml,
+                self.spect[m].Bp_pml, self.spect[m].Bm_pml )
         elif fieldtype == 'J' :
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm) :
-                self.trans[m].interp2spect_scal(
-                    self.interp[m].Jz, self.spect[m].Jz )
-                self.trans[m].interp2spect_vect(
-                    self.interp[m].Jr, self.interp[m].Jt,
-                    self.spect[m].Jp, self.spect[m].Jm )
+            self.trans[m].interp2spect_scal(
+                self.interp[m].Jz, self.spect[m].Jz,
+                skip_zeros=self.skip_zero_sources )
+            self.trans[m].interp2spect_vect(
+                self.interp[m].Jr, self.interp[m].Jt,
+                self.spect[m].Jp, self.spect[m].Jm,
+                skip_zeros=self.skip_zero_sources )
         elif fieldtype in ['rho_prev', 'rho_next', 'rho_next_z', 'rho_next_xy']:
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm) :
-                spectral_rho = getattr( self.spect[m], fieldtype )
-                self.trans[m].interp2spect_scal(
-                    self.interp[m].rho, spectral_rho )
-        else:
-            raise ValueError( 'Invalid string for fieldtype: %s' %fieldtype )
+            spectral_rho = getattr( self.spect[m], fieldtype )
+            self.trans[m].interp2spect_scal(
+                self.interp[m].rho, spectral_rho,
+                skip_zeros=self.skip_zero_sources )
 
     def spect2interp(self, fieldtype) :
         """
@@ -378,55 +460,116 @@ class Fields(object) :
             A string which represents the kind of field to transform
             (either 'E', 'B', 'E_pml', 'B_pml', 'J', 'rho_next', 'rho_prev')
         """
+        if fieldtype not in ['E', 'B', 'E_pml', 'B_pml', 'J',
+                             'rho_next', 'rho_prev']:
+            raise ValueError( 'Invalid string for fieldtype: %s' %fieldtype )
+        # Transform each azimuthal grid individually
+        self.execute_on_modes( self.spect2interp_mode, fieldtype )
+
+    def spect2interp_mode(self, m, fieldtype) :
+        """
+        Transform the fields `fieldtype` of the azimuthal mode `m`
+        from the spectral grid to the interpolation grid
+
+        See the docstring of `spect2interp`
+        """
         # Use the appropriate transformation depending on the fieldtype.
         if fieldtype == 'E' :
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm) :
-                self.trans[m].spect2interp_scal(
-                    self.spect[m].Ez, self.interp[m].Ez )
-                self.trans[m].spect2interp_vect(
-                    self.spect[m].Ep,  self.spect[m].Em,
-                    self.interp[m].Er, self.interp[m].Et )
+            self.trans[m].spect2interp_scal(
+                self.spect[m].Ez, self.interp[m].Ez )
+            self.trans[m].spect2interp_vect(
+                self.spect[m].Ep,  self.spect[m].Em,
+                self.interp[m].Er, self.interp[m].Et )
         elif fieldtype == 'B' :
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm) :
-                self.trans[m].spect2interp_scal(
-                    self.spect[m].Bz, self.interp[m].Bz )
-                self.trans[m].spect2interp_vect(
-                    self.spect[m].Bp, self.spect[m].Bm,
-                    self.interp[m].Br, self.interp[m].Bt )
+            self.trans[m].spect2interp_scal(
+                self.spect[m].Bz, self.interp[m].Bz )
+            self.trans[m].spect2interp_vect(
+                self.spect[m].Bp, self.spect[m].Bm,
+                self.interp[m].Br, self.interp[m].Bt )
         elif fieldtype == 'E_pml':
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm) :
-                self.trans[m].spect2interp_vect(
-                    self.spect[m].Ep_pml,  self.spect[m].Em_pml,
-                    self.interp[m].Er_pml, self.interp[m].Et_pml )
+            self.trans[m].spect2interp_vect(
+                self.spect[m].Ep_pml,  self.spect[m].Em_pml,
+                self.interp[m].Er_pml, self.interp[m].Et_pml )
         elif fieldtype == 'B_pml':
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm) :
-                self.trans[m].spect2interp_vect(
-                    self.spect[m].Bp_pml,  self.spect[m].Bm_pml,
-                    self.interp[m].Br_pml, self.interp[m].Bt_pml )
+            self.trans[m].spect2interp_vect(
+                self.spect[m].Bp_pml,  self.spect[m].Bm_pml,
+                self.interp[m].Br_pml, self.interp[m].Bt_pml )
         elif fieldtype == 'J' :
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm) :
-                self.trans[m].spect2interp_scal(
-                    self.spect[m].Jz, self.interp[m].Jz )
-                self.trans[m].spect2interp_vect(
-                    self.spect[m].Jp,  self.spect[m].Jm,
-                    self.interp[m].Jr, self.interp[m].Jt )
+            self.trans[m].spect2interp_scal(
+                self.spect[m].Jz, self.interp[m].Jz )
+            self.trans[m].spect2interp_vect(
+                self.spect[m].Jp,  self.spect[m].Jm,
+                self.interp[m].Jr, self.interp[m].Jt )
         elif fieldtype == 'rho_next' :
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm) :
-                self.trans[m].spect2interp_scal(
-                    self.spect[m].rho_next, self.interp[m].rho )
+            self.trans[m].spect2interp_scal(
+                self.spect[m].rho_next, self.interp[m].rho )
         elif fieldtype == 'rho_prev' :
-            # Transform each azimuthal grid individually
-            for m in range(self.Nm) :
-                self.trans[m].spect2interp_scal(
-                    self.spect[m].rho_prev, self.interp[m].rho )
-        else :
-            raise ValueError( 'Invalid string for fieldtype: %s' %fieldtype )
+            self.trans[m].spect2interp_scal(
+                self.spect[m].rho_prev, self.interp[m].rho )
+
+    def execute_on_modes(self, function, *args) :
+        """
+        Call `function(m, *args)` for each azimuthal mode m
+
+        When `use_mode_parallel_transforms` is True, the different modes
+        are processed concurrently, by a pool of Python threads. This is
+        efficient because the FFTs and the matrix products of the DHT
+        (which dominate the cost of the transforms) release the GIL.
+        Each mode uses its own transformer and buffers, so that the
+        threads never write to the same arrays.
+
+        Since the transforms also call parallel numba functions, this
+        requires a threading layer of numba that supports concurrent calls
+        (`tbb` or `omp`), and the module `concurrent.futures` (Python 3).
+        Otherwise, the modes are processed one after the other.
+
+        Parameters
+        ----------
+        function: callable
+            Function that processes one mode (e.g. `interp2spect_mode`)
+
+        args: arguments that are passed to `function`, after `m`
+        """
+        # Create the pool of threads at the first call, if possible
+        if self.use_mode_parallel_transforms and self.transform_pool is None:
+            supported = concurrent_calls_supported()
+            if supported:
+                try:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self.transform_pool = ThreadPoolExecutor(
+                                            max_workers=self.Nm )
+                except ImportError:
+                    self.use_mode_parallel_transforms = False
+            elif supported is False:
+                self.use_mode_parallel_transforms = False
+            # (When `supported` is None, the threading layer of numba is
+            # only chosen at the first call to a parallel function: the
+            # modes are processed serially until then.)
+
+        if self.transform_pool is None:
+            for m in range(self.Nm):
+                function( m, *args )
+        # Share the BLAS threads between the modes (if threadpoolctl is
+        # installed; otherwise the BLAS library keeps its own setting)
+        elif threadpoolctl_installed:
+            if self.blas_controller is None:
+                self.blas_controller = ThreadpoolController()
+            with self.blas_controller.limit(
+                    limits=max( 1, nthreads//self.Nm ), user_api='blas' ):
+                self.execute_in_pool( function, *args )
+        else:
+            self.execute_in_pool( function, *args )
+
+    def execute_in_pool(self, function, *args) :
+        """
+        Call `function(m, *args)` for each azimuthal mode m, in the
+        pool of threads `transform_pool`, and wait for all the modes
+        """
+        futures = [ self.transform_pool.submit( function, m, *args )
+                    for m in range(self.Nm) ]
+        # Wait for all modes (and raise the errors of the threads, if any)
+        for future in futures:
+            future.result()
 
     def spect2partial_interp(self, fieldtype) :
         """
@@ -555,12 +698,21 @@ class Fields(object) :
 
         # Erase the duplicated deposition buffer
         if not self.use_cuda:
+            # (Only the region modified by the deposition is erased)
             if fieldtype == 'rho':
-                numba_erase_threading_buffer( self.rho_global )
+                numba_erase_threading_buffer(
+                    self.rho_global, self.rho_deposit_bounds )
+                reset_deposit_bounds( self.rho_deposit_bounds,
+                                      self.Nz+4, self.Nr+4 )
             elif fieldtype == 'J':
-                numba_erase_threading_buffer( self.Jr_global )
-                numba_erase_threading_buffer( self.Jt_global )
-                numba_erase_threading_buffer( self.Jz_global )
+                numba_erase_threading_buffer(
+                    self.Jr_global, self.J_deposit_bounds )
+                numba_erase_threading_buffer(
+                    self.Jt_global, self.J_deposit_bounds )
+                numba_erase_threading_buffer(
+                    self.Jz_global, self.J_deposit_bounds )
+                reset_deposit_bounds( self.J_deposit_bounds,
+                                      self.Nz+4, self.Nr+4 )
 
 
     def sum_reduce_deposition_array(self, fieldtype):
@@ -581,14 +733,19 @@ class Fields(object) :
             return
 
         # Sum thread-local results to main field array
+        # (Only the region modified by the deposition is visited)
         if fieldtype == 'rho':
             for m in range(self.Nm):
-                sum_reduce_2d_array( self.rho_global, self.interp[m].rho, m )
+                sum_reduce_2d_array( self.rho_global, self.interp[m].rho, m,
+                                     self.rho_deposit_bounds )
         elif fieldtype == 'J':
             for m in range(self.Nm):
-                sum_reduce_2d_array( self.Jr_global, self.interp[m].Jr, m )
-                sum_reduce_2d_array( self.Jt_global, self.interp[m].Jt, m )
-                sum_reduce_2d_array( self.Jz_global, self.interp[m].Jz, m )
+                sum_reduce_2d_array( self.Jr_global, self.interp[m].Jr, m,
+                                     self.J_deposit_bounds )
+                sum_reduce_2d_array( self.Jt_global, self.interp[m].Jt, m,
+                                     self.J_deposit_bounds )
+                sum_reduce_2d_array( self.Jz_global, self.interp[m].Jz, m,
+                                     self.J_deposit_bounds )
         else :
             raise ValueError('Invalid string for fieldtype: %s'%fieldtype)
 
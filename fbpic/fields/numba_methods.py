@@ -7,6 +7,7 @@ It defines the optimized fields methods that use numba on a CPU
 """
 from scipy.constants import c, epsilon_0, mu_0
 c2 = c**2
+import math
 import numba
 from fbpic.utils.threading import njit_parallel, prange
 
@@ -122,21 +123,66 @@ def numba_correct_currents_crossdeposition_standard( rho_prev, rho_next,
 
     return
 
+@numba.njit
+def get_psatd_coefs_standard( kz, kr, dt ):
+    """
+    Compute the coefficients of the standard psatd algorithm at one point
+    of the spectral grid (with the same formulas as in `PsatdCoeffs`)
+
+    Parameters
+    ----------
+    kz, kr: floats
+        The (modified) longitudinal and radial wavevectors of this point
+
+    dt: float
+        The timestep of the simulation
+
+    Returns
+    -------
+    A tuple of floats (C, S_w, j_coef, rho_prev_coef, rho_next_coef)
+    """
+    w = c*math.sqrt( kz**2 + kr**2 )
+    # Enforce the right values for w==0
+    if w == 0:
+        return( 1., dt, mu_0*c2*(0.5*dt**2),
+                c2/epsilon_0*(-1./3*dt**2), c2/epsilon_0*(1./6*dt**2) )
+    inv_w = 1./w
+    inv_dt = 1./dt
+    C = math.cos( w*dt )
+    S_w = math.sin( w*dt )*inv_w
+    j_coef = mu_0*c2*(1.-C)*inv_w**2
+    rho_prev_coef = c2/epsilon_0*( C - inv_dt*S_w )*inv_w**2
+    rho_next_coef = c2/epsilon_0*( 1 - inv_dt*S_w )*inv_w**2
+    return( C, S_w, j_coef, rho_prev_coef, rho_next_coef )
+
 @njit_parallel
 def numba_push_eb_standard( Ep, Em, Ez, Bp, Bm, Bz, Jp, Jm, Jz,
                        rho_prev, rho_next,
                        rho_prev_coef, rho_next_coef, j_coef,
-                       C, S_w, kr, kz, dt,
+                       C, S_w, kr, kz, dt, coefs_on_the_fly,
                        use_true_rho, Nz, Nr) :
     """
     Push the fields over one timestep, using the standard psatd algorithm
 
     See the documentation of SpectralGrid.push_eb_with
+    (When `coefs_on_the_fly` is True, the coefficient arrays are not read,
+    and the coefficients are instead recomputed from kz, kr and dt.)
     """
     # Loop over the 2D grid (parallel in z, if threading is installed)
     for iz in prange(Nz):
         for ir in range(Nr):
 
+            # Get the psatd coefficients
+            if coefs_on_the_fly:
+                C_, S_w_, j_coef_, rho_prev_coef_, rho_next_coef_ = \
+                    get_psatd_coefs_standard( kz[iz, ir], kr[iz, ir], dt )
+            else:
+                C_ = C[iz, ir]
+                S_w_ = S_w[iz, ir]
+                j_coef_ = j_coef[iz, ir]
+                rho_prev_coef_ = rho_prev_coef[iz, ir]
+                rho_next_coef_ = rho_next_coef[iz, ir]
+
             # Save the electric fields, since it is needed for the B push
             Ep_old = Ep[iz, ir]
             Em_old = Em[iz, ir]
@@ -145,8 +191,8 @@ def numba_push_eb_standard( Ep, Em, Ez, Bp, Bm, Bz, Jp, Jm, Jz,
             # Calculate useful auxiliary arrays
             if use_true_rho:
                 # Evaluation using the rho projected on the grid
-                rho_diff = rho_next_coef[iz, ir] * rho_next[iz, ir] \
-                        - rho_prev_coef[iz, ir] * rho_prev[iz, ir]
+                rho_diff = rho_next_coef_ * rho_next[iz, ir] \
+                        - rho_prev_coef_ * rho_prev[iz, ir]
             else:
                 # Evaluation using div(E) and div(J)
                 divE = kr[iz, ir]*( Ep[iz, ir] - Em[iz, ir] ) \
@@ -154,39 +200,39 @@ def numba_push_eb_standard( Ep, Em, Ez, Bp, Bm, Bz, Jp, Jm, Jz,
                 divJ = kr[iz, ir]*( Jp[iz, ir] - Jm[iz, ir] ) \
                     + 1.j*kz[iz, ir]*Jz[iz, ir]
 
-                rho_diff = (rho_next_coef[iz, ir] - rho_prev_coef[iz, ir]) \
-                  * epsilon_0 * divE - rho_next_coef[iz, ir] * dt * divJ
+                rho_diff = (rho_next_coef_ - rho_prev_coef_) \
+                  * epsilon_0 * divE - rho_next_coef_ * dt * divJ
 
             # Push the E field
-            Ep[iz, ir] = C[iz, ir]*Ep[iz, ir] + 0.5*kr[iz, ir]*rho_diff \
-                + c2*S_w[iz, ir]*( -1.j*0.5*kr[iz, ir]*Bz[iz, ir] \
+            Ep[iz, ir] = C_*Ep[iz, ir] + 0.5*kr[iz, ir]*rho_diff \
+                + c2*S_w_*( -1.j*0.5*kr[iz, ir]*Bz[iz, ir] \
                 + kz[iz, ir]*Bp[iz, ir] - mu_0*Jp[iz, ir] )
 
-            Em[iz, ir] = C[iz, ir]*Em[iz, ir] - 0.5*kr[iz, ir]*rho_diff \
-                + c2*S_w[iz, ir]*( -1.j*0.5*kr[iz, ir]*Bz[iz, ir] \
+            Em[iz, ir] = C_*Em[iz, ir] - 0.5*kr[iz, ir]*rho_diff \
+                + c2*S_w_*( -1.j*0.5*kr[iz, ir]*Bz[iz, ir] \
                 - kz[iz, ir]*Bm[iz, ir] - mu_0*Jm[iz, ir] )
 
-            Ez[iz, ir] = C[iz, ir]*Ez[iz, ir] - 1.j*kz[iz, ir]*rho_diff \
-                + c2*S_w[iz, ir]*( 1.j*kr[iz, ir]*Bp[iz, ir] \
+            Ez[iz, ir] = C_*Ez[iz, ir] - 1.j*kz[iz, ir]*rho_diff \
+                + c2*S_w_*( 1.j*kr[iz, ir]*Bp[iz, ir] \
                 + 1.j*kr[iz, ir]*Bm[iz, ir] - mu_0*Jz[iz, ir] )
 
             # Push the B field
-            Bp[iz, ir] = C[iz, ir]*Bp[iz, ir] \
-                - S_w[iz, ir]*( -1.j*0.5*kr[iz, ir]*Ez_old \
+            Bp[iz, ir] = C_*Bp[iz, ir] \
+                - S_w_*( -1.j*0.5*kr[iz, ir]*Ez_old \
                             + kz[iz, ir]*Ep_old ) \
-                + j_coef[iz, ir]*( -1.j*0.5*kr[iz, ir]*Jz[iz, ir] \
+                + j_coef_*( -1.j*0.5*kr[iz, ir]*Jz[iz, ir] \
                             + kz[iz, ir]*Jp[iz, ir] )
 
-            Bm[iz, ir] = C[iz, ir]*Bm[iz, ir] \
-                - S_w[iz, ir]*( -1.j*0.5*kr[iz, ir]*Ez_old \
+            Bm[iz, ir] = C_*Bm[iz, ir] \
+                - S_w_*( -1.j*0.5*kr[iz, ir]*Ez_old \
                             - kz[iz, ir]*Em_old ) \
-                + j_coef[iz, ir]*( -1.j*0.5*kr[iz, ir]*Jz[iz, ir] \
+                + j_coef_*( -1.j*0.5*kr[iz, ir]*Jz[iz, ir] \
                             - kz[iz, ir]*Jm[iz, ir] )
 
-            Bz[iz, ir] = C[iz, ir]*Bz[iz, ir] \
-                - S_w[iz, ir]*( 1.j*kr[iz, ir]*Ep_old \
+            Bz[iz, ir] = C_*Bz[iz, ir] \
+                - S_w_*( 1.j*kr[iz, ir]*Ep_old \
                             + 1.j*kr[iz, ir]*Em_old ) \
-                + j_coef[iz, ir]*( 1.j*kr[iz, ir]*Jp[iz, ir] \
+                + j_coef_*( 1.j*kr[iz, ir]*Jp[iz, ir] \
                             + 1.j*kr[iz, ir]*Jm[iz, ir] )
 
     return
@@ -194,7 +240,7 @@ def numba_push_eb_standard( Ep, Em, Ez, Bp, Bm, Bz, Jp, Jm, Jz,
 
 @njit_parallel
 def numba_push_eb_pml_standard( Ep_pml, Em_pml, Bp_pml, Bm_pml,
-                        Ez, Bz, C, S_w, kr, kz, Nz, Nr):
+                        Ez, Bz, C, S_w, kr, kz, dt, coefs_on_the_fly, Nz, Nr):
     """
     Push the PML split fields over one timestep, using the standard psatd algorithm
 
@@ -204,19 +250,27 @@ def numba_push_eb_pml_standard( Ep_pml, Em_pml, Bp_pml, Bm_pml,
     for iz in prange(Nz):
         for ir in range(Nr):
 
+            # Get the psatd coefficients
+            if coefs_on_the_fly:
+                C_, S_w_, _, _, _ = \
+                    get_psatd_coefs_standard( kz[iz, ir], kr[iz, ir], dt )
+            else:
+                C_ = C[iz, ir]
+                S_w_ = S_w[iz, ir]
+
             # Push the PML E field
-            Ep_pml[iz, ir] = C[iz, ir]*Ep_pml[iz, ir] \
-                + c2*S_w[iz, ir]*( -1.j*0.5*kr[iz, ir]*Bz[iz, ir] )
+            Ep_pml[iz, ir] = C_*Ep_pml[iz, ir] \
+                + c2*S_w_*( -1.j*0.5*kr[iz, ir]*Bz[iz, ir] )
 
-            Em_pml[iz, ir] = C[iz, ir]*Em_pml[iz, ir] \
-                + c2*S_w[iz, ir]*( -1.j*0.5*kr[iz, ir]*Bz[iz, ir] )
+            Em_pml[iz, ir] = C_*Em_pml[iz, ir] \
+                + c2*S_w_*( -1.j*0.5*kr[iz, ir]*Bz[iz, ir] )
 
             # Push the PML B field
-            Bp_pml[iz, ir] = C[iz, ir]*Bp_pml[iz, ir] \
-                - S_w[iz, ir]*( -1.j*0.5*kr[iz, ir]*Ez[iz, ir] )
+            Bp_pml[iz, ir] = C_*Bp_pml[iz, ir] \
+                - S_w_*( -1.j*0.5*kr[iz, ir]*Ez[iz, ir] )
 
-            Bm_pml[iz, ir] = C[iz, ir]*Bm_pml[iz, ir] \
-                - S_w[iz, ir]*( -1.j*0.5*kr[iz, ir]*Ez[iz, ir] )
+            Bm_pml[iz, ir] = C_*Bm_pml[iz, ir] \
+                - S_w_*( -1.j*0.5*kr[iz, ir]*Ez[iz, ir] )
 
     return
 
@@ -396,37 +450,304 @@ def numba_push_eb_pml_comoving( Ep_pml, Em_pml, Bp_pml, Bm_pml,
     return
 
 
+# ----------------------------------------------------------------
+# Fused spectral kernels (filter, current correction, push of E/B
+# and push of rho, in a single pass over the spectral grid)
+# ----------------------------------------------------------------
+
+@njit_parallel
+def numba_filter_correct_push_standard( Ep, Em, Ez, Bp, Bm, Bz, Jp, Jm, Jz,
+        rho_prev, rho_next, Ep_pml, Em_pml, Bp_pml, Bm_pml, use_pml,
+        filter_array_z, filter_array_r, use_filter,
+        kz, kr, inv_k2, rho_prev_coef, rho_next_coef, j_coef, C, S_w,
+        dt, inv_dt, coefs_on_the_fly, use_true_rho, Nz, Nr ):
+    """
+    For each point of the spectral grid: filter rho_next and J (if
+    use_filter is True), correct the currents (curl-free correction),
+    push the fields E and B (and the PML split fields, if use_pml is True)
+    with the standard psatd algorithm, and transfer rho_next to rho_prev.
+
+    This is equivalent to calling successively `numba_filter_scalar`,
+    `numba_filter_vector`, `numba_correct_currents_curlfree_standard`,
+    `numba_push_eb_pml_standard`, `numba_push_eb_standard` and
+    `SpectralGrid.push_rho`, but the fields and coefficients are
+    only read and written once. (When `coefs_on_the_fly` is True, the
+    coefficients are recomputed from kz, kr and dt instead of being read.)
+    """
+    # Loop over the 2D grid (parallel in z, if threading is installed)
+    for iz in prange(Nz):
+        for ir in range(Nr):
+
+            # Read the sources, and filter them
+            rho_n = rho_next[iz, ir]
+            jp = Jp[iz, ir]
+            jm = Jm[iz, ir]
+            jz = Jz[iz, ir]
+            if use_filter:
+                filter_coef = filter_array_z[iz]*filter_array_r[ir]
+                rho_n = filter_coef*rho_n
+                jp = filter_coef*jp
+                jm = filter_coef*jm
+                jz = filter_coef*jz
+            rho_p = rho_prev[iz, ir]
+
+            # Correct the currents (curl-free correction)
+            F = - inv_k2[iz, ir] * (
+                (rho_n - rho_p)*inv_dt \
+                + 1.j*kz[iz, ir]*jz \
+                + kr[iz, ir]*( jp - jm ) )
+            jp +=  0.5 * kr[iz, ir] * F
+            jm += -0.5 * kr[iz, ir] * F
+            jz += -1.j * kz[iz, ir] * F
+
+            # Read the fields and the coefficients
+            Ep_old = Ep[iz, ir]
+            Em_old = Em[iz, ir]
+            Ez_old = Ez[iz, ir]
+            Bp_old = Bp[iz, ir]
+            Bm_old = Bm[iz, ir]
+            Bz_old = Bz[iz, ir]
+            kr_ = kr[iz, ir]
+            kz_ = kz[iz, ir]
+            if coefs_on_the_fly:
+                C_, S_w_, j_coef_, rho_prev_coef_, rho_next_coef_ = \
+                    get_psatd_coefs_standard( kz_, kr_, dt )
+            else:
+                C_ = C[iz, ir]
+                S_w_ = S_w[iz, ir]
+                j_coef_ = j_coef[iz, ir]
+                rho_prev_coef_ = rho_prev_coef[iz, ir]
+                rho_next_coef_ = rho_next_coef[iz, ir]
+
+            # Push the PML split fields (using the fields before the push)
+            if use_pml:
+                Ep_pml[iz, ir] = C_*Ep_pml[iz, ir] \
+                    + c2*S_w_*( -1.j*0.5*kr_*Bz_old )
+                Em_pml[iz, ir] = C_*Em_pml[iz, ir] \
+                    + c2*S_w_*( -1.j*0.5*kr_*Bz_old )
+                Bp_pml[iz, ir] = C_*Bp_pml[iz, ir] \
+                    - S_w_*( -1.j*0.5*kr_*Ez_old )
+                Bm_pml[iz, ir] = C_*Bm_pml[iz, ir] \
+                    - S_w_*( -1.j*0.5*kr_*Ez_old )
+
+            # Calculate useful auxiliary arrays
+            if use_true_rho:
+                # Evaluation using the rho projected on the grid
+                rho_diff = rho_next_coef_ * rho_n - rho_prev_coef_ * rho_p
+            else:
+                # Evaluation using div(E) and div(J)
+                divE = kr_*( Ep_old - Em_old ) + 1.j*kz_*Ez_old
+                divJ = kr_*( jp - jm ) + 1.j*kz_*jz
+
+                rho_diff = (rho_next_coef_ - rho_prev_coef_) \
+                  * epsilon_0 * divE - rho_next_coef_ * dt * divJ
+
+            # Push the E field
+            Ep[iz, ir] = C_*Ep_old + 0.5*kr_*rho_diff \
+                + c2*S_w_*( -1.j*0.5*kr_*Bz_old + kz_*Bp_old - mu_0*jp )
+            Em[iz, ir] = C_*Em_old - 0.5*kr_*rho_diff \
+                + c2*S_w_*( -1.j*0.5*kr_*Bz_old - kz_*Bm_old - mu_0*jm )
+            Ez[iz, ir] = C_*Ez_old - 1.j*kz_*rho_diff \
+                + c2*S_w_*( 1.j*kr_*Bp_old + 1.j*kr_*Bm_old - mu_0*jz )
+
+            # Push the B field
+            Bp[iz, ir] = C_*Bp_old \
+                - S_w_*( -1.j*0.5*kr_*Ez_old + kz_*Ep_old ) \
+                + j_coef_*( -1.j*0.5*kr_*jz + kz_*jp )
+            Bm[iz, ir] = C_*Bm_old \
+                - S_w_*( -1.j*0.5*kr_*Ez_old - kz_*Em_old ) \
+                + j_coef_*( -1.j*0.5*kr_*jz - kz_*jm )
+            Bz[iz, ir] = C_*Bz_old \
+                - S_w_*( 1.j*kr_*Ep_old + 1.j*kr_*Em_old ) \
+                + j_coef_*( 1.j*kr_*jp + 1.j*kr_*jm )
+
+            # Store the corrected currents, and push rho
+            Jp[iz, ir] = jp
+            Jm[iz, ir] = jm
+            Jz[iz, ir] = jz
+            rho_prev[iz, ir] = rho_n
+            rho_next[iz, ir] = 0.
+
+    return
+
+@njit_parallel
+def numba_filter_correct_push_comoving( Ep, Em, Ez, Bp, Bm, Bz, Jp, Jm, Jz,
+        rho_prev, rho_next, Ep_pml, Em_pml, Bp_pml, Bm_pml, use_pml,
+        filter_array_z, filter_array_r, use_filter,
+        kz, kr, inv_k2, rho_prev_coef, rho_next_coef, j_coef, C, S_w,
+        j_corr_coef, T_eb, T_cc, T_rho, V, use_true_rho, Nz, Nr ):
+    """
+    Same as `numba_filter_correct_push_standard`, but with the
+    galilean/comoving psatd algorithm (and the corresponding
+    curl-free current correction)
+    """
+    # Loop over the 2D grid (parallel in z, if threading is installed)
+    for iz in prange(Nz):
+        for ir in range(Nr):
+
+            # Read the sources, and filter them
+            rho_n = rho_next[iz, ir]
+            jp = Jp[iz, ir]
+            jm = Jm[iz, ir]
+            jz = Jz[iz, ir]
+            if use_filter:
+                filter_coef = filter_array_z[iz]*filter_array_r[ir]
+                rho_n = filter_coef*rho_n
+                jp = filter_coef*jp
+                jm = filter_coef*jm
+                jz = filter_coef*jz
+            rho_p = rho_prev[iz, ir]
+
+            # Correct the currents (curl-free correction)
+            T_eb_ = T_eb[iz, ir]
+            T_cc_ = T_cc[iz, ir]
+            F =  - inv_k2[iz, ir] * ( T_cc_*j_corr_coef[iz, ir] \
+                * (rho_n - rho_p*T_eb_) \
+                + 1.j*kz[iz, ir]*jz \
+                + kr[iz, ir]*( jp - jm ) )
+            jp +=  0.5 * kr[iz, ir] * F
+            jm += -0.5 * kr[iz, ir] * F
+            jz += -1.j * kz[iz, ir] * F
+
+            # Read the fields and the coefficients
+            Ep_old = Ep[iz, ir]
+            Em_old = Em[iz, ir]
+            Ez_old = Ez[iz, ir]
+            Bp_old = Bp[iz, ir]
+            Bm_old = Bm[iz, ir]
+            Bz_old = Bz[iz, ir]
+            kr_ = kr[iz, ir]
+            kz_ = kz[iz, ir]
+            C_ = C[iz, ir]
+            S_w_ = S_w[iz, ir]
+            j_coef_ = j_coef[iz, ir]
+
+            # Push the PML split fields (using the fields before the push)
+            if use_pml:
+                Ep_pml[iz, ir] = T_eb_*C_*Ep_pml[iz, ir] \
+                    + c2*T_eb_*S_w_*(-1.j*0.5*kr_*Bz_old)
+                Em_pml[iz, ir] = T_eb_*C_*Em_pml[iz, ir] \
+                    + c2*T_eb_*S_w_*(-1.j*0.5*kr_*Bz_old)
+                Bp_pml[iz, ir] = T_eb_*C_*Bp_pml[iz, ir] \
+                    - T_eb_*S_w_*( -1.j*0.5*kr_*Ez_old )
+                Bm_pml[iz, ir] = T_eb_*C_*Bm_pml[iz, ir] \
+                    - T_eb_*S_w_*( -1.j*0.5*kr_*Ez_old )
+
+            # Calculate useful auxiliary arrays
+            if use_true_rho:
+                # Evaluation using the rho projected on the grid
+                rho_diff = rho_next_coef[iz, ir] * rho_n \
+                        - rho_prev_coef[iz, ir] * rho_p
+            else:
+                # Evaluation using div(E) and div(J)
+                divE = kr_*( Ep_old - Em_old ) + 1.j*kz_*Ez_old
+                divJ = kr_*( jp - jm ) + 1.j*kz_*jz
+
+                rho_diff = ( T_eb_ * rho_next_coef[iz, ir] \
+                  - rho_prev_coef[iz, ir] ) \
+                  * epsilon_0 * divE + T_rho[iz, ir] \
+                  * rho_next_coef[iz, ir] * divJ
+
+            # Push the E field
+            Ep[iz, ir] = T_eb_*C_*Ep_old + 0.5*kr_*rho_diff \
+                + j_coef_*1.j*kz_*V*jp \
+                + c2*T_eb_*S_w_*( -1.j*0.5*kr_*Bz_old \
+                + kz_*Bp_old - mu_0*T_cc_*jp )
+            Em[iz, ir] = T_eb_*C_*Em_old - 0.5*kr_*rho_diff \
+                + j_coef_*1.j*kz_*V*jm \
+                + c2*T_eb_*S_w_*( -1.j*0.5*kr_*Bz_old \
+                - kz_*Bm_old - mu_0*T_cc_*jm )
+            Ez[iz, ir] = T_eb_*C_*Ez_old - 1.j*kz_*rho_diff \
+                + j_coef_*1.j*kz_*V*jz \
+                + c2*T_eb_*S_w_*( 1.j*kr_*Bp_old \
+                + 1.j*kr_*Bm_old - mu_0*T_cc_*jz )
+
+            # Push the B field
+            Bp[iz, ir] = T_eb_*C_*Bp_old \
+                - T_eb_*S_w_*( -1.j*0.5*kr_*Ez_old + kz_*Ep_old ) \
+                + j_coef_*( -1.j*0.5*kr_*jz + kz_*jp )
+            Bm[iz, ir] = T_eb_*C_*Bm_old \
+                - T_eb_*S_w_*( -1.j*0.5*kr_*Ez_old - kz_*Em_old ) \
+                + j_coef_*( -1.j*0.5*kr_*jz - kz_*jm )
+            Bz[iz, ir] = T_eb_*C_*Bz_old \
+                - T_eb_*S_w_*( 1.j*kr_*Ep_old + 1.j*kr_*Em_old ) \
+                + j_coef_*( 1.j*kr_*jp + 1.j*kr_*jm )
+
+            # Store the corrected currents, and push rho
+            Jp[iz, ir] = jp
+            Jm[iz, ir] = jm
+            Jz[iz, ir] = jz
+            rho_prev[iz, ir] = rho_n
+            rho_next[iz, ir] = 0.
+
+    return
+
 # -----------------------------------------------------------------------
 # Parallel reduction of the global arrays for threads into a single array
 # -----------------------------------------------------------------------
 
 @njit_parallel
-def numba_erase_threading_buffer( global_array ):
+def numba_erase_threading_buffer( global_array, deposit_bounds ):
     """
     Set the threading buffer `global_array` to 0
 
+    Only the region of each thread-local copy that was modified by the
+    deposition (as recorded in `deposit_bounds`) is erased, since the rest
+    of the buffer is already 0.
+
     Parameter:
     ----------
     global_array: 4darray of complexs
         An array that contains the duplicated charge/current for each thread
+
+    deposit_bounds: 2darray of ints
+        Array of shape (nthreads, 4) that contains, for each thread, the
+        bounds iz_min, iz_max, ir_min, ir_max (exclusive upper bounds)
+        of the cells of `global_array` that were modified by the deposition
     """
     nthreads, Nm, Nz, Nr = global_array.shape
     # Loop in parallel along nthreads
     for i_thread in prange(nthreads):
-        # Loop through the modes and the grid
+        # Loop through the modes and the modified region of the grid
         for m in range(Nm):
-            for iz in range(Nz):
-                for ir in range(Nr):
+            for iz in range( deposit_bounds[i_thread, 0],
+                             deposit_bounds[i_thread, 1] ):
+                for ir in range( deposit_bounds[i_thread, 2],
+                                 deposit_bounds[i_thread, 3] ):
                     # Erase values
                     global_array[i_thread, m, iz, ir] = 0.
 
+@numba.njit
+def reset_deposit_bounds( deposit_bounds, Nz, Nr ):
+    """
+    Mark the threading buffers as entirely 0, by setting the bounds of
+    the region modified by each thread to an empty region
+
+    Parameters:
+    -----------
+    deposit_bounds: 2darray of ints
+        Array of shape (nthreads, 4) (see `numba_erase_threading_buffer`)
+
+    Nz, Nr: ints
+        The number of cells of the threading buffers (including the
+        deposition guard cells)
+    """
+    for i_thread in range( deposit_bounds.shape[0] ):
+        deposit_bounds[i_thread, 0] = Nz
+        deposit_bounds[i_thread, 1] = 0
+        deposit_bounds[i_thread, 2] = Nr
+        deposit_bounds[i_thread, 3] = 0
+
 @njit_parallel
-def sum_reduce_2d_array( global_array, reduced_array, m ):
+def sum_reduce_2d_array( global_array, reduced_array, m, deposit_bounds ):
     """
     Sum the array `global_array` along its first axis and
     add it into `reduced_array`, and fold the deposition guard cells of
     global_array into the regular cells of reduced_array.
 
+    Only the region of each thread-local copy that was modified by the
+    deposition (as recorded in `deposit_bounds`) is visited.
+
     Parameters:
     -----------
     global_array: 4darray of complexs
@@ -439,23 +760,39 @@ def sum_reduce_2d_array( global_array, reduced_array, m ):
 
     m: int
        The azimuthal mode for which the reduction should be performed
+
+    deposit_bounds: 2darray of ints
+        Array of shape (nthreads, 4) that contains, for each thread, the
+        bounds iz_min, iz_max, ir_min, ir_max (exclusive upper bounds)
+        of the cells of `global_array` that were modified by the deposition
     """
     # Extract size of each dimension
     Nz = reduced_array.shape[0]
 
+    # Find the range of z that was modified by any of the threads
+    iz_start = Nz + 4
+    iz_end = 0
+    for it in range( deposit_bounds.shape[0] ):
+        iz_start = min( iz_start, deposit_bounds[it, 0] )
+        iz_end = max( iz_end, deposit_bounds[it, 1] )
+
     # Parallel loop over z
-    for iz in prange(Nz):
+    for iz_global in prange( max(iz_start, 2), min(iz_end, Nz+2) ):
         # Get index inside reduced_array
-        iz_global = iz + 2
-        reduce_slice( reduced_array, iz, global_array, iz_global, m )
+        iz = iz_global - 2
+        reduce_slice( reduced_array, iz, global_array, iz_global, m,
+                      deposit_bounds )
     # Handle deposition guard cells in z
-    reduce_slice( reduced_array, Nz-2, global_array, 0, m )
-    reduce_slice( reduced_array, Nz-1, global_array, 1, m )
-    reduce_slice( reduced_array, 0, global_array, Nz+2, m )
-    reduce_slice( reduced_array, 1, global_array, Nz+3, m )
+    for iz_global in range( iz_start, min(iz_end, 2) ):
+        reduce_slice( reduced_array, Nz-2+iz_global, global_array, iz_global,
+                      m, deposit_bounds )
+    for iz_global in range( max(iz_start, Nz+2), iz_end ):
+        reduce_slice( reduced_array, iz_global-Nz-2, global_array, iz_global,
+                      m, deposit_bounds )
 
 @numba.njit
-def reduce_slice( reduced_array, iz, global_array, iz_global, m ):
+def reduce_slice( reduced_array, iz, global_array, iz_global, m,
+                  deposit_bounds ):
     """
     Sum the array `global_array` into `reduced_array` for one given slice in z
     """
@@ -464,12 +801,23 @@ def reduce_slice( reduced_array, iz, global_array, iz_global, m ):
     # Loop over the reduction dimension (slow dimension)
     for it in range( Nreduce ):
 
+        # Skip the threads that did not modify this slice
+        if iz_global < deposit_bounds[it, 0] or \
+                iz_global >= deposit_bounds[it, 1]:
+            continue
+        ir_start = deposit_bounds[it, 2]
+        ir_end = deposit_bounds[it, 3]
+
         # First fold the low-radius deposition guard cells in
-        reduced_array[iz, 1] += global_array[it, m, iz_global, 0]
-        reduced_array[iz, 0] += global_array[it, m, iz_global, 1]
+        if ir_start <= 0 and ir_end > 0:
+            reduced_array[iz, 1] += global_array[it, m, iz_global, 0]
+        if ir_start <= 1 and ir_end > 1:
+            reduced_array[iz, 0] += global_array[it, m, iz_global, 1]
         # Then loop over regular cells
-        for ir in range( Nr ):
+        for ir in range( max(ir_start-2, 0), min(ir_end-2, Nr) ):
             reduced_array[iz, ir] +=  global_array[it, m, iz_global, ir+2]
         # Finally fold the high-radius guard cells in
-        reduced_array[iz, Nr-1] += global_array[it, m, iz_global, Nr+2]
-        reduced_array[iz, Nr-1] += global_array[it, m, iz_global, Nr+3]
+        if ir_start <= Nr+2 and ir_end > Nr+2:
+            reduced_array[iz, Nr-1] += global_array[it, m, iz_global, Nr+2]
+        if ir_start <= Nr+3 and ir_end > Nr+3:
+            reduced_array[iz, Nr-1] += global_array[it, m, iz_global, Nr+3]
@@ -18,7 +18,7 @@ class PsatdCoeffs(object) :
     """
 
     def __init__( self, kz, kr, m, dt, Nz, Nr, V=None,
-                  use_galilean=False, use_cuda=False ) :
+                  use_galilean=False, use_cuda=False, coefs_on_the_fly=False ):
         """
         Allocates the coefficients matrices for the psatd scheme.
 
@@ -51,6 +51,11 @@ class PsatdCoeffs(object) :
 
         use_cuda : bool, optional
             Wether to use the GPU or not
+
+        coefs_on_the_fly: bool, optional
+            Whether the coefficients are recomputed at each timestep inside
+            the push kernels, from kz, kr and dt, instead of being stored.
+            (Only available for the standard PSATD, on CPU.)
         """
         # Shortcuts
         i = 1.j
@@ -62,6 +67,22 @@ class PsatdCoeffs(object) :
         # Register velocity of galilean/comoving frame
         self.V = V
 
+        # When the coefficients are recomputed inside the push kernels,
+        # do not allocate the coefficient arrays (the kernels receive
+        # placeholder arrays instead, which they do not read)
+        self.coefs_on_the_fly = coefs_on_the_fly
+        if coefs_on_the_fly:
+            if (V is not None) or use_cuda:
+                raise ValueError('The psatd coefficients can only be '
+                    'computed on the fly with the standard PSATD, on CPU.')
+            placeholder = np.zeros( (1, 1) )
+            self.C = placeholder
+            self.S_w = placeholder
+            self.j_coef = placeholder
+            self.rho_prev_coef = placeholder
+            self.rho_next_coef = placeholder
+            return
+
         # Construct the omega and inverse omega array
         w = c*np.sqrt( kz**2 + kr**2 )
         inv_w = 1./np.where( w == 0, 1., w ) # Avoid division by 0
@@ -13,7 +13,8 @@ from .numba_methods import numba_push_eb_standard, numba_push_eb_comoving, \
     numba_correct_currents_crossdeposition_standard, \
     numba_correct_currents_curlfree_comoving, \
     numba_correct_currents_crossdeposition_comoving, \
-    numba_filter_scalar, numba_filter_vector
+    numba_filter_scalar, numba_filter_vector, \
+    numba_filter_correct_push_standard, numba_filter_correct_push_comoving
 # Check if CUDA is available, then import CUDA functions
 from fbpic.utils.cuda import cuda_installed
 if cuda_installed:
@@ -377,15 +378,15 @@ class SpectralGrid(object) :
                     # Push the PML split component
                     numba_push_eb_pml_standard(
                         self.Ep_pml, self.Em_pml, self.Bp_pml, self.Bm_pml,
-                        self.Ez, self.Bz, ps.C, ps.S_w,
-                        self.kr, self.kz, self.Nz, self.Nr )
+                        self.Ez, self.Bz, ps.C, ps.S_w, self.kr, self.kz,
+                        ps.dt, ps.coefs_on_the_fly, self.Nz, self.Nr )
                 # Push the regular fields
                 numba_push_eb_standard(
                     self.Ep, self.Em, self.Ez, self.Bp, self.Bm, self.Bz,
                     self.Jp, self.Jm, self.Jz, self.rho_prev, self.rho_next,
                     ps.rho_prev_coef, ps.rho_next_coef, ps.j_coef,
                     ps.C, ps.S_w, self.kr, self.kz, ps.dt,
-                    use_true_rho, self.Nz, self.Nr )
+                    ps.coefs_on_the_fly, use_true_rho, self.Nz, self.Nr )
 
             else:
                 # With the Galilean/comoving algorithm
@@ -404,6 +405,61 @@ class SpectralGrid(object) :
                     self.kr, self.kz, ps.dt, ps.V,
                     use_true_rho, self.Nz, self.Nr )
 
+    def filter_correct_and_push(self, ps, use_true_rho=False, use_filter=True):
+        """
+        Filter rho_next and J (if use_filter is True), correct the currents
+        (curl-free correction), push the fields over one timestep,
+        and transfer rho_next to rho_prev, in a single pass over the grid.
+        (Only available on CPU.)
+
+        Parameters
+        ----------
+        ps : PsatdCoeffs object
+            psatd object corresponding to the same m mode
+
+        use_true_rho : bool, optional
+            Whether to use the rho projected on the grid
+            (see the docstring of `push_eb_with`)
+
+        use_filter : bool, optional
+            Whether to filter rho_next and J
+        """
+        # Check that psatd object passed as argument is the right one
+        # (i.e. corresponds to the right mode)
+        assert( self.m == ps.m )
+        assert( self.use_cuda is False )
+
+        # The PML arrays are not used by the kernel when use_pml is False
+        if self.use_pml:
+            Ep_pml, Em_pml, Bp_pml, Bm_pml = \
+                self.Ep_pml, self.Em_pml, self.Bp_pml, self.Bm_pml
+        else:
+            Ep_pml, Em_pml, Bp_pml, Bm_pml = \
+                self.Ep, self.Em, self.Bp, self.Bm
+
+        if ps.V is None:
+            # With the standard PSATD algorithm
+            numba_filter_correct_push_standard(
+                self.Ep, self.Em, self.Ez, self.Bp, self.Bm, self.Bz,
+                self.Jp, self.Jm, self.Jz, self.rho_prev, self.rho_next,
+                Ep_pml, Em_pml, Bp_pml, Bm_pml, self.use_pml,
+                self.filter_array_z, self.filter_array_r, use_filter,
+                self.kz, self.kr, self.inv_k2,
+                ps.rho_prev_coef, ps.rho_next_coef, ps.j_coef, ps.C, ps.S_w,
+                ps.dt, 1./ps.dt, ps.coefs_on_the_fly,
+                use_true_rho, self.Nz, self.Nr )
+        else:
+            # With the Galilean/comoving algorithm
+            numba_filter_correct_push_comoving(
+                self.Ep, self.Em, self.Ez, self.Bp, self.Bm, self.Bz,
+                self.Jp, self.Jm, self.Jz, self.rho_prev, self.rho_next,
+                Ep_pml, Em_pml, Bp_pml, Bm_pml, self.use_pml,
+                self.filter_array_z, self.filter_array_r, use_filter,
+                self.kz, self.kr, self.inv_k2,
+                ps.rho_prev_coef, ps.rho_next_coef, ps.j_coef, ps.C, ps.S_w,
+                ps.j_corr_coef, ps.T_eb, ps.T_cc, ps.T_rho, ps.V,
+                use_true_rho, self.Nz, self.Nr )
+
     def push_rho(self) :
         """
         Transfer the values of rho_next to rho_prev,
@@ -5,7 +5,20 @@
 This file is part of the Fourier-Bessel Partile-In-Cell code (FB-PIC)
 It defines the FFT object, which performs Fourier transforms along the axis 0,
 and is used in spectral_transformer.py
+
+On CPU, several FFT libraries (backends) can be used. By default, the
+available backends are benchmarked for the shape of the grid, and the
+fastest one is selected. The result of this benchmark (as well as the
+FFTW wisdom) is cached on disk, in the directory given by the environment
+variable FBPIC_CACHE_DIR (default: ~/.cache/fbpic), so that it is only
+performed once per grid shape and per host. The backend can also be
+imposed by setting the environment variable FBPIC_FFT_BACKEND to
+`mkl`, `fftw` or `scipy`.
 """
+import os
+import json
+import pickle
+import socket
 import numpy as np
 import numba
 # Check if CUDA is available, then import CUDA functions
@@ -21,18 +34,62 @@ try:
     from .mkl_fft import MKLFFT
     mkl_installed = True
 except OSError:
-    import pyfftw
     mkl_installed = False
+# Check if pyfftw is available
+try:
+    import pyfftw
+    fftw_installed = True
+except ImportError:
+    fftw_installed = False
+# Check if scipy.fft is available (scipy 1.4 and later)
+try:
+    import scipy.fft
+    scipy_fft_installed = True
+except ImportError:
+    scipy_fft_installed = False
+# High-resolution timer for the benchmark (not available in Python 2)
+try:
+    from time import perf_counter
+except ImportError:
+    from time import time as perf_counter
+
+# List of the available CPU backends (in order of preference, when the
+# backends are not benchmarked)
+available_backends = [ name for (name, installed) in
+    [ ('mkl', mkl_installed), ('fftw', fftw_installed), ('scipy', scipy_fft_installed) ]
+    if installed ]
+# Names of the backends, as printed in the simulation setup
+library_names = { 'mkl': 'MKL', 'fftw': 'pyFFTW', 'scipy': 'scipy.fft',
+                  'cufft': 'cuFFT' }
+
+# Check whether the environment variable FBPIC_FFT_BACKEND is set,
+# and in that case, use the corresponding backend (no benchmark)
+forced_backend = os.environ.get( 'FBPIC_FFT_BACKEND', 'auto' )
+if forced_backend not in available_backends + ['auto']:
+    raise ValueError( 'FBPIC_FFT_BACKEND=%s, but the available FFT '
+        'backends are: %s' %(forced_backend, available_backends) )
+# Check whether the results of the benchmark should be cached on disk
+# (FBPIC_DISABLE_CACHING also disables the caching of numba functions)
+caching = True
+if 'FBPIC_DISABLE_CACHING' in os.environ:
+    if int(os.environ['FBPIC_DISABLE_CACHING']) == 1:
+        caching = False
+
+# Backends that have already been selected during this run, for a
+# given (Nz, Nr, nthreads), so that the benchmark is only performed once
+# (and not once per azimuthal mode)
+selected_backends = {}
 
 class FFT(object):
     """
     Object that performs Fourier transform of 2D arrays along the z axis,
-    (axis 0) either on the CPU (using pyfftw) or on the GPU (using cufft)
+    (axis 0) either on the CPU (using MKL, pyfftw or scipy.fft)
+    or on the GPU (using cufft)
 
     See the methods `transform` and `inverse transform` for more information
     """
 
-    def __init__(self, Nr, Nz, use_cuda=False, nthreads=None ):
+    def __init__(self, Nr, Nz, use_cuda=False, nthreads=None, backend=None ):
         """
         Initialize an FFT object
 
@@ -48,9 +105,16 @@ class FFT(object):
            Whether to perform the Fourier transform on the z axis
 
         nthreads : int, optional
-            Number of threads for the FFTW transform.
+            Number of threads for the FFTW and scipy.fft transforms.
             If None, the default number of threads of numba is used
             (environment variable NUMBA_NUM_THREADS)
+
+        backend: string, optional
+            The library used on CPU (`mkl`, `fftw` or `scipy`).
+            If None, the backend is given by the environment variable
+            FBPIC_FFT_BACKEND if it is set, and is otherwise selected
+            by benchmarking the available backends
+            (see `select_fft_backend`)
         """
         # Check whether to use cuda
         self.use_cuda = use_cuda
@@ -59,8 +123,25 @@ class FFT(object):
             print('** Cuda not available for Fourier transform.')
             print('** Performing the Fourier transform on the CPU.')
 
-        # Check whether to use MKL
-        self.use_mkl = mkl_installed
+        # Determine number of threads
+        if nthreads is None:
+            # Get the default number of threads for numba
+            nthreads = numba.config.NUMBA_NUM_THREADS
+        self.nthreads = nthreads
+
+        # Choose the CPU backend
+        self.autotuned = False
+        if self.use_cuda:
+            self.backend = 'cufft'
+        elif backend is not None:
+            self.backend = backend
+        elif forced_backend != 'auto':
+            self.backend = forced_backend
+        else:
+            self.backend = select_fft_backend( Nz, Nr, nthreads )
+            self.autotuned = True
+        self.use_mkl = (self.backend == 'mkl')
+        self.library_name = library_names.get( self.backend, self.backend )
 
         # Initialize the object for calculation on the GPU
         if self.use_cuda:
@@ -81,18 +162,15 @@ class FFT(object):
         # Initialize the object for calculation on the CPU
         else:
             # For MKL FFT
-            if self.use_mkl:
+            if self.backend == 'mkl':
                 # Initialize the MKL plan with dummy array
                 spect_buffer = np.zeros( (Nz, Nr), dtype=np.complex128 )
                 self.mklfft = MKLFFT( spect_buffer )
 
             # For FFTW
-            else:
-                # Determine number of threads
-                if nthreads is None:
-                    # Get the default number of threads for numba
-                    nthreads = numba.config.NUMBA_NUM_THREADS
+            elif self.backend == 'fftw':
                 # Initialize the FFT plan with dummy arrays
+                # (The planning reuses the FFTW wisdom, when available)
                 interp_buffer = np.zeros( (Nz, Nr), dtype=np.complex128 )
                 spect_buffer = np.zeros( (Nz, Nr), dtype=np.complex128 )
                 self.fft = pyfftw.FFTW( interp_buffer, spect_buffer,
@@ -100,6 +178,10 @@ class FFT(object):
                 self.ifft = pyfftw.FFTW( spect_buffer, interp_buffer,
                         axes=(0,), direction='FFTW_BACKWARD', threads=nthreads)
 
+            # scipy.fft does not require any initialization
+            elif self.backend != 'scipy':
+                raise ValueError( 'Unknown FFT backend: %s' %self.backend )
+
 
     def transform( self, array_in, array_out ):
         """
@@ -124,14 +206,18 @@ class FFT(object):
             # Copy 1D arrays back to 2D array
             cuda_copy_1d_to_2d[self.dim_grid, self.dim_block](
                 self.buffer1d_out, array_out)
-        elif self.use_mkl:
+        elif self.backend == 'mkl':
             # Perform the FFT on the CPU using MKL
             self.mklfft.transform( array_in, array_out )
-        else :
+        elif self.backend == 'fftw':
             # Perform the FFT on the CPU using FFTW
             self.fft.update_arrays( new_input_array=array_in,
                                     new_output_array=array_out )
             self.fft()
+        else:
+            # Perform the FFT on the CPU using scipy
+            array_out[:,:] = scipy.fft.fft( array_in, axis=0,
+                                            workers=self.nthreads )
 
     def inverse_transform( self, array_in, array_out ):
         """
@@ -158,11 +244,134 @@ class FFT(object):
             # Copy 1D arrays back to 2D array
             cuda_copy_1d_to_2d[self.dim_grid, self.dim_block](
                 self.buffer1d_out, array_out)
-        elif self.use_mkl:
+        elif self.backend == 'mkl':
             # Perform the inverse FFT on the CPU using MKL
             self.mklfft.inverse_transform( array_in, array_out )
-        else :
+        elif self.backend == 'fftw':
             # Perform the inverse FFT on the CPU using FFTW
             self.ifft.update_arrays( new_input_array=array_in,
                                     new_output_array=array_out )
             self.ifft()
+        else:
+            # Perform the inverse FFT on the CPU using scipy
+            array_out[:,:] = scipy.fft.ifft( array_in, axis=0,
+                                             workers=self.nthreads )
+
+
+def select_fft_backend( Nz, Nr, nthreads, cache_dir=None, n_repeat=5 ):
+    """
+    Return the fastest CPU backend for Fourier transforms of arrays of
+    shape (Nz, Nr), by benchmarking the available backends.
+
+    The result is cached in memory (for the rest of the run) and on disk,
+    in a file keyed by the host name, the shape and the number of threads,
+    so that the benchmark is only performed once. The FFTW wisdom
+    accumulated during the benchmark is also saved on disk, and reloaded
+    before the next benchmark or FFTW planning.
+
+    Parameters
+    ----------
+    Nz, Nr: int
+        Shape of the arrays that are transformed
+
+    nthreads: int
+        Number of threads used by the FFTW and scipy.fft transforms
+
+    cache_dir: string, optional
+        Directory where the results are cached. If None, the environment
+        variable FBPIC_CACHE_DIR is used, or ~/.cache/fbpic by default.
+
+    n_repeat: int, optional
+        Number of forward and backward transforms that are timed
+        for each backend (the fastest run is used)
+
+    Returns
+    -------
+    backend: string (`mkl`, `fftw` or `scipy`)
+    """
+    key = '%s_%dx%d_%dthreads' %(socket.gethostname(), Nz, Nr, nthreads)
+    if key in selected_backends:
+        return( selected_backends[key] )
+    if cache_dir is None:
+        cache_dir = os.environ.get( 'FBPIC_CACHE_DIR',
+            os.path.join( os.path.expanduser('~'), '.cache', 'fbpic' ) )
+    cache_file = os.path.join( cache_dir, 'fft_backends.json' )
+    wisdom_file = os.path.join( cache_dir,
+                        'fftw_wisdom_%s.pickle' %socket.gethostname() )
+
+    # Load the previous results and the FFTW wisdom
+    cached_backends = {}
+    if caching:
+        cached_backends = load_cache( cache_file )
+        if fftw_installed and os.path.exists( wisdom_file ):
+            try:
+                with open( wisdom_file, 'rb' ) as f:
+                    pyfftw.import_wisdom( pickle.load( f ) )
+            except Exception:
+                pass
+    if cached_backends.get( key, None ) in available_backends:
+        selected_backends[key] = cached_backends[key]
+        return( cached_backends[key] )
+
+    # Benchmark the available backends
+    # (Use a local random generator, so as not to modify the state of the
+    # global generator, which would then depend on the cache)
+    random_state = np.random.RandomState( 0 )
+    array_in = random_state.rand( Nz, Nr ) + 1.j*random_state.rand( Nz, Nr )
+    array_out = np.zeros( (Nz, Nr), dtype=np.complex128 )
+    timings = {}
+    for backend in available_backends:
+        fft = FFT( Nr, Nz, nthreads=nthreads, backend=backend )
+        # First call, to exclude the possible initialization overhead
+        fft.transform( array_in, array_out )
+        fft.inverse_transform( array_out, array_in )
+        timings[backend] = np.inf
+        for _ in range(n_repeat):
+            t0 = perf_counter()
+            fft.transform( array_in, array_out )
+            fft.inverse_transform( array_out, array_in )
+            timings[backend] = min( timings[backend], perf_counter()-t0 )
+    backend = min( timings, key=timings.get )
+    selected_backends[key] = backend
+
+    # Save the results and the FFTW wisdom
+    if caching:
+        try:
+            if not os.path.exists( cache_dir ):
+                os.makedirs( cache_dir )
+            cached_backends = load_cache( cache_file )
+            cached_backends[key] = backend
+            write_atomically( cache_file, json.dumps(
+                cached_backends, indent=4, sort_keys=True ).encode() )
+            if fftw_installed:
+                write_atomically( wisdom_file,
+                                  pickle.dumps( pyfftw.export_wisdom() ) )
+        except (OSError, IOError):
+            # e.g. read-only file system: the benchmark is simply
+            # performed again at the next run
+            pass
+
+    return( backend )
+
+def load_cache( cache_file ):
+    """
+    Return the dictionary of the cached backends (empty if the cache
+    file does not exist or cannot be read)
+    """
+    try:
+        with open( cache_file ) as f:
+            return( json.load( f ) )
+    except (OSError, IOError, ValueError):
+        return( {} )
+
+def write_atomically( filename, data ):
+    """
+    Write the bytes `data` to `filename`, through a temporary file, so that
+    concurrent processes (e.g. MPI ranks) never read a partial file
+    """
+    tmp_filename = '%s.%d.tmp' %(filename, os.getpid())
+    with open( tmp_filename, 'wb' ) as f:
+        f.write( data )
+    # (os.rename overwrites the destination atomically on POSIX systems ;
+    # os.replace does the same on Windows, but is not available in Python 2)
+    getattr( os, 'replace', os.rename )( tmp_filename, filename )
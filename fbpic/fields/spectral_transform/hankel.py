@@ -15,6 +15,7 @@ from scipy.special import jn, jn_zeros
 # Check if CUDA is available, then import CUDA functions
 from fbpic.utils.cuda import cuda_installed
 from .numba_methods import numba_copy_2dC_to_2dR, numba_copy_2dR_to_2dC
+from .hierarchical_matrix import HierarchicalMatrix
 if cuda_installed:
     from fbpic.utils.cuda import cuda_tpb_bpg_2d, cuda_gpu_model
     from .cuda_methods import cuda_copy_2dC_to_2dR, cuda_copy_2dR_to_2dC
@@ -27,7 +28,7 @@ class DHT(object):
     Class that allows to perform the Discrete Hankel Transform.
     """
 
-    def __init__(self, p, m, Nr, Nz, rmax, use_cuda=False ):
+    def __init__(self, p, m, Nr, Nz, rmax, use_cuda=False, tolerance=None ):
         """
         Calculate the r (position) and nu (frequency) grid
         on which the transform will operate.
@@ -51,6 +52,12 @@ class DHT(object):
 
         use_cuda: bool, optional
         Whether to use the GPU for the Hankel transform
+
+        tolerance: float or None, optional
+        If None, the transform is a dense matrix product. Otherwise,
+        the matrices are compressed (see `HierarchicalMatrix`), with the
+        relative accuracy `tolerance`. This reduces the cost of the
+        transform for large Nr. (Only used on CPU.)
         """
         # Register whether to use the GPU.
         # If yes, initialize the corresponding cuda object
@@ -121,6 +128,13 @@ class DHT(object):
         else:
             self.M = np.linalg.inv( self.invM )
 
+        # Compress the matrices if needed
+        self.compressed_M = None
+        self.compressed_invM = None
+        if (tolerance is not None) and (not self.use_cuda):
+            self.compressed_M = HierarchicalMatrix( self.M, tolerance )
+            self.compressed_invM = HierarchicalMatrix( self.invM, tolerance )
+
         # Copy the matrices to the GPU if needed
         if self.use_cuda:
             self.d_M = cupy.asarray( self.M )
@@ -171,7 +185,7 @@ class DHT(object):
         return( self.nu )
 
 
-    def transform( self, F, G ):
+    def transform( self, F, G, iz_min=0, iz_max=None ):
         """
         Perform the Hankel transform of F.
 
@@ -183,9 +197,28 @@ class DHT(object):
 
         G: 2darray of complex values
         Array where the result will be stored
+
+        iz_min, iz_max: ints, optional
+        If iz_max is not None, F is assumed to be zero outside of the rows
+        iz_min:iz_max, and only these rows are transformed (the other rows
+        of G are set to zero). Only supported on CPU.
         """
+        # Transform only a subset of the rows
+        if iz_max is not None:
+            assert not self.use_cuda
+            n_rows = iz_max - iz_min
+            array_in = self.array_in[:2*n_rows]
+            array_out = self.array_out[:2*n_rows]
+            numba_copy_2dC_to_2dR( F[iz_min:iz_max], array_in )
+            if self.compressed_M is not None:
+                self.compressed_M.dot( array_in, array_out )
+            else:
+                np.dot( array_in, self.M, out=array_out )
+            numba_copy_2dR_to_2dC( array_out, G[iz_min:iz_max] )
+            G[:iz_min] = 0.
+            G[iz_max:] = 0.
         # Perform the matrix product with M
-        if self.use_cuda:
+        elif self.use_cuda:
             # Convert C-order, complex array `F` to F-order, real `d_in`
             cuda_copy_2dC_to_2dR[self.dim_grid, self.dim_block]( F, self.d_in )
             # Call cuBLAS gemm kernel
@@ -199,7 +232,10 @@ class DHT(object):
             # Convert complex array `F` to real array `array_in`
             numba_copy_2dC_to_2dR( F, self.array_in )
             # Perform real matrix product (faster than complex matrix product)
-            np.dot( self.array_in, self.M, out=self.array_out )
+            if self.compressed_M is not None:
+                self.compressed_M.dot( self.array_in, self.array_out )
+            else:
+                np.dot( self.array_in, self.M, out=self.array_out )
             # Convert real array `array_out` to complex array `G`
             numba_copy_2dR_to_2dC( self.array_out, G )
 
@@ -230,6 +266,9 @@ class DHT(object):
             # Convert complex array `G` to real array `array_in`
             numba_copy_2dC_to_2dR( G, self.array_in )
             # Perform real matrix product (faster than complex matrix product)
-            np.dot( self.array_in, self.invM, out=self.array_out )
+            if self.compressed_invM is not None:
+                self.compressed_invM.dot( self.array_in, self.array_out )
+            else:
+                np.dot( self.array_in, self.invM, out=self.array_out )
             # Convert real array `array_out` to complex array `F`
             numba_copy_2dR_to_2dC( self.array_out, F )
@@ -0,0 +1,121 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This file is part of FBPIC (Fourier-Bessel Particle-In-Cell code).
+It defines the class HierarchicalMatrix, which is used to compress the
+matrices of the discrete Hankel transform for large Nr.
+"""
+import numpy as np
+
+class HierarchicalMatrix(object):
+    """
+    Compressed representation of a dense square matrix M, for the
+    product a.M (where a is a 2D array).
+
+    The matrix is recursively partitioned into 4 blocks (quad-tree),
+    and each block of the partition is stored either as a dense block,
+    or as a low-rank product U.V (truncated singular value decomposition).
+    For each block, the representation (dense, low-rank, or further
+    partitioned) that requires the fewest coefficients is selected,
+    which also minimizes the number of operations of the product.
+
+    This is efficient for the matrices of the Hankel transform, since
+    the blocks of the Bessel kernel that couple distant ranges of r and nu
+    are numerically low-rank.
+    """
+
+    def __init__( self, M, tolerance, leaf_size=32, max_svd_size=512 ):
+        """
+        Compress the matrix M
+
+        Parameters
+        ----------
+        M: 2darray of floats
+            The matrix to be compressed
+
+        tolerance: float
+            Relative accuracy of the low-rank blocks: the singular values
+            below `tolerance` times the norm of M are discarded.
+            (The relative error on the product a.M is thus of the order of
+            `tolerance` times the condition number of M, at most.)
+
+        leaf_size: int, optional
+            Blocks smaller than this size are not further partitioned
+
+        max_svd_size: int, optional
+            The low-rank decomposition is only attempted for blocks that
+            are smaller than this size (larger blocks of the Bessel kernel
+            are not low-rank, and their SVD would be expensive)
+        """
+        self.shape = M.shape
+        self.tolerance = tolerance
+        self.leaf_size = leaf_size
+        self.max_svd_size = max_svd_size
+
+        # Absolute threshold for the singular values
+        self.threshold = tolerance * np.linalg.norm( M, 2 )
+
+        # Recursively partition the matrix
+        # (list of tuples (i0, i1, j0, j1, U, V), where V is None for
+        # dense blocks, and where M[i0:i1, j0:j1] ~ U.V otherwise)
+        n_coefs, self.blocks = self.compress( M, 0, M.shape[0], 0, M.shape[1] )
+        # Fraction of the coefficients of the dense matrix that are stored
+        self.compression = n_coefs / M.size
+
+    def compress( self, M, i0, i1, j0, j1 ):
+        """
+        Return the cheapest representation of the block M[i0:i1, j0:j1],
+        as a tuple (number of coefficients, list of blocks)
+        """
+        n_rows = i1 - i0
+        n_cols = j1 - j0
+        block = M[i0:i1, j0:j1]
+        # Dense representation
+        best = ( n_rows*n_cols, [ (i0, i1, j0, j1, block.copy(), None) ] )
+
+        # Low-rank representation
+        if max( n_rows, n_cols ) <= self.max_svd_size:
+            U, s, V = np.linalg.svd( block, full_matrices=False )
+            rank = int( np.sum( s > self.threshold ) )
+            n_coefs = rank*( n_rows + n_cols )
+            if n_coefs < best[0]:
+                best = ( n_coefs, [ (i0, i1, j0, j1,
+                    U[:, :rank]*s[np.newaxis, :rank], V[:rank, :].copy()) ] )
+            # Do not partition blocks that are already strongly compressed
+            if n_coefs < 0.25*n_rows*n_cols:
+                return( best )
+
+        # Partitioned representation
+        if min( n_rows, n_cols ) > self.leaf_size:
+            i_mid = (i0 + i1)//2
+            j_mid = (j0 + j1)//2
+            n_coefs = 0
+            blocks = []
+            for (k0, k1) in [ (i0, i_mid), (i_mid, i1) ]:
+                for (l0, l1) in [ (j0, j_mid), (j_mid, j1) ]:
+                    n_sub, sub_blocks = self.compress( M, k0, k1, l0, l1 )
+                    n_coefs += n_sub
+                    blocks += sub_blocks
+            if n_coefs < best[0]:
+                best = ( n_coefs, blocks )
+
+        return( best )
+
+    def dot( self, a, out ):
+        """
+        Compute the matrix product a.M, and store it in `out`
+
+        Parameters
+        ----------
+        a: 2darray of floats
+            Array of shape (N, M.shape[0])
+
+        out: 2darray of floats
+            Array of shape (N, M.shape[1]), which is overwritten
+        """
+        out[:, :] = 0.
+        for (i0, i1, j0, j1, U, V) in self.blocks:
+            if V is None:
+                out[:, j0:j1] += np.dot( a[:, i0:i1], U )
+            else:
+                out[:, j0:j1] += np.dot( np.dot( a[:, i0:i1], U ), V )
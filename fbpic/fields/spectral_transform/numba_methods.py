@@ -6,6 +6,7 @@ This file is part of the Fourier-Bessel Particle-In-Cell code (FB-PIC)
 It defines a set of functions that are useful when converting the
 fields from interpolation grid to the spectral grid and vice-versa
 """
+import numba
 from fbpic.utils.threading import prange, njit_parallel
 
 @njit_parallel
@@ -101,3 +102,42 @@ def numba_pm_to_rt( buffer_p, buffer_m, buffer_r, buffer_t ) :
             # Combine the values
             buffer_r[iz, ir] =     ( value_p + value_m )
             buffer_t[iz, ir] = 1.j*( value_p - value_m )
+
+# ----------------------------------------------------
+# Detection of the empty regions of the source arrays
+# ----------------------------------------------------
+
+@numba.njit
+def get_nonzero_z_range( array ):
+    """
+    Return the range (iz_min, iz_max) of z indices outside of which
+    the rows of the 2D array `array` are zero (i.e. array[:iz_min] and
+    array[iz_max:] are zero). If the whole array is zero, iz_min=iz_max=0.
+
+    The array is scanned from both ends, so that this function
+    returns quickly when the first and last rows are non-zero.
+    """
+    Nz, Nr = array.shape
+
+    # Find the first non-zero row
+    iz_min = Nz
+    for iz in range(Nz):
+        for ir in range(Nr):
+            if array[iz, ir] != 0:
+                iz_min = iz
+                break
+        if iz_min < Nz:
+            break
+    if iz_min == Nz:
+        return( 0, 0 )
+
+    # Find the last non-zero row
+    iz_max = iz_min + 1
+    for iz in range(Nz-1, iz_min, -1):
+        for ir in range(Nr):
+            if array[iz, ir] != 0:
+                iz_max = iz + 1
+                break
+        if iz_max > iz_min + 1:
+            break
+    return( iz_min, iz_max )
@@ -10,7 +10,8 @@ import numpy as np
 from .hankel import DHT
 from .fourier import FFT
 
-from .numba_methods import numba_rt_to_pm, numba_pm_to_rt
+from .numba_methods import numba_rt_to_pm, numba_pm_to_rt, \
+    get_nonzero_z_range
 # Check if CUDA is available, then import CUDA functions
 from fbpic.utils.cuda import cuda_installed
 if cuda_installed:
@@ -39,7 +40,7 @@ class SpectralTransformer(object) :
         converts a vector field from the interpolation to the spectral grid
     """
 
-    def __init__(self, Nz, Nr, m, rmax, use_cuda=False ) :
+    def __init__(self, Nz, Nr, m, rmax, use_cuda=False, dht_tolerance=None ):
         """
         Initializes the dht and fft attributes, which contain auxiliary
         matrices allowing to transform the fields quickly
@@ -54,6 +55,10 @@ class SpectralTransformer(object) :
 
         rmax : float
             The size of the simulation box along r.
+
+        dht_tolerance : float or None, optional
+            If not None, use compressed Hankel transforms with this
+            relative accuracy (see the docstring of `DHT`)
         """
         # Check whether to use the GPU
         self.use_cuda = use_cuda
@@ -64,9 +69,12 @@ class SpectralTransformer(object) :
             self.dim_grid, self.dim_block = cuda_tpb_bpg_2d( Nz, Nr, 1, 32 )
 
         # Initialize the DHT (local implementation, see hankel.py)
-        self.dht0 = DHT(  m, m, Nr, Nz, rmax, use_cuda=self.use_cuda )
-        self.dhtp = DHT(m+1, m, Nr, Nz, rmax, use_cuda=self.use_cuda )
-        self.dhtm = DHT(m-1, m, Nr, Nz, rmax, use_cuda=self.use_cuda )
+        self.dht0 = DHT(  m, m, Nr, Nz, rmax, use_cuda=self.use_cuda,
+                          tolerance=dht_tolerance )
+        self.dhtp = DHT(m+1, m, Nr, Nz, rmax, use_cuda=self.use_cuda,
+                          tolerance=dht_tolerance )
+        self.dhtm = DHT(m-1, m, Nr, Nz, rmax, use_cuda=self.use_cuda,
+                          tolerance=dht_tolerance )
 
         # Initialize the FFT
         self.fft = FFT( Nr, Nz, use_cuda=self.use_cuda )
@@ -154,7 +162,8 @@ class SpectralTransformer(object) :
         self.fft.inverse_transform( self.spect_buffer_r, interp_array_r )
         self.fft.inverse_transform( self.spect_buffer_t, interp_array_t )
 
-    def interp2spect_scal( self, interp_array, spect_array ) :
+    def interp2spect_scal( self, interp_array, spect_array,
+                           skip_zeros=False ) :
         """
         Convert a scalar field from the interpolation grid
         to the spectral grid.
@@ -169,7 +178,28 @@ class SpectralTransformer(object) :
         spect_array : 2darray
            A complex array representing the fields in spectral space,
            and which is overwritten by this function.
+
+        skip_zeros : bool, optional
+           Whether to skip the work for the rows of `interp_array` that are
+           zero (e.g. regions without plasma, for the sources), by
+           performing the Hankel transform first, and only on the non-zero
+           rows. (Only supported on CPU.)
         """
+        if skip_zeros:
+            iz_min, iz_max = get_nonzero_z_range( interp_array )
+            if iz_max - iz_min < interp_array.shape[0]:
+                if iz_max == iz_min:
+                    # The whole array is zero
+                    spect_array[:, :] = 0.
+                else:
+                    # Perform the DHT on the non-zero rows, then the FFT
+                    # (the two transforms commute, since they operate
+                    # along different axes)
+                    self.dht0.transform( interp_array, self.spect_buffer_r,
+                                         iz_min, iz_max )
+                    self.fft.transform( self.spect_buffer_r, spect_array )
+                return
+
         # Perform the FFT first (along axis 0, which corresponds to z)
         self.fft.transform( interp_array, self.spect_buffer_r )
 
@@ -177,7 +207,7 @@ class SpectralTransformer(object) :
         self.dht0.transform( self.spect_buffer_r, spect_array )
 
     def interp2spect_vect( self, interp_array_r, interp_array_t,
-                           spect_array_p, spect_array_m ) :
+                           spect_array_p, spect_array_m, skip_zeros=False ) :
         """
         Convert a transverse vector field from the interpolation grid
         (e.g. Er, Et) to the spectral space (e.g. Ep, Em)
@@ -192,7 +222,40 @@ class SpectralTransformer(object) :
         spect_array_p, spect_array_m : 2darray
            Complex arrays representing the fields in spectral space,
            and which are overwritten by this function.
+
+        skip_zeros : bool, optional
+           Whether to skip the work for the rows of the interpolation arrays
+           that are zero (see `interp2spect_scal`)
         """
+        if skip_zeros:
+            iz_min_r, iz_max_r = get_nonzero_z_range( interp_array_r )
+            iz_min_t, iz_max_t = get_nonzero_z_range( interp_array_t )
+            if iz_max_r == iz_min_r:
+                iz_min, iz_max = iz_min_t, iz_max_t
+            elif iz_max_t == iz_min_t:
+                iz_min, iz_max = iz_min_r, iz_max_r
+            else:
+                iz_min = min( iz_min_r, iz_min_t )
+                iz_max = max( iz_max_r, iz_max_t )
+            if iz_max - iz_min < interp_array_r.shape[0]:
+                if iz_max == iz_min:
+                    # The whole arrays are zero
+                    spect_array_p[:, :] = 0.
+                    spect_array_m[:, :] = 0.
+                else:
+                    # Combine the r and t components (in the spectral
+                    # arrays, which are used as temporary buffers), then
+                    # perform the DHT on the non-zero rows, and the FFT
+                    numba_rt_to_pm( interp_array_r, interp_array_t,
+                                    spect_array_p, spect_array_m )
+                    self.dhtp.transform( spect_array_p, self.spect_buffer_p,
+                                         iz_min, iz_max )
+                    self.dhtm.transform( spect_array_m, self.spect_buffer_m,
+                                         iz_min, iz_max )
+                    self.fft.transform( self.spect_buffer_p, spect_array_p )
+                    self.fft.transform( self.spect_buffer_m, spect_array_m )
+                return
+
         # Perform the FFT first (along axis 0, which corresponds to z)
         self.fft.transform( interp_array_r, self.spect_buffer_r )
         self.fft.transform( interp_array_t, self.spect_buffer_t )
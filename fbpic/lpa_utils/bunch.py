@@ -5,20 +5,25 @@
 This file is part of the Fourier-Bessel Particle-In-Cell code (FB-PIC)
 It defines a set of utilities for the initialization of an electron bunch.
 """
+import os
+import h5py
 import numpy as np
+from itertools import islice
 from scipy.constants import m_e, c, e, epsilon_0, mu_0
 from fbpic.fields import Fields
 from fbpic.particles.elementary_process.cuda_numba_utils import \
     reallocate_and_copy_old
 from fbpic.particles.injection import BallisticBeforePlane
 from fbpic.utils.cuda import GpuMemoryManager
+from fbpic.utils.mpi import MPI
 import warnings
 
 
 def add_particle_bunch(sim, q, m, gamma0, n, p_zmin, p_zmax, p_rmin, p_rmax,
                        p_nr=2, p_nz=2, p_nt=4, dens_func=None, boost=None,
                        direction='forward', z_injection_plane=None,
-                       initialize_self_field=True):
+                       initialize_self_field=True,
+                       distributed_self_field=False):
     """
     Introduce a simple relativistic particle bunch in the simulation,
     along with its space charge field.
@@ -87,6 +92,11 @@ def add_particle_bunch(sim, q, m, gamma0, n, p_zmin, p_zmax, p_rmin, p_rmax,
     initialize_self_field: bool, optional
        Whether to calculate the initial space charge fields of the bunch
        and add these fields to the fields on the grid (Default: True)
+
+    distributed_self_field: bool, optional
+       Whether to calculate the space charge fields on the local grid of
+       each MPI rank, instead of gathering the sources on the first rank.
+       (See the docstring of `get_space_charge_fields`.)
     """
     # Calculate the electron momentum
     uz_m = ( gamma0**2 - 1. )**0.5
@@ -107,7 +117,8 @@ def add_particle_bunch(sim, q, m, gamma0, n, p_zmin, p_zmax, p_rmin, p_rmax,
 
     # Get the corresponding space-charge fields
     if initialize_self_field:
-        get_space_charge_fields( sim, ptcl_bunch, direction=direction )
+        get_space_charge_fields( sim, ptcl_bunch, direction=direction,
+                                 distributed=distributed_self_field )
     return ptcl_bunch
 
 
@@ -115,7 +126,8 @@ def add_particle_bunch_gaussian(sim, q, m, sig_r, sig_z, n_emit, gamma0,
                                 sig_gamma, n_physical_particles,
                                 n_macroparticles, tf=0., zf=0., boost=None,
                                 save_beam=None, z_injection_plane=None,
-                                initialize_self_field=True):
+                                initialize_self_field=True,
+                                distributed_self_field=False):
     """
     Introduce a relativistic Gaussian particle bunch in the simulation,
     along with its space charge field.
@@ -180,6 +192,11 @@ def add_particle_bunch_gaussian(sim, q, m, sig_r, sig_z, n_emit, gamma0,
     initialize_self_field: bool, optional
        Whether to calculate the initial space charge fields of the bunch
        and add these fields to the fields on the grid (Default: True)
+
+    distributed_self_field: bool, optional
+       Whether to calculate the space charge fields on the local grid of
+       each MPI rank, instead of gathering the sources on the first rank.
+       (See the docstring of `get_space_charge_fields`.)
     """
     # Generate Gaussian gamma distribution of the beam
     if sig_gamma > 0.:
@@ -247,14 +264,16 @@ def add_particle_bunch_gaussian(sim, q, m, sig_r, sig_z, n_emit, gamma0,
     # Add the electrons to the simulation
     ptcl_bunch = add_particle_bunch_from_arrays(sim, q, m, x, y, z, ux, uy, uz,
                     w, boost=boost, z_injection_plane=z_injection_plane,
-                    initialize_self_field=initialize_self_field)
+                    initialize_self_field=initialize_self_field,
+                    distributed_self_field=distributed_self_field)
     return ptcl_bunch
 
 
 def add_particle_bunch_file(sim, q, m, filename, n_physical_particles,
                             z_off=0., boost=None, direction='forward',
                             z_injection_plane=None,
-                            initialize_self_field=True):
+                            initialize_self_field=True, chunk_size=None,
+                            distributed_self_field=False):
     """
     Introduce a relativistic particle bunch in the simulation,
     along with its space charge field, loading particles from text file.
@@ -299,7 +318,35 @@ def add_particle_bunch_file(sim, q, m, filename, n_physical_particles,
     initialize_self_field: bool, optional
        Whether to calculate the initial space charge fields of the bunch
        and add these fields to the fields on the grid (Default: True)
+
+    distributed_self_field: bool, optional
+       Whether to calculate the space charge fields on the local grid of
+       each MPI rank, instead of gathering the sources on the first rank.
+       (See the docstring of `get_space_charge_fields`.)
+
+    chunk_size: int or None, optional
+       If None, every MPI rank loads the whole file, and then discards
+       the particles that are outside of its local subdomain.
+       Otherwise, the file is read by chunks of `chunk_size` lines: each
+       chunk is converted to the boosted frame (if `boost` is not None)
+       and only the particles of the local subdomain are kept. This bounds
+       the memory footprint of each rank for very large bunches.
     """
+    if chunk_size is not None:
+        # Read the file chunk by chunk, and only keep the local particles
+        x, y, z, ux, uy, uz, inv_gamma, n_macroparticles = \
+            read_local_particles_from_text( sim, filename, z_off,
+                                            boost, chunk_size )
+        w = n_physical_particles / n_macroparticles * np.ones_like(x)
+        # Add the electrons to the simulation
+        ptcl_bunch = add_local_particle_bunch( sim, q, m, x, y, z,
+                        ux, uy, uz, inv_gamma, w, boost=boost,
+                        direction=direction,
+                        z_injection_plane=z_injection_plane,
+                        initialize_self_field=initialize_self_field,
+                        distributed_self_field=distributed_self_field )
+        return ptcl_bunch
+
     # Load particle data to numpy array
     particle_data = np.loadtxt(filename)
 
@@ -319,14 +366,16 @@ def add_particle_bunch_file(sim, q, m, filename, n_physical_particles,
     ptcl_bunch = add_particle_bunch_from_arrays(sim, q, m, x, y, z, ux, uy, uz,
                            w, boost=boost, direction=direction,
                            z_injection_plane=z_injection_plane,
-                           initialize_self_field=initialize_self_field)
+                           initialize_self_field=initialize_self_field,
+                           distributed_self_field=distributed_self_field)
     return ptcl_bunch
 
 
 def add_particle_bunch_openPMD( sim, q, m, ts_path, z_off=0., species=None,
                                 select=None, iteration=None, boost=None,
                                 z_injection_plane=None,
-                                initialize_self_field=True ):
+                                initialize_self_field=True, chunk_size=None,
+                                distributed_self_field=False ):
     """
     Introduce a relativistic particle bunch in the simulation,
     along with its space charge field, loading particles from an openPMD
@@ -360,9 +409,12 @@ def add_particle_bunch_openPMD( sim, q, m, ts_path, z_off=0., species=None,
     select: dict, optional
         Either None or a dictionary of rules
         to select the particles, of the form
-        'x' : [-4., 10.]   (Particles having x between -4 and 10 microns)
-        'ux' : [-0.1, 0.1] (Particles having ux between -0.1 and 0.1 mc)
-        'uz' : [5., None]  (Particles with uz above 5 mc)
+        'x' : [-4.e-6, 10.e-6] (Particles having x between -4 and 10 microns)
+        'ux' : [-0.1, 0.1]     (Particles having ux between -0.1 and 0.1 mc)
+        'uz' : [5., None]      (Particles with uz above 5 mc)
+        The positions are in meters (except with the deprecated
+        openPMD-viewer 0 and `chunk_size=None`, in which case they are
+        in microns).
 
     iteration: integer (optional)
         The iteration number of the openPMD file from which to extract the
@@ -381,7 +433,36 @@ def add_particle_bunch_openPMD( sim, q, m, ts_path, z_off=0., species=None,
     initialize_self_field: bool, optional
        Whether to calculate the initial space charge fields of the bunch
        and add these fields to the fields on the grid (Default: True)
+
+    distributed_self_field: bool, optional
+       Whether to calculate the space charge fields on the local grid of
+       each MPI rank, instead of gathering the sources on the first rank.
+       (See the docstring of `get_space_charge_fields`.)
+
+    chunk_size: int or None, optional
+       If None, every MPI rank loads the whole bunch with openPMD-viewer,
+       and then discards the particles that are outside of its local
+       subdomain. Otherwise, the HDF5 file is read directly (with h5py)
+       by slices of `chunk_size` particles: each slice is converted to the
+       boosted frame (if `boost` is not None) and only the particles of the
+       local subdomain are kept. The MPI ranks share a first pass over the
+       file, which only reads the quantities that are needed to find the
+       final position of the particles; in the second pass, each rank only
+       reads the slices that overlap with its local subdomain.
     """
+    if chunk_size is not None:
+        # Read the file slice by slice, and only keep the local particles
+        x, y, z, ux, uy, uz, inv_gamma, w = \
+            read_local_particles_from_openPMD( sim, ts_path, z_off, species,
+                                        select, iteration, boost, chunk_size )
+        # Add the electrons to the simulation, and calculate the space charge
+        ptcl_bunch = add_local_particle_bunch( sim, q, m, x, y, z,
+                        ux, uy, uz, inv_gamma, w, boost=boost,
+                        z_injection_plane=z_injection_plane,
+                        initialize_self_field=initialize_self_field,
+                        distributed_self_field=distributed_self_field )
+        return ptcl_bunch
+
     # Try to import openPMD-viewer, version 1
     try:
         from openpmd_viewer import OpenPMDTimeSeries
@@ -399,6 +480,14 @@ def add_particle_bunch_openPMD( sim, q, m, ts_path, z_off=0., species=None,
         'The package openPMD-viewer is required to load a particle bunch from on openPMD file.'
         '\nPlease install it from https://github.com/openPMD/openPMD-viewer')
     ts = OpenPMDTimeSeries(ts_path)
+    if (openpmd_viewer_version == 0) and (select is not None) and \
+            any( quantity in ('x', 'y', 'z') for quantity in select ):
+        # openPMD-viewer 0 uses microns: the bounds are passed unchanged
+        warnings.warn(
+            "With openPMD-viewer 0, the positions in `select` are in microns"
+            "\n(whereas they are in meters with openPMD-viewer 1, or when "
+            "`chunk_size` is not None).\nPlease update openPMD-viewer, "
+            "since this behavior is deprecated.", DeprecationWarning )
     # Extract phasespace and particle weights
     x, y, z, ux, uy, uz, w = ts.get_particle(
                                 ['x', 'y', 'z', 'ux', 'uy', 'uz', 'w'],
@@ -416,14 +505,16 @@ def add_particle_bunch_openPMD( sim, q, m, ts_path, z_off=0., species=None,
     ptcl_bunch = add_particle_bunch_from_arrays(sim, q, m, x, y, z, ux, uy, uz,
                             w, boost=boost,
                             z_injection_plane=z_injection_plane,
-                            initialize_self_field=initialize_self_field)
+                            initialize_self_field=initialize_self_field,
+                            distributed_self_field=distributed_self_field)
     return ptcl_bunch
 
 
 def add_particle_bunch_from_arrays(sim, q, m, x, y, z, ux, uy, uz, w,
                                    boost=None, direction='forward',
                                    z_injection_plane=None,
-                                   initialize_self_field=True):
+                                   initialize_self_field=True,
+                                   distributed_self_field=False):
     """
     Introduce a relativistic particle bunch in the simulation,
     along with its space charge field, loading particles from numpy arrays.
@@ -466,26 +557,41 @@ def add_particle_bunch_from_arrays(sim, q, m, x, y, z, ux, uy, uz, w,
     initialize_self_field: bool, optional
        Whether to calculate the initial space charge fields of the bunch
        and add these fields to the fields on the grid (Default: True)
+
+    distributed_self_field: bool, optional
+       Whether to calculate the space charge fields on the local grid of
+       each MPI rank, instead of gathering the sources on the first rank.
+       (See the docstring of `get_space_charge_fields`.)
     """
-    inv_gamma = 1./np.sqrt( 1. + ux**2 + uy**2 + uz**2 )
-    # Convert the particles to the boosted-frame
-    if boost is not None:
-        x, y, z, ux, uy, uz, inv_gamma = boost.boost_particle_arrays(
-                                        x, y, z, ux, uy, uz, inv_gamma )
+    # Convert the particles to the boosted-frame, and select
+    # the particles that are in the local subdomain
+    x, y, z, ux, uy, uz, inv_gamma, w = select_local_particles(
+                                sim, x, y, z, ux, uy, uz, w, boost )
 
-    # Select the particles that are in the local subdomain
-    zmin, zmax = sim.comm.get_zmin_zmax(
-        local=True, with_damp=False, with_guard=False, rank=sim.comm.rank )
-    selected = (z >= zmin) & (z < zmax)
-    x = x[selected]
-    y = y[selected]
-    z = z[selected]
-    ux = ux[selected]
-    uy = uy[selected]
-    uz = uz[selected]
-    w = w[selected]
-    inv_gamma = inv_gamma[selected]
+    # Add the electrons to the simulation
+    ptcl_bunch = add_local_particle_bunch( sim, q, m, x, y, z,
+                        ux, uy, uz, inv_gamma, w, boost=boost,
+                        direction=direction,
+                        z_injection_plane=z_injection_plane,
+                        initialize_self_field=initialize_self_field,
+                        distributed_self_field=distributed_self_field )
+    return ptcl_bunch
+
+
+def add_local_particle_bunch( sim, q, m, x, y, z, ux, uy, uz, inv_gamma, w,
+                              boost=None, direction='forward',
+                              z_injection_plane=None,
+                              initialize_self_field=True,
+                              distributed_self_field=False ):
+    """
+    Create a new species from particles that have already been converted
+    to the boosted frame (if needed) and which are all inside the local
+    subdomain, and calculate their space charge field.
 
+    See the docstring of `add_particle_bunch_from_arrays` for
+    the meaning of the parameters. (Here, `inv_gamma` is the inverse
+    of the Lorentz factor of the particles, in the simulation frame.)
+    """
     # Create electron species with no macroparticles
     ptcl_bunch = sim.add_new_species( q=q, m=m )
 
@@ -510,10 +616,228 @@ def add_particle_bunch_from_arrays(sim, q, m, x, y, z, ux, uy, uz, w,
 
     # Get the corresponding space-charge fields
     if initialize_self_field:
-        get_space_charge_fields(sim, ptcl_bunch, direction=direction)
+        get_space_charge_fields( sim, ptcl_bunch, direction=direction,
+                                 distributed=distributed_self_field )
     return ptcl_bunch
 
 
+def select_local_particles( sim, x, y, z, ux, uy, uz, w, boost=None ):
+    """
+    Convert the particles to the boosted frame (if `boost` is not None)
+    and only keep the particles that are inside the local subdomain.
+
+    Parameters
+    ----------
+    sim : a Simulation object
+        Contains the MPI decomposition of the simulation box
+
+    x, y, z, ux, uy, uz, w: 1d arrays of length (N_macroparticles,)
+        The positions (in meters), dimensionless momenta and weights
+        of the particles, in the lab frame
+
+    boost : a BoostConverter object, optional
+        A BoostConverter object defining the Lorentz boost of
+        the simulation.
+
+    Returns
+    -------
+    x, y, z, ux, uy, uz, inv_gamma, w: 1d arrays
+        The quantities of the local particles, in the simulation frame
+    """
+    inv_gamma = 1./np.sqrt( 1. + ux**2 + uy**2 + uz**2 )
+    # Convert the particles to the boosted-frame
+    if boost is not None:
+        x, y, z, ux, uy, uz, inv_gamma = boost.boost_particle_arrays(
+                                        x, y, z, ux, uy, uz, inv_gamma )
+
+    # Select the particles that are in the local subdomain
+    zmin, zmax = sim.comm.get_zmin_zmax(
+        local=True, with_damp=False, with_guard=False, rank=sim.comm.rank )
+    selected = (z >= zmin) & (z < zmax)
+    x = x[selected]
+    y = y[selected]
+    z = z[selected]
+    ux = ux[selected]
+    uy = uy[selected]
+    uz = uz[selected]
+    w = w[selected]
+    inv_gamma = inv_gamma[selected]
+
+    return( x, y, z, ux, uy, uz, inv_gamma, w )
+
+
+def read_local_particles_from_text( sim, filename, z_off, boost, chunk_size ):
+    """
+    Read a text file (in the format of `add_particle_bunch_file`) by
+    chunks of `chunk_size` lines, and only keep the particles that
+    are inside the local subdomain (after the optional boost).
+
+    Returns
+    -------
+    x, y, z, ux, uy, uz, inv_gamma: 1d arrays
+        The quantities of the local particles, in the simulation frame
+
+    n_macroparticles: int
+        The total number of particles in the file (across all ranks)
+    """
+    local_chunks = []
+    n_macroparticles = 0
+    with open( filename ) as f:
+        while True:
+            lines = list( islice( f, chunk_size ) )
+            if len(lines) == 0:
+                break
+            particle_data = np.loadtxt( lines, ndmin=2 )
+            n_macroparticles += particle_data.shape[0]
+            # Boost the particles of this chunk and keep the local ones
+            # (with a dummy weight, which is not used by the caller)
+            x, y, z, ux, uy, uz, inv_gamma, _ = select_local_particles( sim,
+                particle_data[:,0], particle_data[:,1],
+                particle_data[:,2] + z_off, particle_data[:,3],
+                particle_data[:,4], particle_data[:,5],
+                np.empty(particle_data.shape[0]), boost )
+            local_chunks.append( (x, y, z, ux, uy, uz, inv_gamma) )
+
+    # Concatenate the local particles of each chunk
+    x, y, z, ux, uy, uz, inv_gamma = concatenate_chunks( local_chunks, 7 )
+    return( x, y, z, ux, uy, uz, inv_gamma, n_macroparticles )
+
+
+def read_local_particles_from_openPMD( sim, ts_path, z_off, species, select,
+                                       iteration, boost, chunk_size ):
+    """
+    Read the particles of an openPMD file (see `add_particle_bunch_openPMD`)
+    by slices of `chunk_size` particles, and only keep the particles that
+    are inside the local subdomain (after the optional boost).
+
+    The first pass over the file (which finds the center of the bunch) is
+    shared between the MPI ranks, and records the range of the final
+    positions of the particles of each slice. In the second pass, each
+    rank only reads the slices whose range overlaps with its subdomain.
+
+    The bounds in `select` use the same units as openPMD-viewer 1
+    (positions in meters, momenta in m*c).
+
+    Returns
+    -------
+    x, y, z, ux, uy, uz, inv_gamma, w: 1d arrays
+        The quantities of the local particles, in the simulation frame
+    """
+    species_grp, extensions, dfile = open_openPMD_species(
+                                        ts_path, iteration, species )
+    quantities = ['x', 'y', 'z', 'ux', 'uy', 'uz', 'w']
+    if select is None:
+        select = {}
+    for quantity in select.keys():
+        if quantity not in quantities:
+            raise ValueError('Unsupported selection quantity: %s' %quantity)
+    Ntot = get_openPMD_species_size( species_grp )
+    chunk_starts = np.arange( 0, Ntot, chunk_size )
+    n_chunks = len( chunk_starts )
+
+    def read_slice( quantity, i_start, i_end, data ):
+        # Read a quantity (only once) for the current slice
+        if quantity not in data:
+            data[quantity] = read_openPMD_quantity( species_grp, extensions,
+                                                    quantity, i_start, i_end )
+        return data[quantity]
+
+    def get_selection( i_start, i_end, data ):
+        # Apply the rules of `select` to the current slice
+        selected = np.ones( i_end - i_start, dtype=bool )
+        for quantity, (lower, upper) in select.items():
+            q = read_slice( quantity, i_start, i_end, data )
+            if lower is not None:
+                selected &= (q > lower)
+            if upper is not None:
+                selected &= (q < upper)
+        return selected
+
+    # First pass (shared between the MPI ranks): find the weighted average
+    # of z, in order to center the bunch at z_off, and the range of z for
+    # the selected particles of each slice. With a boost, the final
+    # position of a particle is (z + z_shift)*k, where k>0 only depends on
+    # its momenta: thus the range of k of each slice is also recorded.
+    w_sum = 0.
+    wz_sum = 0.
+    z_lo = np.full( n_chunks, np.inf )
+    z_hi = np.full( n_chunks, -np.inf )
+    k_lo = np.full( n_chunks, np.inf )
+    k_hi = np.full( n_chunks, -np.inf )
+    for i_chunk in range( sim.comm.rank, n_chunks, sim.comm.size ):
+        i_start = chunk_starts[i_chunk]
+        i_end = min( i_start + chunk_size, Ntot )
+        data = {}
+        selected = get_selection( i_start, i_end, data )
+        if not np.any( selected ):
+            continue
+        z = read_slice( 'z', i_start, i_end, data )[selected]
+        w = read_slice( 'w', i_start, i_end, data )[selected]
+        w_sum += w.sum()
+        wz_sum += (w*z).sum()
+        z_lo[i_chunk] = z.min()
+        z_hi[i_chunk] = z.max()
+        if boost is not None:
+            ux, uy, uz = [
+                read_slice( quantity, i_start, i_end, data )[selected]
+                for quantity in ['ux', 'uy', 'uz'] ]
+            inv_gamma = 1./np.sqrt( 1. + ux**2 + uy**2 + uz**2 )
+            zeros = np.zeros_like( z )
+            _, _, k, _, _, _, _ = boost.boost_particle_arrays(
+                zeros, zeros, np.ones_like( z ), ux, uy, uz, inv_gamma )
+            k_lo[i_chunk] = k.min()
+            k_hi[i_chunk] = k.max()
+        else:
+            k_lo[i_chunk] = 1.
+            k_hi[i_chunk] = 1.
+    if sim.comm.size > 1:
+        mpi_comm = sim.comm.mpi_comm
+        w_sum = mpi_comm.allreduce( w_sum )
+        wz_sum = mpi_comm.allreduce( wz_sum )
+        for array, op in [ (z_lo, MPI.MIN), (z_hi, MPI.MAX),
+                           (k_lo, MPI.MIN), (k_hi, MPI.MAX) ]:
+            mpi_comm.Allreduce( MPI.IN_PLACE, array, op=op )
+    if w_sum == 0:
+        dfile.close()
+        raise ValueError('No particle was selected in %s.' %ts_path)
+    z_shift = z_off - wz_sum/w_sum
+
+    # Range of the final positions of the particles of each slice
+    # (empty slices have z_lo > z_hi, and are never read again)
+    corners = np.array([ (z_lo + z_shift)*k_lo, (z_lo + z_shift)*k_hi,
+                         (z_hi + z_shift)*k_lo, (z_hi + z_shift)*k_hi ])
+    final_lo = corners.min( axis=0 )
+    final_hi = corners.max( axis=0 )
+
+    # Second pass: only read the slices that overlap with the local
+    # subdomain (with a margin of one cell, to be robust to round-off
+    # errors), and keep the particles that are inside this subdomain
+    zmin, zmax = sim.comm.get_zmin_zmax(
+        local=True, with_damp=False, with_guard=False, rank=sim.comm.rank )
+    margin = sim.fld.interp[0].dz
+    local_chunks = []
+    for i_chunk in range( n_chunks ):
+        if not ( (z_lo[i_chunk] <= z_hi[i_chunk])
+                 and (final_hi[i_chunk] >= zmin - margin)
+                 and (final_lo[i_chunk] < zmax + margin) ):
+            continue
+        i_start = chunk_starts[i_chunk]
+        i_end = min( i_start + chunk_size, Ntot )
+        data = {}
+        selected = get_selection( i_start, i_end, data )
+        x, y, z, ux, uy, uz, w = [
+            read_slice( quantity, i_start, i_end, data )[selected]
+            for quantity in quantities ]
+        local_chunks.append( select_local_particles( sim,
+                        x, y, z + z_shift, ux, uy, uz, w, boost ) )
+    dfile.close()
+
+    # Concatenate the local particles of each slice
+    x, y, z, ux, uy, uz, inv_gamma, w = concatenate_chunks( local_chunks, 8 )
+    return( x, y, z, ux, uy, uz, inv_gamma, w )
+
+
+
 def add_elec_bunch( sim, gamma0, n_e, p_zmin, p_zmax, p_rmin, p_rmax,
                 p_nr=2, p_nz=2, p_nt=4, dens_func=None, boost=None,
                 direction='forward', z_injection_plane=None ) :
@@ -727,9 +1051,11 @@ def add_elec_bunch_openPMD( sim, ts_path, z_off=0., species=None, select=None,
     select: dict, optional
         Either None or a dictionary of rules
         to select the particles, of the form
-        'x' : [-4., 10.]   (Particles having x between -4 and 10 microns)
-        'ux' : [-0.1, 0.1] (Particles having ux between -0.1 and 0.1 mc)
-        'uz' : [5., None]  (Particles with uz above 5 mc)
+        'x' : [-4.e-6, 10.e-6] (Particles having x between -4 and 10 microns)
+        'ux' : [-0.1, 0.1]     (Particles having ux between -0.1 and 0.1 mc)
+        'uz' : [5., None]      (Particles with uz above 5 mc)
+        The positions are in meters (except with the deprecated
+        openPMD-viewer 0, in which case they are in microns).
 
     iteration: integer (optional)
         The iteration number of the openPMD file from which to extract the
@@ -794,12 +1120,24 @@ def add_elec_bunch_from_arrays( sim, x, y, z, ux, uy, uz, w,
     return elec_bunch
 
 
-def get_space_charge_fields( sim, ptcl, direction='forward' ):
+def get_space_charge_fields( sim, ptcl, direction='forward',
+                             distributed=False ):
     """
     Add the space charge field from `ptcl` the interpolation grid
 
     This assumes that all the particles being passed have the same gamma.
 
+    By default, the sources of all MPI ranks are gathered on the first
+    rank, which solves for the fields on the global grid and scatters them
+    back. When `distributed` is True, each rank instead solves for the
+    fields on its own local grid (including the guard cells, which contain
+    the sources of the neighboring ranks, after the guard cell exchange).
+    This avoids the global gather, and scales with the number of ranks,
+    but it is only accurate when the longitudinal extent of the space
+    charge fields (typically r_bunch/gamma) is small compared to the
+    guard region. (As for the finite-order stencil, the results in the
+    guard cells are then overwritten by the next guard cell exchange.)
+
     Parameters
     ----------
     sim : a Simulation object
@@ -813,6 +1151,10 @@ def get_space_charge_fields( sim, ptcl, direction='forward' ):
     direction : string, optional
         Can be either "forward" or "backward".
         Propagation direction of the beam.
+
+    distributed : bool, optional
+        Whether to solve for the space charge fields on the local grid
+        of each rank, instead of on a global grid on the first rank.
     """
     if sim.comm.rank == 0:
         print("Calculating initial space charge field...")
@@ -843,6 +1185,12 @@ def get_space_charge_fields( sim, ptcl, direction='forward' ):
         sim.deposit( 'J', exchange=True, species_list=[ptcl],
                         update_spectral=False )
 
+    if distributed:
+        get_space_charge_fields_local( sim, ptcl, gamma, direction )
+        if sim.comm.rank == 0:
+            print("Done.\n")
+        return
+
     # Create a global field object across all subdomains, and copy the sources
     # (Space-charge calculation is a global operation)
     # Note: in the single-proc case, this is also useful in order not to
@@ -902,6 +1250,90 @@ def get_space_charge_fields( sim, ptcl, direction='forward' ):
         print("Done.\n")
 
 
+def get_space_charge_fields_local( sim, ptcl, gamma, direction='forward' ):
+    """
+    Add the space charge fields to the interpolation grid of `sim.fld`,
+    by solving for them on the local grid of the current MPI rank.
+
+    It is assumed that the charge density and current of the bunch have
+    already been deposited on `sim.fld.interp` (with guard cell exchange).
+
+    The fields of a particle extend over a length of the order of r/gamma
+    in z (where r is the radial extent of the bunch): the charges of the
+    neighboring subdomains that are further away than the guard region
+    are missed. A warning is raised when r/gamma exceeds the guard region.
+
+    Parameters
+    ----------
+    sim : a Simulation object
+        Contains the values of the fields, and the MPI communicator
+
+    ptcl : a Particles object
+        The species that produces the space charge field
+
+    gamma : float
+        The mean Lorentz factor of the particles
+
+    direction : string, optional
+        Can be either "forward" or "backward".
+        Propagation direction of the beam.
+    """
+    # Check that the fields of the neighboring subdomains are captured
+    # by the guard region
+    if sim.comm.size > 1:
+        if ptcl.Ntot > 0:
+            r_extent = np.sqrt( ptcl.x**2 + ptcl.y**2 ).max()
+        else:
+            r_extent = 0.
+        r_extent = sim.comm.mpi_comm.allreduce( r_extent, op=MPI.MAX )
+        guard_length = sim.comm.n_guard * sim.fld.interp[0].dz
+        if (r_extent/gamma > guard_length) and (sim.comm.rank == 0):
+            warnings.warn(
+                "The radial extent of the bunch divided by its Lorentz factor\n"
+                "(%.3e m) exceeds the length of the guard region (%.3e m).\n"
+                "The space charge fields calculated with "
+                "`distributed_self_field=True`\nmay be inaccurate near the "
+                "boundaries of the MPI subdomains.\nConsider increasing "
+                "`n_guard`, or using `distributed_self_field=False`.\n"
+                %(r_extent/gamma, guard_length) )
+
+    # Create a field object with the same (local) grid as sim.fld, and copy
+    # the sources. (This avoids erasing the pre-existing E and B fields.)
+    local_fld = Fields( sim.fld.Nz, sim.fld.interp[0].zmax,
+            sim.fld.Nr, sim.fld.rmax, sim.fld.Nm, sim.fld.dt,
+            n_order=sim.fld.n_order, smoother=sim.fld.smoother,
+            zmin=sim.fld.interp[0].zmin, use_cuda=False)
+    for m in range(sim.fld.Nm):
+        for field in ['Jr', 'Jt', 'Jz', 'rho']:
+            local_array = getattr( sim.fld.interp[m], field )
+            getattr( local_fld.interp[m], field )[:,:] = local_array
+
+    # Calculate the space-charge fields on the local grid
+    local_fld.interp2spect('rho_prev')
+    local_fld.interp2spect('J')
+    if sim.filter_currents:
+        local_fld.filter_spect('rho_prev')
+        local_fld.filter_spect('J')
+    for m in range(local_fld.Nm) :
+        get_space_charge_spect( local_fld.spect[m], gamma, direction )
+    local_fld.spect2interp( 'E' )
+    local_fld.spect2interp( 'B' )
+
+    # Add the fields outside of the guard cells to sim.fld
+    # (The guard cells are filled by the next guard cell exchange)
+    Nz_local, iz_start_local_domain = sim.comm.get_Nz_and_iz(
+        local=True, with_damp=True, with_guard=False, rank=sim.comm.rank )
+    _, iz_start_local_array = sim.comm.get_Nz_and_iz(
+        local=True, with_damp=True, with_guard=True, rank=sim.comm.rank )
+    iz_in_array = iz_start_local_domain - iz_start_local_array
+    for m in range(sim.fld.Nm):
+        for field in ['Er', 'Et', 'Ez', 'Br', 'Bt', 'Bz']:
+            local_array = getattr( local_fld.interp[m], field )
+            local_field = getattr( sim.fld.interp[m], field )
+            local_field[ iz_in_array:iz_in_array+Nz_local, : ] += \
+                local_array[ iz_in_array:iz_in_array+Nz_local, : ]
+
+
 def get_space_charge_spect( spect, gamma, direction='forward',
                              neglect_transverse_currents=True ) :
     """
@@ -964,3 +1396,126 @@ def get_space_charge_spect( spect, gamma, direction='forward',
         spect.Bp[:,:] += spect.kz * Ap
         spect.Bm[:,:] -= spect.kz * Am
         spect.Bz[:,:] += 1.j*spect.kr * Ap + 1.j*spect.kr * Am
+
+
+
+def concatenate_chunks( chunks, n_arrays ):
+    """
+    Concatenate a list of tuples of `n_arrays` 1d arrays into
+    a list of `n_arrays` 1d arrays (which are empty if `chunks` is empty)
+    """
+    if len(chunks) == 0:
+        return( [ np.empty(0) for i in range(n_arrays) ] )
+    return( [ np.concatenate([ chunk[i] for chunk in chunks ])
+              for i in range(n_arrays) ] )
+
+
+def open_openPMD_species( ts_path, iteration, species ):
+    """
+    Open the openPMD (HDF5) file that contains `iteration` in the
+    directory `ts_path` (or the first iteration, if `iteration` is None)
+    and return the group of the particle species `species`.
+
+    Returns
+    -------
+    species_grp: an h5py Group
+    extensions: a list of strings (the openPMD extensions of the file)
+    dfile: an h5py File (to be closed by the caller)
+    """
+    # Find the files and the iterations that they contain
+    iteration_to_file = {}
+    for filename in os.listdir( ts_path ):
+        if filename.endswith('.h5') or filename.endswith('.hdf5'):
+            full_name = os.path.join( ts_path, filename )
+            with h5py.File( full_name, 'r' ) as f:
+                for key_iteration in f['/data'].keys():
+                    iteration_to_file[ int(key_iteration) ] = full_name
+    if len(iteration_to_file) == 0:
+        raise OSError('No openPMD file found in %s.' %ts_path)
+    if iteration is None:
+        iteration = min( iteration_to_file.keys() )
+    elif iteration not in iteration_to_file:
+        raise ValueError('Iteration %d is not available in %s.'
+                         %(iteration, ts_path))
+
+    # Open the file and extract the species group
+    dfile = h5py.File( iteration_to_file[iteration], 'r' )
+    particles_path = dfile.attrs['particlesPath']
+    if isinstance( particles_path, bytes ):
+        particles_path = particles_path.decode()
+    particles_grp = dfile['/data/%d/%s' %(iteration, particles_path)]
+    avail_species = list( particles_grp.keys() )
+    if species is None:
+        if len(avail_species) != 1:
+            dfile.close()
+            raise ValueError('Please specify the `species` to load, among: '
+                             '%s' %avail_species)
+        species = avail_species[0]
+    species_grp = particles_grp[species]
+    extensions = []
+    if 'openPMDextension' in dfile.attrs and \
+            int(dfile.attrs['openPMDextension']) % 2 == 1:
+        extensions.append('ED-PIC')
+
+    return( species_grp, extensions, dfile )
+
+
+def get_openPMD_record_component( record_comp, i_start, i_end ):
+    """
+    Read the elements `i_start:i_end` of an openPMD record component
+    (either a dataset or a constant record), and convert them to SI.
+    """
+    unit_SI = record_comp.attrs['unitSI']
+    if 'value' in record_comp.attrs:
+        # Constant record component
+        return( np.full( i_end - i_start,
+                         record_comp.attrs['value']*unit_SI ) )
+    else:
+        return( record_comp[i_start:i_end].astype(np.float64) * unit_SI )
+
+
+def get_openPMD_species_size( species_grp ):
+    """Return the number of macroparticles in the species `species_grp`."""
+    record_comp = species_grp['position/z']
+    if 'value' in record_comp.attrs:
+        return( int(record_comp.attrs['shape'][0]) )
+    else:
+        return( record_comp.shape[0] )
+
+
+def read_openPMD_quantity( species_grp, extensions, quantity,
+                           i_start, i_end ):
+    """
+    Read the elements `i_start:i_end` of the particle quantity `quantity`
+    (either 'x', 'y', 'z', 'ux', 'uy', 'uz' or 'w'), with the same
+    conventions as openPMD-viewer (positions in meters, momenta in m*c)
+    """
+    dict_record_comp = {'x': 'position/x', 'y': 'position/y',
+                        'z': 'position/z', 'ux': 'momentum/x',
+                        'uy': 'momentum/y', 'uz': 'momentum/z',
+                        'w': 'weighting'}
+    opmd_record_comp = dict_record_comp[quantity]
+    data = get_openPMD_record_component(
+                species_grp[opmd_record_comp], i_start, i_end )
+
+    # For ED-PIC: if the data is weighted for a full macroparticle,
+    # divide by the weight with the proper power
+    if 'ED-PIC' in extensions and quantity != 'w':
+        record = species_grp[ opmd_record_comp.split('/')[0] ]
+        weighting_power = record.attrs['weightingPower']
+        if (record.attrs['macroWeighted'] == 1) and (weighting_power != 0):
+            w = get_openPMD_record_component(
+                    species_grp['weighting'], i_start, i_end )
+            data *= w ** (-weighting_power)
+
+    # Add the offset for the positions, and normalize the momenta
+    if quantity in ['x', 'y', 'z']:
+        data += get_openPMD_record_component(
+            species_grp['positionOffset/%s' %quantity], i_start, i_end )
+    elif quantity in ['ux', 'uy', 'uz']:
+        mass = get_openPMD_record_component(
+                    species_grp['mass'], i_start, i_end )
+        if np.all( mass != 0 ):
+            data *= 1./( mass * c )
+
+    return( data )
@@ -6,12 +6,13 @@ This file is part of the Fourier-Bessel Particle-In-Cell code (FB-PIC)
 It defines the class LaserAntenna, which can be used to continuously
 emit a laser during a simulation.
 """
+import warnings
 import numpy as np
 from scipy.constants import e, c, epsilon_0, physical_constants
 r_e = physical_constants['classical electron radius'][0]
 from fbpic.particles.deposition.threading_methods import \
-        deposit_rho_numba_linear, deposit_J_numba_linear
-from fbpic.utils.threading import nthreads, get_chunk_indices
+        deposit_species_numba
+from .numba_methods import make_E_field_evaluator, apply_longitudinal_factor
 
 # Check if CUDA is available, then import CUDA functions
 from fbpic.utils.cuda import cuda_installed
@@ -54,7 +55,7 @@ class LaserAntenna( object ):
     """
     def __init__( self, laser_profile, z0_antenna, v_antenna,
                     dr_grid, Nr_grid, Nm, boost, npr=2, epsilon=0.01,
-                    use_cuda=False ):
+                    use_cuda=False, use_separable_cache=False ):
         """
         Initialize a LaserAntenna object (see class docstring for more info)
 
@@ -97,6 +98,14 @@ class LaserAntenna( object ):
 
         use_cuda: bool
             Whether to use CUDA for the antenna
+
+        use_separable_cache: bool
+            Whether to precompute the transverse part of the laser field
+            at each virtual particle, so that only a complex scalar factor
+            needs to be evaluated at each timestep. This is only possible
+            for separable laser profiles (see `LaserProfile.is_separable`)
+            and for a fixed antenna in the lab frame (no boost and
+            `v_antenna=0`); otherwise it is ignored with a warning.
         """
         # Register the properties of the laser injection
         self.laser_profile = laser_profile
@@ -171,6 +180,34 @@ class LaserAntenna( object ):
         # Register whether the antenna deposits on the local domain
         # (gets updated by `update_current_rank`)
         self.deposit_on_this_rank = False
+
+        # When the laser field is calculated on CPU, use the compiled kernel
+        # of the laser profile (if available), in order to avoid allocating
+        # temporary arrays at each timestep
+        self.E_field_evaluator = None
+        if not ( use_cuda and laser_profile.gpu_capable ):
+            kernel = laser_profile.get_numba_kernel()
+            if kernel is not None:
+                self.E_field_evaluator = make_E_field_evaluator( kernel )
+                if use_cuda:
+                    self.vx_buffer = np.empty( Ntot )
+                    self.vy_buffer = np.empty( Ntot )
+
+        # For a separable profile and a fixed antenna, cache the transverse
+        # part of the velocities (i.e. including the mobility coefficient)
+        self.use_separable_cache = False
+        if use_separable_cache:
+            if laser_profile.is_separable() and (boost is None) \
+                    and (v_antenna == 0):
+                Tx, Ty = laser_profile.transverse_factor(
+                    self.baseline_x, self.baseline_y, z0_antenna )
+                self.Tx = self.mobility_coef * Tx.astype( np.complex128 )
+                self.Ty = self.mobility_coef * Ty.astype( np.complex128 )
+                self.use_separable_cache = True
+            else:
+                warnings.warn( 'The separable cache of the laser antenna '
+                    'is only available for separable laser profiles, with '
+                    'a fixed antenna and no boost. It will not be used.' )
     
         # Copy all required arrays to GPU if needed
         # Some of the arrays are kept as copies on CPU in the case that
@@ -190,6 +227,10 @@ class LaserAntenna( object ):
 
             self.w = cupy.asarray( self.w )
 
+            if self.use_separable_cache:
+                self.Tx = cupy.asarray( self.Tx )
+                self.Ty = cupy.asarray( self.Ty )
+
 
     def update_current_rank(self, comm):
         """
@@ -259,6 +300,38 @@ class LaserAntenna( object ):
         t: float (seconds)
             The time at which to calculate the velocities
         """
+        # With the separable cache, only the longitudinal factor is evaluated
+        if self.use_separable_cache:
+            L = self.laser_profile.longitudinal_factor( self.baseline_z[0], t )
+            if self.use_cuda:
+                self.vx = ( L * self.Tx ).real
+                self.vy = ( L * self.Ty ).real
+            else:
+                apply_longitudinal_factor( self.Tx, self.Ty, complex(L),
+                                           self.vx, self.vy )
+            return
+
+        # If the laser profile provides a compiled kernel, evaluate the
+        # field and the velocities in a single pass over the particles
+        if self.E_field_evaluator is not None:
+            if self.boost is not None:
+                gamma0, beta0 = self.boost.gamma0, self.boost.beta0
+            else:
+                gamma0, beta0 = 1., 0.
+            if self.use_cuda:
+                # Calculate on CPU, and copy the velocities to GPU
+                self.E_field_evaluator( self.baseline_x, self.baseline_y,
+                    self.baseline_z, t, gamma0, beta0, self.mobility_coef,
+                    self.vx_buffer, self.vy_buffer )
+                self.vx.set( self.vx_buffer )
+                self.vy.set( self.vy_buffer )
+            else:
+                # Write the velocities in place
+                self.E_field_evaluator( self.baseline_x, self.baseline_y,
+                    self.baseline_z, t, gamma0, beta0, self.mobility_coef,
+                    self.vx, self.vy )
+            return
+
         # If the laser profile supports it, do the whole calculation on GPU
         if self.use_cuda and self.laser_profile.gpu_capable:
             x = self.d_baseline_x
@@ -296,9 +369,8 @@ class LaserAntenna( object ):
             self.vx.set( self.mobility_coef * Ex )
             self.vy.set( self.mobility_coef * Ey )
         else:
-            self.vx = self.mobility_coef * Ex 
-            self.vy = self.mobility_coef * Ey 
-            
+            self.vx = self.mobility_coef * Ex
+            self.vy = self.mobility_coef * Ey
 
     def deposit( self, fld, fieldtype ):
         """
@@ -327,14 +399,16 @@ class LaserAntenna( object ):
         # Shortcut for the list of InterpolationGrid objects
         grid = fld.interp
 
-        # Deposit the charge/current of positive and negative
-        # virtual particles successively
-        for q in [-1, 1]:
-
-            if self.use_cuda:
+        if self.use_cuda:
+            # Deposit the charge/current of positive and negative
+            # virtual particles successively
+            for q in [-1, 1]:
                 self.deposit_virtual_particles_gpu( q, fieldtype, grid )
-            else:
-                self.deposit_virtual_particles_cpu( q, fieldtype, grid, fld )
+        else:
+            # Deposit the charge/current of positive and negative
+            # virtual particles in a single parallel region
+            deposit_species_numba( fld, fieldtype, 'linear',
+                                   self.get_deposition_arrays() )
             
 
     def deposit_virtual_particles_gpu( self, q, fieldtype, grid ):
@@ -375,40 +449,23 @@ class LaserAntenna( object ):
                     grid[m].Jr, grid[m].Jt, grid[m].Jz,
                     m, grid[m].d_ruyten_linear_coef)
 
-    def deposit_virtual_particles_cpu( self, q, fieldtype, grid, fld ):
-        x = self.baseline_x + q*self.excursion_x
-        y = self.baseline_y + q*self.excursion_y
-
-        # Divide particles in chunks (each chunk is handled by a different
-        # thread) and register the indices that bound each chunks
-        ptcl_chunk_indices = get_chunk_indices(self.Ntot, nthreads)
-
-        # The set of Ruyten shape coefficients to use for higher modes. 
-        # For Nm > 1, the set from mode 1 is used, since all higher modes have the
-        # same coefficients. For Nm == 1, the coefficients from mode 0 are 
-        # passed twice to satisfy the argument types for Numba JIT.
-        if fld.Nm > 1:
-            ruyten_m = 1
-        else: 
-            ruyten_m = 0
-
-        if fieldtype == 'rho' :
-            # ---------------------------------------
-            # Deposit the charge density all modes at once
-            # ---------------------------------------
-            deposit_rho_numba_linear(
-                x, y, self.baseline_z, self.w, q,
-                grid[0].invdz, grid[0].zmin, grid[0].Nz,
-                grid[0].invdr, grid[0].rmin, grid[0].Nr,
-                fld.rho_global, fld.Nm,
-                nthreads, ptcl_chunk_indices,
-                grid[0].ruyten_linear_coef,
-                grid[ruyten_m].ruyten_linear_coef )
-
+    def get_deposition_arrays( self ):
+        """
+        Return the arrays of the positive and negative virtual particles
+        that are used by the deposition on CPU, as a list of two tuples
+        (x, y, z, w, q, ux, uy, uz, inv_gamma) (see `deposit_species_numba`)
+        """
+        # Return no particles if the antenna does not currently
+        # deposit on the local domain (as determined by `update_current_rank`)
+        if not self.deposit_on_this_rank:
+            return( [] )
 
-        elif fieldtype == 'J' :
+        deposition_arrays = []
+        for q in [-1, 1]:
+            x = self.baseline_x + q*self.excursion_x
+            y = self.baseline_y + q*self.excursion_y
             # Calculate the relativistic momenta from the velocities.
-            # The gamma is set to 1 both here and in the deposition kernel. 
+            # The gamma is set to 1 both here and in the deposition kernel.
             # This is alright since the deposition only depends on the products
             # ux*inv_gamma, uy*inv_gamma and uz*inv_gamma, which correspond to
             # vx/c, vy/c and vz/c, respectively. So as long as the products are
@@ -416,16 +473,6 @@ class LaserAntenna( object ):
             ux = q*self.vx / c
             uy = q*self.vy / c
             uz = self.vz / c
-
-            # ---------------------------------------
-            # Deposit the current density all modes at once
-            # ---------------------------------------
-            deposit_J_numba_linear(
-                x, y, self.baseline_z, self.w, q,
-                ux, uy, uz, self.inv_gamma,
-                grid[0].invdz, grid[0].zmin, grid[0].Nz,
-                grid[0].invdr, grid[0].rmin, grid[0].Nr,
-                fld.Jr_global, fld.Jt_global, fld.Jz_global, fld.Nm,
-                nthreads, ptcl_chunk_indices,
-                grid[0].ruyten_linear_coef,
-                grid[ruyten_m].ruyten_linear_coef )
\ No newline at end of file
+            deposition_arrays.append( ( x, y, self.baseline_z, self.w, q,
+                                        ux, uy, uz, self.inv_gamma ) )
+        return( deposition_arrays )
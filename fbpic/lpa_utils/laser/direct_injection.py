@@ -8,6 +8,8 @@ It defines methods to directly inject the laser in the Simulation box
 import numpy as np
 from scipy.constants import c
 from fbpic.fields import Fields
+from fbpic.utils.threading import nthreads
+from .numba_methods import make_E_field_evaluator
 
 def add_laser_direct( sim, laser_profile, boost ):
     """
@@ -45,9 +47,9 @@ def add_laser_direct( sim, laser_profile, boost ):
     saved_Et = []
     for m in range(sim.fld.Nm):
         saved_Er.append( sim.fld.interp[m].Er.copy() )
-        sim.fld.interp[m].Er[:,:] = laser_Er[:,:,m]
+        sim.fld.interp[m].Er[:,:] = laser_Er[m]
         saved_Et.append( sim.fld.interp[m].Et.copy() )
-        sim.fld.interp[m].Et[:,:] = laser_Et[:,:,m]
+        sim.fld.interp[m].Et[:,:] = laser_Et[m]
 
     # Create a global field object across all subdomains, and copy the fields
     # (Calculating the self-consistent Ez and B is a global operation)
@@ -100,11 +102,16 @@ def add_laser_direct( sim, laser_profile, boost ):
         print("Done.\n")
 
 
-def get_laser_Er_Et( sim, laser_profile, boost ):
+def get_laser_Er_Et( sim, laser_profile, boost, chunk_size=None ):
     """
     Calculate the laser Er and Et fields on the points of the interpolation
     grid of sim, and decompose into azimuthal modes.
 
+    The fields are evaluated by chunks of `chunk_size` points along z
+    (in parallel, with one thread per chunk), so that the temporary
+    3d arrays only span one chunk at a time. Only the modes of the
+    simulation are kept from each chunk.
+
     Parameters:
     -----------
     sim: a Simulation object
@@ -113,12 +120,15 @@ def get_laser_Er_Et( sim, laser_profile, boost ):
     boost: a BoostConverter object or None
        Contains the information about the boost to be applied
 
+    chunk_size: int or None, optional
+       The number of points along z in each chunk. If None, the chunks
+       are chosen so as to contain about 2**20 points of the 3d grid.
+
     Returns:
     --------
-    Er_m, Er_t: 3d_arrays of complexs
-        Arrays of size (Nz, Nr, 2*Nm), that represent the
-        azimuthally-decomposed fields of the laser. The first Nm points
-        along the last axis correspond to the values in the modes m>= 0.
+    Er_m, Er_t: lists of 2d arrays of complexs
+        Lists of Nm arrays of size (Nz, Nr), that represent the
+        azimuthally-decomposed fields of the laser in the modes m>=0.
     """
     # Initialize a grid on which the laser amplitude should be calculated
     # - Get the 1d arrays of the grid
@@ -128,23 +138,98 @@ def get_laser_Er_Et( sim, laser_profile, boost ):
     #   perform the azimuthal decomposition of the fields
     ntheta = 2*sim.fld.Nm
     theta = (2*np.pi/ntheta) * np.arange( ntheta )
-    # - Get corresponding 3d arrays
+
+    # Allocate the arrays for the result, and divide the grid in chunks
+    # If the laser profile provides a compiled kernel, use it in each chunk
+    # (serial version, which releases the GIL for the threads below)
+    kernel = laser_profile.get_numba_kernel()
+    if kernel is not None:
+        E_field_evaluator = make_E_field_evaluator( kernel, parallel=False )
+    else:
+        E_field_evaluator = None
+
+    Nz = len(z)
+    Nm = sim.fld.Nm
+    Er_m = [ np.empty( (Nz, len(r)), dtype=np.complex128 ) for m in range(Nm) ]
+    Et_m = [ np.empty( (Nz, len(r)), dtype=np.complex128 ) for m in range(Nm) ]
+    if chunk_size is None:
+        chunk_size = max( 1, 2**20 // (len(r)*ntheta) )
+    chunk_bounds = [ (iz, min(iz+chunk_size, Nz))
+                     for iz in range(0, Nz, chunk_size) ]
+
+    def fill_chunk( bounds ):
+        iz_start, iz_end = bounds
+        Er_m_chunk, Et_m_chunk = get_laser_Er_Et_chunk( z[iz_start:iz_end],
+            r, theta, sim.time, laser_profile, boost, E_field_evaluator )
+        for m in range(Nm):
+            Er_m[m][iz_start:iz_end] = Er_m_chunk[:,:,m]
+            Et_m[m][iz_start:iz_end] = Et_m_chunk[:,:,m]
+
+    # Evaluate the fields chunk by chunk
+    # (NumPy and the compiled kernels release the GIL, so that the threads
+    # run in parallel ; concurrent.futures is not available in Python 2,
+    # in which case the chunks are evaluated serially)
+    if nthreads > 1 and len(chunk_bounds) > 1:
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:
+            ThreadPoolExecutor = None
+    else:
+        ThreadPoolExecutor = None
+    if ThreadPoolExecutor is not None:
+        with ThreadPoolExecutor( max_workers=nthreads ) as executor:
+            list( executor.map( fill_chunk, chunk_bounds ) )
+    else:
+        for bounds in chunk_bounds:
+            fill_chunk( bounds )
+
+    return( Er_m, Et_m )
+
+
+def get_laser_Er_Et_chunk( z, r, theta, t, laser_profile, boost,
+                           E_field_evaluator=None ):
+    """
+    Calculate the azimuthally-decomposed laser Er and Et fields
+    on the 3d grid defined by the 1d arrays `z`, `r` and `theta`
+    (see `get_laser_Er_Et`), at the (simulation-frame) time `t`.
+
+    If `E_field_evaluator` is not None (see `make_E_field_evaluator`),
+    it is used instead of `laser_profile.E_field`.
+
+    Returns:
+    --------
+    Er_m, Er_t: 3d_arrays of complexs, of size (len(z), len(r), len(theta))
+    """
+    # Get corresponding 3d arrays
     z_3d, r_3d, theta_3d = np.meshgrid( z, r, theta, indexing='ij' )
     cos_theta_3d = np.cos(theta_3d)
     sin_theta_3d = np.sin(theta_3d)
     x_3d = r_3d * cos_theta_3d
     y_3d = r_3d * sin_theta_3d
 
-    # For boosted-frame: convert time and position to the lab-frame
-    if boost is not None:
-        zlab_3d = boost.gamma0*( z_3d + boost.beta0 * c * sim.time )
-        tlab = boost.gamma0*( sim.time + (boost.beta0 * 1./c) * z_3d )
+    if E_field_evaluator is not None:
+        # Evaluate the field with the compiled kernel, which also performs
+        # the conversion to the lab-frame
+        if boost is not None:
+            gamma0, beta0 = boost.gamma0, boost.beta0
+        else:
+            gamma0, beta0 = 1., 0.
+        Ex_3d = np.empty( x_3d.shape )
+        Ey_3d = np.empty( x_3d.shape )
+        E_field_evaluator( x_3d.ravel(), y_3d.ravel(), z_3d.ravel(), t,
+                gamma0, beta0, 1., Ex_3d.reshape(-1), Ey_3d.reshape(-1) )
     else:
-        zlab_3d = z_3d
-        tlab = sim.time
+        # For boosted-frame: convert time and position to the lab-frame
+        if boost is not None:
+            zlab_3d = boost.gamma0*( z_3d + boost.beta0 * c * t )
+            tlab = boost.gamma0*( t + (boost.beta0 * 1./c) * z_3d )
+        else:
+            zlab_3d = z_3d
+            tlab = t
+
+        # Evaluate the transverse Er and Et field at these position
+        Ex_3d, Ey_3d = laser_profile.E_field( x_3d, y_3d, zlab_3d, tlab )
 
-    # Evaluate the transverse Er and Et field at these position
-    Ex_3d, Ey_3d = laser_profile.E_field( x_3d, y_3d, zlab_3d, tlab )
     Er_3d = cos_theta_3d * Ex_3d + sin_theta_3d * Ey_3d
     Et_3d = - sin_theta_3d * Ex_3d + cos_theta_3d * Ey_3d
 
@@ -156,7 +241,6 @@ def get_laser_Er_Et( sim, laser_profile, boost ):
         Et_3d *= scale_factor
 
     # Perform the azimuthal decomposition of the Er and Et fields
-    # and add them to the mesh
     Er_m_3d = np.fft.ifft(Er_3d, axis=-1)
     Et_m_3d = np.fft.ifft(Et_3d, axis=-1)
 
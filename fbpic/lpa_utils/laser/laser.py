@@ -12,7 +12,8 @@ from .direct_injection import add_laser_direct
 from .antenna_injection import LaserAntenna
 
 def add_laser_pulse( sim, laser_profile, gamma_boost=None,
-                method='direct', z0_antenna=None, v_antenna=0.):
+                method='direct', z0_antenna=None, v_antenna=0.,
+                use_separable_cache=False ):
     """
     Introduce a laser pulse in the simulation.
 
@@ -49,6 +50,14 @@ def add_laser_pulse( sim, laser_profile, gamma_boost=None,
        Only used for the ``antenna`` method: velocity of the antenna
        (in the lab frame)
 
+    use_separable_cache: bool, optional
+       Only used for the ``antenna`` method: whether to precompute the
+       transverse profile of the laser at the antenna, so that only the
+       time-dependent longitudinal factor is evaluated at each timestep.
+       This requires a separable profile (``GaussianLaser``,
+       ``LaguerreGaussLaser``, ``DonutLikeLaguerreGaussLaser`` or
+       ``FlattenedGaussianLaser``), no boost and ``v_antenna=0``.
+
     Example
     -------
     In order to initialize a Laguerre-Gauss profile with a waist of
@@ -87,7 +96,8 @@ def add_laser_pulse( sim, laser_profile, gamma_boost=None,
         Nm = sim.fld.Nm
         sim.laser_antennas.append(
             LaserAntenna( laser_profile, z0_antenna, v_antenna,
-                            dr, Nr, Nm, boost, use_cuda=sim.use_cuda ) )
+                            dr, Nr, Nm, boost, use_cuda=sim.use_cuda,
+                            use_separable_cache=use_separable_cache ) )
 
     else:
         raise ValueError('Unknown laser method: %s' %method)
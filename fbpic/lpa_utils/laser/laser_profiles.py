@@ -5,9 +5,13 @@
 This file is part of the Fourier-Bessel Particle-In-Cell code (FB-PIC)
 It defines a set of common laser profiles.
 """
+import cmath
+import math
+import numba
 import numpy as np
 from scipy.constants import c, m_e, e
 from scipy.special import factorial, genlaguerre, binom
+from .numba_methods import laguerre
 
 # Generic classes
 # ---------------
@@ -41,6 +45,8 @@ class LaserProfile( object ):
         assert propagation_direction in [-1, 1]
         self.propag_direction = float(propagation_direction)
         self.gpu_capable = gpu_capable
+        # By default, profiles are not separable (see `is_separable`)
+        self.separable = False
 
     def E_field( self, x, y, z, t ):
         """
@@ -62,6 +68,63 @@ class LaserProfile( object ):
         # (This should be replaced by any class that inherits from this one.)
         return( np.zeros_like(x), np.zeros_like(x) )
 
+    def get_numba_kernel( self ):
+        """
+        Return a numba-compiled function ``kernel( x, y, z, t )``, which
+        takes scalar positions and time (in the lab frame) and returns the
+        tuple (Ex, Ey) of the laser field at this point, or None if this
+        profile does not provide such a kernel (in which case `E_field`
+        is used instead).
+
+        The kernel is built only once (see `make_numba_kernel`).
+        """
+        if not hasattr( self, 'numba_kernel' ):
+            # Only use the kernel if it was defined along with `E_field`
+            # (e.g. not for a user class that redefines `E_field` of a
+            # class which inherits from LaserProfile)
+            mro = type(self).__mro__
+            E_field_cls = next( cls for cls in mro if 'E_field' in vars(cls) )
+            kernel_cls = next( cls for cls in mro
+                               if 'make_numba_kernel' in vars(cls) )
+            if E_field_cls is kernel_cls:
+                self.numba_kernel = self.make_numba_kernel()
+            else:
+                self.numba_kernel = None
+        return( self.numba_kernel )
+
+    def make_numba_kernel( self ):
+        """
+        Build the numba-compiled kernel of the laser profile
+        (see `get_numba_kernel`).
+
+        Laser profiles that can be expressed point by point should override
+        this method. The kernel should give the same result as `E_field`.
+        """
+        return( None )
+
+    def is_separable( self ):
+        """
+        Return whether the laser field can be written, at a fixed position z
+        (in the lab frame), as the product of a transverse factor that
+        depends only on x, y and of a longitudinal factor that depends
+        only on t, i.e.
+        Ex = Re( Tx(x,y,z) * L(z,t) ), Ey = Re( Ty(x,y,z) * L(z,t) )
+
+        Separable profiles set `self.separable = True` and define the methods
+        ``transverse_factor( x, y, z )``, which returns the complex arrays
+        Tx, Ty (in V/m) for the arrays x, y and the scalar z, and
+        ``longitudinal_factor( z, t )``, which returns the complex scalar L.
+        (These methods are only called when `is_separable` returns True.)
+        """
+        if not self.separable:
+            return( False )
+        # Only use the factors if they were defined along with `E_field`
+        mro = type(self).__mro__
+        E_field_cls = next( cls for cls in mro if 'E_field' in vars(cls) )
+        factor_cls = next( ( cls for cls in mro
+                             if 'transverse_factor' in vars(cls) ), None )
+        return( E_field_cls is factor_cls )
+
     def __add__( self, other ):
         """
         Overload the + operations for laser profiles
@@ -97,6 +160,23 @@ class SummedLaserProfile( LaserProfile ):
         Ex2, Ey2 = self.profile2.E_field( x, y, z, t )
         return( Ex1+Ex2, Ey1+Ey2 )
 
+    def make_numba_kernel( self ):
+        """
+        Fuse the kernels of the two profiles into a single kernel
+        (see the docstring of LaserProfile.make_numba_kernel)
+        """
+        kernel1 = self.profile1.get_numba_kernel()
+        kernel2 = self.profile2.get_numba_kernel()
+        if (kernel1 is None) or (kernel2 is None):
+            return( None )
+
+        @numba.njit
+        def kernel( x, y, z, t ):
+            Ex1, Ey1 = kernel1( x, y, z, t )
+            Ex2, Ey2 = kernel2( x, y, z, t )
+            return( Ex1+Ex2, Ey1+Ey2 )
+        return( kernel )
+
 
 # Particular classes for each laser profile
 # -----------------------------------------
@@ -180,8 +260,10 @@ class GaussianLaser( LaserProfile ):
             This should be either 1 (laser propagates towards positive z)
             or -1 (laser propagates towards negative z).
         """
-        # Initialize propagation direction and mark the profile as GPU capable
+        # Initialize propagation direction, and mark the profile as GPU capable
+        # and separable (see `is_separable`)
         LaserProfile.__init__(self, propagation_direction, gpu_capable=True)
+        self.separable = True
 
         # Set a number of parameters for the laser
         k0 = 2*np.pi/lambda0
@@ -237,6 +319,56 @@ class GaussianLaser( LaserProfile ):
 
         return( Ex.real, Ey.real )
 
+    def transverse_factor( self, x, y, z ):
+        """
+        See the docstring of LaserProfile.is_separable
+        """
+        diffract_factor = 1. + 1j * self.propag_direction * \
+                                    (z - self.zf) * self.inv_zr
+        profile = np.exp( - (x**2 + y**2) / (self.w0**2 * diffract_factor) ) \
+                                                        / diffract_factor
+        return( self.E0x * profile, self.E0y * profile )
+
+    def longitudinal_factor( self, z, t ):
+        """
+        See the docstring of LaserProfile.is_separable
+        """
+        stretch_factor = 1 - 2j * self.phi2_chirp * c**2 * self.inv_ctau2
+        u = self.propag_direction*(z - self.z0) - c*t
+        return( np.exp( - 1j*self.cep_phase + 1j*self.k0*u \
+                        - 1./stretch_factor*self.inv_ctau2 * u**2 ) \
+                / stretch_factor**0.5 )
+
+    def make_numba_kernel( self ):
+        """
+        See the docstring of LaserProfile.make_numba_kernel
+        """
+        prop_dir = self.propag_direction
+        k0 = self.k0
+        inv_zr = self.inv_zr
+        zf = self.zf
+        z0 = self.z0
+        w0 = self.w0
+        E0x = self.E0x
+        E0y = self.E0y
+        cep_phase = self.cep_phase
+        inv_ctau2 = self.inv_ctau2
+        stretch_factor = complex( 1 - 2j * self.phi2_chirp * c**2 * inv_ctau2 )
+        inv_stretch_factor = 1./stretch_factor
+        inv_sqrt_stretch_factor = 1./stretch_factor**0.5
+
+        @numba.njit
+        def kernel( x, y, z, t ):
+            diffract_factor = 1. + 1j * prop_dir*(z - zf) * inv_zr
+            u = prop_dir*(z - z0) - c*t
+            exp_argument = - 1j*cep_phase + 1j*k0*u \
+                - (x**2 + y**2) / (w0**2 * diffract_factor) \
+                - inv_stretch_factor*inv_ctau2 * u**2
+            profile = cmath.exp(exp_argument) / diffract_factor \
+                * inv_sqrt_stretch_factor
+            return( (E0x*profile).real, (E0y*profile).real )
+        return( kernel )
+
 
 class LaguerreGaussLaser( LaserProfile ):
     """Class that calculates a Laguerre-Gauss pulse."""
@@ -352,8 +484,9 @@ class LaguerreGaussLaser( LaserProfile ):
             This should be either 1 (laser propagates towards positive z)
             or -1 (laser propagates towards negative z).
         """
-        # Initialize propagation direction
+        # Initialize propagation direction, and mark the profile as separable
         LaserProfile.__init__(self, propagation_direction)
+        self.separable = True
 
         # Set a number of parameters for the laser
         k0 = 2*np.pi/lambda0
@@ -418,6 +551,68 @@ class LaguerreGaussLaser( LaserProfile ):
 
         return( Ex.real, Ey.real )
 
+    def transverse_factor( self, x, y, z ):
+        """
+        See the docstring of LaserProfile.is_separable
+        """
+        diffract_factor = 1. + 1j * self.propag_direction * \
+                                    (z - self.zf) * self.inv_zr
+        w = self.w0 * abs( diffract_factor )
+        psi = np.angle( diffract_factor )
+        scaled_radius_squared = 2*( x**2 + y**2 ) / w**2
+        scaled_radius = np.sqrt( scaled_radius_squared )
+        theta = np.angle( x + 1.j*y )
+        exp_argument = - (x**2 + y**2) / (self.w0**2 * diffract_factor) \
+            - 1.j*(2*self.p + self.m)*psi
+        profile = np.exp(exp_argument) / diffract_factor \
+            * scaled_radius**self.m * self.laguerre_pm(scaled_radius_squared) \
+            * np.cos( self.m*(theta-self.theta0) )
+        return( self.E0x * profile, self.E0y * profile )
+
+    def longitudinal_factor( self, z, t ):
+        """
+        See the docstring of LaserProfile.is_separable
+        """
+        u = self.propag_direction*(z - self.z0) - c*t
+        return( np.exp( - 1j*self.cep_phase + 1j*self.k0*u \
+                        - self.inv_ctau2 * u**2 ) )
+
+    def make_numba_kernel( self ):
+        """
+        See the docstring of LaserProfile.make_numba_kernel
+        """
+        prop_dir = self.propag_direction
+        p = self.p
+        m = self.m
+        theta0 = self.theta0
+        k0 = self.k0
+        inv_zr = self.inv_zr
+        zf = self.zf
+        z0 = self.z0
+        w0 = self.w0
+        E0x = self.E0x
+        E0y = self.E0y
+        cep_phase = self.cep_phase
+        inv_ctau2 = self.inv_ctau2
+
+        @numba.njit
+        def kernel( x, y, z, t ):
+            diffract_factor = 1. + 1j * prop_dir * (z - zf) * inv_zr
+            w = w0 * abs( diffract_factor )
+            psi = cmath.phase( diffract_factor )
+            scaled_radius_squared = 2*( x**2 + y**2 ) / w**2
+            scaled_radius = math.sqrt( scaled_radius_squared )
+            theta = math.atan2( y, x )
+            u = prop_dir*(z - z0) - c*t
+            exp_argument = - 1j*cep_phase + 1j*k0*u \
+                - (x**2 + y**2) / (w0**2 * diffract_factor) \
+                - inv_ctau2 * u**2 - 1.j*(2*p + m)*psi
+            profile = cmath.exp(exp_argument) / diffract_factor \
+                * scaled_radius**m * laguerre(p, m, scaled_radius_squared) \
+                * math.cos( m*(theta-theta0) )
+            return( (E0x*profile).real, (E0y*profile).real )
+        return( kernel )
+
 
 class DonutLikeLaguerreGaussLaser( LaserProfile ):
     """Class that calculates a donut-like Laguerre-Gauss pulse."""
@@ -520,8 +715,9 @@ class DonutLikeLaguerreGaussLaser( LaserProfile ):
             This should be either 1 (laser propagates towards positive z)
             or -1 (laser propagates towards negative z).
         """
-        # Initialize propagation direction
+        # Initialize propagation direction, and mark the profile as separable
         LaserProfile.__init__(self, propagation_direction)
+        self.separable = True
 
         # Set a number of parameters for the laser
         k0 = 2*np.pi/lambda0
@@ -578,6 +774,69 @@ class DonutLikeLaguerreGaussLaser( LaserProfile ):
 
         return( Ex.real, Ey.real )
 
+    def transverse_factor( self, x, y, z ):
+        """
+        See the docstring of LaserProfile.is_separable
+        """
+        diffract_factor = 1. + 1j * self.propag_direction * \
+                                    ( z - self.zf ) * self.inv_zr
+        w = self.w0 * abs( diffract_factor )
+        psi = np.angle( diffract_factor )
+        scaled_radius_squared = 2*( x**2 + y**2 ) / w**2
+        scaled_radius = np.sqrt( scaled_radius_squared )
+        theta = np.angle( x + 1.j*y )
+        exp_argument = - 1.j*self.m*theta \
+            - (x**2 + y**2) / (self.w0**2 * diffract_factor) \
+            + 1.j*(2*self.p + abs(self.m))*psi
+        profile = np.exp(exp_argument) / diffract_factor \
+            * scaled_radius**abs(self.m) \
+            * self.laguerre_pm(scaled_radius_squared)
+        return( self.E0x * profile, self.E0y * profile )
+
+    def longitudinal_factor( self, z, t ):
+        """
+        See the docstring of LaserProfile.is_separable
+        """
+        u = self.propag_direction*(z - self.z0) - c*t
+        return( np.exp( 1j*self.k0*u - 1j*self.cep_phase \
+                        - self.inv_ctau2 * u**2 ) )
+
+    def make_numba_kernel( self ):
+        """
+        See the docstring of LaserProfile.make_numba_kernel
+        """
+        prop_dir = self.propag_direction
+        p = self.p
+        m = self.m
+        abs_m = abs(self.m)
+        k0 = self.k0
+        inv_zr = self.inv_zr
+        zf = self.zf
+        z0 = self.z0
+        w0 = self.w0
+        E0x = self.E0x
+        E0y = self.E0y
+        cep_phase = self.cep_phase
+        inv_ctau2 = self.inv_ctau2
+
+        @numba.njit
+        def kernel( x, y, z, t ):
+            diffract_factor = 1. + 1j * prop_dir * ( z - zf ) * inv_zr
+            w = w0 * abs( diffract_factor )
+            psi = cmath.phase( diffract_factor )
+            scaled_radius_squared = 2*( x**2 + y**2 ) / w**2
+            scaled_radius = math.sqrt( scaled_radius_squared )
+            theta = math.atan2( y, x )
+            u = prop_dir*(z - z0) - c*t
+            exp_argument = 1j*k0*u - 1j*cep_phase - 1.j*m*theta \
+                - (x**2 + y**2) / (w0**2 * diffract_factor) \
+                - inv_ctau2 * u**2 + 1.j*(2*p + abs_m)*psi
+            profile = cmath.exp(exp_argument) / diffract_factor \
+                * scaled_radius**abs_m \
+                * laguerre(p, abs_m, scaled_radius_squared)
+            return( (E0x*profile).real, (E0y*profile).real )
+        return( kernel )
+
 
 class FlattenedGaussianLaser( LaserProfile ):
     """Class that calculates a focused flattened Gaussian"""
@@ -665,8 +924,9 @@ class FlattenedGaussianLaser( LaserProfile ):
             This should be either 1 (laser propagates towards positive z)
             or -1 (laser propagates towards negative z).
         """
-        # Initialize propagation direction
+        # Initialize propagation direction, and mark the profile as separable
         LaserProfile.__init__(self, propagation_direction)
+        self.separable = True
 
         # Ensure that N is an integer
         self.N = int(round(N))
@@ -714,7 +974,35 @@ class FlattenedGaussianLaser( LaserProfile ):
         scaled_radius_squared = 2*( x**2 + y**2 ) / w**2
 
         # Sum recursively over the Laguerre polynomials
-        laguerre_sum = np.zeros_like( x, dtype=np.complex128 )
+        laguerre_sum = self.laguerre_sum( scaled_radius_squared, psi )
+
+        # Final profile: multiply by n-independent propagation factors
+        exp_argument = - 1j*self.cep_phase \
+            + 1j*self.k0*( prop_dir*(z - self.z0) - c*t ) \
+            - (x**2 + y**2) / (self.w_foc**2 * diffract_factor) \
+            - self.inv_ctau2 * ( prop_dir*(z - self.z0) - c*t )**2
+        profile = laguerre_sum * np.exp( exp_argument ) / diffract_factor
+
+        # Get the projection along x and y, with the correct polarization
+        Ex = self.E0x * profile
+        Ey = self.E0y * profile
+
+        return( Ex.real, Ey.real )
+
+    def laguerre_sum( self, scaled_radius_squared, psi ):
+        """
+        Return the sum of the Laguerre-Gauss modes that make up the profile,
+        including their additional Gouy phase
+
+        Parameters
+        -----------
+        scaled_radius_squared: ndarray
+            The value of 2*r**2/w**2 at which to evaluate the sum
+        psi: ndarray or float
+            The Gouy phase
+        """
+        laguerre_sum = np.zeros_like( scaled_radius_squared,
+                                      dtype=np.complex128 )
         for n in range(0, self.N+1):
 
             # Recursive calculation of the Laguerre polynomial
@@ -734,18 +1022,74 @@ class FlattenedGaussianLaser( LaserProfile ):
             # Add to the sum, including the term for the additional Gouy phase
             laguerre_sum += self.cn[n] * np.exp( - (2j* n) * psi ) * L
 
-        # Final profile: multiply by n-independent propagation factors
-        exp_argument = - 1j*self.cep_phase \
-            + 1j*self.k0*( prop_dir*(z - self.z0) - c*t ) \
-            - (x**2 + y**2) / (self.w_foc**2 * diffract_factor) \
-            - self.inv_ctau2 * ( prop_dir*(z - self.z0) - c*t )**2
-        profile = laguerre_sum * np.exp( exp_argument ) / diffract_factor
+        return( laguerre_sum )
 
-        # Get the projection along x and y, with the correct polarization
-        Ex = self.E0x * profile
-        Ey = self.E0y * profile
+    def transverse_factor( self, x, y, z ):
+        """
+        See the docstring of LaserProfile.is_separable
+        """
+        diffract_factor = 1. + 1j * self.propag_direction * \
+                                    (z - self.zf) * self.inv_zr
+        w = self.w_foc * np.abs( diffract_factor )
+        psi = np.angle( diffract_factor )
+        scaled_radius_squared = 2*( x**2 + y**2 ) / w**2
+        profile = self.laguerre_sum( scaled_radius_squared, psi ) * \
+            np.exp( - (x**2 + y**2) / (self.w_foc**2 * diffract_factor) ) \
+            / diffract_factor
+        return( self.E0x * profile, self.E0y * profile )
 
-        return( Ex.real, Ey.real )
+    def longitudinal_factor( self, z, t ):
+        """
+        See the docstring of LaserProfile.is_separable
+        """
+        u = self.propag_direction*(z - self.z0) - c*t
+        return( np.exp( - 1j*self.cep_phase + 1j*self.k0*u \
+                        - self.inv_ctau2 * u**2 ) )
+
+    def make_numba_kernel( self ):
+        """
+        See the docstring of LaserProfile.make_numba_kernel
+        """
+        prop_dir = self.propag_direction
+        N = self.N
+        cn = self.cn.copy()
+        k0 = self.k0
+        inv_zr = self.inv_zr
+        zf = self.zf
+        z0 = self.z0
+        w_foc = self.w_foc
+        E0x = self.E0x
+        E0y = self.E0y
+        cep_phase = self.cep_phase
+        inv_ctau2 = self.inv_ctau2
+
+        @numba.njit
+        def kernel( x, y, z, t ):
+            diffract_factor = 1. + 1j * prop_dir*(z - zf) * inv_zr
+            w = w_foc * abs( diffract_factor )
+            psi = cmath.phase( diffract_factor )
+            scaled_radius_squared = 2*( x**2 + y**2 ) / w**2
+            # Sum recursively over the Laguerre polynomials
+            laguerre_sum = 0.j
+            L = 1.
+            L1 = 0.
+            for n in range(0, N+1):
+                if n == 1:
+                    L1 = L
+                    L = 1. - scaled_radius_squared
+                elif n > 1:
+                    L2 = L1
+                    L1 = L
+                    L = (((2*n -1) - scaled_radius_squared) * L1 \
+                            - (n - 1) * L2) / n
+                laguerre_sum += cn[n] * cmath.exp( - (2j* n) * psi ) * L
+            u = prop_dir*(z - z0) - c*t
+            exp_argument = - 1j*cep_phase + 1j*k0*u \
+                - (x**2 + y**2) / (w_foc**2 * diffract_factor) \
+                - inv_ctau2 * u**2
+            profile = laguerre_sum * cmath.exp( exp_argument ) / diffract_factor
+            return( (E0x*profile).real, (E0y*profile).real )
+        return( kernel )
 
 
 class FewCycleLaser( LaserProfile ):
@@ -880,3 +1224,26 @@ class FewCycleLaser( LaserProfile ):
         Ey = self.E0y * profile
 
         return( Ex.real, Ey.real )
+
+    def make_numba_kernel( self ):
+        """
+        See the docstring of LaserProfile.make_numba_kernel
+        """
+        prop_dir = self.propag_direction
+        k0 = self.k0
+        zr = self.zr
+        zf = self.zf
+        z0 = self.z0
+        s = float( self.s )
+        E0x = self.E0x
+        E0y = self.E0y
+        cep_factor = complex( np.exp(1.j*self.cep_phase) )
+
+        @numba.njit
+        def kernel( x, y, z, t ):
+            inv_q = 1./( prop_dir * (z - zf) + 1.j*zr )
+            argument = 1. + 1.j*k0/s*(
+                prop_dir*(z - z0) - c*t + 0.5*(x**2 + y**2)*inv_q )
+            profile = cep_factor * 1.j*zr*inv_q * argument**(-s-1)
+            return( (E0x*profile).real, (E0y*profile).real )
+        return( kernel )
@@ -0,0 +1,80 @@
+# Copyright 2016, FBPIC contributors
+# Authors: Remi Lehe, Manuel Kirchen
+# License: 3-Clause-BSD-LBNL
+"""
+This file is part of the Fourier-Bessel Particle-In-Cell code (FB-PIC)
+It defines numba methods that evaluate the laser profiles on a set of points,
+using the compiled kernels provided by the laser profiles.
+"""
+import numba
+from scipy.constants import c
+from fbpic.utils.threading import threading_enabled, prange, njit_parallel
+
+@numba.njit
+def laguerre( n, alpha, x ):
+    """
+    Return the value of the generalized Laguerre polynomial L_n^alpha(x),
+    calculated with the usual recursion relation.
+    """
+    L = 1.
+    if n == 0:
+        return( L )
+    L1 = L
+    L = 1. + alpha - x
+    for k in range( 2, n+1 ):
+        L2 = L1
+        L1 = L
+        L = ( (2*k - 1 + alpha - x) * L1 - (k - 1 + alpha) * L2 ) / k
+    return( L )
+
+
+def make_E_field_evaluator( kernel, parallel=True ):
+    """
+    Return a compiled function which evaluates the laser field given by
+    `kernel` (see `LaserProfile.get_numba_kernel`) on a set of points,
+    with no temporary arrays.
+
+    The returned function has the signature
+    ``evaluate( x, y, z, t, gamma0, beta0, coef, Ex, Ey )``, where `x`, `y`
+    and `z` are 1d arrays of positions and `t` is a time (in the simulation
+    frame), `gamma0` and `beta0` define the boost to the lab frame
+    (use 1. and 0. for a simulation in the lab frame), and `Ex`, `Ey`
+    are 1d arrays, which are filled with `coef` times the laser field.
+
+    Parameters
+    ----------
+    kernel: a numba-compiled function
+        The scalar kernel of the laser profile
+
+    parallel: bool, optional
+        Whether to loop over the points with several threads. If False,
+        the function releases the GIL, so that it can be called concurrently
+        from several Python threads.
+    """
+    inv_c = 1./c
+
+    def evaluate( x, y, z, t, gamma0, beta0, coef, Ex, Ey ):
+        for i in prange( x.shape[0] ):
+            # Convert the position and time to the lab frame
+            zlab = gamma0*( z[i] + (c*beta0)*t )
+            tlab = gamma0*( t + (inv_c*beta0)*z[i] )
+            Ex_i, Ey_i = kernel( x[i], y[i], zlab, tlab )
+            Ex[i] = coef * Ex_i
+            Ey[i] = coef * Ey_i
+
+    return( numba.njit( evaluate, nogil=True,
+                        parallel=(parallel and threading_enabled) ) )
+
+
+@njit_parallel
+def apply_longitudinal_factor( Tx, Ty, L, vx, vy ):
+    """
+    Fill `vx` and `vy` with the real part of the cached transverse factors
+    `Tx` and `Ty`, multiplied by the complex longitudinal factor `L`
+    (for separable laser profiles)
+    """
+    Lr = L.real
+    Li = L.imag
+    for i in prange( Tx.shape[0] ):
+        vx[i] = Tx[i].real * Lr - Tx[i].imag * Li
+        vy[i] = Ty[i].real * Lr - Ty[i].imag * Li
@@ -30,6 +30,7 @@ import numpy as np
 from scipy.constants import m_e, m_p, e, c
 from .utils.printing import ProgressBar, print_simulation_setup
 from .particles import Particles
+from .particles.deposition.threading_methods import deposit_species_numba
 from .lpa_utils.boosted_frame import BoostConverter
 from .fields import Fields
 from .boundaries import BoundaryCommunicator, MovingWindow
@@ -60,7 +61,8 @@ class Simulation(object):
                  gamma_boost=None, use_all_mpi_ranks=True,
                  particle_shape='linear', verbose_level=1,
                  smoother=None, use_ruyten_shapes=True,
-                 use_modified_volume=True ):
+                 use_modified_volume=True, psatd_coefs_on_the_fly=False,
+                 dht_tolerance=None ):
         """
         Initializes a simulation.
 
@@ -225,6 +227,24 @@ class Simulation(object):
             Whether to use a slightly-modified, effective cell volume, that
             ensures that the charge deposited near the axis is correctly
             taken into account by the spectral cylindrical Maxwell solver.
+
+        psatd_coefs_on_the_fly: bool, optional
+            Whether to recompute the coefficients of the PSATD scheme at
+            each timestep (from the wavevectors and the timestep), instead
+            of storing them. This reduces the memory footprint and the
+            memory traffic of the field push, at the cost of additional
+            arithmetic. Only available with the standard PSATD
+            (i.e. `v_comoving=None`), on CPU.
+
+        dht_tolerance: float or None, optional
+            If None (default), the Hankel transforms along r are
+            performed as dense matrix products, whose cost scales as Nr**2.
+            Otherwise, the matrices of the Hankel transform are compressed
+            (hierarchical partition into dense and low-rank blocks), with
+            the relative accuracy `dht_tolerance` (e.g. 1.e-10). This
+            reduces the cost of the transforms for large Nr (typically
+            Nr > 1000), at the expense of a longer initialization.
+            Only used on CPU.
         """
         # Check whether to use CUDA
         self.use_cuda = use_cuda
@@ -303,7 +323,9 @@ class Simulation(object):
                     # Only create threading buffers when running on CPU
                     create_threading_buffers=(self.use_cuda is False),
                     use_ruyten_shapes=use_ruyten_shapes,
-                    use_modified_volume=use_modified_volume )
+                    use_modified_volume=use_modified_volume,
+                    psatd_coefs_on_the_fly=psatd_coefs_on_the_fly,
+                    dht_tolerance=dht_tolerance )
 
         # Initialize the electrons and the ions
         self.grid_shape = self.fld.interp[0].Ez.shape
@@ -325,6 +347,8 @@ class Simulation(object):
         # Register the time and the iteration
         self.time = 0.
         self.iteration = 0
+        # Whether the spectral fields were loaded from a native checkpoint
+        self.spectral_fields_loaded = False
         # Register the filtering flag
         self.filter_currents = filter_currents
 
@@ -384,6 +408,12 @@ class Simulation(object):
             # This is because use_true_rho requires the guard cells of
             # rho to be exchanged while correct_currents requires the opposite.
 
+        # Check whether the filter of rho_next/J, the current correction and
+        # the field push can be fused into a single pass over the spectral
+        # grid (not possible when the corrected J is exchanged via MPI)
+        fuse_spectral_kernels = correct_currents and \
+            fld.use_fused_spectral_kernel and (self.comm.size == 1)
+
         # Initialize the positions for continuous injection by moving window
         if self.comm.moving_win is not None:
             for species in self.ptcl:
@@ -402,14 +432,18 @@ class Simulation(object):
         # Get the E and B fields in spectral space initially
         # (In the rest of the loop, E and B will only be transformed
         # from spectal space to real space, but never the other way around)
-        self.comm.exchange_fields(fld.interp, 'E', 'replace')
-        self.comm.exchange_fields(fld.interp, 'B', 'replace')
-        self.comm.damp_EB_open_boundary( fld.interp )
-        fld.interp2spect('E')
-        fld.interp2spect('B')
-        if self.use_pml:
-            fld.interp2spect('E_pml')
-            fld.interp2spect('B_pml')
+        # (This is skipped after a restart from a native checkpoint, since
+        # the fields are then directly loaded in spectral space)
+        if not self.spectral_fields_loaded:
+            self.comm.exchange_fields(fld.interp, 'E', 'replace')
+            self.comm.exchange_fields(fld.interp, 'B', 'replace')
+            self.comm.damp_EB_open_boundary( fld.interp )
+            fld.interp2spect('E')
+            fld.interp2spect('B')
+            if self.use_pml:
+                fld.interp2spect('E_pml')
+                fld.interp2spect('B_pml')
+        self.spectral_fields_loaded = False
 
         # Beginning of the N iterations
         # -----------------------------
@@ -505,7 +539,9 @@ class Simulation(object):
 
             # Get the current at t = (n+1/2) dt
             # (Guard cell exchange done either now or after current correction)
-            self.deposit('J', exchange=(correct_currents is False))
+            # (Filtering done either now or in the fused spectral kernel)
+            self.deposit('J', exchange=(correct_currents is False),
+                         filter_spectral=(not fuse_spectral_kernels) )
             # Perform cross-deposition if needed
             if correct_currents and fld.current_correction=='cross-deposition':
                 self.cross_deposit( move_positions )
@@ -522,9 +558,16 @@ class Simulation(object):
                 self.shift_galilean_boundaries( 0.5*dt )
 
             # Get the charge density at t = (n+1) dt
-            self.deposit('rho_next', exchange=(use_true_rho is True))
+            self.deposit('rho_next', exchange=(use_true_rho is True),
+                         filter_spectral=(not fuse_spectral_kernels) )
+            if fuse_spectral_kernels:
+                # Filter rho and J, correct the currents, and push the
+                # fields E and B to t = (n+1) dt, in a single pass
+                fld.filter_correct_and_push( use_true_rho,
+                                             use_filter=self.filter_currents )
+                fld.exchanged_source['J'] = True
             # Correct the currents (requires rho at t = (n+1) dt )
-            if correct_currents:
+            elif correct_currents:
                 fld.correct_currents( check_exchanges=(self.comm.size > 1) )
                 if self.comm.size > 1:
                     # Exchange the guard cells of corrected J between domains
@@ -536,7 +579,8 @@ class Simulation(object):
                 fld.exchanged_source['J'] = True
 
             # Push the fields E and B on the spectral grid to t = (n+1) dt
-            fld.push( use_true_rho, check_exchanges=(self.comm.size > 1) )
+            if not fuse_spectral_kernels:
+                fld.push( use_true_rho, check_exchanges=(self.comm.size > 1) )
             if correct_divE:
                 fld.correct_divE()
             # Move the grids if needed
@@ -563,6 +607,12 @@ class Simulation(object):
         # End of the N iterations
         # -----------------------
 
+        # Wait for the checkpoints that are written in the background
+        # (raises their errors, and deletes the older checkpoints)
+        for checkpoint in self.checkpoints:
+            if hasattr( checkpoint, 'wait' ):
+                checkpoint.wait()
+
         # Finalize PIC loop
         # Get the charge density and the current from spectral space.
         fld.spect2interp('J')
@@ -582,7 +632,8 @@ class Simulation(object):
 
 
     def deposit( self, fieldtype, exchange=False,
-                update_spectral=True, species_list=None ):
+                update_spectral=True, species_list=None,
+                filter_spectral=True ):
         """
         Deposit the charge or the currents to the interpolation grid
         and then to the spectral grid.
@@ -607,6 +658,11 @@ class Simulation(object):
         species_list: list of `Particles` objects, or None
             The species which that should deposit their charge/current.
             If this is None, all species (and antennas) deposit.
+
+        filter_spectral: bool
+            Whether to filter the deposited field in spectral space
+            (if `filter_currents` is True). This is False when the
+            filtering is done later, in the fused spectral kernel.
         """
         # Shortcut
         fld = self.fld
@@ -623,12 +679,9 @@ class Simulation(object):
         # Charge
         if fieldtype.startswith('rho'):  # e.g. rho_next, rho_prev, etc.
             fld.erase('rho')
-            # Deposit the particle charge
-            for species in species_list:
-                species.deposit( fld, 'rho' )
-            # Deposit the charge of the virtual particles in the antenna
-            for antenna in antennas_list:
-                antenna.deposit( fld, 'rho' )
+            # Deposit the charge of the particles and of
+            # the virtual particles in the antenna
+            self.deposit_species( 'rho', species_list, antennas_list )
             # Sum contribution from each CPU threads (skipped on GPU)
             fld.sum_reduce_deposition_array('rho')
             # Divide by cell volume
@@ -640,12 +693,9 @@ class Simulation(object):
         # Currents
         elif fieldtype == 'J':
             fld.erase('J')
-            # Deposit the particle current
-            for species in species_list:
-                species.deposit( fld, 'J' )
-            # Deposit the current of the virtual particles in the antenna
-            for antenna in antennas_list:
-                antenna.deposit( fld, 'J' )
+            # Deposit the current of the particles and of
+            # the virtual particles in the antenna
+            self.deposit_species( 'J', species_list, antennas_list )
             # Sum contribution from each CPU threads (skipped on GPU)
             fld.sum_reduce_deposition_array('J')
             # Divide by cell volume
@@ -659,11 +709,55 @@ class Simulation(object):
         # Get the charge or currents on the spectral grid
         if update_spectral:
             fld.interp2spect( fieldtype )
-            if self.filter_currents:
+            if self.filter_currents and filter_spectral:
                 fld.filter_spect( fieldtype )
             # Set the flag to indicate whether these fields have been exchanged
             fld.exchanged_source[ fieldtype ] = exchange
 
+    def deposit_species( self, fieldtype, species_list, antennas_list ):
+        """
+        Deposit the charge or current of the species in `species_list` and
+        of the antennas in `antennas_list` on the interpolation grid
+        (or, on CPU, on the threading buffers of the interpolation grid).
+
+        On CPU, all species with the same particle shape (and the antennas)
+        are deposited in a single parallel region, with the combined set
+        of particles divided evenly between the threads.
+
+        Parameters
+        ----------
+        fieldtype: str
+            Either 'rho' or 'J'
+
+        species_list: list of `Particles` objects
+
+        antennas_list: list of `LaserAntenna` objects
+        """
+        # GPU: deposit each species successively
+        if self.use_cuda:
+            for species in species_list:
+                species.deposit( self.fld, fieldtype )
+            for antenna in antennas_list:
+                antenna.deposit( self.fld, fieldtype )
+            return
+
+        # CPU: gather the particle arrays, for each particle shape
+        # (Skip neutral particles, e.g. photons)
+        deposition_arrays = { 'linear': [], 'cubic': [] }
+        # (Species with cached shape factors deposit separately)
+        for species in species_list:
+            if species.use_shape_factor_cache:
+                species.deposit( self.fld, fieldtype )
+            elif species.q != 0:
+                deposition_arrays[ species.particle_shape ].append(
+                    species.get_deposition_arrays() )
+        for antenna in antennas_list:
+            deposition_arrays['linear'] += antenna.get_deposition_arrays()
+        # Deposit all the particles of a given shape at once
+        for particle_shape in [ 'linear', 'cubic' ]:
+            deposit_species_numba( self.fld, fieldtype, particle_shape,
+                                   deposition_arrays[ particle_shape ] )
+
     def cross_deposit( self, move_positions ):
         """
         Perform cross-deposition. This function should be called
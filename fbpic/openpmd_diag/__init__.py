@@ -6,6 +6,8 @@ It imports the objects that allow to produce output in openPMD format.
 from .field_diag import FieldDiagnostic
 from .particle_diag import ParticleDiagnostic
 from .particle_density_diag import ParticleChargeDensityDiagnostic
+from .reduced_particle_diag import ReducedParticleDiagnostic
+from .reduced_field_diag import ReducedFieldDiagnostic
 from .boosted_field_diag import BoostedFieldDiagnostic, \
                                 BackTransformedFieldDiagnostic
 from .boosted_particle_diag import BoostedParticleDiagnostic, \
@@ -17,5 +19,6 @@ from .checkpoint_restart import set_periodic_checkpoint, \
 __all__ = ['FieldDiagnostic', 'ParticleDiagnostic',
 	'BoostedFieldDiagnostic', 'BoostedParticleDiagnostic',
     'BackTransformedFieldDiagnostic', 'BackTransformedParticleDiagnostic',
-    'ParticleChargeDensityDiagnostic', 'InputScriptDiagnostic',
+    'ParticleChargeDensityDiagnostic', 'ReducedParticleDiagnostic',
+    'ReducedFieldDiagnostic', 'InputScriptDiagnostic',
     'set_periodic_checkpoint', 'restart_from_checkpoint']
@@ -9,12 +9,15 @@ Major features:
   as much as possible, through class inheritance
 - The class implements memory buffering of the slices, so as
   not to write to disk at every timestep
-- Parallel output is not implemented for the moment
+- Parallel output is not implemented for the moment ; the slices
+  of the different procs are gathered on the first proc with MPI Gatherv
 """
 import os
 import numpy as np
 from scipy.constants import c
+from fbpic.utils.mpi import mpi_type_dict
 from .field_diag import FieldDiagnostic
+from .slice_buffer import SliceBuffer
 
 # Check if CUDA is available, then import CUDA functions
 from fbpic.utils.cuda import cuda_installed
@@ -30,7 +33,7 @@ class BackTransformedFieldDiagnostic(FieldDiagnostic):
     def __init__(self, zmin_lab, zmax_lab, v_lab, dt_snapshots_lab,
                  Ntot_snapshots_lab, gamma_boost, period, fldobject,
                  comm=None, fieldtypes=["E", "B"],
-                 write_dir=None ) :
+                 write_dir=None, buffer_memory_budget=None ) :
         """
         Initialize diagnostics that retrieve the data in the lab frame,
         as a series of snapshot (one file per snapshot),
@@ -72,6 +75,15 @@ class BackTransformedFieldDiagnostic(FieldDiagnostic):
             but has to be aware that there may errors in the backward transform.
             Moreover, writing rho/J slows down the simulation, as these fields
             are then brought from spectral to real space, at each iteration.
+
+        buffer_memory_budget: int or None, optional
+            Maximal number of bytes that each snapshot keeps in memory
+            (on each MPI rank) between two writes to disk. Beyond this
+            budget, the buffered slices are moved to staging files in
+            the subdirectory `staging` of `write_dir`, until they are
+            written to the openPMD files. This allows to use a long `period`
+            and many snapshots with a bounded memory footprint.
+            If None (default), all the slices are kept in memory.
         """
         # Do not leave write_dir as None, as this may conflict with
         # the default directory ('./diags') in which diagnostics in the
@@ -108,7 +120,8 @@ class BackTransformedFieldDiagnostic(FieldDiagnostic):
             snapshot = LabSnapshot( t_lab,
                                     zmin_lab + v_lab*t_lab,
                                     zmax_lab + v_lab*t_lab,
-                                    self.write_dir, i, self.fld, Nr )
+                                    self.write_dir, i, self.fld, Nr,
+                                    buffer_memory_budget, self.rank )
             self.snapshots.append( snapshot )
             # Initialize a corresponding empty file
             self.create_file_empty_meshes( snapshot.filename, i,
@@ -192,7 +205,7 @@ class BackTransformedFieldDiagnostic(FieldDiagnostic):
 
                 # Register snapshot.slice_array in the list of buffers
                 # (when running on the GPU, the slice to the CPU)
-                snapshot.register_slice( self.inv_dz_lab )
+                snapshot.register_slice( self.inv_dz_lab, iteration )
 
     def flush_to_disk( self ):
         """
@@ -200,7 +213,8 @@ class BackTransformedFieldDiagnostic(FieldDiagnostic):
 
         Erase the buffered slices of the LabSnapshot objects
         """
-        # Loop through the labsnapshots and flush the data
+        # Loop through the labsnapshots and compact the data
+        compacted_slices = []
         for snapshot in self.snapshots:
 
             # Compact the successive slices that have been buffered
@@ -210,106 +224,119 @@ class BackTransformedFieldDiagnostic(FieldDiagnostic):
             # *from the boosted frame to the lab frame*, on each proc
             if field_array is not None:
                 self.slice_handler.transform_fields_to_lab_frame( field_array )
-
-            # Gather the slices on the first proc
-            if self.comm is not None and self.comm.size > 1:
-                global_field_array, global_iz_min, global_iz_max = \
-                    self.gather_slices( field_array, iz_min, iz_max )
-            else:
-                global_field_array = field_array
-                global_iz_min = iz_min
-                global_iz_max = iz_max
-
-            # First proc writes the global array to disk (if it is not empty)
-            if (self.rank==0) and (global_field_array is not None):
-
-                # Write to disk
-                self.write_slices( global_field_array, global_iz_min,
-                    global_iz_max, snapshot, self.slice_handler.field_to_index)
+            compacted_slices.append( (field_array, iz_min, iz_max) )
 
             # Erase the memory buffers
-            snapshot.buffered_slices = []
+            snapshot.buffered_slices.clear()
             snapshot.buffer_z_indices = []
 
-    def gather_slices( self, field_array, iz_min, iz_max ):
+        # Gather the slices on the first proc
+        if self.comm is not None and self.comm.size > 1:
+            compacted_slices = self.gather_slices( compacted_slices )
+
+        # First proc writes the global arrays to disk (if they are not empty)
+        if self.rank == 0:
+            for snapshot, (global_field_array, global_iz_min, global_iz_max) \
+                    in zip( self.snapshots, compacted_slices ):
+                if global_field_array is not None:
+                    self.write_slices( global_field_array, global_iz_min,
+                        global_iz_max, snapshot,
+                        self.slice_handler.field_to_index )
+
+    def gather_slices( self, compacted_slices ):
         """
-        Stitch together the field_array of the different processors
+        Stitch together the field_array of the different processors,
+        for each snapshot
 
         Parameters:
         -----------
-        field_array: ndarray of reals, or None
-            If the local proc has no slice data, this is None
-            Otherwise, it is an array of shape (10, 2*Nm-1, Nr, nslice_local)
-
-        iz_min, iz_max: ints or None
-            If the local proc has no slice data, this is None
-            Otherwise, it corresponds to the indices at which the data should
-            written, in final dataset which is on disk
+        compacted_slices: list of tuples (one element per snapshot)
+            Each tuple contains:
+            - field_array: ndarray of reals, or None
+              If the local proc has no slice data, this is None
+              Otherwise, it is an array of shape (10, 2*Nm-1, Nr, nslice_local)
+            - iz_min, iz_max: ints or None
+              If the local proc has no slice data, this is None
+              Otherwise, it corresponds to the indices at which the data
+              should written, in final dataset which is on disk
 
         Returns:
         --------
-        A tuple with:
+        A list of tuples (one element per snapshot) with:
         global_field_array: an array of shape (10, 2*Nm-1, Nr, nslice_global),
            or None if none of the procs had any data
         global_izmin, global_izmax: the indices at which the global_field_array
            should be written (or None)
+        (On the other procs, all elements of the tuples are None.)
         """
-        # Gather objects into lists (one element per proc)
-        # Note: this is slow, as it uses the generic mpi4py routines gather.
-        # (This is because for some proc field_array can be None.)
         mpi_comm = self.comm.mpi_comm
-        field_array_list = mpi_comm.gather( field_array )
-        iz_min_list = mpi_comm.gather( iz_min )
-        iz_max_list = mpi_comm.gather( iz_max )
+        n_snapshots = len( compacted_slices )
 
-        # First proc: merge the results
-        if self.rank == 0:
-
-            # Check whether any processor had some slices
-            no_slices = True
-            for f_array in field_array_list:
-                if f_array is not None:
-                    no_slices = False
-                    n_modes = f_array.shape[1] # n_modes is 2*Nm - 1
-                    Nr = f_array.shape[2]
-
-            # If there are no slices, set global quantities to None
-            if no_slices:
-                global_field_array = None
-                global_iz_min = None
-                global_iz_max = None
-
-            # If there are some slices, gather them
+        # Exchange the indices of the slices of all snapshots
+        # (single collective call, with fixed-size integer buffers)
+        local_indices = -np.ones( (n_snapshots, 2), dtype=np.int64 )
+        for i, (field_array, iz_min, iz_max) in enumerate(compacted_slices):
+            if field_array is not None:
+                local_indices[i] = iz_min, iz_max
+        all_indices = np.empty( (self.comm.size, n_snapshots, 2),
+                                dtype=np.int64 )
+        mpi_comm.Allgather( local_indices, all_indices )
+
+        # Gather the slices of each snapshot that has data on any proc
+        # (buffer-based Gatherv: the slices of each proc are sent as a
+        # contiguous block, and received directly at their position)
+        gathered_slices = []
+        for i, snapshot in enumerate( self.snapshots ):
+            iz_min_list = all_indices[:, i, 0]
+            iz_max_list = all_indices[:, i, 1]
+            has_slices = ( iz_min_list >= 0 )
+            if not np.any( has_slices ):
+                gathered_slices.append( (None, None, None) )
+                continue
+            global_iz_min = int( iz_min_list[has_slices].min() )
+            global_iz_max = int( iz_max_list[has_slices].max() )
+
+            # Number of elements sent by each proc, and position
+            # at which they are received (z is the first axis of the buffers)
+            slice_shape = tuple( snapshot.slice_array.shape )
+            slice_size = int( np.prod( slice_shape ) )
+            N_procs = []
+            istart_procs = []
+            for k in range( self.comm.size ):
+                if has_slices[k]:
+                    N_procs.append( int( slice_size * \
+                        (iz_max_list[k] - iz_min_list[k]) ) )
+                    istart_procs.append( int( slice_size * \
+                        (iz_min_list[k] - global_iz_min) ) )
+                else:
+                    N_procs.append( 0 )
+                    istart_procs.append( 0 )
+            N_procs = tuple( N_procs )
+            istart_procs = tuple( istart_procs )
+
+            field_array = compacted_slices[i][0]
+            if field_array is not None:
+                sendbuf = np.ascontiguousarray(
+                    np.moveaxis( field_array, -1, 0 ) )
             else:
-                # Find the global iz_min and global iz_max
-                global_iz_min = min([n for n in iz_min_list if n is not None])
-                global_iz_max = max([n for n in iz_max_list if n is not None])
-
-                # Allocate a the global field array, with the proper size
-                nslice = global_iz_max - global_iz_min
-                data_shape = (10, n_modes, Nr, nslice)
-                global_field_array = np.zeros( data_shape )
-
-                # Loop through all the processors
-                # Fit the field arrays one by one into the global_field_array
-                for i_proc in range(self.comm.size):
-
-                    # If this proc has no data, skip it
-                    if field_array_list[ i_proc ] is None:
-                        continue
-                    # Longitudinal indices within the array global_field_array
-                    s_min = iz_min_list[ i_proc ] - global_iz_min
-                    s_max = iz_max_list[ i_proc ] - global_iz_min
-                    # Copy the array to the proper position
-                    global_field_array[:,:,:, s_min:s_max] = \
-                                                    field_array_list[i_proc]
-
-            # The first proc returns the result
-            return( global_field_array, global_iz_min, global_iz_max )
-
-        # Other processors return a dummy placeholder
-        else:
-            return( None, None, None )
+                sendbuf = np.empty( (0,) + slice_shape )
+            if self.rank == 0:
+                recvbuf = np.zeros(
+                    (global_iz_max - global_iz_min,) + slice_shape )
+            else:
+                recvbuf = None
+            mpi_type = mpi_type_dict['float64']
+            mpi_comm.Gatherv( [ sendbuf, N_procs[self.rank], mpi_type ],
+                [ recvbuf, N_procs, istart_procs, mpi_type ], root=0 )
+
+            # First proc: put the z axis back at the end
+            if self.rank == 0:
+                gathered_slices.append( ( np.moveaxis( recvbuf, 0, -1 ),
+                                          global_iz_min, global_iz_max ) )
+            else:
+                gathered_slices.append( (None, None, None) )
+
+        return( gathered_slices )
 
     def write_slices( self, field_array, iz_min, iz_max, snapshot, f2i ):
         """
@@ -370,7 +397,8 @@ class LabSnapshot:
     in the lab frame (i.e. one given *time* in the lab frame)
     """
     def __init__(self, t_lab, zmin_lab, zmax_lab,
-                    write_dir, i, fld, Nr_output):
+                    write_dir, i, fld, Nr_output,
+                    buffer_memory_budget=None, rank=0):
         """
         Initialize a LabSnapshot
 
@@ -396,6 +424,15 @@ class LabSnapshot:
         Nr_output: int
             Number of cells in the r direction, in the final output
             (This typically excludes the radial damping cells)
+
+        buffer_memory_budget: int or None, optional
+            Maximal number of bytes that this snapshot keeps in memory,
+            before moving the buffered slices to a staging file on disk.
+            If None, no staging file is used.
+
+        rank: int, optional
+            The rank of the MPI process (used in the name of the
+            staging file)
         """
         # Deduce the name of the filename where this snapshot writes
         self.filename = os.path.join( write_dir, 'hdf5/data%08d.h5' %i)
@@ -411,8 +448,11 @@ class LabSnapshot:
         self.current_z_lab = 0
         self.current_z_boost = 0
 
-        # Buffered field slice and corresponding array index in z
-        self.buffered_slices = []
+        # Buffered field slices and corresponding array index in z
+        staging_prefix = os.path.join( write_dir, 'staging',
+                                       'data%08d_proc%d' %(i, rank) )
+        self.buffered_slices = SliceBuffer(
+            staging_prefix, buffer_memory_budget )
         self.buffer_z_indices = []
 
         # Allocate a buffer for only one slice (avoids having to
@@ -443,8 +483,10 @@ class LabSnapshot:
         # for a snapshot having a fixed t_lab
         self.current_z_boost = ( t_lab*inv_gamma - t_boost )*c*inv_beta
         self.current_z_lab = ( t_lab - t_boost*inv_gamma )*c*inv_beta
+        # Output position in the lab frame at t_boost = 0
+        self.initial_z_lab = t_lab*c*inv_beta
 
-    def register_slice( self, inv_dz_lab ):
+    def register_slice( self, inv_dz_lab, iteration ):
         """
         Store the slice of fields represented by self.slice_array
         and also store the z index at which this slice should be
@@ -454,25 +496,32 @@ class LabSnapshot:
         ----------
         inv_dz_lab: float
             Inverse of the grid spacing in z, *in the lab frame*
+
+        iteration: int
+            The current iteration in the boosted frame simulation
         """
         # Find the index of the slice in the lab frame
-        if self.buffer_z_indices == []:
-            # No previous index: caculate it from the absolute z_lab
-            iz_lab = int( (self.current_z_lab - self.zmin_lab)*inv_dz_lab )
-        else:
-            # By construction, this index shoud be the previous index - 1
-            # Handling integers avoids unstable roundoff errors, when
-            # self.current_z_lab is very close to zmin_lab + iz_lab*dz_lab
-            iz_lab = self.buffer_z_indices[-1] - 1
+        # By construction, the output position moves by -dz_lab at each
+        # iteration, so the index is the index at iteration 0, minus the
+        # iteration. Handling integers avoids unstable roundoff errors, when
+        # self.current_z_lab is very close to zmin_lab + iz_lab*dz_lab,
+        # and gives the same index on all procs (i.e. when the output
+        # position moves to the next proc) and after the buffers are flushed
+        iz_lab = int( np.floor( (self.initial_z_lab - self.zmin_lab) \
+                                * inv_dz_lab ) ) - iteration
 
         # Store the array and the index
         self.buffer_z_indices.append( iz_lab )
         # Make a copy of the array if it is directly on the CPU
         if type(self.slice_array) is np.ndarray:
-            self.buffered_slices.append( self.slice_array.copy() )
+            slice_array = self.slice_array.copy()
         # or copy from the GPU
         else:
-            self.buffered_slices.append( self.slice_array.get() )
+            slice_array = self.slice_array.get()
+        # (The buffer moves the slices to a staging file
+        # if the memory budget of the snapshot is exceeded)
+        self.buffered_slices.append(
+            { 'fields': slice_array[np.newaxis] } )
 
     def compact_slices(self):
         """
@@ -511,7 +560,8 @@ class LabSnapshot:
         # Pack the different slices together
         # Reverse the order of the slices when stacking the array,
         # since the slices where registered for right to left
-        field_array = np.stack( self.buffered_slices[::-1], axis=-1 )
+        field_array = self.buffered_slices.get( 'fields' )
+        field_array = np.moveaxis( field_array[::-1], 0, -1 )
 
         # Get the first and last index in z
         # (Following Python conventions, iz_min is inclusive,
@@ -582,8 +632,13 @@ class SliceHandler:
         # and the corresponding interpolation shape factor
         dz = fld.interp[0].dz
         # Find the interpolation data in the z direction
+        # (In the first half cell of the local subdomain, iz is the index
+        # of the last guard cell: rounding towards zero would extrapolate)
         z_staggered_gridunits = ( z_boost - zmin_boost - 0.5*dz )/dz
-        iz = int( z_staggered_gridunits )
+        iz = int( np.floor( z_staggered_gridunits ) )
+        if comm is None:
+            # Without guard cells, extrapolate from the first cell
+            iz = max( iz, 0 )
         Sz = iz + 1 - z_staggered_gridunits
         # Add the guard cells to the index iz
         if comm is not None:
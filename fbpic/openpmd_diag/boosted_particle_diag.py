@@ -14,7 +14,11 @@ import os
 import math
 import numpy as np
 from scipy.constants import c, e
+from fbpic.utils.threading import nthreads, get_chunk_indices
 from .particle_diag import ParticleDiagnostic
+from .slice_buffer import SliceBuffer
+from .numba_methods import count_slice_particles_numba, \
+    extract_slice_particles_numba
 
 # Check if CUDA is available, then import CUDA functions
 from fbpic.utils.cuda import cuda_installed
@@ -41,7 +45,7 @@ class BackTransformedParticleDiagnostic(ParticleDiagnostic):
                  Ntot_snapshots_lab, gamma_boost, period, fldobject,
                  particle_data=["position", "momentum", "weighting"],
                  select=None, write_dir=None, species={"electrons": None},
-                 comm = None):
+                 comm = None, buffer_memory_budget=None):
         """
         Initialize diagnostics that retrieve the data in the lab frame,
         as a series of snapshot (one file per snapshot),
@@ -83,6 +87,15 @@ class BackTransformedParticleDiagnostic(ParticleDiagnostic):
         fldobject : a Fields object,
             The Fields object of the simulation, that is needed to
             extract some information about the grid
+
+        buffer_memory_budget: int or None, optional
+            Maximal number of bytes that each snapshot keeps in memory
+            (on each MPI rank) between two writes to disk. Beyond this
+            budget, the buffered slices are moved to staging files in
+            the subdirectory `staging` of `write_dir`, until they are
+            written to the openPMD files. This allows to use a long `period`
+            and many snapshots with a bounded memory footprint.
+            If None (default), all the slices are kept in memory.
         """
         # Do not leave write_dir as None, as this may conflict with
         # the default directory ('./diags') in which diagnostics in the
@@ -111,7 +124,8 @@ class BackTransformedParticleDiagnostic(ParticleDiagnostic):
                                     zmin_lab + v_lab*t_lab,
                                     zmax_lab + v_lab*t_lab,
                                     self.dt,
-                                    self.write_dir, i ,self.species_dict )
+                                    self.write_dir, i ,self.species_dict,
+                                    buffer_memory_budget, self.rank )
             self.snapshots.append(snapshot)
             # Initialize a corresponding empty file to store particles
             self.create_file_empty_slice(
@@ -156,7 +170,9 @@ class BackTransformedParticleDiagnostic(ParticleDiagnostic):
         # Extract the current time in the boosted frame
         time = iteration * self.dt
 
-        # Loop through the labsnapshots
+        # Loop through the labsnapshots and find the snapshots
+        # whose output plane is in the current local domain
+        active_snapshots = []
         for snapshot in self.snapshots:
 
             # Update the positions of the output slice of this snapshot
@@ -173,17 +189,32 @@ class BackTransformedParticleDiagnostic(ParticleDiagnostic):
                  (snapshot.current_z_boost < zmax_boost) and \
                  (snapshot.current_z_lab >= snapshot.zmin_lab) and \
                  (snapshot.current_z_lab < snapshot.zmax_lab) ):
-
-                # Loop through the particle species and register the
-                # data dictionaries in the snapshot objects (buffering)
-                for species_name in self.species_names_list:
-                    species = self.species_dict[species_name]
-                    # Extract the slice of particles
+                active_snapshots.append( snapshot )
+
+        if len(active_snapshots) == 0:
+            return
+
+        # Loop through the particle species and register the
+        # data dictionaries in the snapshot objects (buffering)
+        for species_name in self.species_names_list:
+            species = self.species_dict[species_name]
+            if species.use_cuda:
+                # GPU: extract the slice of each snapshot separately
+                for snapshot in active_snapshots:
                     slice_data_dict = self.particle_catcher.extract_slice(
                         species, snapshot.current_z_boost,
                         snapshot.prev_z_boost, time, self.select)
                     # Register new slice in the LabSnapshot
                     snapshot.register_slice( slice_data_dict, species_name )
+            else:
+                # CPU: extract the slices of all snapshots
+                # in a single pass over the particles
+                slice_data_dicts = self.particle_catcher.extract_slices(
+                    species, active_snapshots, time, self.select )
+                for snapshot, slice_data_dict in \
+                        zip( active_snapshots, slice_data_dicts ):
+                    # Register new slice in the LabSnapshot
+                    snapshot.register_slice( slice_data_dict, species_name )
 
     def flush_to_disk(self):
         """
@@ -217,7 +248,7 @@ class BackTransformedParticleDiagnostic(ParticleDiagnostic):
                     self.write_slices( particle_dict, species_name, snapshot )
 
                 # Erase the previous slices
-                snapshot.buffered_slices[species_name] = []
+                snapshot.buffered_slices[species_name].clear()
 
     def gather_particle_arrays( self, local_dict, quantities_in_file ):
         """
@@ -405,7 +436,8 @@ class LabSnapshot:
     in the lab frame (i.e. one given *time* in the lab frame)
     """
     def __init__( self, t_lab, zmin_lab, zmax_lab, dt,
-                  write_dir, i, species_dict ):
+                  write_dir, i, species_dict, buffer_memory_budget=None,
+                  rank=0 ):
         """
         Initialize a LabSnapshot
 
@@ -430,6 +462,15 @@ class LabSnapshot:
         species_dict: dict
             Contains all the species name of the species object
             (inherited from Warp)
+
+        buffer_memory_budget: int or None, optional
+            Maximal number of bytes that this snapshot keeps in memory
+            (shared between the species), before moving the buffered slices
+            to staging files on disk. If None, no staging files are used.
+
+        rank: int, optional
+            The rank of the MPI process (used in the name of the
+            staging files)
         """
         # Deduce the name of the filename where this snapshot writes
         self.filename = os.path.join( write_dir, 'hdf5/data%08d.h5' %i)
@@ -446,10 +487,15 @@ class LabSnapshot:
         self.current_z_lab = 0
         self.current_z_boost = 0
 
-        # Initialize empty dictionary to buffer the slices for each species
+        # Initialize empty buffers for the slices of each species
+        if buffer_memory_budget is not None:
+            buffer_memory_budget = buffer_memory_budget // len(species_dict)
         self.buffered_slices = {}
         for species in species_dict:
-            self.buffered_slices[species] = []
+            staging_prefix = os.path.join( write_dir, 'staging',
+                                'data%08d_proc%d_%s' %(i, rank, species) )
+            self.buffered_slices[species] = SliceBuffer(
+                staging_prefix, buffer_memory_budget )
 
     def update_current_output_positions( self, t_boost, inv_gamma, inv_beta ):
         """
@@ -490,7 +536,8 @@ class LabSnapshot:
         species: String, key of the species_dict
             Act as the key for the buffered_slices dictionary
         """
-        # Store the values
+        # Store the values (in memory, or in the staging files
+        # if the memory budget of the snapshot is exceeded)
         self.buffered_slices[species].append(slice_data_dict)
 
     def compact_slices( self, species, quantities_in_file ):
@@ -518,11 +565,10 @@ class LabSnapshot:
 
         # Loop through the particle quantities that will be written to file,
         # and compact the buffered arrays into a single array
-        if self.buffered_slices[species] != []:
+        if len( self.buffered_slices[species] ) != 0:
             for quantity in quantities_in_file:
-                buffered_arrays = [ slice_dict[quantity] \
-                            for slice_dict in self.buffered_slices[species] ]
-                particle_data_dict[quantity] = np.concatenate(buffered_arrays)
+                particle_data_dict[quantity] = \
+                    self.buffered_slices[species].get( quantity )
         else:
             for quantity in quantities_in_file:
                 if quantity == 'id':
@@ -621,6 +667,93 @@ class ParticleCatcher:
 
         return slice_data_dict
 
+    def extract_slices( self, species, snapshots, t, select=None ):
+        """
+        Extract the slices of particles of several snapshots at once, on
+        the CPU. This is equivalent to calling `extract_slice` for each
+        snapshot, but the particle arrays are scanned only once (with
+        numba prange), and the particles that crossed the output plane of
+        each snapshot are directly interpolated to the lab frame.
+
+        Parameters
+        ----------
+        species : A ParticleObject
+            Contains the particle attributes to output
+
+        snapshots : list of LabSnapshot objects
+            The snapshots whose output plane is in the local domain
+
+        t : float (s)
+            Current time of the simulation in the boosted frame
+
+        select : dict
+            A set of rules defined by the users in selecting the particles
+            (see `extract_slice`)
+
+        Returns
+        -------
+        slice_data_dicts : list of dictionaries of 1D float and integer arrays
+            For each snapshot, a dictionary that contains the particle data
+            of the slice, as returned by `extract_slice`
+        """
+        n_snapshots = len(snapshots)
+        current_z_boost = np.array(
+            [ snapshot.current_z_boost for snapshot in snapshots ] )
+        previous_z_boost = np.array(
+            [ snapshot.prev_z_boost for snapshot in snapshots ] )
+
+        # Count the particles of each slice, for each thread
+        ptcl_chunk_indices = get_chunk_indices( species.Ntot, nthreads )
+        n_slice = np.zeros( (nthreads, n_snapshots), dtype=np.int64 )
+        count_slice_particles_numba( species.z, species.uz,
+            species.inv_gamma, c, self.dt, current_z_boost, previous_z_boost,
+            nthreads, ptcl_chunk_indices, n_slice )
+
+        # Calculate where each thread writes the particles of each slice
+        # (the slices of the different snapshots are contiguous in memory)
+        n_per_snapshot = n_slice.sum( axis=0 )
+        snapshot_offsets = np.zeros( n_snapshots+1, dtype=np.int64 )
+        snapshot_offsets[1:] = np.cumsum( n_per_snapshot )
+        slice_offsets = snapshot_offsets[np.newaxis,:-1] \
+                        + np.cumsum( n_slice, axis=0 ) - n_slice
+
+        # Extract, interpolate and back-transform the particles
+        n_total = snapshot_offsets[-1]
+        slice_data = np.empty( (7, n_total), dtype=np.float64 )
+        slice_indices = np.empty( n_total, dtype=np.int64 )
+        extract_slice_particles_numba( species.x, species.y, species.z,
+            species.ux, species.uy, species.uz, species.inv_gamma, species.w,
+            c, self.dt, t, self.beta_boost, self.gamma_boost,
+            current_z_boost, previous_z_boost, nthreads, ptcl_chunk_indices,
+            slice_offsets, slice_data, slice_indices )
+
+        # Split the buffers into one dictionary per snapshot
+        slice_data_dicts = []
+        for i_snap in range( n_snapshots ):
+            start = snapshot_offsets[i_snap]
+            end = snapshot_offsets[i_snap+1]
+            slice_data_dict = {}
+            # (Copy the arrays, so that the buffered slices do not keep
+            # the buffers of all the snapshots in memory)
+            for i, quantity in enumerate(
+                    ['x', 'y', 'z', 'ux', 'uy', 'uz', 'w'] ):
+                slice_data_dict[quantity] = slice_data[i, start:end].copy()
+            # Optional integer quantities
+            indices = slice_indices[start:end]
+            if species.ionizer is not None:
+                slice_data_dict['charge'] = \
+                    species.ionizer.ionization_level[indices]
+            if species.tracker is not None:
+                slice_data_dict['id'] = species.tracker.id[indices]
+            # Apply the selection rules and convert to the openPMD standard
+            if (select is not None):
+                slice_data_dict = self.apply_selection(select, slice_data_dict)
+            slice_data_dict = self.apply_opmd_standard(
+                                        slice_data_dict, species )
+            slice_data_dicts.append( slice_data_dict )
+
+        return slice_data_dicts
+
     def get_particle_data( self, species, current_z_boost,
                            previous_z_boost, t ):
         """
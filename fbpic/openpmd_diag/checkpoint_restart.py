@@ -19,12 +19,16 @@ from fbpic.utils.cuda import cuda_installed
 if cuda_installed:
     import cupy
 
-def set_periodic_checkpoint( sim, period, checkpoint_dir='./checkpoints' ):
+def set_periodic_checkpoint( sim, period, checkpoint_dir='./checkpoints',
+                             checkpoint_format='openpmd', asynchronous=False,
+                             keep_last=None, walltime_limit=None,
+                             walltime_deadline=None, walltime_margin=300. ):
     """
     Set up periodic checkpoints of the simulation
 
-    The checkpoints are saved in openPMD format, in the specified
-    directory, with one subdirectory per process.
+    The checkpoints are saved in openPMD format (or in the native format,
+    see below), in the specified directory, with one subdirectory
+    per process.
     The E and B fields and particle information of each processor is saved.
 
     NB: Checkpoints are registered in the list `checkpoints` of the Simulation
@@ -43,7 +47,53 @@ def set_periodic_checkpoint( sim, period, checkpoint_dir='./checkpoints' ):
         The path to the directory in which the checkpoints are stored
         (When running a simulation with several MPI ranks, use the
         same path for all ranks.)
+
+    checkpoint_format: string, optional
+        Either 'openpmd' or 'native'. The native format stores the raw
+        arrays of each rank (including the fields in spectral space) as
+        memory-mappable binary files, which makes the restart much faster
+        (see `restart_from_checkpoint`).
+
+    asynchronous: bool, optional (native format only)
+        Whether to write the checkpoints in a background thread, from a
+        copy of the state of the simulation. Each checkpoint is written in
+        a temporary directory, which is renamed once it is complete.
+
+    keep_last: int or None, optional (native format only)
+        If not None, only the `keep_last` newest checkpoints are kept.
+        (Older checkpoints are deleted once a newer one is complete.)
+
+    walltime_limit: float (in seconds) or None, optional (native format only)
+        The duration of the job allocation, from the call to this function.
+        If not None, an additional checkpoint is written at the first
+        iteration that ends less than `walltime_margin` seconds before
+        this limit. (`period` can then be None.)
+
+    walltime_deadline: float, string or None, optional (native format only)
+        Alternative to `walltime_limit`: the end time of the job allocation,
+        in seconds since the epoch (see `time.time()`), or 'slurm' to use
+        the end time of the current SLURM job.
+
+    walltime_margin: float (in seconds), optional (native format only)
+        See `walltime_limit`
     """
+    if checkpoint_format == 'native':
+        from .native_checkpoint import NativeCheckpoint
+        sim.checkpoints.append( NativeCheckpoint( sim, period,
+            checkpoint_dir, asynchronous=asynchronous, keep_last=keep_last,
+            walltime_limit=walltime_limit,
+            walltime_deadline=walltime_deadline,
+            walltime_margin=walltime_margin ) )
+        return
+    elif checkpoint_format != 'openpmd':
+        raise ValueError(
+            'Unknown `checkpoint_format`: %s' %checkpoint_format )
+    if asynchronous or (keep_last is not None) or \
+        (walltime_limit is not None) or (walltime_deadline is not None):
+        raise ValueError('The arguments `asynchronous`, `keep_last`, '
+            '`walltime_limit` and `walltime_deadline` require '
+            '`checkpoint_format=\'native\'`.')
+
     # Only processor 0 creates a directory where checkpoints will be stored
     # Make sure that all processors wait until this directory is created
     # (Use the global MPI communicator instead of the `BoundaryCommunicator`
@@ -75,7 +125,8 @@ def set_periodic_checkpoint( sim, period, checkpoint_dir='./checkpoints' ):
             ParticleDiagnostic( period, particle_dict, write_dir=write_dir ) )
 
 def restart_from_checkpoint( sim, iteration=None,
-                            checkpoint_dir='./checkpoints' ):
+                            checkpoint_dir='./checkpoints',
+                            checkpoint_format='openpmd' ):
     """
     Fills the Simulation object `sim` with data saved in a checkpoint.
 
@@ -110,7 +161,19 @@ def restart_from_checkpoint( sim, iteration=None,
         The path to the directory that contains the checkpoints to be loaded.
         (When running a simulation with several MPI ranks, use the
         same path for all ranks.)
+
+    checkpoint_format: string, optional
+        Either 'openpmd' or 'native' (the format that was
+        used in `set_periodic_checkpoint`)
     """
+    if checkpoint_format == 'native':
+        from .native_checkpoint import restart_from_native_checkpoint
+        restart_from_native_checkpoint( sim, iteration, checkpoint_dir )
+        return
+    elif checkpoint_format != 'openpmd':
+        raise ValueError(
+            'Unknown `checkpoint_format`: %s' %checkpoint_format )
+
     # Try to import openPMD-viewer, version 1
     try:
         from openpmd_viewer import OpenPMDTimeSeries
@@ -325,6 +388,8 @@ def load_species( species, name, ts, iteration, comm, openpmd_viewer_version ):
     # Take into account the fact that the arrays are resized
     Ntot = len(species.w)
     species.Ntot = Ntot
+    # The cached shape factors are not valid anymore
+    species.shape_factor_cache = None
 
     # Check if the particles where tracked
     if "id" in ts.avail_record_components[name]:
@@ -350,6 +415,20 @@ def load_species( species, name, ts, iteration, comm, openpmd_viewer_version ):
     for attr in ['x', 'y', 'z', 'ux', 'uy', 'uz', 'w', 'inv_gamma' ]:
         assert getattr( species, attr ).dtype == np.float64
 
+    # Reallocate the auxiliary arrays of the species
+    reset_particle_buffers( species )
+
+def reset_particle_buffers( species ):
+    """
+    Reallocate the field arrays and sorting buffers of `species`, after
+    its particle arrays have been replaced by arrays of a different size
+
+    Parameters:
+    -----------
+    species: a Species object
+        The object whose particle arrays have been replaced
+    """
+    Ntot = species.Ntot
     # Field arrays
     species.Ez = np.zeros( Ntot )
     species.Ex = np.zeros( Ntot )
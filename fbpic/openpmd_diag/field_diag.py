@@ -6,6 +6,8 @@ This file defines the class FieldDiagnostic.
 """
 import os
 import numpy as np
+from fbpic.boundaries.boundary_communicator import get_region_block_range, \
+    extract_region_blocks
 from .generic_diag import OpenPMDDiagnostic
 
 class FieldDiagnostic(OpenPMDDiagnostic):
@@ -15,7 +17,12 @@ class FieldDiagnostic(OpenPMDDiagnostic):
 
     def __init__(self, period=None, fldobject=None, comm=None,
                  fieldtypes=["rho", "E", "B", "J"], write_dir=None,
-                 iteration_min=0, iteration_max=np.inf, dt_period=None ) :
+                 iteration_min=0, iteration_max=np.inf, dt_period=None,
+                 chunks=None, compression=None, compression_opts=None,
+                 shuffle=False, precision=None, zmin_output=None,
+                 zmax_output=None, rmax_output=None, region_frame='lab',
+                 decimation=(1, 1), decimation_method='stride',
+                 modes=None ) :
         """
         Initialize the field diagnostic.
 
@@ -53,6 +60,45 @@ class FieldDiagnostic(OpenPMDDiagnostic):
         iteration_min, iteration_max: ints
             The iterations between which data should be written
             (`iteration_min` is inclusive, `iteration_max` is exclusive)
+
+        chunks, compression, compression_opts, shuffle : optional
+            The HDF5 storage options of the datasets: chunk shape
+            (True or a tuple of 3 ints, along the modes, r and z),
+            compression filter (e.g. "gzip", "lzf") and its options, and
+            whether to use the shuffle filter.
+            Default: contiguous, uncompressed datasets.
+
+        precision : None, "float32" or int, optional
+            Whether to store the fields in single precision ("float32"),
+            or to round their mantissa to a given number of bits (int).
+            Default: None (double precision)
+
+        zmin_output, zmax_output, rmax_output : floats (meters), optional
+            If not None, only the fields in the region between `zmin_output`
+            and `zmax_output` along z, and below `rmax_output` along r,
+            are gathered and written (rounded outwards to the nearest cells).
+
+        region_frame : string, optional
+            Either 'lab' (`zmin_output` and `zmax_output` are positions
+            in the simulation box) or 'window' (they are positions
+            relative to the moving window, i.e. the region moves along
+            with the window; for instance, at the first iteration the two
+            definitions coincide)
+
+        decimation : tuple of 2 ints, optional
+            The decimation factors along z and r (e.g. (4, 2) writes one
+            value out of 4 cells along z and out of 2 cells along r)
+
+        decimation_method : string, optional
+            Either 'stride' (write the value at the middle cell of each
+            block of decimated cells) or 'average' (write the average over
+            each block)
+
+        modes : list of ints, optional
+            The azimuthal modes to be written. The other modes (below the
+            highest requested mode) are written as zeros, so that the
+            output still follows the openPMD thetaMode convention.
+            Default: all modes are written
         """
         # Check input
         if fldobject is None:
@@ -62,13 +108,39 @@ class FieldDiagnostic(OpenPMDDiagnostic):
         # General setup
         OpenPMDDiagnostic.__init__(self, period, comm, write_dir,
                             iteration_min, iteration_max,
-                            dt_period=dt_period, dt_sim=fldobject.dt )
+                            dt_period=dt_period, dt_sim=fldobject.dt,
+                            chunks=chunks, compression=compression,
+                            compression_opts=compression_opts,
+                            shuffle=shuffle, precision=precision )
 
         # Register the arguments
         self.fld = fldobject
         self.fieldtypes = fieldtypes
         self.coords = ['r', 't', 'z']
 
+        # Register the output region and decimation
+        if region_frame not in ['lab', 'window']:
+            raise ValueError("Invalid `region_frame`: %s" %region_frame)
+        if decimation_method not in ['stride', 'average']:
+            raise ValueError(
+                "Invalid `decimation_method`: %s" %decimation_method)
+        self.zmin_output = zmin_output
+        self.zmax_output = zmax_output
+        self.rmax_output = rmax_output
+        self.region_frame = region_frame
+        self.decimation = tuple( int(n) for n in decimation )
+        self.decimation_method = decimation_method
+        # Position of the window (used when region_frame is 'window')
+        self.initial_zmin = self.get_zmin_Nz_Nr()[0]
+        # Modes to be written
+        if modes is None:
+            modes = range( self.fld.Nm )
+        self.modes = sorted( set( modes ) )
+        if (len(self.modes) == 0) or (self.modes[0] < 0) or \
+            (self.modes[-1] >= self.fld.Nm):
+            raise ValueError("Invalid `modes`: %s" %modes)
+        self.Nm_output = self.modes[-1] + 1
+
     def write_hdf5( self, iteration ):
         """
         Write an HDF5 file that complies with the OpenPMD standard
@@ -101,26 +173,13 @@ class FieldDiagnostic(OpenPMDDiagnostic):
         # Extract information needed for the openPMD attributes
         dt = self.fld.dt
         time = iteration * dt
-        dz = self.fld.interp[0].dz
-        if self.comm is None:
-            # No communicator: dump all the present subdomain
-            # (including damp cells and guard cells)
-            zmin = self.fld.interp[0].zmin
-            Nz = self.fld.interp[0].Nz
-            Nr = self.fld.interp[0].Nr
-        else:
-            # Communicator present: only dump physical cells
-            zmin, _ = self.comm.get_zmin_zmax(
-                    local=False, with_damp=False, with_guard=False )
-            Nz, _ = self.comm.get_Nz_and_iz(
-                    local=False, with_damp=False, with_guard=False )
-            Nr = self.comm.get_Nr( with_damp=False )
+        Nr, Nz, zmin, dr, dz, position = self.get_output_region()
 
         # Create the file with these attributes
         filename = "data%08d.h5" %iteration
         fullpath = os.path.join( self.write_dir, "hdf5", filename )
-        self.create_file_empty_meshes(
-            fullpath, iteration, time, Nr, Nz, zmin, dz, dt )
+        self.create_file_empty_meshes( fullpath, iteration, time,
+                                       Nr, Nz, zmin, dz, dt, dr, position )
 
         # Open the file again, and get the field path
         f = self.open_file( fullpath )
@@ -156,6 +215,84 @@ class FieldDiagnostic(OpenPMDDiagnostic):
         if self.fld.use_cuda :
             self.fld.send_fields_to_gpu()
 
+    def get_zmin_Nz_Nr( self ):
+        """
+        Return the position of the left end, and the number of cells along
+        z and r, of the full grid that this diagnostic can write
+        """
+        if self.comm is None:
+            # No communicator: dump all the present subdomain
+            # (including damp cells and guard cells)
+            zmin = self.fld.interp[0].zmin
+            Nz = self.fld.interp[0].Nz
+            Nr = self.fld.interp[0].Nr
+        else:
+            # Communicator present: only dump physical cells
+            zmin, _ = self.comm.get_zmin_zmax(
+                    local=False, with_damp=False, with_guard=False )
+            Nz, _ = self.comm.get_Nz_and_iz(
+                    local=False, with_damp=False, with_guard=False )
+            Nr = self.comm.get_Nr( with_damp=False )
+        return( zmin, Nz, Nr )
+
+    def get_output_region( self ):
+        """
+        Determine the cells to be written at the current iteration
+        (registered in `self.output_region`, and used by `get_dataset`)
+        and return the properties of the corresponding output grid
+
+        Returns
+        -------
+        Nr, Nz: ints
+            The number of points of the output grid along r and z
+
+        zmin: float (meters)
+            The position of the left end of the output grid
+
+        dr, dz: floats (meters)
+            The spacing of the output grid
+
+        position: list of 2 floats
+            The position of the points within the cells of the output grid
+            (in units of the spacing, along r and z)
+        """
+        zmin, Nz, Nr = self.get_zmin_Nz_Nr()
+        dz = self.fld.interp[0].dz
+        dr = self.fld.interp[0].dr
+        nz, nr = self.decimation
+
+        # Find the cells of the region along z
+        if self.region_frame == 'window':
+            z_shift = zmin - self.initial_zmin
+        else:
+            z_shift = 0.
+        iz_min = 0
+        iz_max = Nz
+        # (The small tolerance avoids that round-off errors on the position
+        # of the moving window change the number of cells)
+        if self.zmin_output is not None:
+            iz_min = int( np.floor(
+                (self.zmin_output + z_shift - zmin)/dz + 1.e-6 ) )
+            iz_min = min( max( iz_min, 0 ), Nz )
+        if self.zmax_output is not None:
+            iz_max = int( np.ceil(
+                (self.zmax_output + z_shift - zmin)/dz - 1.e-6 ) )
+            iz_max = min( max( iz_max, iz_min ), Nz )
+        # Find the cells of the region along r
+        Nr_region = Nr
+        if self.rmax_output is not None:
+            Nr_region = int( np.ceil( self.rmax_output/dr - 1.e-6 ) )
+            Nr_region = min( max( Nr_region, nr ), Nr )
+        self.output_region = ( iz_min, iz_max, Nr_region )
+
+        # Properties of the decimated grid
+        if self.decimation_method == 'stride':
+            position = [ (nr//2 + 0.5)/nr, (nz//2 + 0.5)/nz ]
+        else:
+            position = [ 0.5, 0.5 ]
+        return( Nr_region//nr, (iz_max-iz_min)//nz, zmin + iz_min*dz,
+                nr*dr, nz*dz, position )
+
     # Writing methods
     # ---------------
     def write_dataset( self, field_grp, path, quantity ) :
@@ -180,25 +317,26 @@ class FieldDiagnostic(OpenPMDDiagnostic):
         else:
             dset = None
 
-        # Write the mode 0 : only the real part is non-zero
-        mode0 = self.get_dataset( quantity, 0 )
-        if self.rank == 0:
-            mode0 = mode0.T
-            dset[0,:,:] = mode0[:,:].real
-        # Write the higher modes
-        # There is a factor 2 here so as to comply with the convention in
-        # Lifschitz et al., which is also the convention adopted in Warp Circ
-        for m in range(1,self.fld.Nm):
+        for m in self.modes:
             mode = self.get_dataset( quantity, m )
             if self.rank == 0:
                 mode = mode.T
-                dset[2*m-1,:,:] = 2*mode[:,:].real
-                dset[2*m,:,:] = 2*mode[:,:].imag
+                if m == 0:
+                    # Write the mode 0 : only the real part is non-zero
+                    dset[0,:,:] = self.apply_precision( mode[:,:].real )
+                else:
+                    # Write the higher modes
+                    # There is a factor 2 here so as to comply with the
+                    # convention in Lifschitz et al., which is also the
+                    # convention adopted in Warp Circ
+                    dset[2*m-1,:,:] = self.apply_precision( 2*mode[:,:].real )
+                    dset[2*m,:,:] = self.apply_precision( 2*mode[:,:].imag )
+        # (The modes that are not in self.modes keep the fill value 0)
 
     def get_dataset( self, quantity, m ):
         """
-        Get the field `quantity` in the mode `m`
-        Gathers it on the first proc, in MPI mode
+        Get the field `quantity` in the mode `m`, in the output region
+        (see `get_output_region`). Gathers it on the first proc, in MPI mode
 
         Parameters
         ----------
@@ -212,11 +350,20 @@ class FieldDiagnostic(OpenPMDDiagnostic):
         # Get the data on each individual proc
         data_one_proc = getattr( self.fld.interp[m], quantity )
 
-        # Gather the data
+        # Gather the data of the output region
+        iz_min, iz_max, Nr_region = self.output_region
+        nz, nr = self.decimation
         if self.comm is not None:
-            data_all_proc = self.comm.gather_grid_array( data_one_proc )
+            data_all_proc = self.comm.gather_grid_region( data_one_proc,
+                iz_min, iz_max, Nr_region, nz, nr, self.decimation_method )
         else:
-            data_all_proc = data_one_proc
+            N_blocks = (iz_max - iz_min)//nz
+            k_start, k_end = get_region_block_range( 0,
+                data_one_proc.shape[0], iz_min, N_blocks, nz,
+                self.decimation_method )
+            data_all_proc = extract_region_blocks( data_one_proc, 0,
+                k_start, k_end, iz_min, nz, nr, Nr_region//nr,
+                self.decimation_method )
 
         return( data_all_proc )
 
@@ -224,7 +371,8 @@ class FieldDiagnostic(OpenPMDDiagnostic):
     # ---------------------
 
     def create_file_empty_meshes( self, fullpath, iteration,
-                                   time, Nr, Nz, zmin, dz, dt ):
+                                   time, Nr, Nz, zmin, dz, dt,
+                                   dr=None, position=None ):
         """
         Create an openPMD file with empty meshes and setup all its attributes
 
@@ -250,10 +398,19 @@ class FieldDiagnostic(OpenPMDDiagnostic):
 
         dt: float (seconds)
             The timestep of the simulation
+
+        dr: float (meters), optional
+            The resolution in r of this diagnostic
+            (Default: the resolution of the simulation grid)
+
+        position: list of 2 floats, optional
+            The position of the data points within the cells (along r and z)
+            (Default: at the center of the cells)
         """
         # Determine the shape of the datasets that will be written
         # First write real part mode 0, then imaginary part of higher modes
-        data_shape = ( 2*self.fld.Nm - 1, Nr, Nz )
+        data_shape = ( 2*self.Nm_output - 1, Nr, Nz )
+        dset_options = self.get_dataset_options( data_shape )
 
         # Create the file
         f = self.open_file( fullpath )
@@ -281,10 +438,12 @@ class FieldDiagnostic(OpenPMDDiagnostic):
                 if fieldtype.startswith("rho") or fieldtype.endswith("_pml"):
                     # Setup the dataset
                     dset = field_grp.require_dataset(
-                        fieldtype, data_shape, dtype='f8')
-                    self.setup_openpmd_mesh_component( dset, fieldtype )
+                        fieldtype, data_shape, **dset_options )
+                    self.setup_openpmd_mesh_component(
+                        dset, fieldtype, position )
                     # Setup the record to which it belongs
-                    self.setup_openpmd_mesh_record( dset, fieldtype, dz, zmin )
+                    self.setup_openpmd_mesh_record(
+                        dset, fieldtype, dz, zmin, dr )
 
                 # Vector field
                 elif fieldtype in ["E", "B", "J"]:
@@ -293,11 +452,12 @@ class FieldDiagnostic(OpenPMDDiagnostic):
                         quantity = "%s%s" %(fieldtype, coord)
                         path = "%s/%s" %(fieldtype, coord)
                         dset = field_grp.require_dataset(
-                            path, data_shape, dtype='f8')
-                        self.setup_openpmd_mesh_component( dset, quantity )
+                            path, data_shape, **dset_options )
+                        self.setup_openpmd_mesh_component(
+                            dset, quantity, position )
                     # Setup the record to which they belong
                     self.setup_openpmd_mesh_record(
-                        field_grp[fieldtype], fieldtype, dz, zmin )
+                        field_grp[fieldtype], fieldtype, dz, zmin, dr )
 
                 # Unknown field
                 else:
@@ -333,7 +493,7 @@ class FieldDiagnostic(OpenPMDDiagnostic):
         dset.attrs["chargeCorrection"] = np.string_("spectral")
         dset.attrs["chargeCorrectionParameters"] = np.string_("period=1")
 
-    def setup_openpmd_mesh_record( self, dset, quantity, dz, zmin ) :
+    def setup_openpmd_mesh_record( self, dset, quantity, dz, zmin, dr=None ) :
         """
         Sets the attributes that are specific to a mesh record
 
@@ -349,16 +509,22 @@ class FieldDiagnostic(OpenPMDDiagnostic):
 
         zmin: float (meters)
             The position of the left end of the grid
+
+        dr: float (meters), optional
+            The resolution in r of this diagnostic
+            (Default: the resolution of the simulation grid)
         """
+        if dr is None:
+            dr = self.fld.interp[0].dr
+
         # Generic record attributes
         self.setup_openpmd_record( dset, quantity )
 
         # Geometry parameters
         dset.attrs['geometry'] = np.string_("thetaMode")
         dset.attrs['geometryParameters'] = \
-            np.string_("m={:d};imag=+".format(self.fld.Nm))
-        dset.attrs['gridSpacing'] = np.array([
-                self.fld.interp[0].dr, dz ])
+            np.string_("m={:d};imag=+".format(self.Nm_output))
+        dset.attrs['gridSpacing'] = np.array([ dr, dz ])
         dset.attrs["gridGlobalOffset"] = np.array([
             self.fld.interp[0].rmin, zmin ])
         dset.attrs['axisLabels'] = np.array([ b'r', b'z' ])
@@ -368,7 +534,7 @@ class FieldDiagnostic(OpenPMDDiagnostic):
         dset.attrs["gridUnitSI"] = 1.
         dset.attrs["fieldSmoothing"] = np.string_("none")
 
-    def setup_openpmd_mesh_component( self, dset, quantity ) :
+    def setup_openpmd_mesh_component( self, dset, quantity, position=None ) :
         """
         Set up the attributes of a mesh component
 
@@ -378,9 +544,15 @@ class FieldDiagnostic(OpenPMDDiagnostic):
 
         quantity : string
             The field that is being written
+
+        position: list of 2 floats, optional
+            The position of the data points within the cells (along r and z)
+            (Default: at the center of the cells)
         """
         # Generic setup of the component
         self.setup_openpmd_component( dset )
 
         # Field positions
-        dset.attrs["position"] = np.array([0.5, 0.5])
+        if position is None:
+            position = [0.5, 0.5]
+        dset.attrs["position"] = np.array( position )
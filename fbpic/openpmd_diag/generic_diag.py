@@ -25,7 +25,8 @@ class OpenPMDDiagnostic(object) :
 
     def __init__(self, period, comm, write_dir=None,
                 iteration_min=0, iteration_max=np.inf,
-                dt_period=None, dt_sim=None ):
+                dt_period=None, dt_sim=None, chunks=None, compression=None,
+                compression_opts=None, shuffle=False, precision=None ):
         """
         General setup of the diagnostic
 
@@ -58,6 +59,21 @@ class OpenPMDDiagnostic(object) :
         dt_sim : float (in seconds), optional
             The timestep of the simulation.
             Only needed if `dt_period` is not None.
+
+        chunks, compression, compression_opts, shuffle : optional
+            The HDF5 storage options of the datasets (passed to
+            `h5py.Group.create_dataset`). `chunks` can be True (automatic
+            chunking) or a tuple (which is truncated to the shape of each
+            dataset). `compression` can be e.g. "gzip", "lzf" or the
+            number of any HDF5 filter available to h5py.
+            Default: contiguous, uncompressed datasets.
+
+        precision : None, "float32" or int, optional
+            If "float32", the floating-point data is stored in single
+            precision. If an int `n` (between 1 and 52), the mantissa of the
+            double precision data is rounded to `n` bits (relative error
+            below 2**-(n+1)), which makes it much more compressible.
+            Default: None (data is stored in double precision, unchanged).
         """
         # Get the rank of this processor
         if comm is not None :
@@ -82,6 +98,21 @@ class OpenPMDDiagnostic(object) :
         self.iteration_min = iteration_min
         self.iteration_max = iteration_max
         self.comm = comm
+        # Whether this diagnostic already wrote to its time-series file
+        # (only used by the reduced diagnostics)
+        self.time_series_opened = False
+
+        # Register the HDF5 storage options
+        # (`bool` is a subclass of `int`, and is rejected explicitly)
+        if isinstance(precision, (bool, np.bool_)) or not ( \
+            (precision is None) or (precision == "float32") or \
+            (isinstance(precision, (int, np.integer)) and 1<=precision<=52) ):
+            raise ValueError("Invalid `precision`: %s" %precision)
+        self.chunks = chunks
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.shuffle = shuffle
+        self.precision = precision
 
         # Get the directory in which to write the data
         if write_dir is None:
@@ -121,6 +152,172 @@ class OpenPMDDiagnostic(object) :
         return(f)
 
 
+    def get_dataset_options( self, shape, dtype='f8' ):
+        """
+        Return the keyword arguments of `h5py.Group.create_dataset`
+        that correspond to the storage options of this diagnostic
+
+        Parameters
+        ----------
+        shape: tuple of ints
+            The shape of the dataset to be created
+
+        dtype: string
+            The type of the data (only the floating-point data is affected
+            by `precision`)
+
+        Returns
+        -------
+        A dictionary of keyword arguments (including `dtype`)
+        """
+        options = {}
+        if dtype == 'f8' and self.precision == "float32":
+            options['dtype'] = 'f4'
+        else:
+            options['dtype'] = dtype
+        # Chunked storage is not possible for empty datasets
+        if np.prod( shape ) == 0:
+            return( options )
+        if self.chunks is not None:
+            if self.chunks is True:
+                options['chunks'] = True
+            else:
+                if len(self.chunks) != len(shape):
+                    raise ValueError("`chunks` should have %d elements "
+                        "for the datasets of this diagnostic." %len(shape))
+                # Chunks cannot be larger than the dataset
+                options['chunks'] = tuple( max(1, min(c, n))
+                                for c, n in zip(self.chunks, shape) )
+        if self.compression is not None:
+            options['compression'] = self.compression
+            options['compression_opts'] = self.compression_opts
+        if self.shuffle:
+            options['shuffle'] = True
+        return( options )
+
+    def apply_precision( self, array ):
+        """
+        Round the mantissa of the floating-point `array` to `self.precision`
+        bits, when `self.precision` is an integer (the rounding to single
+        precision is done by h5py when writing to a float32 dataset).
+
+        Parameter
+        ---------
+        array: ndarray
+            The data to be written
+
+        Returns
+        -------
+        The rounded array (may be the same object as `array`)
+        """
+        if isinstance( self.precision, (int, np.integer) ) \
+                and array.dtype == np.float64 and self.precision < 52:
+            n_dropped = 52 - int(self.precision)
+            bits = np.ascontiguousarray( array ).view( np.uint64 )
+            # Round to nearest, then clear the dropped bits
+            # (a carry into the exponent gives the correctly rounded value)
+            half = np.uint64( 1 << (n_dropped - 1) )
+            mask = ~np.uint64( (1 << n_dropped) - 1 )
+            finite = np.isfinite( array )
+            rounded = ( (bits + half) & mask ).view( np.float64 )
+            array = np.where( finite, rounded, array )
+        return( array )
+
+    def open_time_series_file( self, filename, iteration ):
+        """
+        Open a time-series file (used by the reduced diagnostics), in
+        order to append data to it.
+
+        At the first output of this diagnostic, the file is truncated,
+        unless the simulation was restarted from a checkpoint. A restart
+        is detected when the first output occurs after the first output
+        iteration of a fresh simulation (i.e. the first multiple of
+        `period` above `iteration_min`). In this case, the existing data
+        is kept, except for the outputs at or after the current iteration
+        (which were written by the previous run, after its checkpoint).
+
+        Parameters
+        ----------
+        filename : string
+            The path to the time-series file
+
+        iteration : int
+            The current iteration number of the simulation
+
+        Returns
+        -------
+        An h5py.File object
+        """
+        if self.time_series_opened or not os.path.exists( filename ):
+            self.time_series_opened = True
+            return( h5py.File( filename, mode='a' ) )
+        self.time_series_opened = True
+
+        first_iteration = self.period * \
+            int( np.ceil( max( self.iteration_min, 0 ) / self.period ) )
+        if iteration <= first_iteration:
+            # Fresh simulation: discard the data of previous simulations
+            return( h5py.File( filename, mode='w' ) )
+
+        # Restarted simulation: discard the outputs after the checkpoint
+        f = h5py.File( filename, mode='a' )
+        groups = [ f ]
+        f.visititems( lambda name, obj: groups.append( obj ) \
+                      if isinstance( obj, h5py.Group ) else None )
+        for grp in groups:
+            if 'iteration' not in grp or \
+                    not isinstance( grp['iteration'], h5py.Dataset ):
+                continue
+            n_kept = int( np.sum( grp['iteration'][:] < iteration ) )
+            datasets = []
+            grp.visititems( lambda name, obj: datasets.append( obj ) \
+                            if isinstance( obj, h5py.Dataset ) else None )
+            for dset in datasets:
+                if dset.shape[0] > n_kept:
+                    dset.resize( n_kept, axis=0 )
+        return( f )
+
+    def append_time_series_data( self, grp, data ):
+        """
+        Append one value to each of the (resizable) datasets of a
+        time-series file, and create the datasets if needed.
+        (Used by the reduced diagnostics.)
+
+        Parameters
+        ----------
+        grp : an h5py.Group object
+
+        data : dict
+            The path of each dataset in `grp`, and the value to be appended
+            (a scalar, or an array which has the same shape at each output)
+        """
+        for path, value in data.items():
+            value = np.asarray( value )
+            if path not in grp:
+                dset = grp.create_dataset( path, (0,) + value.shape,
+                    maxshape=(None,) + value.shape, dtype=value.dtype,
+                    chunks=(64,) + value.shape )
+                self.setup_dataset_attributes( dset, path )
+            else:
+                dset = grp[path]
+            n = dset.shape[0]
+            dset.resize( n+1, axis=0 )
+            dset[n] = value
+
+    def setup_dataset_attributes( self, dset, path ):
+        """
+        Set the attributes of a newly-created time-series dataset
+        (Overridden by the reduced diagnostics, when needed)
+
+        Parameters
+        ----------
+        dset : an h5py.Dataset object
+
+        path : string
+            The path of the dataset, in its group
+        """
+        pass
+
     def write( self, iteration ) :
         """
         Check if the data should be written at this iteration
@@ -0,0 +1,546 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This file is part of the Fourier-Bessel Particle-In-Cell code (FB-PIC)
+
+It defines the native checkpoint format, in which each MPI rank saves
+the raw arrays of the simulation (including the fields in spectral space)
+as memory-mappable .npy files, together with a manifest.
+"""
+import os, re, json, time, shutil, threading, subprocess
+import numpy as np
+from fbpic.utils.mpi import comm, MPI
+from fbpic.boundaries.moving_window import MovingWindow
+from .checkpoint_restart import reset_particle_buffers
+
+# Version of the native checkpoint format
+format_version = 1
+# Fields saved for each mode
+interp_fields = [ 'Er', 'Et', 'Ez', 'Br', 'Bt', 'Bz' ]
+interp_pml_fields = [ 'Er_pml', 'Et_pml', 'Br_pml', 'Bt_pml' ]
+spect_fields = [ 'Ep', 'Em', 'Ez', 'Bp', 'Bm', 'Bz' ]
+spect_pml_fields = [ 'Ep_pml', 'Em_pml', 'Bp_pml', 'Bm_pml' ]
+# Arrays saved for each species
+particle_arrays = [ 'x', 'y', 'z', 'ux', 'uy', 'uz', 'w', 'inv_gamma' ]
+
+class NativeCheckpoint(object):
+    """
+    Class that writes checkpoints of the simulation in the native format.
+    Each checkpoint is written in the directory
+    `checkpoint_dir/proc<rank>/native<iteration>`.
+
+    The checkpoints are first written in a temporary directory, which is
+    renamed once the checkpoint is complete. Optionally, the writing can
+    be done in a background thread (from a copy of the simulation state),
+    and only the newest checkpoints can be kept.
+    """
+
+    def __init__( self, sim, period, checkpoint_dir='./checkpoints',
+                  asynchronous=False, keep_last=None, walltime_limit=None,
+                  walltime_deadline=None, walltime_margin=300. ):
+        """
+        Initialize the checkpoints
+
+        Parameters
+        ----------
+        sim: a Simulation object
+           The simulation that is to be saved in checkpoints
+
+        period: integer or None
+           The number of PIC iteration between each checkpoint.
+           If None, checkpoints are only triggered by `walltime_limit`.
+
+        checkpoint_dir: string, optional
+            The path to the directory in which the checkpoints are stored
+            (When running a simulation with several MPI ranks, use the
+            same path for all ranks.)
+
+        asynchronous: bool, optional
+            Whether to write the checkpoints in a background thread.
+            In this case, the state of the simulation is first copied
+            (on the CPU) and the simulation continues while it is written.
+            (This requires enough memory for one copy of the state.)
+
+        keep_last: int or None, optional
+            If not None, only the `keep_last` newest complete checkpoints
+            are kept; older checkpoints are deleted once a newer checkpoint
+            is complete on all MPI ranks.
+
+        walltime_limit: float (in seconds) or None, optional
+            The duration of the job allocation, counted from the creation
+            of this object. If not None, a checkpoint is written (once)
+            at the first iteration that ends less than `walltime_margin`
+            before this limit.
+
+        walltime_deadline: float, string or None, optional
+            The end time of the job allocation, as an absolute time (in
+            seconds since the epoch, as returned by `time.time()`), or
+            'slurm' to use the end time of the current SLURM job.
+            This is an alternative to `walltime_limit`, which does not
+            depend on the time at which this object is created.
+
+        walltime_margin: float (in seconds), optional
+            See `walltime_limit`
+        """
+        if (walltime_limit is not None) and (walltime_deadline is not None):
+            raise ValueError('You need to pass either `walltime_limit` or '
+                '`walltime_deadline`, but not both.')
+        if (period is None) and (walltime_limit is None) \
+                and (walltime_deadline is None):
+            raise ValueError('You need to pass either `period`, '
+                '`walltime_limit` or `walltime_deadline`.')
+        if (keep_last is not None) and (keep_last < 1):
+            raise ValueError('`keep_last` should be at least 1.')
+        self.sim = sim
+        self.period = period
+        self.asynchronous = asynchronous
+        self.keep_last = keep_last
+        self.write_dir = os.path.join( checkpoint_dir, 'proc%d' %comm.rank )
+        if not os.path.exists( self.write_dir ):
+            os.makedirs( self.write_dir )
+
+        # Wall-clock trigger
+        if walltime_deadline == 'slurm':
+            walltime_deadline = get_slurm_end_time()
+        if walltime_limit is not None:
+            self.walltime_deadline = \
+                time.time() + walltime_limit - walltime_margin
+        elif walltime_deadline is not None:
+            self.walltime_deadline = walltime_deadline - walltime_margin
+        else:
+            self.walltime_deadline = None
+
+        # Background thread that writes the current checkpoint
+        self.thread = None
+        self.thread_error = None
+
+    def write( self, iteration ):
+        """
+        Check if a checkpoint should be written at this iteration
+        and if yes, write it.
+
+        Parameter
+        ---------
+        iteration : int
+            The current iteration number of the simulation.
+        """
+        if not self.is_triggered( iteration ):
+            return
+
+        # Make sure that the previous checkpoint is complete on all ranks,
+        # and delete the older checkpoints
+        self.wait()
+
+        # Copy the state of the simulation, and write it
+        arrays, manifest = get_simulation_state( self.sim )
+        if self.asynchronous:
+            self.thread = threading.Thread(
+                target=self.write_in_background,
+                args=(iteration, arrays, manifest) )
+            self.thread.start()
+        else:
+            self.write_checkpoint( iteration, arrays, manifest )
+            self.wait()
+
+    def is_triggered( self, iteration ):
+        """
+        Return whether a checkpoint should be written at this iteration
+        (The decision is identical on all MPI ranks)
+
+        Parameter
+        ---------
+        iteration : int
+            The current iteration number of the simulation.
+        """
+        triggered = (self.period is not None) and \
+                    (iteration % self.period == 0)
+        if self.walltime_deadline is not None:
+            walltime_triggered = ( time.time() > self.walltime_deadline )
+            # Use the decision of the first rank (clocks may differ)
+            if comm.size > 1:
+                walltime_triggered = comm.bcast( walltime_triggered, root=0 )
+            if walltime_triggered:
+                # Only trigger a single checkpoint
+                self.walltime_deadline = None
+                triggered = True
+        return( triggered )
+
+    def write_checkpoint( self, iteration, arrays, manifest ):
+        """
+        Write a checkpoint in a temporary directory, and rename it
+        (atomically) once it is complete
+
+        Parameters
+        ----------
+        iteration : int
+            The iteration of the checkpoint
+
+        arrays, manifest : dicts
+            The state of the simulation (see `get_simulation_state`)
+        """
+        path = os.path.join( self.write_dir, 'native%08d' %iteration )
+        tmp_path = path + '.tmp'
+        if os.path.exists( tmp_path ):
+            shutil.rmtree( tmp_path )
+        write_native_checkpoint( tmp_path, arrays, manifest )
+        if os.path.exists( path ):
+            shutil.rmtree( path )
+        os.rename( tmp_path, path )
+
+    def write_in_background( self, iteration, arrays, manifest ):
+        """
+        Write a checkpoint, and record any error (to be raised
+        in the main thread, by `wait`)
+        """
+        try:
+            self.write_checkpoint( iteration, arrays, manifest )
+        except Exception as error:
+            self.thread_error = error
+
+    def wait( self ):
+        """
+        Wait until the checkpoint that is being written in the background
+        (if any) is complete on all ranks, and then delete the older
+        checkpoints (if `keep_last` is not None).
+
+        This is automatically called before writing a new checkpoint,
+        and at the end of `Simulation.step` (so that the errors of the
+        last checkpoint are raised, and the older checkpoints are deleted).
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if comm.size > 1:
+            comm.barrier()
+        if self.thread_error is not None:
+            error = self.thread_error
+            self.thread_error = None
+            raise error
+        self.prune()
+
+    def prune( self ):
+        """
+        Delete the complete checkpoints of this rank, except
+        the `keep_last` newest ones.
+        (Assumes that these checkpoints are complete on all ranks.)
+        """
+        if self.keep_last is None:
+            return
+        iterations = get_native_checkpoint_iterations( self.write_dir )
+        for iteration in iterations[ :-self.keep_last ]:
+            shutil.rmtree( os.path.join( self.write_dir,
+                                         'native%08d' %iteration ) )
+
+def get_slurm_end_time():
+    """
+    Return the end time of the current SLURM job (in seconds since the
+    epoch), as given by `squeue`. (The decision to write a checkpoint
+    is taken by the first rank, so only its value is used.)
+    """
+    job_id = os.environ.get( 'SLURM_JOB_ID' )
+    if job_id is None:
+        raise RuntimeError('`walltime_deadline=\'slurm\'` requires '
+                           'to run within a SLURM job.')
+    end_time = subprocess.check_output(
+        [ 'squeue', '-h', '-j', job_id, '-o', '%e' ] ).decode().strip()
+    # The end time is in local time, e.g. 2024-01-31T23:59:59
+    return( time.mktime( time.strptime( end_time, '%Y-%m-%dT%H:%M:%S' ) ) )
+
+def get_simulation_state( sim ):
+    """
+    Return the state of the simulation on the local rank
+
+    Parameters
+    ----------
+    sim: a Simulation object
+
+    Returns
+    -------
+    arrays: dict
+        The arrays to be saved (copied to the CPU, if needed) with their names
+
+    manifest: dict
+        The scalar state of the simulation (JSON-serializable)
+    """
+    arrays = {}
+    fld = sim.fld
+
+    # Fields: interpolation grid (used for the gathering at the first
+    # iteration after the restart) and spectral grid (used for the push)
+    grids = []
+    for m in range( fld.Nm ):
+        interp = fld.interp[m]
+        spect = fld.spect[m]
+        fields = [ ('interp', interp, interp_fields),
+                   ('spect', spect, spect_fields) ]
+        if sim.use_pml:
+            fields += [ ('interp', interp, interp_pml_fields),
+                        ('spect', spect, spect_pml_fields) ]
+        for grid_type, grid, field_names in fields:
+            for field in field_names:
+                arrays[ '%s%d_%s' %(grid_type, m, field) ] = \
+                    to_host( getattr( grid, field ), fld.use_cuda )
+        grids.append( { 'zmin': interp.zmin, 'zmax': interp.zmax } )
+
+    # Particles
+    species_state = []
+    for i, species in enumerate( sim.ptcl ):
+        prefix = 'species%d_' %i
+        for attr in particle_arrays:
+            arrays[ prefix + attr ] = to_host(
+                getattr( species, attr ), species.use_cuda )
+        state = { 'Ntot': species.Ntot, 'tracker': None,
+                  'ionizable': species.ionizer is not None, 'injector': None }
+        if species.tracker is not None:
+            arrays[ prefix + 'id' ] = to_host(
+                species.tracker.id, species.use_cuda )
+            state['tracker'] = {
+                'next_attributed_id': int(species.tracker.next_attributed_id),
+                'id_step': int(species.tracker.id_step) }
+        if species.ionizer is not None:
+            arrays[ prefix + 'ionization_level' ] = to_host(
+                species.ionizer.ionization_level, species.use_cuda )
+        if species.continuous_injection:
+            injector = species.injector
+            state['injector'] = { 'nz_inject': injector.nz_inject,
+                'z_inject': injector.z_inject,
+                'z_end_plasma': injector.z_end_plasma }
+        species_state.append( state )
+
+    # Moving window
+    moving_win = sim.comm.moving_win
+    if moving_win is not None:
+        window_state = { 'v': moving_win.v,
+                         't_last_move': moving_win.t_last_move,
+                         'zmin': getattr( moving_win, 'zmin', None ) }
+    else:
+        window_state = None
+
+    # State of the random number generator of numpy
+    rng_name, rng_keys, rng_pos, rng_has_gauss, rng_gauss = \
+        np.random.get_state()
+    arrays['rng_keys'] = rng_keys
+
+    manifest = {
+        'format_version': format_version,
+        'iteration': sim.iteration, 'time': sim.time,
+        'rank': sim.comm.rank, 'size': sim.comm.size,
+        'Nm': fld.Nm, 'use_pml': sim.use_pml, 'grids': grids,
+        'zmin_global_domain': sim.comm._zmin_global_domain,
+        'species': species_state, 'moving_window': window_state,
+        'rng': { 'name': rng_name, 'pos': int(rng_pos),
+                 'has_gauss': int(rng_has_gauss), 'gauss': float(rng_gauss) }
+        }
+    return( arrays, manifest )
+
+def to_host( array, use_cuda ):
+    """
+    Return a copy of `array` on the CPU
+
+    Parameters
+    ----------
+    array: a numpy or cupy array
+
+    use_cuda: bool
+        Whether the array may be on the GPU
+    """
+    if use_cuda and not isinstance( array, np.ndarray ):
+        return( array.get() )
+    else:
+        return( array.copy() )
+
+def write_native_checkpoint( path, arrays, manifest ):
+    """
+    Write the arrays as .npy files in the directory `path`, along with
+    the manifest (which lists these files)
+
+    Parameters
+    ----------
+    path: string
+        The directory of the checkpoint (created if needed)
+
+    arrays: dict
+        The arrays to be saved, with their names
+
+    manifest: dict
+        The scalar state of the simulation
+    """
+    if not os.path.exists( path ):
+        os.makedirs( path )
+    manifest = dict( manifest )
+    manifest['arrays'] = {}
+    for name, array in arrays.items():
+        filename = name + '.npy'
+        np.save( os.path.join( path, filename ), array )
+        manifest['arrays'][name] = { 'file': filename,
+            'dtype': array.dtype.str, 'shape': list(array.shape) }
+    # The manifest is written last: a checkpoint without
+    # manifest is considered incomplete
+    # (numpy scalars are converted to python scalars)
+    with open( os.path.join( path, 'manifest.json' ), 'w' ) as f:
+        json.dump( manifest, f, indent=1, default=lambda x: x.item() )
+
+def get_native_checkpoint_iterations( write_dir ):
+    """
+    Return the sorted list of the iterations for which a complete native
+    checkpoint exists in `write_dir`
+
+    Parameters
+    ----------
+    write_dir: string
+        The directory of the checkpoints of one MPI rank
+    """
+    iterations = []
+    if os.path.exists( write_dir ):
+        regex_matcher = re.compile(r'native(\d+)$')
+        for directory in os.listdir( write_dir ):
+            match = regex_matcher.match( directory )
+            if (match is not None) and os.path.exists( os.path.join(
+                    write_dir, directory, 'manifest.json' ) ):
+                iterations.append( int(match.group(1)) )
+    return( sorted(iterations) )
+
+def restart_from_native_checkpoint( sim, iteration=None,
+                                    checkpoint_dir='./checkpoints' ):
+    """
+    Fills the Simulation object `sim` with data saved in a native checkpoint.
+
+    The arrays are memory-mapped and copied into the simulation; the
+    fields are directly loaded in spectral space, so that no transform
+    and no deposition is needed to restart.
+
+    The following data from `sim` is overwritten:
+
+    - Current time and iteration number of the simulation
+    - Position of the boundaries of the simulation box
+    - Values of the field arrays (interpolation and spectral grids)
+    - Size and values of the particle arrays, including the particle ids,
+      ionization levels and the state of continuous injection
+    - State of the moving window (which is created if needed)
+    - State of the random number generator of numpy
+
+    Other information (e.g. diagnostics, laser antennas, and the state of
+    the random number generators of numba and cupy) is not restored.
+
+    NB: The fields should not be modified between this function and the
+    next call to `sim.step` (since the spectral fields would then be
+    inconsistent with the modified fields).
+
+    Parameters
+    ----------
+    sim: a Simulation object
+       The Simulation object into which the checkpoint should be loaded
+
+    iteration: integer, optional
+       The iteration number of the checkpoint from which to restart
+       If None, the latest checkpoint available will be used.
+
+    checkpoint_dir: string, optional
+        The path to the directory that contains the checkpoints to be loaded.
+        (When running a simulation with several MPI ranks, use the
+        same path for all ranks.)
+    """
+    # Find the checkpoint to be loaded
+    write_dir = os.path.join( checkpoint_dir, 'proc%d' %comm.rank )
+    available_iterations = get_native_checkpoint_iterations( write_dir )
+    if iteration is None:
+        # Use the latest checkpoint that is complete on all ranks
+        if len( available_iterations ) > 0:
+            iteration = available_iterations[-1]
+        else:
+            iteration = -1
+        if comm.size > 1:
+            iteration = comm.allreduce( iteration, op=MPI.MIN )
+    if iteration not in available_iterations:
+        raise RuntimeError('No native checkpoint found for iteration %s in %s'
+                            %(iteration, write_dir))
+    path = os.path.join( write_dir, 'native%08d' %iteration )
+    with open( os.path.join( path, 'manifest.json' ) ) as f:
+        manifest = json.load( f )
+
+    # Check that the checkpoint is compatible with the simulation
+    if manifest['format_version'] != format_version:
+        raise RuntimeError('Unsupported native checkpoint format: %s'
+                            %manifest['format_version'])
+    if (manifest['size'] != sim.comm.size) or \
+        (manifest['Nm'] != sim.fld.Nm) or \
+        (manifest['use_pml'] != sim.use_pml) or \
+        (len(manifest['species']) != len(sim.ptcl)):
+        raise RuntimeError('The native checkpoint in %s was written by a '
+            'simulation with a different number of MPI ranks, modes or '
+            'species, or different PML settings.' %path)
+
+    def load( name ):
+        """Memory-map the array `name` of the checkpoint"""
+        info = manifest['arrays'][name]
+        return( np.load( os.path.join( path, info['file'] ), mmap_mode='r' ) )
+
+    # Modify parameters of the simulation
+    sim.iteration = manifest['iteration']
+    sim.time = manifest['time']
+
+    # Load the fields (copy into the existing arrays)
+    fld = sim.fld
+    for m in range( fld.Nm ):
+        interp = fld.interp[m]
+        spect = fld.spect[m]
+        fields = [ ('interp', interp, interp_fields),
+                   ('spect', spect, spect_fields) ]
+        if sim.use_pml:
+            fields += [ ('interp', interp, interp_pml_fields),
+                        ('spect', spect, spect_pml_fields) ]
+        for grid_type, grid, field_names in fields:
+            for field in field_names:
+                array = getattr( grid, field )
+                array[:,:] = load( '%s%d_%s' %(grid_type, m, field) )
+        interp.zmin = manifest['grids'][m]['zmin']
+        interp.zmax = manifest['grids'][m]['zmax']
+    sim.comm.shift_global_domain_positions(
+        manifest['zmin_global_domain'] - sim.comm._zmin_global_domain )
+    # Skip the transformation of the fields at the beginning of `step`
+    sim.spectral_fields_loaded = True
+
+    # Load the particles (replace the arrays)
+    for i, species in enumerate( sim.ptcl ):
+        prefix = 'species%d_' %i
+        state = manifest['species'][i]
+        for attr in particle_arrays:
+            setattr( species, attr, np.array( load( prefix + attr ) ) )
+        species.Ntot = state['Ntot']
+        # The cached shape factors are not valid anymore
+        species.shape_factor_cache = None
+        if state['tracker'] is not None:
+            if species.tracker is None:
+                species.track( sim.comm )
+            species.tracker.id = np.array( load( prefix + 'id' ) )
+            species.tracker.next_attributed_id = \
+                np.uint64( state['tracker']['next_attributed_id'] )
+            species.tracker.id_step = np.uint64( state['tracker']['id_step'] )
+        if species.ionizer is not None:
+            species.ionizer.ionization_level = \
+                np.array( load( prefix + 'ionization_level' ) )
+            species.ionizer.w_times_level = \
+                species.w * species.ionizer.ionization_level
+        if species.continuous_injection:
+            injector = species.injector
+            if state['injector'] is not None:
+                injector.nz_inject = state['injector']['nz_inject']
+                injector.z_inject = state['injector']['z_inject']
+                injector.z_end_plasma = state['injector']['z_end_plasma']
+            else:
+                injector.reset_injection_positions()
+        reset_particle_buffers( species )
+
+    # Restore the moving window
+    window_state = manifest['moving_window']
+    if window_state is not None:
+        sim.comm.moving_win = MovingWindow( sim.comm, sim.dt,
+                                window_state['v'], sim.time )
+        sim.comm.moving_win.t_last_move = window_state['t_last_move']
+        if window_state['zmin'] is not None:
+            sim.comm.moving_win.zmin = window_state['zmin']
+
+    # Restore the random number generator of numpy
+    rng = manifest['rng']
+    np.random.set_state( ( rng['name'], np.array( load('rng_keys') ),
+                    rng['pos'], rng['has_gauss'], rng['gauss'] ) )
@@ -0,0 +1,315 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This files contains numba methods that are used in the particle
+diagnostics and in the boosted-frame diagnostics
+"""
+import numba
+from fbpic.utils.threading import njit_parallel, prange
+
+@njit_parallel
+def count_slice_particles_numba( z, uz, inv_gamma, c, dt,
+        current_z_boost, previous_z_boost, nthreads, ptcl_chunk_indices,
+        n_slice ):
+    """
+    Count, for each thread and each snapshot, the number of particles
+    that crossed the output plane of this snapshot during the last
+    iteration. (Single pass over the particles, for all snapshots.)
+
+    Parameters
+    ----------
+    z, uz, inv_gamma : 1darrays of floats
+        The particle quantities (in the boosted frame)
+
+    c, dt : floats
+        The speed of light and the timestep of the simulation
+
+    current_z_boost, previous_z_boost : 1darrays of floats
+        Current and previous position of the output plane of each snapshot,
+        in the boosted frame
+
+    nthreads : int
+        Number of CPU threads used with numba prange
+
+    ptcl_chunk_indices : array of int, of size nthreads+1
+        The indices (of the particle array) between which each thread
+        should loop. (i.e. divisions of particle array between threads)
+
+    n_slice : 2darray of ints, of shape (nthreads, n_snapshots)
+        The number of particles in each slice, for each thread
+        (modified by this function)
+    """
+    n_snapshots = current_z_boost.shape[0]
+    for i_thread in prange( nthreads ):
+        for i_ptcl in range( ptcl_chunk_indices[i_thread],
+                             ptcl_chunk_indices[i_thread+1] ):
+            current_z = z[i_ptcl]
+            previous_z = current_z - uz[i_ptcl]*inv_gamma[i_ptcl]*c*dt
+            for i_snap in range( n_snapshots ):
+                z_boost = current_z_boost[i_snap]
+                prev_z_boost = previous_z_boost[i_snap]
+                if ((current_z >= z_boost) and (previous_z <= prev_z_boost))\
+                  or ((current_z <= z_boost) and (previous_z >= prev_z_boost)):
+                    n_slice[i_thread, i_snap] += 1
+    return
+
+@njit_parallel
+def extract_slice_particles_numba( x, y, z, ux, uy, uz, inv_gamma, w,
+        c, dt, t, beta_boost, gamma_boost,
+        current_z_boost, previous_z_boost, nthreads, ptcl_chunk_indices,
+        slice_offsets, slice_data, slice_indices ):
+    """
+    Copy the particles that crossed the output plane of each snapshot
+    during the last iteration into the buffer `slice_data`, after
+    interpolating them to the output plane and transforming them
+    to the lab frame.
+
+    Within the buffers, the particles of a given snapshot are contiguous
+    and are stored in the same order as in the particle arrays.
+
+    Parameters
+    ----------
+    x, y, z, ux, uy, uz, inv_gamma, w : 1darrays of floats
+        The particle quantities (in the boosted frame)
+
+    c, dt, t : floats
+        The speed of light, the timestep and the current time
+        of the simulation (in the boosted frame)
+
+    beta_boost, gamma_boost : floats
+        The velocity (normalized by c) and Lorentz factor of the boost
+
+    current_z_boost, previous_z_boost : 1darrays of floats
+        Current and previous position of the output plane of each snapshot,
+        in the boosted frame
+
+    nthreads : int
+        Number of CPU threads used with numba prange
+
+    ptcl_chunk_indices : array of int, of size nthreads+1
+        The indices (of the particle array) between which each thread
+        should loop. (i.e. divisions of particle array between threads)
+
+    slice_offsets : 2darray of ints, of shape (nthreads, n_snapshots)
+        The index in the buffers at which each thread starts writing
+        the particles of each snapshot
+
+    slice_data : 2darray of floats, of shape (7, n_slice_total)
+        The buffer for x, y, z, ux, uy, uz, w in the lab frame
+        (modified by this function)
+
+    slice_indices : 1darray of ints, of shape (n_slice_total,)
+        The index of each buffered particle in the particle arrays
+        (modified by this function)
+    """
+    n_snapshots = current_z_boost.shape[0]
+    # Velocity of the plane
+    v_plane = -c/beta_boost
+    for i_thread in prange( nthreads ):
+        # Thread-local copy of the write positions
+        i_write = slice_offsets[i_thread].copy()
+        for i_ptcl in range( ptcl_chunk_indices[i_thread],
+                             ptcl_chunk_indices[i_thread+1] ):
+            current_z = z[i_ptcl]
+            previous_z = current_z - uz[i_ptcl]*inv_gamma[i_ptcl]*c*dt
+            for i_snap in range( n_snapshots ):
+                z_boost = current_z_boost[i_snap]
+                prev_z_boost = previous_z_boost[i_snap]
+                if ((current_z >= z_boost) and (previous_z <= prev_z_boost))\
+                  or ((current_z <= z_boost) and (previous_z >= prev_z_boost)):
+                    # Time in the boosted frame when the particle
+                    # crosses the output plane
+                    v_z = uz[i_ptcl]*inv_gamma[i_ptcl]*c
+                    t_cross = t - (z_boost - current_z) / (v_plane - v_z)
+                    # Push the particle to the position of intersection
+                    # and back-transform position and momentum
+                    dt_inv_gamma = c*(t_cross - t)*inv_gamma[i_ptcl]
+                    z_cross = current_z + dt_inv_gamma*uz[i_ptcl]
+                    gamma = 1./inv_gamma[i_ptcl]
+                    i = i_write[i_snap]
+                    slice_data[0, i] = x[i_ptcl] + dt_inv_gamma*ux[i_ptcl]
+                    slice_data[1, i] = y[i_ptcl] + dt_inv_gamma*uy[i_ptcl]
+                    slice_data[2, i] = \
+                        gamma_boost*( z_cross + beta_boost*c*t_cross )
+                    slice_data[3, i] = ux[i_ptcl]
+                    slice_data[4, i] = uy[i_ptcl]
+                    slice_data[5, i] = gamma_boost*uz[i_ptcl] \
+                                        + gamma*(beta_boost*gamma_boost)
+                    slice_data[6, i] = w[i_ptcl]
+                    slice_indices[i] = i_ptcl
+                    i_write[i_snap] += 1
+    return
+
+# -----------------------------------
+# Selection of the particles to write
+# -----------------------------------
+
+@numba.njit
+def splitmix64( z ):
+    """
+    Return a well-mixed 64-bit hash of the uint64 `z`
+    (finalizer of the SplitMix64 generator)
+    """
+    z = z + numba.uint64(0x9E3779B97F4A7C15)
+    z = ( z ^ (z >> numba.uint64(30)) ) * numba.uint64(0xBF58476D1CE4E5B9)
+    z = ( z ^ (z >> numba.uint64(27)) ) * numba.uint64(0x94D049BB133111EB)
+    return( z ^ (z >> numba.uint64(31)) )
+
+@numba.njit
+def get_random_uniform( seed, counter ):
+    """
+    Return a pseudo-random number, uniformly distributed in [0, 1),
+    which only depends on `seed` and `counter` (counter-based generator:
+    the result does not depend on the order in which it is called,
+    nor on the number of threads)
+
+    Parameters
+    ----------
+    seed, counter : uint64
+    """
+    z = splitmix64( seed ^ splitmix64( counter ) )
+    # Use the 53 upper bits, to fill the mantissa of a double
+    return( (z >> numba.uint64(11)) * (1./9007199254740992.) )
+
+@numba.njit
+def is_selected( i_ptcl, x, y, z, ux, uy, uz, w, inv_gamma, ids, use_ids,
+                 lower_bounds, upper_bounds, subsampling_fraction, seed ):
+    """
+    Return whether the particle `i_ptcl` satisfies all the selection rules
+    (and is drawn by the random subsampling, if subsampling_fraction < 1)
+
+    The bounds correspond to the quantities
+    x, y, z, ux, uy, uz, w, gamma (in this order). The random number of
+    the subsampling is drawn with the id of the particle as counter
+    (if use_ids is True), or with its index otherwise.
+    """
+    if not ( (x[i_ptcl] > lower_bounds[0]) and
+             (x[i_ptcl] < upper_bounds[0]) and
+             (y[i_ptcl] > lower_bounds[1]) and
+             (y[i_ptcl] < upper_bounds[1]) and
+             (z[i_ptcl] > lower_bounds[2]) and
+             (z[i_ptcl] < upper_bounds[2]) and
+             (ux[i_ptcl] > lower_bounds[3]) and
+             (ux[i_ptcl] < upper_bounds[3]) and
+             (uy[i_ptcl] > lower_bounds[4]) and
+             (uy[i_ptcl] < upper_bounds[4]) and
+             (uz[i_ptcl] > lower_bounds[5]) and
+             (uz[i_ptcl] < upper_bounds[5]) and
+             (w[i_ptcl] > lower_bounds[6]) and
+             (w[i_ptcl] < upper_bounds[6]) ):
+        return( False )
+    gamma = 1./inv_gamma[i_ptcl]
+    if not ( (gamma > lower_bounds[7]) and (gamma < upper_bounds[7]) ):
+        return( False )
+    if subsampling_fraction < 1.:
+        if use_ids:
+            counter = numba.uint64( ids[i_ptcl] )
+        else:
+            counter = numba.uint64( i_ptcl )
+        if get_random_uniform( seed, counter ) >= subsampling_fraction:
+            return( False )
+    return( True )
+
+@njit_parallel
+def count_selected_particles_numba( x, y, z, ux, uy, uz, w, inv_gamma,
+        ids, use_ids, lower_bounds, upper_bounds, subsampling_fraction,
+        seed, nthreads, ptcl_chunk_indices, n_selected ):
+    """
+    Count, for each thread, the number of particles that satisfy the
+    selection rules (see `is_selected`)
+
+    Parameters
+    ----------
+    x, y, z, ux, uy, uz, w, inv_gamma : 1darrays of floats
+        The particle quantities
+
+    ids : 1darray of uint64
+        The ids of the particles (only used if use_ids is True)
+
+    use_ids : bool
+        Whether the subsampling uses the particle ids as counters
+        (reproducible independently of the order of the particles)
+        or the particle indices
+
+    lower_bounds, upper_bounds : 1darrays of floats
+        The selection rules for x, y, z, ux, uy, uz, w and gamma
+
+    subsampling_fraction : float
+        The probability with which each particle is kept
+
+    seed : uint64
+        The seed of the counter-based random generator
+
+    nthreads : int
+        Number of CPU threads used with numba prange
+
+    ptcl_chunk_indices : array of int, of size nthreads+1
+        The indices (of the particle array) between which each thread
+        should loop. (i.e. divisions of particle array between threads)
+
+    n_selected : 1darray of ints, of size nthreads
+        The number of selected particles, for each thread
+        (modified by this function)
+    """
+    for i_thread in prange( nthreads ):
+        n = 0
+        for i_ptcl in range( ptcl_chunk_indices[i_thread],
+                             ptcl_chunk_indices[i_thread+1] ):
+            if is_selected( i_ptcl, x, y, z, ux, uy, uz, w, inv_gamma,
+                    ids, use_ids, lower_bounds, upper_bounds,
+                    subsampling_fraction, seed ):
+                n += 1
+        n_selected[i_thread] = n
+    return
+
+@njit_parallel
+def get_selected_indices_numba( x, y, z, ux, uy, uz, w, inv_gamma,
+        ids, use_ids, lower_bounds, upper_bounds, subsampling_fraction,
+        seed, nthreads, ptcl_chunk_indices, selected_offsets, selected_indices ):
+    """
+    Write the (sorted) indices of the particles that satisfy the
+    selection rules into `selected_indices`
+
+    Parameters
+    ----------
+    x, y, z, ux, uy, uz, w, inv_gamma, ids, use_ids, lower_bounds,
+    upper_bounds, subsampling_fraction, seed, nthreads, ptcl_chunk_indices :
+        See the docstring of `count_selected_particles_numba`
+
+    selected_offsets : 1darray of ints, of size nthreads
+        The position in `selected_indices` at which each thread
+        starts writing
+
+    selected_indices : 1darray of ints
+        The indices of the selected particles (modified by this function)
+    """
+    for i_thread in prange( nthreads ):
+        i = selected_offsets[i_thread]
+        for i_ptcl in range( ptcl_chunk_indices[i_thread],
+                             ptcl_chunk_indices[i_thread+1] ):
+            if is_selected( i_ptcl, x, y, z, ux, uy, uz, w, inv_gamma,
+                    ids, use_ids, lower_bounds, upper_bounds,
+                    subsampling_fraction, seed ):
+                selected_indices[i] = i_ptcl
+                i += 1
+    return
+
+@njit_parallel
+def gather_particle_array_numba( array, selected_indices, gathered_array ):
+    """
+    Copy the elements `selected_indices` of `array` into `gathered_array`
+
+    Parameters
+    ----------
+    array : 1darray
+        The particle quantity
+
+    selected_indices : 1darray of ints
+        The indices of the selected particles
+
+    gathered_array : 1darray
+        The selected values (modified by this function)
+    """
+    for i in prange( selected_indices.shape[0] ):
+        gathered_array[i] = array[ selected_indices[i] ]
+    return
@@ -15,7 +15,8 @@ class ParticleChargeDensityDiagnostic(FieldDiagnostic):
 
     def __init__(self, period=None, sim=None, species={},
                 write_dir=None, iteration_min=0, iteration_max=np.inf,
-                dt_period=None ):
+                dt_period=None, chunks=None, compression=None,
+                compression_opts=None, shuffle=False, precision=None ):
         """
         Writes the charge density of the specified species in the
         openPMD file (one dataset per species)
@@ -47,6 +48,9 @@ class ParticleChargeDensityDiagnostic(FieldDiagnostic):
         iteration_min, iteration_max: ints
             The iterations between which data should be written
             (`iteration_min` is inclusive, `iteration_max` is exclusive)
+
+        chunks, compression, compression_opts, shuffle, precision : optional
+            The HDF5 storage options (see `FieldDiagnostic`)
         """
         # Check the arguments
         if sim is None:
@@ -63,7 +67,9 @@ class ParticleChargeDensityDiagnostic(FieldDiagnostic):
         FieldDiagnostic.__init__(self, period, fldobject=sim.fld,
                     comm=sim.comm, fieldtypes=fieldtypes, write_dir=write_dir,
                     iteration_min=iteration_min, iteration_max=iteration_max,
-                    dt_period=dt_period )
+                    dt_period=dt_period, chunks=chunks,
+                    compression=compression, compression_opts=compression_opts,
+                    shuffle=shuffle, precision=precision )
 
         # Register the arguments
         self.sim = sim
@@ -83,18 +89,13 @@ class ParticleChargeDensityDiagnostic(FieldDiagnostic):
         # Extract information needed for the openPMD attributes
         dt = self.fld.dt
         time = iteration * dt
-        dz = self.fld.interp[0].dz
-        zmin, _ = self.comm.get_zmin_zmax(
-                local=False, with_damp=False, with_guard=False )
-        Nz, _ = self.comm.get_Nz_and_iz(
-                local=False, with_damp=False, with_guard=False )
-        Nr = self.comm.get_Nr(with_damp=False)
+        Nr, Nz, zmin, dr, dz, position = self.get_output_region()
 
         # Create the file with these attributes
         filename = "data%08d.h5" %iteration
         fullpath = os.path.join( self.write_dir, "hdf5", filename )
-        self.create_file_empty_meshes(
-            fullpath, iteration, time, Nr, Nz, zmin, dz, dt )
+        self.create_file_empty_meshes( fullpath, iteration, time,
+                                       Nr, Nz, zmin, dz, dt, dr, position )
 
         # Loop over the requested species
         for species_name in self.species.keys():
@@ -9,7 +9,14 @@ import h5py
 import numpy as np
 from scipy import constants
 from .generic_diag import OpenPMDDiagnostic
+from fbpic.utils.threading import nthreads, get_chunk_indices
 from .data_dict import macro_weighted_dict, weighting_power_dict
+from .numba_methods import count_selected_particles_numba, \
+    get_selected_indices_numba, gather_particle_array_numba
+
+# Quantities whose selection rules are applied by the single-pass kernel
+# (in the order of the bounds of `is_selected`)
+single_pass_quantities = [ 'x', 'y', 'z', 'ux', 'uy', 'uz', 'w', 'gamma' ]
 
 class ParticleDiagnostic(OpenPMDDiagnostic) :
     """
@@ -19,7 +26,9 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
     def __init__(self, period=None, species={}, comm=None,
         particle_data=["position", "momentum", "weighting"],
         select=None, write_dir=None, iteration_min=0, iteration_max=np.inf,
-        subsampling_fraction=None, dt_period=None ) :
+        subsampling_fraction=None, dt_period=None, chunks=None,
+        compression=None, compression_opts=None, shuffle=False,
+        precision=None, subsampling_seed=0 ) :
         """
         Initialize the particle diagnostics.
 
@@ -73,6 +82,26 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
         subsampling_fraction : float, optional
             If this is not None, the particle data is subsampled with
             subsampling_fraction probability
+
+        subsampling_seed : int, optional
+            The seed of the random subsampling. For a given seed, the
+            subsampled particles are reproducible: the random number of
+            each particle only depends on the seed, the iteration, and the
+            id of the particle (for tracked species) or its index and the
+            MPI rank (for untracked species).
+
+        chunks, compression, compression_opts, shuffle : optional
+            The HDF5 storage options of the datasets: chunk shape
+            (True or a tuple of 1 int), compression filter
+            (e.g. "gzip", "lzf") and its options, and whether to use
+            the shuffle filter.
+            Default: contiguous, uncompressed datasets.
+
+        precision : None, "float32" or int, optional
+            Whether to store the floating-point particle data in single
+            precision ("float32"), or to round its mantissa to a given
+            number of bits (int). The particle ids are always stored exactly.
+            Default: None (double precision)
         """
         # Check input
         if len(species) == 0:
@@ -88,12 +117,16 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
         # General setup (uses the above timestep)
         OpenPMDDiagnostic.__init__(self, period, comm, write_dir,
                         iteration_min, iteration_max,
-                        dt_period=dt_period, dt_sim=self.dt )
+                        dt_period=dt_period, dt_sim=self.dt, chunks=chunks,
+                        compression=compression,
+                        compression_opts=compression_opts,
+                        shuffle=shuffle, precision=precision )
 
         # Register the arguments
         self.species_dict = species
         self.select = select
         self.subsampling_fraction = subsampling_fraction
+        self.subsampling_seed = subsampling_seed
 
         # For each species, get the particle arrays to be written
         self.array_quantities_dict = {}
@@ -254,9 +287,10 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
                 species_grp = None
 
             # Select the particles that will be written
-            select_array = self.apply_selection( species )
+            selected_indices = self.apply_selection( species,
+                self.get_subsampling_seed( iteration, species_name ) )
             # Get their total number
-            n = select_array.sum()
+            n = len( selected_indices )
             if self.comm is not None:
                 # Multi-proc output
                 if self.comm.size > 1:
@@ -271,7 +305,8 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
 
             # Write the datasets for each particle datatype
             self.write_particles( species_grp, species, n_rank,
-                Ntot, select_array, self.array_quantities_dict[species_name] )
+                Ntot, selected_indices,
+                self.array_quantities_dict[species_name] )
 
         # Close the file
         if self.rank == 0:
@@ -284,7 +319,7 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
                 species.send_particles_to_gpu()
 
     def write_particles( self, species_grp, species, n_rank,
-                         Ntot, select_array, particle_data ) :
+                         Ntot, selected_indices, particle_data ) :
         """
         Write all the particle data sets for one given species
 
@@ -300,9 +335,8 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
         Ntot : int
         	Contains the global number of particles
 
-        select_array : 1darray of bool
-            An array of the same shape as that particle array
-            containing True for the particles that satify all
+        selected_indices : 1darray of ints
+            The indices of the particles that satisfy all
             the rules of self.select
 
         particle_data: list of string
@@ -315,22 +349,22 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
             if quantity in ["x", "y", "z"]:
                 quantity_path = "position/%s" %(quantity)
                 self.write_dataset( species_grp, species, quantity_path,
-                        quantity, n_rank, Ntot, select_array )
+                        quantity, n_rank, Ntot, selected_indices )
 
             elif quantity in ["ux", "uy", "uz"]:
                 quantity_path = "momentum/%s" %(quantity[-1])
                 self.write_dataset( species_grp, species, quantity_path,
-                        quantity, n_rank, Ntot, select_array )
+                        quantity, n_rank, Ntot, selected_indices )
 
             elif quantity in ["Ex" , "Ey" , "Ez"]:
                 quantity_path = "E/%s" %(quantity[-1])
                 self.write_dataset( species_grp, species, quantity_path,
-                        quantity, n_rank, Ntot, select_array )
+                        quantity, n_rank, Ntot, selected_indices )
 
             elif quantity in ["Bx", "By", "Bz"]:
                 quantity_path = "B/%s" %(quantity[-1])
                 self.write_dataset( species_grp, species, quantity_path,
-                        quantity, n_rank, Ntot, select_array )
+                        quantity, n_rank, Ntot, selected_indices )
 
             elif quantity in ["w", "id", "charge", "gamma"]:
                 if quantity == "w":
@@ -338,7 +372,7 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
                 else:
                     quantity_path = quantity
                 self.write_dataset( species_grp, species, quantity_path,
-                                    quantity, n_rank, Ntot, select_array )
+                                    quantity, n_rank, Ntot, selected_indices )
                 if self.rank == 0:
                     self.setup_openpmd_species_record(
                         species_grp[quantity_path], quantity_path )
@@ -363,54 +397,119 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
                     species_grp["B"], "B" )
 
 
-    def apply_selection( self, species ) :
+    def apply_selection( self, species, seed=0 ) :
         """
         Apply the rules of self.select to determine which
         particles should be written, Apply random subsampling using
         the property subsampling_fraction.
 
+        The rules on x, y, z, ux, uy, uz, w and gamma, and the subsampling,
+        are applied in a single (multithreaded) pass over the particles.
+        The subsampling uses a counter-based random generator, so that
+        the selected particles only depend on `seed` and on the particle
+        ids (or the particle indices, for untracked species).
+
         Parameters
         ----------
         species : a Species object
 
+        seed : int, optional
+            The seed of the random subsampling
+
         Returns
         -------
-        A 1d array of the same shape as that particle array
-        containing True for the particles that satify all
-        the rules of self.select
+        A 1d array of ints, containing the (sorted) indices of the particles
+        that satisfy all the rules of self.select
         """
-        # Initialize an array filled with True
-        select_array = np.ones( species.Ntot, dtype='bool' )
-        # subsampling selector
-        if self.subsampling_fraction is not None :
-            subsampling_array = np.random.rand(species.Ntot) < \
-                self.subsampling_fraction
-            select_array = np.logical_and(subsampling_array,select_array)
-
-        # Apply the rules successively
+        # Bounds of the rules on the quantities of the single-pass kernel
+        lower_bounds = -np.inf * np.ones( len(single_pass_quantities) )
+        upper_bounds = np.inf * np.ones( len(single_pass_quantities) )
+        other_rules = {}
         if self.select is not None :
-            # Go through the quantities on which a rule applies
             for quantity in self.select.keys() :
-                if quantity == "gamma":
-                    quantity_array = 1.0/getattr( species, "inv_gamma" )
+                if quantity in single_pass_quantities:
+                    i = single_pass_quantities.index( quantity )
+                    if self.select[quantity][0] is not None :
+                        lower_bounds[i] = self.select[quantity][0]
+                    if self.select[quantity][1] is not None :
+                        upper_bounds[i] = self.select[quantity][1]
                 else:
-                    quantity_array = getattr( species, quantity )
-                # Lower bound
-                if self.select[quantity][0] is not None :
-                    select_array = np.logical_and(
-                        quantity_array > self.select[quantity][0],
-                        select_array )
-                # Upper bound
-                if self.select[quantity][1] is not None :
-                    select_array = np.logical_and(
-                        quantity_array < self.select[quantity][1],
-                        select_array )
+                    other_rules[quantity] = self.select[quantity]
+        if self.subsampling_fraction is not None :
+            subsampling_fraction = self.subsampling_fraction
+        else:
+            subsampling_fraction = 1.
+        if species.tracker is not None:
+            ids = species.tracker.id
+            use_ids = True
+        else:
+            ids = np.empty( 0, dtype=np.uint64 )
+            use_ids = False
+        kernel_args = ( species.x, species.y, species.z,
+            species.ux, species.uy, species.uz, species.w, species.inv_gamma,
+            ids, use_ids, lower_bounds, upper_bounds, subsampling_fraction,
+            np.uint64(seed % 2**64) )
+
+        # Count the selected particles of each thread, and
+        # write their indices in a compact array
+        ptcl_chunk_indices = get_chunk_indices( species.Ntot, nthreads )
+        n_selected = np.empty( nthreads, dtype=np.int64 )
+        count_selected_particles_numba( *( kernel_args +
+                ( nthreads, ptcl_chunk_indices, n_selected ) ) )
+        selected_offsets = np.cumsum( n_selected ) - n_selected
+        selected_indices = np.empty( n_selected.sum(), dtype=np.int64 )
+        get_selected_indices_numba( *( kernel_args + ( nthreads,
+            ptcl_chunk_indices, selected_offsets, selected_indices ) ) )
+
+        # Apply the rules on the other quantities (e.g. fields
+        # gathered on the particles), to the selected particles only
+        for quantity in other_rules.keys() :
+            quantity_array = getattr( species, quantity )[ selected_indices ]
+            select_array = np.ones( len(selected_indices), dtype='bool' )
+            # Lower bound
+            if other_rules[quantity][0] is not None :
+                select_array = np.logical_and(
+                    quantity_array > other_rules[quantity][0],
+                    select_array )
+            # Upper bound
+            if other_rules[quantity][1] is not None :
+                select_array = np.logical_and(
+                    quantity_array < other_rules[quantity][1],
+                    select_array )
+            selected_indices = selected_indices[ select_array ]
+
+        return( selected_indices )
+
+    def get_subsampling_seed( self, iteration, species_name ):
+        """
+        Return the seed of the random subsampling, for a given
+        iteration and species (and for the local MPI rank, if the
+        particles of the species are not tracked)
+
+        Parameters
+        ----------
+        iteration : int
+            The current iteration number of the simulation
 
-        return( select_array )
+        species_name : string
+            The name of the species
+        """
+        seed_components = [ iteration,
+                            self.species_names_list.index(species_name) ]
+        # For tracked species, the random numbers are attached to the
+        # particle ids, and thus should not depend on the MPI rank.
+        # Otherwise, the particle indices are used as counters, and the
+        # seed is made different on each rank.
+        if self.species_dict[species_name].tracker is None:
+            seed_components.append( self.rank )
+        seed = self.subsampling_seed
+        for n in seed_components:
+            seed = ( seed * 1000003 + n ) % 2**64
+        return( seed )
 
 
     def write_dataset( self, species_grp, species, path, quantity,
-                       n_rank, Ntot, select_array ) :
+                       n_rank, Ntot, selected_indices ) :
         """
         Write a given dataset
 
@@ -436,9 +535,8 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
         Ntot : int
         	Contains the global number of particles
 
-        select_array : 1darray of bool
-            An array of the same shape as that particle array
-            containing True for the particles that satify all
+        selected_indices : 1darray of ints
+            The indices of the particles that satisfy all
             the rules of self.select
         """
         # Create the dataset and setup its attributes
@@ -453,18 +551,20 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
             # in case the number of particles is not exactly the same.)
             if path in species_grp:
                 del species_grp[path]
-            dset = species_grp.create_dataset(path, datashape, dtype=dtype )
+            dset = species_grp.create_dataset( path, datashape,
+                        **self.get_dataset_options( datashape, dtype ) )
             self.setup_openpmd_species_component( dset, quantity )
 
         # Fill the dataset with the quantity
-        quantity_array = self.get_dataset( species, quantity, select_array,
-                                           n_rank, Ntot )
+        quantity_array = self.get_dataset( species, quantity,
+                                    selected_indices, n_rank, Ntot )
         if self.rank==0:
-            dset[:] = quantity_array
+            dset[:] = self.apply_precision( quantity_array )
 
-    def get_dataset( self, species, quantity, select_array, n_rank, Ntot ) :
+    def get_dataset( self, species, quantity, selected_indices,
+                     n_rank, Ntot ) :
         """
-        Extract the array that satisfies select_array
+        Extract the array of the selected particles
 
         species : a Particles object
         	The species object to get the particle data from
@@ -472,9 +572,8 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
         quantity : string
             The quantity to be extracted (e.g. 'x', 'uz', 'w')
 
-        select_array : 1darray of bool
-            An array of the same shape as that particle array
-            containing True for the particles that satify all
+        selected_indices : 1darray of ints
+            The indices of the particles that satisfy all
             the rules of self.select
 
         n_rank: list of ints
@@ -485,18 +584,24 @@ class ParticleDiagnostic(OpenPMDDiagnostic) :
         """
         # Extract the quantity
         if quantity == "id":
-            quantity_one_proc = species.tracker.id
+            array = species.tracker.id
         elif quantity == "charge":
-            quantity_one_proc = constants.e * species.ionizer.ionization_level
+            array = species.ionizer.ionization_level
         elif quantity == "w":
-            quantity_one_proc = species.w
+            array = species.w
         elif quantity == "gamma":
-            quantity_one_proc = 1.0/getattr( species, "inv_gamma" )
+            array = species.inv_gamma
         else:
-            quantity_one_proc = getattr( species, quantity )
-
-        # Apply the selection
-        quantity_one_proc = quantity_one_proc[ select_array ]
+            array = getattr( species, quantity )
+
+        # Gather the selected particles (multithreaded)
+        quantity_one_proc = np.empty( len(selected_indices), dtype=array.dtype )
+        gather_particle_array_numba( array, selected_indices,
+                                     quantity_one_proc )
+        if quantity == "charge":
+            quantity_one_proc = constants.e * quantity_one_proc
+        elif quantity == "gamma":
+            quantity_one_proc = 1.0/quantity_one_proc
 
         # If this is the momentum, multiply by the proper factor
         # (only for species that have a mass)
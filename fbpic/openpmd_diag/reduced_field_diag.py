@@ -0,0 +1,310 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This file defines the class ReducedFieldDiagnostic.
+"""
+import os
+import numpy as np
+from scipy.constants import c, e, m_e, epsilon_0
+from fbpic.utils.threading import njit_parallel, prange
+from fbpic.utils.mpi import MPI
+from .generic_diag import OpenPMDDiagnostic
+
+class ReducedFieldDiagnostic(OpenPMDDiagnostic):
+    """
+    Class that computes reduced quantities of the fields (energy per mode,
+    peak fields, laser centroid and width, on-axis lineout of Ez) during
+    the simulation, and appends them to a single time-series HDF5 file.
+
+    The quantities are calculated from the interpolation grid of each
+    rank, and combined with MPI reductions. The file contains the datasets:
+
+    - `iteration`, `time`
+    - `energy`: array of shape (n_outputs, Nm), with the electromagnetic
+      energy (in Joules) contained in each azimuthal mode
+    - `max_E` and `max_E_perp`: the maximum of |E| and of the transverse
+      field sqrt(Ex**2 + Ey**2) (in V/m), evaluated at `n_theta` angles
+    - `a0`: the corresponding peak normalized vector potential (only if
+      `lambda0` is given)
+    - `laser_centroid_z`, `laser_rms_z`: the mean position and rms length
+      (in meters) of the energy density of the transverse electric field
+      in the `laser_modes`
+    - `laser_waist`: sqrt(2<r**2>) for the same energy density (i.e. the
+      waist w0, for a Gaussian pulse)
+    - `Ez_axis`: array of shape (n_outputs, Nz), with the on-axis Ez
+      (in V/m) on the cells of the grid (which start at `Ez_axis_zmin`)
+    """
+
+    def __init__(self, period=None, fldobject=None, comm=None,
+                 lambda0=None, laser_modes=[1], n_theta=16, lineout=True,
+                 write_dir=None, filename='reduced_fields.h5',
+                 iteration_min=0, iteration_max=np.inf, dt_period=None ):
+        """
+        Initialize the reduced field diagnostic.
+
+        Parameters
+        ----------
+        period : int, optional
+            The period of the diagnostics, in number of timesteps.
+            (i.e. the diagnostics are written whenever the number
+            of iterations is divisible by `period`). Specify either this or
+            `dt_period`.
+
+        dt_period : float (in seconds), optional
+            The period of the diagnostics, in physical time of the simulation.
+            Specify either this or `period`
+
+        fldobject : a Fields object
+            Points to the data that is to be reduced at each output
+
+        comm : an fbpic BoundaryCommunicator object or None
+            If this is not None, the results are reduced over all the ranks,
+            and the guard and damp cells are excluded.
+            Otherwise, each rank calculates the reduced quantities of
+            its own grid (including guard cells).
+            (Make sure to use different write_dir in this case.)
+
+        lambda0 : float (in meters), optional
+            The wavelength of the laser, used to convert the peak transverse
+            field into a0. If None, a0 is not written.
+
+        laser_modes : list of ints, optional
+            The azimuthal modes from which the laser centroid and width
+            are calculated
+
+        n_theta : int, optional
+            The number of angles at which the fields are reconstructed,
+            in order to find the peak fields
+
+        lineout : bool, optional
+            Whether to write the on-axis Ez
+
+        write_dir : string, optional
+            The POSIX path to the directory where the results are
+            to be written. If none is provided, this will be the path
+            of the current working directory.
+
+        filename : string, optional
+            The name of the time-series file, in `write_dir`
+
+        iteration_min, iteration_max: ints
+            The iterations between which data should be written
+            (`iteration_min` is inclusive, `iteration_max` is exclusive)
+        """
+        # General setup
+        OpenPMDDiagnostic.__init__(self, period, comm, write_dir,
+                            iteration_min, iteration_max,
+                            dt_period=dt_period, dt_sim=fldobject.dt )
+
+        # Register the arguments
+        self.fld = fldobject
+        self.Nm = fldobject.Nm
+        self.lambda0 = lambda0
+        self.lineout = lineout
+        self.filename = os.path.join( self.write_dir, filename )
+        self.laser_modes = np.zeros( self.Nm, dtype=np.bool_ )
+        for m in laser_modes:
+            if (m < 0) or (m >= self.Nm):
+                raise ValueError("Invalid mode in `laser_modes`: %s" %m)
+            self.laser_modes[m] = True
+        # Angles at which the fields are reconstructed
+        theta = 2*np.pi*np.arange( n_theta )/n_theta
+        m_theta = np.arange( self.Nm )[np.newaxis,:] * theta[:,np.newaxis]
+        self.cos_m_theta = np.cos( m_theta )
+        self.sin_m_theta = np.sin( m_theta )
+
+    def write_hdf5( self, iteration ):
+        """
+        Calculate the reduced quantities and append them to the file
+
+        Parameter
+        ---------
+        iteration : int
+             The current iteration number of the simulation.
+        """
+        # Find the cells of the local grid to be considered
+        if self.comm is None:
+            zmin = self.fld.interp[0].zmin
+            Nz = self.fld.interp[0].Nz
+            Nr = self.fld.interp[0].Nr
+            Nz_local = Nz
+            iz_in_array = 0
+            iz_in_global = 0
+        else:
+            zmin, _ = self.comm.get_zmin_zmax(
+                local=False, with_damp=False, with_guard=False )
+            Nz, iz_start_global = self.comm.get_Nz_and_iz(
+                local=False, with_damp=False, with_guard=False )
+            Nz_local, iz_start_local_domain = self.comm.get_Nz_and_iz(
+                local=True, with_damp=False, with_guard=False,
+                rank=self.rank )
+            _, iz_start_local_array = self.comm.get_Nz_and_iz(
+                local=True, with_damp=True, with_guard=True, rank=self.rank )
+            Nr = self.comm.get_Nr( with_damp=False )
+            iz_in_array = iz_start_local_domain - iz_start_local_array
+            iz_in_global = iz_start_local_domain - iz_start_global
+
+        # Get the fields of the physical cells of the local grid
+        fields = []
+        for field in [ 'Er', 'Et', 'Ez', 'Br', 'Bt', 'Bz' ]:
+            modes = []
+            for m in range( self.Nm ):
+                array = getattr( self.fld.interp[m], field )
+                array = array[ iz_in_array:iz_in_array+Nz_local, :Nr ]
+                if self.fld.use_cuda:
+                    array = array.get()
+                modes.append( array )
+            fields.append( np.stack( modes ) )
+        dr = self.fld.interp[0].dr
+        dz = self.fld.interp[0].dz
+        r = dr * ( 0.5 + np.arange( Nr ) )
+
+        # Calculate the local reductions, for each slice in z
+        energy = np.zeros( (Nz_local, self.Nm) )
+        laser_energy = np.zeros( Nz_local )
+        laser_r2 = np.zeros( Nz_local )
+        max_E = np.zeros( Nz_local )
+        max_E_perp = np.zeros( Nz_local )
+        Er, Et, Ez, Br, Bt, Bz = fields
+        get_reduced_fields_numba( Er, Et, Ez, Br, Bt, Bz, r, dr,
+            self.laser_modes, self.cos_m_theta, self.sin_m_theta,
+            energy, laser_energy, laser_r2, max_E, max_E_perp )
+
+        # Combine the results in a single array
+        # (Positions along z are taken from the left end of the
+        # global grid, to limit round-off errors in the moments)
+        z = dz * ( 0.5 + iz_in_global + np.arange( Nz_local ) )
+        local_sums = np.zeros( self.Nm + 4 + Nz )
+        local_sums[:self.Nm] = 0.5 * epsilon_0 * dz * energy.sum( axis=0 )
+        local_sums[self.Nm] = laser_energy.sum()
+        local_sums[self.Nm+1] = ( z * laser_energy ).sum()
+        local_sums[self.Nm+2] = ( z**2 * laser_energy ).sum()
+        local_sums[self.Nm+3] = laser_r2.sum()
+        if self.lineout:
+            local_sums[ self.Nm+4+iz_in_global :
+                        self.Nm+4+iz_in_global+Nz_local ] = \
+                fields[2][0, :, 0].real
+        local_max = np.array([ max_E.max(initial=0.),
+                               max_E_perp.max(initial=0.) ])
+
+        # Combine the results of all ranks
+        if (self.comm is not None) and (self.comm.size > 1):
+            if self.rank == 0:
+                sums = np.empty_like( local_sums )
+                maxima = np.empty_like( local_max )
+            else:
+                sums = None
+                maxima = None
+            self.comm.mpi_comm.Reduce( local_sums, sums, op=MPI.SUM, root=0 )
+            self.comm.mpi_comm.Reduce( local_max, maxima, op=MPI.MAX, root=0 )
+        else:
+            sums = local_sums
+            maxima = local_max
+
+        # Append the results to the file
+        if self.rank == 0:
+            data = { 'iteration': iteration,
+                     'time': iteration * self.fld.dt,
+                     'energy': sums[:self.Nm],
+                     'max_E': maxima[0], 'max_E_perp': maxima[1] }
+            if self.lambda0 is not None:
+                omega0 = 2*np.pi*c/self.lambda0
+                data['a0'] = e*maxima[1]/(m_e*c*omega0)
+            W, Wz, Wz2, Wr2 = sums[ self.Nm:self.Nm+4 ]
+            if W > 0:
+                data['laser_centroid_z'] = zmin + Wz/W
+                data['laser_rms_z'] = np.sqrt( max( Wz2/W - (Wz/W)**2, 0 ) )
+                data['laser_waist'] = np.sqrt( 2*Wr2/W )
+            else:
+                data['laser_centroid_z'] = 0.
+                data['laser_rms_z'] = 0.
+                data['laser_waist'] = 0.
+            if self.lineout:
+                data['Ez_axis'] = sums[ self.Nm+4: ]
+                data['Ez_axis_zmin'] = zmin + 0.5*dz
+            with self.open_time_series_file( self.filename, iteration ) as f:
+                self.append_time_series_data( f, data )
+                f.attrs['dz'] = dz
+
+@njit_parallel
+def get_reduced_fields_numba( Er, Et, Ez, Br, Bt, Bz, r, dr, laser_modes,
+        cos_m_theta, sin_m_theta, energy, laser_energy, laser_r2,
+        max_E, max_E_perp ):
+    """
+    Calculate the field reductions for each slice in z, using numba prange
+    on the CPU (the threads loop over the slices).
+
+    The fields are reconstructed in the openPMD convention, i.e.
+    F(theta) = Re(F_0) + sum_m 2 Re( F_m exp(-i m theta) )
+
+    Parameters
+    ----------
+    Er, Et, Ez, Br, Bt, Bz : 3darrays of complexs, of shape (Nm, Nz, Nr)
+        The fields of each mode, on the interpolation grid
+
+    r : 1darray of floats
+        The radial position of the cells
+
+    dr : float
+        The radial size of the cells
+
+    laser_modes : 1darray of bools
+        Whether each mode contributes to the laser energy density
+
+    cos_m_theta, sin_m_theta : 2darrays of floats, of shape (n_theta, Nm)
+        The phases of each mode, at the angles where the fields
+        are reconstructed
+
+    energy : 2darray of floats, of shape (Nz, Nm)
+        Sum over r of (|E|**2 + c**2 |B|**2) * 2 pi r dr, for each mode
+        (Modified by this function)
+
+    laser_energy, laser_r2 : 1darrays of floats, of shape (Nz)
+        Sum over r of |E_perp|**2 * 2 pi r dr in the laser modes,
+        and of the same quantity weighted by r**2
+        (Modified by this function)
+
+    max_E, max_E_perp : 1darrays of floats, of shape (Nz)
+        The maximum of |E| and of |E_perp| over r and theta
+        (Modified by this function)
+    """
+    Nm, Nz, Nr = Er.shape
+    n_theta = cos_m_theta.shape[0]
+    for iz in prange( Nz ):
+        for ir in range( Nr ):
+            # Integral over theta: 2 pi for mode 0, 4 pi for the others
+            # (since the fields of the modes m>0 are multiplied by 2)
+            dS = 2*np.pi*r[ir]*dr
+            for m in range( Nm ):
+                if m == 0:
+                    weight = dS
+                else:
+                    weight = 2*dS
+                E2 = abs(Er[m,iz,ir])**2 + abs(Et[m,iz,ir])**2
+                B2 = abs(Br[m,iz,ir])**2 + abs(Bt[m,iz,ir])**2 \
+                    + abs(Bz[m,iz,ir])**2
+                energy[iz, m] += weight * \
+                    ( E2 + abs(Ez[m,iz,ir])**2 + c**2*B2 )
+                if laser_modes[m]:
+                    laser_energy[iz] += weight * E2
+                    laser_r2[iz] += weight * E2 * r[ir]**2
+            # Reconstruct the fields at each angle
+            # (|E_perp| does not depend on the orientation of the
+            # local (r, theta) basis, so Er and Et can be used directly)
+            for it in range( n_theta ):
+                er = Er[0,iz,ir].real
+                et = Et[0,iz,ir].real
+                ez = Ez[0,iz,ir].real
+                for m in range( 1, Nm ):
+                    cos = 2*cos_m_theta[it, m]
+                    sin = 2*sin_m_theta[it, m]
+                    er += Er[m,iz,ir].real*cos + Er[m,iz,ir].imag*sin
+                    et += Et[m,iz,ir].real*cos + Et[m,iz,ir].imag*sin
+                    ez += Ez[m,iz,ir].real*cos + Ez[m,iz,ir].imag*sin
+                E_perp = np.sqrt( er**2 + et**2 )
+                E = np.sqrt( er**2 + et**2 + ez**2 )
+                if E_perp > max_E_perp[iz]:
+                    max_E_perp[iz] = E_perp
+                if E > max_E[iz]:
+                    max_E[iz] = E
+    return
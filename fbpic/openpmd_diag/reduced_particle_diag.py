@@ -0,0 +1,527 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This file defines the class ReducedParticleDiagnostic.
+"""
+import os
+import numpy as np
+from scipy import constants
+from fbpic.utils.threading import njit_parallel, prange, nthreads, \
+    get_chunk_indices
+from fbpic.utils.mpi import MPI
+from .generic_diag import OpenPMDDiagnostic
+
+# Check if CUDA is available, then import CUDA functions
+from fbpic.utils.cuda import cuda_installed
+if cuda_installed:
+    import cupy
+
+# Quantities for which the moments are calculated (in this order)
+reduced_quantities = [ 'x', 'y', 'z', 'ux', 'uy', 'uz', 'gamma' ]
+n_quantities = len( reduced_quantities )
+# Index of the sums in the reduced array:
+# number of macroparticles, total weight, total charge (in units of e),
+# sums of w*q and sums of w*q_i*q_j (upper triangle of the matrix)
+i_count = 0
+i_weight = 1
+i_charge = 2
+i_first_moment = 3
+i_second_moment = i_first_moment + n_quantities
+n_sums = i_second_moment + n_quantities*(n_quantities+1)//2
+
+
+class ReducedParticleDiagnostic(OpenPMDDiagnostic):
+    """
+    Class that computes reduced quantities of the particles (moments,
+    normalized emittances, charge and histograms) during the simulation,
+    and appends them to a single time-series HDF5 file.
+
+    The quantities are calculated on each rank in two passes over the
+    particles: the first pass calculates the mean of each quantity (over
+    all ranks), and the second pass calculates the moments with respect to
+    this mean (which avoids the loss of precision of <q**2> - <q>**2,
+    e.g. for the energy spread of a high-energy beam). The file is
+    truncated at the first output, unless the simulation was restarted
+    (see `OpenPMDDiagnostic.open_time_series_file`). It contains
+    one group per species, with the datasets:
+
+    - `iteration`, `time`
+    - `n_macroparticles`, `weight` (i.e. number of physical particles)
+      and `charge` (in Coulomb) of the selected particles
+    - `mean` and `rms`: arrays of shape (n_outputs, 7), for the quantities
+      x, y, z (meters), ux, uy, uz (dimensionless momenta) and gamma
+      (listed in the attribute `quantities` of the file)
+    - `covariance`: array of shape (n_outputs, 7, 7)
+    - `emittance_x`, `emittance_y`: normalized emittances (meters.radians)
+    - `histograms/<name>`: weighted histograms, of shape (n_outputs, nbins)
+      or (n_outputs, nbins1, nbins2), with the bin edges stored as
+      attributes (`edges` or `edges1`, `edges2`)
+    """
+
+    def __init__(self, period=None, species={}, comm=None, select=None,
+                 histograms={}, write_dir=None, filename='reduced_particles.h5',
+                 iteration_min=0, iteration_max=np.inf, dt_period=None ):
+        """
+        Initialize the reduced particle diagnostic.
+
+        Parameters
+        ----------
+        period : int, optional
+            The period of the diagnostics, in number of timesteps.
+            (i.e. the diagnostics are written whenever the number
+            of iterations is divisible by `period`). Specify either this or
+            `dt_period`.
+
+        dt_period : float (in seconds), optional
+            The period of the diagnostics, in physical time of the simulation.
+            Specify either this or `period`
+
+        species : a dictionary of :any:`Particles` objects
+            Similar to the corresponding object for `ParticleDiagnostic`
+
+        comm : an fbpic BoundaryCommunicator object or None
+            If this is not None, the results are reduced over all the ranks.
+            Otherwise, each rank calculates the reduced quantities of
+            its own particles (including guard cells).
+            (Make sure to use different write_dir in this case.)
+
+        select : dict, optional
+            Either None or a dictionary of rules to select the particles,
+            of the same form as for `ParticleDiagnostic`. The rules
+            can apply to 'x', 'y', 'z', 'ux', 'uy', 'uz' and 'gamma'.
+
+        histograms : dict, optional
+            The histograms to be calculated. For a 1D histogram, the key
+            is one of the above quantities and the value is a tuple
+            (nbins, min, max), e.g. 'gamma': (100, 1., 200.). For a 2D
+            histogram, the key is a tuple of two quantities and the value
+            is a tuple of two such tuples, e.g.
+            ('z', 'uz'): ((50, 0., 20.e-6), (100, 0., 400.)).
+            Particles outside of the bins are not counted.
+
+        write_dir : string, optional
+            The POSIX path to the directory where the results are
+            to be written. If none is provided, this will be the path
+            of the current working directory.
+
+        filename : string, optional
+            The name of the time-series file, in `write_dir`
+
+        iteration_min, iteration_max: ints
+            The iterations between which data should be written
+            (`iteration_min` is inclusive, `iteration_max` is exclusive)
+        """
+        # Check input
+        if len(species) == 0:
+            raise ValueError("You need to pass an non-empty `species_dict`.")
+        # Build an ordered list of species (see ParticleDiagnostic)
+        self.species_names_list = sorted( species.keys() )
+        self.species_dict = species
+        self.dt = species[self.species_names_list[0]].dt
+
+        # General setup
+        OpenPMDDiagnostic.__init__(self, period, comm, write_dir,
+                        iteration_min, iteration_max,
+                        dt_period=dt_period, dt_sim=self.dt )
+        self.filename = os.path.join( self.write_dir, filename )
+
+        # Convert the selection rules into bounds for each quantity
+        self.lower_bounds = -np.inf * np.ones( n_quantities )
+        self.upper_bounds = np.inf * np.ones( n_quantities )
+        if select is not None:
+            for quantity, (lower, upper) in select.items():
+                if quantity not in reduced_quantities:
+                    raise ValueError(
+                        "Invalid quantity in `select`: %s" %quantity)
+                i = reduced_quantities.index( quantity )
+                if lower is not None:
+                    self.lower_bounds[i] = lower
+                if upper is not None:
+                    self.upper_bounds[i] = upper
+
+        # Convert the histograms into arrays of bin properties
+        # (One line per histogram, one column per dimension ;
+        # for a 1D histogram, the second dimension has a single bin)
+        self.histogram_names = []
+        self.histogram_shapes = []
+        self.histogram_edges = []
+        n_hist = len( histograms )
+        self.hist_iq = np.zeros( (n_hist, 2), dtype=np.int64 )
+        self.hist_nbins = np.ones( (n_hist, 2), dtype=np.int64 )
+        self.hist_min = np.zeros( (n_hist, 2) )
+        self.hist_inv_d = np.zeros( (n_hist, 2) )
+        for k, key in enumerate( sorted( histograms.keys(), key=str ) ):
+            if isinstance( key, str ):
+                quantities = [ key ]
+                bins = [ histograms[key] ]
+            else:
+                quantities = list( key )
+                bins = list( histograms[key] )
+            if len(quantities) not in [1, 2] or len(bins) != len(quantities):
+                raise ValueError("Invalid histogram: %s" %str(key))
+            edges = []
+            for d, (quantity, (nbins, qmin, qmax)) in \
+                    enumerate( zip( quantities, bins ) ):
+                if quantity not in reduced_quantities:
+                    raise ValueError(
+                        "Invalid quantity in `histograms`: %s" %quantity)
+                self.hist_iq[k, d] = reduced_quantities.index( quantity )
+                self.hist_nbins[k, d] = nbins
+                self.hist_min[k, d] = qmin
+                self.hist_inv_d[k, d] = nbins/(qmax - qmin)
+                edges.append( np.linspace( qmin, qmax, nbins+1 ) )
+            if len(quantities) == 1:
+                # Dummy second dimension: all particles fall in bin 0
+                # (since hist_min and hist_inv_d are 0 for this dimension)
+                self.hist_iq[k, 1] = self.hist_iq[k, 0]
+            self.histogram_names.append( '_'.join( quantities ) )
+            self.histogram_shapes.append( tuple( len(e)-1 for e in edges ) )
+            self.histogram_edges.append( edges )
+        self.hist_offsets = np.zeros( n_hist+1, dtype=np.int64 )
+        self.hist_offsets[1:] = np.cumsum( self.hist_nbins.prod(axis=1) )
+
+    def write_hdf5( self, iteration ):
+        """
+        Calculate the reduced quantities and append them to the file
+
+        Parameter
+        ---------
+        iteration : int
+             The current iteration number of the simulation.
+        """
+        n_per_species = n_sums + self.hist_offsets[-1]
+        use_mpi = (self.comm is not None) and (self.comm.size > 1)
+
+        # First pass: calculate the mean of each quantity, for all species
+        local_sums = np.concatenate( [ self.get_local_sums(
+            self.species_dict[species_name], np.zeros( n_quantities ),
+            first_moments_only=True )
+            for species_name in self.species_names_list ] )
+        if use_mpi:
+            sums = np.empty_like( local_sums )
+            self.comm.mpi_comm.Allreduce( local_sums, sums, op=MPI.SUM )
+        else:
+            sums = local_sums
+        shifts = []
+        for i in range( len(self.species_names_list) ):
+            species_sums = sums[ i*n_per_species:(i+1)*n_per_species ]
+            if species_sums[i_weight] > 0:
+                shifts.append( species_sums[i_first_moment:i_second_moment] \
+                                / species_sums[i_weight] )
+            else:
+                shifts.append( np.zeros( n_quantities ) )
+
+        # Second pass: calculate the moments with respect to the mean
+        local_sums = np.concatenate( [ self.get_local_sums(
+            self.species_dict[species_name], shifts[i] )
+            for i, species_name in enumerate( self.species_names_list ) ] )
+
+        # Combine the results of all ranks
+        if use_mpi:
+            if self.rank == 0:
+                sums = np.empty_like( local_sums )
+            else:
+                sums = None
+            self.comm.mpi_comm.Reduce( local_sums, sums, op=MPI.SUM, root=0 )
+        else:
+            sums = local_sums
+
+        # Append the results to the file
+        if self.rank == 0:
+            with self.open_time_series_file( self.filename, iteration ) as f:
+                for i, species_name in enumerate( self.species_names_list ):
+                    self.append_species_data( f, species_name, iteration,
+                        sums[ i*n_per_species:(i+1)*n_per_species ],
+                        shifts[i] )
+
+    def get_local_sums( self, species, shift, first_moments_only=False ):
+        """
+        Return a 1d array with the sums over the local particles of
+        `species` (see `n_sums`), followed by the histograms.
+
+        Parameters
+        ----------
+        species : a Particles object
+
+        shift : 1darray of floats
+            The value that is subtracted from each quantity, before
+            calculating the first and second moments
+
+        first_moments_only : bool, optional
+            Whether to calculate only the number of macroparticles, the
+            weight and the first moments (the other sums are left to 0)
+        """
+        n_hist_tot = self.hist_offsets[-1]
+        if species.Ntot == 0:
+            return( np.zeros( n_sums + n_hist_tot ) )
+
+        if species.ionizer is not None:
+            ionization_level = species.ionizer.ionization_level
+            use_ionization = True
+        else:
+            ionization_level = np.zeros( 1, dtype=np.uint64 )
+            use_ionization = False
+
+        if species.use_cuda:
+            return( get_reduced_sums_cuda( species.x, species.y, species.z,
+                species.ux, species.uy, species.uz, species.inv_gamma,
+                species.w, ionization_level, use_ionization,
+                self.lower_bounds, self.upper_bounds, shift,
+                first_moments_only, self.hist_iq, self.hist_nbins,
+                self.hist_min, self.hist_inv_d, self.hist_offsets ) )
+
+        ptcl_chunk_indices = get_chunk_indices( species.Ntot, nthreads )
+        sums = np.zeros( (nthreads, n_sums) )
+        histograms = np.zeros( (nthreads, n_hist_tot) )
+        get_reduced_sums_numba( species.x, species.y, species.z,
+            species.ux, species.uy, species.uz, species.inv_gamma,
+            species.w, ionization_level, use_ionization,
+            self.lower_bounds, self.upper_bounds, shift, first_moments_only,
+            self.hist_iq, self.hist_nbins, self.hist_min, self.hist_inv_d,
+            self.hist_offsets, nthreads, ptcl_chunk_indices,
+            sums, histograms )
+        return( np.concatenate( [ sums.sum(axis=0), histograms.sum(axis=0) ] ) )
+
+    def append_species_data( self, f, species_name, iteration,
+                             sums, shift ):
+        """
+        Calculate the moments from the sums, and append them
+        to the datasets of `species_name` in the file `f`
+
+        Parameters
+        ----------
+        f : an h5py.File object
+
+        species_name : string
+
+        iteration : int
+
+        sums : 1darray
+            The sums of the species over all ranks (see `get_local_sums`)
+
+        shift : 1darray
+            The value that was subtracted from each quantity in the sums
+        """
+        species = self.species_dict[species_name]
+        # Calculate the moments
+        weight = sums[i_weight]
+        if weight > 0:
+            # Mean of the shifted quantities (close to 0)
+            shifted_mean = sums[i_first_moment:i_second_moment] / weight
+            mean = shift + shifted_mean
+            covariance = np.zeros( (n_quantities, n_quantities) )
+            i_sum = i_second_moment
+            for i in range(n_quantities):
+                for j in range(i, n_quantities):
+                    covariance[i, j] = sums[i_sum]/weight \
+                        - shifted_mean[i]*shifted_mean[j]
+                    covariance[j, i] = covariance[i, j]
+                    i_sum += 1
+        else:
+            mean = np.zeros( n_quantities )
+            covariance = np.zeros( (n_quantities, n_quantities) )
+        rms = np.sqrt( np.maximum( np.diag( covariance ), 0 ) )
+        emittances = []
+        for ix, iu in [ (0, 3), (1, 4) ]:
+            emittances.append( np.sqrt( max( covariance[ix, ix] * \
+                covariance[iu, iu] - covariance[ix, iu]**2, 0. ) ) )
+        if species.ionizer is not None:
+            charge = constants.e * sums[i_charge]
+        else:
+            charge = species.q * weight
+
+        # Append the data to the datasets
+        data = {
+            'iteration': iteration, 'time': iteration * self.dt,
+            'n_macroparticles': sums[i_count], 'weight': weight,
+            'charge': charge, 'mean': mean, 'rms': rms,
+            'covariance': covariance, 'emittance_x': emittances[0],
+            'emittance_y': emittances[1] }
+        for k, name in enumerate( self.histogram_names ):
+            data['histograms/%s' %name] = \
+                sums[ n_sums + self.hist_offsets[k] :
+                      n_sums + self.hist_offsets[k+1] ].reshape(
+                          self.histogram_shapes[k] )
+        self.append_time_series_data( f.require_group( species_name ), data )
+        f.attrs['quantities'] = np.array(
+            [ np.string_(q) for q in reduced_quantities ] )
+
+    def setup_dataset_attributes( self, dset, path ):
+        """
+        Store the bin edges of the histograms as attributes
+
+        Parameters
+        ----------
+        dset : an h5py.Dataset object
+
+        path : string
+            The path of the dataset, in the species group
+        """
+        if path.startswith('histograms/'):
+            k = self.histogram_names.index( path[len('histograms/'):] )
+            edges = self.histogram_edges[k]
+            if len(edges) == 1:
+                dset.attrs['edges'] = edges[0]
+            else:
+                dset.attrs['edges1'] = edges[0]
+                dset.attrs['edges2'] = edges[1]
+
+
+@njit_parallel
+def get_reduced_sums_numba( x, y, z, ux, uy, uz, inv_gamma, w,
+        ionization_level, use_ionization, lower_bounds, upper_bounds,
+        shift, first_moments_only, hist_iq, hist_nbins, hist_min,
+        hist_inv_d, hist_offsets, nthreads, ptcl_chunk_indices,
+        sums, histograms ):
+    """
+    Calculate the weighted sums of the selected particles and their
+    histograms using numba prange on the CPU, in a single pass over the
+    particles. Each thread stores its results in its own line of
+    `sums` and `histograms`. (The final reduction over the threads
+    is *not* done in this function)
+
+    Parameters
+    ----------
+    x, y, z, ux, uy, uz, inv_gamma, w : 1darrays of floats
+        The particle quantities
+
+    ionization_level : 1darray of ints
+        The ionization level of the particles (only if use_ionization)
+
+    lower_bounds, upper_bounds : 1darrays of floats
+        The selection rules, for each of the reduced quantities
+
+    shift : 1darray of floats
+        The value that is subtracted from each quantity, for the moments
+        (The selection rules and histograms use the unshifted quantities)
+
+    first_moments_only : bool
+        Whether to skip the charge, second moments and histograms
+
+    hist_iq, hist_nbins, hist_min, hist_inv_d : 2darrays
+        The index of the quantity, number of bins, lower bound and inverse
+        bin size, for each histogram (first index) and dimension
+
+    hist_offsets : 1darray of ints
+        The index of each histogram in the array `histograms`
+
+    nthreads : int
+        Number of CPU threads used with numba prange
+
+    ptcl_chunk_indices : array of int, of size nthreads+1
+        The indices (of the particle array) between which each thread
+        should loop. (i.e. divisions of particle array between threads)
+
+    sums, histograms : 2darrays of floats, of shape (nthreads, ...)
+        Thread-local results (modified by this function)
+    """
+    n_q = lower_bounds.shape[0]
+    n_hist = hist_iq.shape[0]
+    for i_thread in prange( nthreads ):
+
+        q = np.empty( n_q )
+        for i_ptcl in range( ptcl_chunk_indices[i_thread],
+                             ptcl_chunk_indices[i_thread+1] ):
+            q[0] = x[i_ptcl]
+            q[1] = y[i_ptcl]
+            q[2] = z[i_ptcl]
+            q[3] = ux[i_ptcl]
+            q[4] = uy[i_ptcl]
+            q[5] = uz[i_ptcl]
+            q[6] = 1./inv_gamma[i_ptcl]
+
+            # Apply the selection rules
+            selected = True
+            for i in range(n_q):
+                if not ( (q[i] > lower_bounds[i]) and \
+                         (q[i] < upper_bounds[i]) ):
+                    selected = False
+            if not selected:
+                continue
+
+            wj = w[i_ptcl]
+            sums[i_thread, 0] += 1.
+            sums[i_thread, 1] += wj
+            if first_moments_only:
+                for i in range(n_q):
+                    sums[i_thread, 3+i] += wj * ( q[i] - shift[i] )
+                continue
+
+            # Add the contribution to the sums
+            if use_ionization:
+                sums[i_thread, 2] += wj * ionization_level[i_ptcl]
+            i_sum = 3 + n_q
+            for i in range(n_q):
+                wq = wj * ( q[i] - shift[i] )
+                sums[i_thread, 3+i] += wq
+                for j in range(i, n_q):
+                    sums[i_thread, i_sum] += wq * ( q[j] - shift[j] )
+                    i_sum += 1
+
+            # Add the contribution to the histograms
+            for k in range(n_hist):
+                ib0 = int( np.floor( (q[hist_iq[k,0]] - hist_min[k,0]) \
+                                     * hist_inv_d[k,0] ) )
+                ib1 = int( np.floor( (q[hist_iq[k,1]] - hist_min[k,1]) \
+                                     * hist_inv_d[k,1] ) )
+                if (ib0 >= 0) and (ib0 < hist_nbins[k,0]) and \
+                   (ib1 >= 0) and (ib1 < hist_nbins[k,1]):
+                    histograms[i_thread,
+                        hist_offsets[k] + ib0*hist_nbins[k,1] + ib1 ] += wj
+
+    return
+
+
+def get_reduced_sums_cuda( x, y, z, ux, uy, uz, inv_gamma, w,
+        ionization_level, use_ionization, lower_bounds, upper_bounds,
+        shift, first_moments_only, hist_iq, hist_nbins, hist_min,
+        hist_inv_d, hist_offsets ):
+    """
+    Calculate the same sums as `get_reduced_sums_numba`, for particles on
+    the GPU, with array operations on the GPU. Only the results are copied
+    to the CPU.
+
+    Returns
+    -------
+    A 1darray on the CPU, with the sums followed by the histograms
+    """
+    q = cupy.stack( [ x, y, z, ux, uy, uz, 1./inv_gamma ] )
+    selected = cupy.ones( x.shape, dtype=bool )
+    for i in range( n_quantities ):
+        if np.isfinite( lower_bounds[i] ):
+            selected &= ( q[i] > lower_bounds[i] )
+        if np.isfinite( upper_bounds[i] ):
+            selected &= ( q[i] < upper_bounds[i] )
+    w_sel = cupy.where( selected, w, 0. )
+
+    sums = [ selected.sum(), w_sel.sum() ]
+    if use_ionization and not first_moments_only:
+        sums.append( ( w_sel * ionization_level ).sum() )
+    else:
+        sums.append( 0. )
+    dq = q - cupy.asarray( shift )[:, np.newaxis]
+    wq = dq * w_sel
+    sums += list( wq.sum( axis=1 ) )
+    if first_moments_only:
+        sums = cupy.stack( [ cupy.asarray(s, dtype=np.float64) for s in sums ] )
+        return( np.concatenate( [ sums.get(),
+            np.zeros( n_sums - len(sums) + int(hist_offsets[-1]) ) ] ) )
+    second_moments = wq.dot( dq.T )
+    for i in range( n_quantities ):
+        for j in range( i, n_quantities ):
+            sums.append( second_moments[i, j] )
+    sums = cupy.stack( [ cupy.asarray(s, dtype=np.float64) for s in sums ] )
+
+    histograms = []
+    for k in range( hist_iq.shape[0] ):
+        ib0 = cupy.floor( (q[hist_iq[k,0]] - hist_min[k,0])*hist_inv_d[k,0] )
+        ib1 = cupy.floor( (q[hist_iq[k,1]] - hist_min[k,1])*hist_inv_d[k,1] )
+        in_bins = (ib0 >= 0) & (ib0 < hist_nbins[k,0]) & \
+                  (ib1 >= 0) & (ib1 < hist_nbins[k,1])
+        index = cupy.where( in_bins,
+                ib0*hist_nbins[k,1] + ib1, 0 ).astype( np.int64 )
+        histograms.append( cupy.bincount( index,
+            weights=cupy.where( in_bins, w_sel, 0. ),
+            minlength=int( hist_offsets[k+1] - hist_offsets[k] ) ) )
+
+    return( cupy.concatenate( [ sums ] + histograms ).get() )
@@ -0,0 +1,143 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This file defines the class SliceBuffer, which is used by the
+back-transformed diagnostics to buffer the slices of a lab-frame snapshot
+between two flushes to disk, within a given memory budget.
+"""
+import os
+import numpy as np
+
+class SliceBuffer(object):
+    """
+    Buffer for a sequence of slices, where each slice is a dictionary of
+    arrays (the arrays of a given key have the same dtype and the same
+    shape, except along their first axis).
+
+    The slices are kept in memory as long as their total size is below
+    `memory_budget`. Once this budget is exceeded, the buffered slices
+    are appended to raw staging files on disk (one file per key), and
+    the memory is released. When the buffer is read, the staged data and
+    the data in memory are concatenated along the first axis, in the order
+    in which the slices were appended.
+    """
+    def __init__( self, staging_prefix, memory_budget=None ):
+        """
+        Initialize an empty buffer
+
+        Parameters
+        ----------
+        staging_prefix: string
+            Path prefix of the staging files (the name of the key and
+            the extension `.bin` are appended to this prefix). The staging
+            files are only created if the memory budget is exceeded.
+
+        memory_budget: int or None, optional
+            Maximal number of bytes that this buffer keeps in memory.
+            If None, the slices are always kept in memory.
+        """
+        self.staging_prefix = staging_prefix
+        self.memory_budget = memory_budget
+
+        # Slices in memory, and their total size in bytes
+        self.slices = []
+        self.nbytes = 0
+        # Slices on disk: dtype, shape and number of rows per key
+        self.staged = {}
+        self.n_staged_slices = 0
+
+    def __len__( self ):
+        """Return the total number of slices (in memory and on disk)"""
+        return( self.n_staged_slices + len(self.slices) )
+
+    def append( self, slice_dict ):
+        """
+        Append a slice to the buffer, and spill the buffer to disk
+        if the memory budget is exceeded
+
+        Parameters
+        ----------
+        slice_dict: dictionary of ndarrays
+            The data of the slice
+        """
+        self.slices.append( slice_dict )
+        self.nbytes += sum( array.nbytes for array in slice_dict.values() )
+        if (self.memory_budget is not None) and \
+                (self.nbytes > self.memory_budget):
+            self.spill()
+
+    def spill( self ):
+        """
+        Append the slices that are in memory to the staging files,
+        and release the corresponding memory
+        """
+        if len(self.slices) == 0:
+            return
+        # Create the staging directory if needed
+        staging_dir = os.path.dirname( self.staging_prefix )
+        if staging_dir != '' and not os.path.exists( staging_dir ):
+            try:
+                os.makedirs( staging_dir )
+            except OSError:
+                # (The directory may have been created by another process)
+                if not os.path.isdir( staging_dir ):
+                    raise
+
+        # Append the data of each key to the corresponding file
+        for key in self.slices[0].keys():
+            arrays = [ slice_dict[key] for slice_dict in self.slices ]
+            n_rows = sum( array.shape[0] for array in arrays )
+            if key in self.staged:
+                dtype, shape, n_staged_rows = self.staged[key]
+            else:
+                dtype = arrays[0].dtype
+                shape = arrays[0].shape[1:]
+                n_staged_rows = 0
+            with open( self.get_staging_file(key), 'ab' ) as f:
+                for array in arrays:
+                    np.ascontiguousarray( array, dtype=dtype ).tofile( f )
+            self.staged[key] = ( dtype, shape, n_staged_rows + n_rows )
+        self.n_staged_slices += len(self.slices)
+
+        # Release the memory
+        self.slices = []
+        self.nbytes = 0
+
+    def get( self, key ):
+        """
+        Return the data of all the slices for a given key, concatenated
+        along the first axis (in the order in which they were appended)
+
+        Parameters
+        ----------
+        key: string
+            The key of the slice dictionaries
+
+        Returns
+        -------
+        An ndarray, or None if the buffer is empty
+        """
+        arrays = []
+        if key in self.staged:
+            dtype, shape, n_rows = self.staged[key]
+            data = np.fromfile( self.get_staging_file(key), dtype=dtype )
+            arrays.append( data.reshape( (n_rows,) + shape ) )
+        arrays += [ slice_dict[key] for slice_dict in self.slices ]
+        if len(arrays) == 0:
+            return( None )
+        return( np.concatenate( arrays ) )
+
+    def clear( self ):
+        """
+        Erase all the slices, in memory and on disk
+        """
+        for key in self.staged:
+            os.remove( self.get_staging_file(key) )
+        self.staged = {}
+        self.n_staged_slices = 0
+        self.slices = []
+        self.nbytes = 0
+
+    def get_staging_file( self, key ):
+        """Return the path of the staging file for a given key"""
+        return( self.staging_prefix + '_%s.bin' %key )
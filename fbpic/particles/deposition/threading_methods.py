@@ -8,7 +8,8 @@ order shapes on the CPU with threading.
 """
 import numpy as np
 import numba
-from fbpic.utils.threading import njit_parallel, prange
+from fbpic.utils.threading import njit_parallel, prange, \
+    nthreads, get_chunk_indices
 import math
 from scipy.constants import c
 from fbpic.particles.deposition.particle_shapes import Sz_linear, \
@@ -20,6 +21,34 @@ Sr_linear = numba.njit(Sr_linear)
 Sz_cubic = numba.njit(Sz_cubic)
 Sr_cubic = numba.njit(Sr_cubic)
 
+@numba.njit
+def update_deposit_bounds( deposit_bounds, i_thread,
+                           iz_start, iz_end, ir_start, ir_end, Nz, Nr ):
+    """
+    Extend the region of the threading buffer that was modified by the
+    thread `i_thread` (stored in `deposit_bounds`) so that it contains
+    the cells [iz_start:iz_end, ir_start:ir_end] (which include the 2
+    deposition guard cells on each side)
+
+    If these cells are not within the buffer (which happens only for
+    particles outside of the box), the whole buffer is marked as modified.
+    """
+    # Do not modify the bounds if no particle was deposited
+    if iz_end <= iz_start:
+        return
+    # Particles outside of the box: mark the whole buffer as modified
+    if iz_start < 0 or iz_end > Nz+4:
+        iz_start = 0
+        iz_end = Nz+4
+    if ir_start < 0 or ir_end > Nr+4:
+        ir_start = 0
+        ir_end = Nr+4
+    # Merge with the region modified by previous deposition kernels
+    deposit_bounds[i_thread, 0] = min( deposit_bounds[i_thread, 0], iz_start )
+    deposit_bounds[i_thread, 1] = max( deposit_bounds[i_thread, 1], iz_end )
+    deposit_bounds[i_thread, 2] = min( deposit_bounds[i_thread, 2], ir_start )
+    deposit_bounds[i_thread, 3] = max( deposit_bounds[i_thread, 3], ir_end )
+
 # -------------------------------
 # Field deposition - linear - rho
 # -------------------------------
@@ -29,8 +58,8 @@ def deposit_rho_numba_linear(x, y, z, w, q,
                            invdz, zmin, Nz,
                            invdr, rmin, Nr,
                            rho_global, Nm,
-                           nthreads, ptcl_chunk_indices,
-                           beta_n_m_0, beta_n_m_higher):
+                           nthreads, ptcl_chunk_indices, species_indices,
+                           deposit_bounds, beta_n_m_0, beta_n_m_higher):
     """
     Deposition of the charge density rho using numba prange on the CPU.
     Iterates over the threads in parallel, while each thread iterates
@@ -38,21 +67,23 @@ def deposit_rho_numba_linear(x, y, z, w, q,
     stored in copies of the global grid. At the end of the parallel loop,
     the thread-local field arrays are combined (summed) to a global array.
     (This final reduction is *not* done in this function)
+    Several species can be deposited in a single call: their particles
+    are then divided between the threads as a single combined set.
 
     Calculates the weighted amount of rho that is deposited to the
     4 cells surounding the particle based on its shape (linear).
 
     Parameters
     ----------
-    x, y, z : 1darray of floats (in meters)
-        The position of the particles
+    x, y, z : tuples of 1darrays of floats (in meters)
+        The position of the particles (one array per species)
 
-    w : 1d array of floats
-        The weights of the particles
+    w : tuple of 1d arrays of floats
+        The weights of the particles (one array per species)
         (For ionizable atoms: weight times the ionization level)
 
-    q : float
-        Charge of the species
+    q : 1darray of floats
+        Charge of each species
         (For ionizable atoms: this is always the elementary charge e)
 
     rho_global : 4darrays of complexs
@@ -78,8 +109,19 @@ def deposit_rho_numba_linear(x, y, z, w, q,
         Number of CPU threads used with numba prange
 
     ptcl_chunk_indices : array of int, of size nthreads+1
-        The indices (of the particle array) between which each thread
-        should loop. (i.e. divisions of particle array between threads)
+        The indices (of the combined set of particles of all species)
+        between which each thread should loop.
+        (i.e. divisions of the combined particle set between threads)
+
+    species_indices : array of int, of size (number of species)+1
+        The indices that bound each species, in the combined set of
+        particles of all species (i.e. cumulated number of particles)
+
+    deposit_bounds : 2darray of ints
+        Array of shape (nthreads, 4) that contains, for each thread, the
+        bounds iz_min, iz_max, ir_min, ir_max (exclusive upper bounds) of
+        the cells of the global arrays that were modified by the deposition.
+        (is extended by this function, to include the cells that it modifies)
 
     beta_n_m_0 : 1darray of floats
         Ruyten-corrected particle shape factor coefficients for mode 0.
@@ -93,57 +135,85 @@ def deposit_rho_numba_linear(x, y, z, w, q,
 
         # Allocate thread-local array
         rho_scal = np.zeros( Nm, dtype=np.complex128 )
-
-        # Loop over all particles in thread chunk
-        for i_ptcl in range( ptcl_chunk_indices[i_thread],
-                             ptcl_chunk_indices[i_thread+1] ):
-
-            # Position
-            xj = x[i_ptcl]
-            yj = y[i_ptcl]
-            zj = z[i_ptcl]
-            # Weights
-            wj = q * w[i_ptcl]
-
-            # Cylindrical conversion
-            rj = math.sqrt(xj**2 + yj**2)
-            # Avoid division by 0.
-            if (rj != 0.):
-                invr = 1./rj
-                cos = xj*invr  # Cosine
-                sin = yj*invr  # Sine
-            else:
-                cos = 1.
-                sin = 0.
-            # Calculate contribution from this particle to each mode
-            rho_scal[0] = wj
-            for m in range(1,Nm):
-                rho_scal[m] = (cos + 1.j*sin)*rho_scal[m-1]
-
-            # Positions of the particles, in the cell unit
-            r_cell = invdr*(rj - rmin) - 0.5
-            z_cell = invdz*(zj - zmin) - 0.5
-            # Index of the lowest cell of `global_array` that gets modified
-            # by this particle (note: `global_array` has 2 guard cells)
-            # (`min` function avoids out-of-bounds access at high r)
-            ir_cell = min( int(math.ceil(r_cell))+1, Nr+2 )
-            iz_cell = int(math.ceil( z_cell )) + 1
-
-            ir = min( int(math.ceil(r_cell)), Nr )
-
-            # Add contribution of this particle to the global array
-            for m in range(Nm):
-
-                # Ruyten-corrected shape factor coefficient
-                if m == 0:
-                    bn = beta_n_m_0[ir]
+        # Region of the global arrays that is modified by this thread
+        iz_start = Nz+4
+        iz_end = 0
+        ir_start = Nr+4
+        ir_end = 0
+
+        # Loop over the species, and over the particles of each species
+        # that are in the thread chunk
+        for i_species in range( len(x) ):
+            i_start = max( ptcl_chunk_indices[i_thread],
+                           species_indices[i_species] )
+            i_end = min( ptcl_chunk_indices[i_thread+1],
+                         species_indices[i_species+1] )
+            if i_end <= i_start:
+                continue
+            # Arrays and charge of this species
+            xs = x[i_species]
+            ys = y[i_species]
+            zs = z[i_species]
+            ws = w[i_species]
+            qs = q[i_species]
+            for i_ptcl in range( i_start - species_indices[i_species],
+                                 i_end - species_indices[i_species] ):
+
+                # Position
+                xj = xs[i_ptcl]
+                yj = ys[i_ptcl]
+                zj = zs[i_ptcl]
+                # Weights
+                wj = qs * ws[i_ptcl]
+
+                # Cylindrical conversion
+                rj = math.sqrt(xj**2 + yj**2)
+                # Avoid division by 0.
+                if (rj != 0.):
+                    invr = 1./rj
+                    cos = xj*invr  # Cosine
+                    sin = yj*invr  # Sine
                 else:
-                    bn = beta_n_m_higher[ir]
-
-                rho_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 0, (-1)**m, bn) * rho_scal[m]
-                rho_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 1, (-1)**m, bn) * rho_scal[m]
-                rho_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 0, (-1)**m, bn) * rho_scal[m]
-                rho_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 1, (-1)**m, bn) * rho_scal[m]
+                    cos = 1.
+                    sin = 0.
+                # Calculate contribution from this particle to each mode
+                rho_scal[0] = wj
+                for m in range(1,Nm):
+                    rho_scal[m] = (cos + 1.j*sin)*rho_scal[m-1]
+
+                # Positions of the particles, in the cell unit
+                r_cell = invdr*(rj - rmin) - 0.5
+                z_cell = invdz*(zj - zmin) - 0.5
+                # Index of the lowest cell of `global_array` that gets modified
+                # by this particle (note: `global_array` has 2 guard cells)
+                # (`min` function avoids out-of-bounds access at high r)
+                ir_cell = min( int(math.ceil(r_cell))+1, Nr+2 )
+                iz_cell = int(math.ceil( z_cell )) + 1
+                # Extend the modified region (2 cells in each direction)
+                iz_start = min( iz_start, iz_cell )
+                iz_end = max( iz_end, iz_cell+2 )
+                ir_start = min( ir_start, ir_cell )
+                ir_end = max( ir_end, ir_cell+2 )
+
+                ir = min( int(math.ceil(r_cell)), Nr )
+
+                # Add contribution of this particle to the global array
+                for m in range(Nm):
+
+                    # Ruyten-corrected shape factor coefficient
+                    if m == 0:
+                        bn = beta_n_m_0[ir]
+                    else:
+                        bn = beta_n_m_higher[ir]
+
+                    rho_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 0, (-1)**m, bn) * rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 1, (-1)**m, bn) * rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 0, (-1)**m, bn) * rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 1, (-1)**m, bn) * rho_scal[m]
+
+        # Record the region modified by this thread
+        update_deposit_bounds( deposit_bounds, i_thread,
+            iz_start, iz_end, ir_start, ir_end, Nz, Nr )
 
     return
 
@@ -157,8 +227,8 @@ def deposit_J_numba_linear(x, y, z, w, q,
                          invdz, zmin, Nz,
                          invdr, rmin, Nr,
                          j_r_global, j_t_global, j_z_global, Nm,
-                         nthreads, ptcl_chunk_indices,
-                         beta_n_m_0, beta_n_m_higher):
+                         nthreads, ptcl_chunk_indices, species_indices,
+                         deposit_bounds, beta_n_m_0, beta_n_m_higher):
     """
     Deposition of the current density J using numba prange on the CPU.
     Iterates over the threads in parallel, while each thread iterates
@@ -166,28 +236,30 @@ def deposit_J_numba_linear(x, y, z, w, q,
     stored in copies of the global grid. At the end of the parallel loop,
     the thread-local field arrays are combined (summed) to the global array.
     (This final reduction is *not* done in this function)
+    Several species can be deposited in a single call: their particles
+    are then divided between the threads as a single combined set.
 
     Calculates the weighted amount of J that is deposited to the
     4 cells surounding the particle based on its shape (linear).
 
     Parameters
     ----------
-    x, y, z : 1darray of floats (in meters)
-        The position of the particles
+    x, y, z : tuples of 1darrays of floats (in meters)
+        The position of the particles (one array per species)
 
-    w : 1d array of floats
-        The weights of the particles
+    w : tuple of 1d arrays of floats
+        The weights of the particles (one array per species)
         (For ionizable atoms: weight times the ionization level)
 
-    q : float
-        Charge of the species
+    q : 1darray of floats
+        Charge of each species
         (For ionizable atoms: this is always the elementary charge e)
 
-    ux, uy, uz : 1darray of floats (in meters * second^-1)
-        The velocity of the particles
+    ux, uy, uz : tuples of 1darrays of floats (in meters * second^-1)
+        The velocity of the particles (one array per species)
 
-    inv_gamma : 1darray of floats
-        The inverse of the relativistic gamma factor
+    inv_gamma : tuple of 1darrays of floats
+        The inverse of the relativistic gamma factor (one array per species)
 
     j_x_global : 4darrays of complexs
         Global helper arrays of shape (nthreads, Nm, 2+Nz+2, 2+Nr+2) where the
@@ -212,8 +284,19 @@ def deposit_J_numba_linear(x, y, z, w, q,
         Number of CPU threads used with numba prange
 
     ptcl_chunk_indices : array of int, of size nthreads+1
-        The indices (of the particle array) between which each thread
-        should loop. (i.e. divisions of particle array between threads)
+        The indices (of the combined set of particles of all species)
+        between which each thread should loop.
+        (i.e. divisions of the combined particle set between threads)
+
+    species_indices : array of int, of size (number of species)+1
+        The indices that bound each species, in the combined set of
+        particles of all species (i.e. cumulated number of particles)
+
+    deposit_bounds : 2darray of ints
+        Array of shape (nthreads, 4) that contains, for each thread, the
+        bounds iz_min, iz_max, ir_min, ir_max (exclusive upper bounds) of
+        the cells of the global arrays that were modified by the deposition.
+        (is extended by this function, to include the cells that it modifies)
 
     beta_n_m_0 : 1darray of floats
         Ruyten-corrected particle shape factor coefficients for mode 0.
@@ -229,78 +312,109 @@ def deposit_J_numba_linear(x, y, z, w, q,
         jr_scal = np.zeros( Nm, dtype=np.complex128 )
         jt_scal = np.zeros( Nm, dtype=np.complex128 )
         jz_scal = np.zeros( Nm, dtype=np.complex128 )
-
-        # Loop over all particles in thread chunk
-        for i_ptcl in range( ptcl_chunk_indices[i_thread],
-                             ptcl_chunk_indices[i_thread+1] ):
-
-            # Position
-            xj = x[i_ptcl]
-            yj = y[i_ptcl]
-            zj = z[i_ptcl]
-            # Velocity
-            uxj = ux[i_ptcl]
-            uyj = uy[i_ptcl]
-            uzj = uz[i_ptcl]
-            # Inverse gamma
-            inv_gammaj = inv_gamma[i_ptcl]
-            # Weights
-            wj = q * w[i_ptcl]
-
-            # Cylindrical conversion
-            rj = math.sqrt(xj**2 + yj**2)
-            # Avoid division by 0.
-            if (rj != 0.):
-                invr = 1./rj
-                cos = xj*invr  # Cosine
-                sin = yj*invr  # Sine
-            else:
-                cos = 1.
-                sin = 0.
-            # Calculate contribution from this particle to each mode
-            jr_scal[0] = wj * c * inv_gammaj * (cos*uxj + sin*uyj)
-            jt_scal[0] = wj * c * inv_gammaj * (cos*uyj - sin*uxj)
-            jz_scal[0] = wj * c * inv_gammaj * uzj
-            for m in range(1,Nm):
-                jr_scal[m] = (cos + 1.j*sin) * jr_scal[m-1]
-                jt_scal[m] = (cos + 1.j*sin) * jt_scal[m-1]
-                jz_scal[m] = (cos + 1.j*sin) * jz_scal[m-1]
-
-            # Positions of the particles, in the cell unit
-            r_cell = invdr*(rj - rmin) - 0.5
-            z_cell = invdz*(zj - zmin) - 0.5
-            # Index of the lowest cell of `global_array` that gets modified
-            # by this particle (note: `global_array` has 2 guard cells)
-            # (`min` function avoids out-of-bounds access at high r)
-            ir_cell = min( int(math.ceil(r_cell))+1, Nr+2 )
-            iz_cell = int(math.ceil( z_cell )) + 1
-
-            ir = min( int(math.ceil(r_cell)), Nr )
-
-            # Add contribution of this particle to the global array
-            for m in range(Nm):
-
-                # Ruyten-corrected shape factor coefficient
-                if m == 0:
-                    bn = beta_n_m_0[ir]
+        # Region of the global arrays that is modified by this thread
+        iz_start = Nz+4
+        iz_end = 0
+        ir_start = Nr+4
+        ir_end = 0
+
+        # Loop over the species, and over the particles of each species
+        # that are in the thread chunk
+        for i_species in range( len(x) ):
+            i_start = max( ptcl_chunk_indices[i_thread],
+                           species_indices[i_species] )
+            i_end = min( ptcl_chunk_indices[i_thread+1],
+                         species_indices[i_species+1] )
+            if i_end <= i_start:
+                continue
+            # Arrays and charge of this species
+            xs = x[i_species]
+            ys = y[i_species]
+            zs = z[i_species]
+            ws = w[i_species]
+            qs = q[i_species]
+            uxs = ux[i_species]
+            uys = uy[i_species]
+            uzs = uz[i_species]
+            inv_gammas = inv_gamma[i_species]
+            for i_ptcl in range( i_start - species_indices[i_species],
+                                 i_end - species_indices[i_species] ):
+
+                # Position
+                xj = xs[i_ptcl]
+                yj = ys[i_ptcl]
+                zj = zs[i_ptcl]
+                # Velocity
+                uxj = uxs[i_ptcl]
+                uyj = uys[i_ptcl]
+                uzj = uzs[i_ptcl]
+                # Inverse gamma
+                inv_gammaj = inv_gammas[i_ptcl]
+                # Weights
+                wj = qs * ws[i_ptcl]
+
+                # Cylindrical conversion
+                rj = math.sqrt(xj**2 + yj**2)
+                # Avoid division by 0.
+                if (rj != 0.):
+                    invr = 1./rj
+                    cos = xj*invr  # Cosine
+                    sin = yj*invr  # Sine
                 else:
-                    bn = beta_n_m_higher[ir]
-
-                j_r_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 0, -(-1)**m, bn) * jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 1, -(-1)**m, bn) * jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 0, -(-1)**m, bn) * jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 1, -(-1)**m, bn) * jr_scal[m]
-
-                j_t_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 0, -(-1)**m, bn) * jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 1, -(-1)**m, bn) * jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 0, -(-1)**m, bn) * jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 1, -(-1)**m, bn) * jt_scal[m]
-
-                j_z_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 0, (-1)**m, bn) * jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 1, (-1)**m, bn) * jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 0, (-1)**m, bn) * jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 1, (-1)**m, bn) * jz_scal[m]
-
+                    cos = 1.
+                    sin = 0.
+                # Calculate contribution from this particle to each mode
+                jr_scal[0] = wj * c * inv_gammaj * (cos*uxj + sin*uyj)
+                jt_scal[0] = wj * c * inv_gammaj * (cos*uyj - sin*uxj)
+                jz_scal[0] = wj * c * inv_gammaj * uzj
+                for m in range(1,Nm):
+                    jr_scal[m] = (cos + 1.j*sin) * jr_scal[m-1]
+                    jt_scal[m] = (cos + 1.j*sin) * jt_scal[m-1]
+                    jz_scal[m] = (cos + 1.j*sin) * jz_scal[m-1]
+
+                # Positions of the particles, in the cell unit
+                r_cell = invdr*(rj - rmin) - 0.5
+                z_cell = invdz*(zj - zmin) - 0.5
+                # Index of the lowest cell of `global_array` that gets modified
+                # by this particle (note: `global_array` has 2 guard cells)
+                # (`min` function avoids out-of-bounds access at high r)
+                ir_cell = min( int(math.ceil(r_cell))+1, Nr+2 )
+                iz_cell = int(math.ceil( z_cell )) + 1
+                # Extend the modified region (2 cells in each direction)
+                iz_start = min( iz_start, iz_cell )
+                iz_end = max( iz_end, iz_cell+2 )
+                ir_start = min( ir_start, ir_cell )
+                ir_end = max( ir_end, ir_cell+2 )
+
+                ir = min( int(math.ceil(r_cell)), Nr )
+
+                # Add contribution of this particle to the global array
+                for m in range(Nm):
+
+                    # Ruyten-corrected shape factor coefficient
+                    if m == 0:
+                        bn = beta_n_m_0[ir]
+                    else:
+                        bn = beta_n_m_higher[ir]
+
+                    j_r_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 0, -(-1)**m, bn) * jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 1, -(-1)**m, bn) * jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 0, -(-1)**m, bn) * jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 1, -(-1)**m, bn) * jr_scal[m]
+
+                    j_t_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 0, -(-1)**m, bn) * jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 1, -(-1)**m, bn) * jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 0, -(-1)**m, bn) * jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 1, -(-1)**m, bn) * jt_scal[m]
+
+                    j_z_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 0, (-1)**m, bn) * jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_linear(z_cell, 0)*Sr_linear(r_cell, 1, (-1)**m, bn) * jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 0, (-1)**m, bn) * jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_linear(z_cell, 1)*Sr_linear(r_cell, 1, (-1)**m, bn) * jz_scal[m]
+
+        # Record the region modified by this thread
+        update_deposit_bounds( deposit_bounds, i_thread,
+            iz_start, iz_end, ir_start, ir_end, Nz, Nr )
 
     return
 
@@ -314,8 +428,8 @@ def deposit_rho_numba_cubic(x, y, z, w, q,
                           invdz, zmin, Nz,
                           invdr, rmin, Nr,
                           rho_global, Nm,
-                          nthreads, ptcl_chunk_indices,
-                          beta_n_m_0, beta_n_m_higher):
+                          nthreads, ptcl_chunk_indices, species_indices,
+                          deposit_bounds, beta_n_m_0, beta_n_m_higher):
     """
     Deposition of the charge density rho using numba prange on the CPU.
     Iterates over the threads in parallel, while each thread iterates
@@ -323,21 +437,23 @@ def deposit_rho_numba_cubic(x, y, z, w, q,
     stored in copies of the global grid. At the end of the parallel loop,
     the thread-local field arrays are combined (summed) to the global array.
     (This final reduction is *not* done in this function)
+    Several species can be deposited in a single call: their particles
+    are then divided between the threads as a single combined set.
 
     Calculates the weighted amount of rho that is deposited to the
     16 cells surounding the particle based on its shape (cubic).
 
     Parameters
     ----------
-    x, y, z : 1darray of floats (in meters)
-        The position of the particles
+    x, y, z : tuples of 1darrays of floats (in meters)
+        The position of the particles (one array per species)
 
-    w : 1d array of floats
-        The weights of the particles
+    w : tuple of 1d arrays of floats
+        The weights of the particles (one array per species)
         (For ionizable atoms: weight times the ionization level)
 
-    q : float
-        Charge of the species
+    q : 1darray of floats
+        Charge of each species
         (For ionizable atoms: this is always the elementary charge e)
 
     rho_global : 4darray of complexs
@@ -363,8 +479,19 @@ def deposit_rho_numba_cubic(x, y, z, w, q,
         Number of CPU threads used with numba prange
 
     ptcl_chunk_indices : array of int, of size nthreads+1
-        The indices (of the particle array) between which each thread
-        should loop. (i.e. divisions of particle array between threads)
+        The indices (of the combined set of particles of all species)
+        between which each thread should loop.
+        (i.e. divisions of the combined particle set between threads)
+
+    species_indices : array of int, of size (number of species)+1
+        The indices that bound each species, in the combined set of
+        particles of all species (i.e. cumulated number of particles)
+
+    deposit_bounds : 2darray of ints
+        Array of shape (nthreads, 4) that contains, for each thread, the
+        bounds iz_min, iz_max, ir_min, ir_max (exclusive upper bounds) of
+        the cells of the global arrays that were modified by the deposition.
+        (is extended by this function, to include the cells that it modifies)
 
     beta_n_m_0 : 1darray of floats
         Ruyten-corrected particle shape factor coefficients for mode 0.
@@ -378,72 +505,100 @@ def deposit_rho_numba_cubic(x, y, z, w, q,
 
         # Allocate thread-local array
         rho_scal = np.zeros( Nm, dtype=np.complex128 )
-
-        # Loop over all particles in thread chunk
-        for i_ptcl in range( ptcl_chunk_indices[i_thread],
-                             ptcl_chunk_indices[i_thread+1] ):
-
-            # Position
-            xj = x[i_ptcl]
-            yj = y[i_ptcl]
-            zj = z[i_ptcl]
-            # Weights
-            wj = q * w[i_ptcl]
-
-            # Cylindrical conversion
-            rj = math.sqrt(xj**2 + yj**2)
-            # Avoid division by 0.
-            if (rj != 0.):
-                invr = 1./rj
-                cos = xj*invr  # Cosine
-                sin = yj*invr  # Sine
-            else:
-                cos = 1.
-                sin = 0.
-            # Calculate contribution from this particle to each mode
-            rho_scal[0] = wj
-            for m in range(1,Nm):
-                rho_scal[m] = (cos + 1.j*sin)*rho_scal[m-1]
-
-            # Positions of the particles, in the cell unit
-            r_cell = invdr*(rj - rmin) - 0.5
-            z_cell = invdz*(zj - zmin) - 0.5
-            # Index of the lowest cell of `global_array` that gets modified
-            # by this particle (note: `global_array` has 2 guard cells)
-            # (`min` function avoids out-of-bounds access at high r)
-            ir_cell = min( int(math.ceil(r_cell)), Nr )
-            iz_cell = int(math.ceil( z_cell ))
-
-            ir = min( int(math.ceil(r_cell)), Nr )
-
-            # Add contribution of this particle to the global array
-            for m in range(Nm):
-
-                # Ruyten-corrected shape factor coefficient
-                if m == 0:
-                    bn = beta_n_m_0[ir]
+        # Region of the global arrays that is modified by this thread
+        iz_start = Nz+4
+        iz_end = 0
+        ir_start = Nr+4
+        ir_end = 0
+
+        # Loop over the species, and over the particles of each species
+        # that are in the thread chunk
+        for i_species in range( len(x) ):
+            i_start = max( ptcl_chunk_indices[i_thread],
+                           species_indices[i_species] )
+            i_end = min( ptcl_chunk_indices[i_thread+1],
+                         species_indices[i_species+1] )
+            if i_end <= i_start:
+                continue
+            # Arrays and charge of this species
+            xs = x[i_species]
+            ys = y[i_species]
+            zs = z[i_species]
+            ws = w[i_species]
+            qs = q[i_species]
+            for i_ptcl in range( i_start - species_indices[i_species],
+                                 i_end - species_indices[i_species] ):
+
+                # Position
+                xj = xs[i_ptcl]
+                yj = ys[i_ptcl]
+                zj = zs[i_ptcl]
+                # Weights
+                wj = qs * ws[i_ptcl]
+
+                # Cylindrical conversion
+                rj = math.sqrt(xj**2 + yj**2)
+                # Avoid division by 0.
+                if (rj != 0.):
+                    invr = 1./rj
+                    cos = xj*invr  # Cosine
+                    sin = yj*invr  # Sine
                 else:
-                    bn = beta_n_m_higher[ir]
-
-                rho_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 0, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 1, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+0,ir_cell+2] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 2, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+0,ir_cell+3] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 3, (-1)**m, bn)*rho_scal[m]
-
-                rho_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 0, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 1, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+1,ir_cell+2] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 2, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+1,ir_cell+3] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 3, (-1)**m, bn)*rho_scal[m]
-
-                rho_global[i_thread,m,iz_cell+2,ir_cell+0] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 0, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+2,ir_cell+1] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 1, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+2,ir_cell+2] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 2, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+2,ir_cell+3] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 3, (-1)**m, bn)*rho_scal[m]
-
-                rho_global[i_thread,m,iz_cell+3,ir_cell+0] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 0, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+3,ir_cell+1] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 1, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+3,ir_cell+2] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 2, (-1)**m, bn)*rho_scal[m]
-                rho_global[i_thread,m,iz_cell+3,ir_cell+3] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 3, (-1)**m, bn)*rho_scal[m]
+                    cos = 1.
+                    sin = 0.
+                # Calculate contribution from this particle to each mode
+                rho_scal[0] = wj
+                for m in range(1,Nm):
+                    rho_scal[m] = (cos + 1.j*sin)*rho_scal[m-1]
+
+                # Positions of the particles, in the cell unit
+                r_cell = invdr*(rj - rmin) - 0.5
+                z_cell = invdz*(zj - zmin) - 0.5
+                # Index of the lowest cell of `global_array` that gets modified
+                # by this particle (note: `global_array` has 2 guard cells)
+                # (`min` function avoids out-of-bounds access at high r)
+                ir_cell = min( int(math.ceil(r_cell)), Nr )
+                iz_cell = int(math.ceil( z_cell ))
+                # Extend the modified region (4 cells in each direction)
+                iz_start = min( iz_start, iz_cell )
+                iz_end = max( iz_end, iz_cell+4 )
+                ir_start = min( ir_start, ir_cell )
+                ir_end = max( ir_end, ir_cell+4 )
+
+                ir = min( int(math.ceil(r_cell)), Nr )
+
+                # Add contribution of this particle to the global array
+                for m in range(Nm):
+
+                    # Ruyten-corrected shape factor coefficient
+                    if m == 0:
+                        bn = beta_n_m_0[ir]
+                    else:
+                        bn = beta_n_m_higher[ir]
+
+                    rho_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 0, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 1, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+0,ir_cell+2] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 2, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+0,ir_cell+3] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 3, (-1)**m, bn)*rho_scal[m]
+
+                    rho_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 0, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 1, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+1,ir_cell+2] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 2, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+1,ir_cell+3] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 3, (-1)**m, bn)*rho_scal[m]
+
+                    rho_global[i_thread,m,iz_cell+2,ir_cell+0] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 0, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+2,ir_cell+1] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 1, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+2,ir_cell+2] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 2, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+2,ir_cell+3] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 3, (-1)**m, bn)*rho_scal[m]
+
+                    rho_global[i_thread,m,iz_cell+3,ir_cell+0] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 0, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+3,ir_cell+1] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 1, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+3,ir_cell+2] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 2, (-1)**m, bn)*rho_scal[m]
+                    rho_global[i_thread,m,iz_cell+3,ir_cell+3] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 3, (-1)**m, bn)*rho_scal[m]
+
+        # Record the region modified by this thread
+        update_deposit_bounds( deposit_bounds, i_thread,
+            iz_start, iz_end, ir_start, ir_end, Nz, Nr )
 
     return
 
@@ -457,8 +612,8 @@ def deposit_J_numba_cubic(x, y, z, w, q,
                         invdz, zmin, Nz,
                         invdr, rmin, Nr,
                         j_r_global, j_t_global, j_z_global, Nm,
-                        nthreads, ptcl_chunk_indices,
-                        beta_n_m_0, beta_n_m_higher ):
+                        nthreads, ptcl_chunk_indices, species_indices,
+                        deposit_bounds, beta_n_m_0, beta_n_m_higher ):
     """
     Deposition of the current density J using numba prange on the CPU.
     Iterates over the threads in parallel, while each thread iterates
@@ -466,28 +621,30 @@ def deposit_J_numba_cubic(x, y, z, w, q,
     stored in copies of the global grid. At the end of the parallel loop,
     the thread-local field arrays are combined (summed) to the global array.
     (This final reduction is *not* done in this function)
+    Several species can be deposited in a single call: their particles
+    are then divided between the threads as a single combined set.
 
     Calculates the weighted amount of J that is deposited to the
     16 cells surounding the particle based on its shape (cubic).
 
     Parameters
     ----------
-    x, y, z : 1darray of floats (in meters)
-        The position of the particles
+    x, y, z : tuples of 1darrays of floats (in meters)
+        The position of the particles (one array per species)
 
-    w : 1d array of floats
-        The weights of the particles
+    w : tuple of 1d arrays of floats
+        The weights of the particles (one array per species)
         (For ionizable atoms: weight times the ionization level)
 
-    q : float
-        Charge of the species
+    q : 1darray of floats
+        Charge of each species
         (For ionizable atoms: this is always the elementary charge e)
 
-    ux, uy, uz : 1darray of floats (in meters * second^-1)
-        The velocity of the particles
+    ux, uy, uz : tuples of 1darrays of floats (in meters * second^-1)
+        The velocity of the particles (one array per species)
 
-    inv_gamma : 1darray of floats
-        The inverse of the relativistic gamma factor
+    inv_gamma : tuple of 1darrays of floats
+        The inverse of the relativistic gamma factor (one array per species)
 
     j_x_global : 4darrays of complexs
         Global helper arrays of shape (nthreads, Nm, 2+Nz+2, 2+Nr+2) where the
@@ -513,8 +670,19 @@ def deposit_J_numba_cubic(x, y, z, w, q,
         Number of CPU threads used with numba prange
 
     ptcl_chunk_indices : array of int, of size nthreads+1
-        The indices (of the particle array) between which each thread
-        should loop. (i.e. divisions of particle array between threads)
+        The indices (of the combined set of particles of all species)
+        between which each thread should loop.
+        (i.e. divisions of the combined particle set between threads)
+
+    species_indices : array of int, of size (number of species)+1
+        The indices that bound each species, in the combined set of
+        particles of all species (i.e. cumulated number of particles)
+
+    deposit_bounds : 2darray of ints
+        Array of shape (nthreads, 4) that contains, for each thread, the
+        bounds iz_min, iz_max, ir_min, ir_max (exclusive upper bounds) of
+        the cells of the global arrays that were modified by the deposition.
+        (is extended by this function, to include the cells that it modifies)
 
     beta_n_m_0 : 1darray of floats
         Ruyten-corrected particle shape factor coefficients for mode 0.
@@ -530,8 +698,223 @@ def deposit_J_numba_cubic(x, y, z, w, q,
         jr_scal = np.zeros( Nm, dtype=np.complex128 )
         jt_scal = np.zeros( Nm, dtype=np.complex128 )
         jz_scal = np.zeros( Nm, dtype=np.complex128 )
+        # Region of the global arrays that is modified by this thread
+        iz_start = Nz+4
+        iz_end = 0
+        ir_start = Nr+4
+        ir_end = 0
+
+        # Loop over the species, and over the particles of each species
+        # that are in the thread chunk
+        for i_species in range( len(x) ):
+            i_start = max( ptcl_chunk_indices[i_thread],
+                           species_indices[i_species] )
+            i_end = min( ptcl_chunk_indices[i_thread+1],
+                         species_indices[i_species+1] )
+            if i_end <= i_start:
+                continue
+            # Arrays and charge of this species
+            xs = x[i_species]
+            ys = y[i_species]
+            zs = z[i_species]
+            ws = w[i_species]
+            qs = q[i_species]
+            uxs = ux[i_species]
+            uys = uy[i_species]
+            uzs = uz[i_species]
+            inv_gammas = inv_gamma[i_species]
+            for i_ptcl in range( i_start - species_indices[i_species],
+                                 i_end - species_indices[i_species] ):
+
+                # Position
+                xj = xs[i_ptcl]
+                yj = ys[i_ptcl]
+                zj = zs[i_ptcl]
+                # Velocity
+                uxj = uxs[i_ptcl]
+                uyj = uys[i_ptcl]
+                uzj = uzs[i_ptcl]
+                # Inverse gamma
+                inv_gammaj = inv_gammas[i_ptcl]
+                # Weights
+                wj = qs * ws[i_ptcl]
+
+                # Cylindrical conversion
+                rj = math.sqrt(xj**2 + yj**2)
+                # Avoid division by 0.
+                if (rj != 0.):
+                    invr = 1./rj
+                    cos = xj*invr  # Cosine
+                    sin = yj*invr  # Sine
+                else:
+                    cos = 1.
+                    sin = 0.
+                # Calculate contribution from this particle to each mode
+                jr_scal[0] = wj * c * inv_gammaj * (cos*uxj + sin*uyj)
+                jt_scal[0] = wj * c * inv_gammaj * (cos*uyj - sin*uxj)
+                jz_scal[0] = wj * c * inv_gammaj * uzj
+                for m in range(1,Nm):
+                    jr_scal[m] = (cos + 1.j*sin) * jr_scal[m-1]
+                    jt_scal[m] = (cos + 1.j*sin) * jt_scal[m-1]
+                    jz_scal[m] = (cos + 1.j*sin) * jz_scal[m-1]
+
+                # Positions of the particles, in the cell unit
+                r_cell = invdr*(rj - rmin) - 0.5
+                z_cell = invdz*(zj - zmin) - 0.5
+                # Index of the lowest cell of `global_array` that gets modified
+                # by this particle (note: `global_array` has 2 guard cells)
+                # (`min` function avoids out-of-bounds access at high r)
+                ir_cell = min( int(math.ceil(r_cell)), Nr )
+                iz_cell = int(math.ceil( z_cell ))
+                # Extend the modified region (4 cells in each direction)
+                iz_start = min( iz_start, iz_cell )
+                iz_end = max( iz_end, iz_cell+4 )
+                ir_start = min( ir_start, ir_cell )
+                ir_end = max( ir_end, ir_cell+4 )
+
+                ir = min( int(math.ceil(r_cell)), Nr )
+
+                # Add contribution of this particle to the global array
+                for m in range(Nm):
+
+                    # Ruyten-corrected shape factor coefficient
+                    if m == 0:
+                        bn = beta_n_m_0[ir]
+                    else:
+                        bn = beta_n_m_higher[ir]
+
+                    j_r_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+0,ir_cell+2] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+0,ir_cell+3] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jr_scal[m]
+
+                    j_r_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+1,ir_cell+2] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+1,ir_cell+3] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jr_scal[m]
+
+                    j_r_global[i_thread,m,iz_cell+2,ir_cell+0] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+2,ir_cell+1] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+2,ir_cell+2] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+2,ir_cell+3] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jr_scal[m]
+
+                    j_r_global[i_thread,m,iz_cell+3,ir_cell+0] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+3,ir_cell+1] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+3,ir_cell+2] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jr_scal[m]
+                    j_r_global[i_thread,m,iz_cell+3,ir_cell+3] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jr_scal[m]
+
+                    j_t_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+0,ir_cell+2] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+0,ir_cell+3] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jt_scal[m]
+
+                    j_t_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+1,ir_cell+2] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+1,ir_cell+3] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jt_scal[m]
+
+                    j_t_global[i_thread,m,iz_cell+2,ir_cell+0] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+2,ir_cell+1] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+2,ir_cell+2] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+2,ir_cell+3] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jt_scal[m]
+
+                    j_t_global[i_thread,m,iz_cell+3,ir_cell+0] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+3,ir_cell+1] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+3,ir_cell+2] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jt_scal[m]
+                    j_t_global[i_thread,m,iz_cell+3,ir_cell+3] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jt_scal[m]
+
+                    j_z_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 0, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 1, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+0,ir_cell+2] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 2, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+0,ir_cell+3] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 3, (-1)**m, bn)*jz_scal[m]
+
+                    j_z_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 0, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 1, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+1,ir_cell+2] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 2, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+1,ir_cell+3] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 3, (-1)**m, bn)*jz_scal[m]
+
+                    j_z_global[i_thread,m,iz_cell+2,ir_cell+0] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 0, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+2,ir_cell+1] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 1, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+2,ir_cell+2] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 2, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+2,ir_cell+3] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 3, (-1)**m, bn)*jz_scal[m]
+
+                    j_z_global[i_thread,m,iz_cell+3,ir_cell+0] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 0, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+3,ir_cell+1] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 1, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+3,ir_cell+2] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 2, (-1)**m, bn)*jz_scal[m]
+                    j_z_global[i_thread,m,iz_cell+3,ir_cell+3] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 3, (-1)**m, bn)*jz_scal[m]
+
+        # Record the region modified by this thread
+        update_deposit_bounds( deposit_bounds, i_thread,
+            iz_start, iz_end, ir_start, ir_end, Nz, Nr )
 
-        # Loop over all particles in thread chunk
+    return
+
+# -------------------------------
+# Cached shape factors
+# -------------------------------
+
+@njit_parallel
+def compute_shape_factors_numba( x, y, z,
+                                 invdz, zmin, Nz, invdr, rmin, Nr,
+                                 nthreads, ptcl_chunk_indices,
+                                 beta_n_m_0, beta_n_m_higher,
+                                 iz_cell, ir_cell, n_flip, Sz, Sr, phase ):
+    """
+    Compute the quantities that are used by the deposition of each particle
+    and that depend only on its position: the index of the lowest cell that
+    it modifies, its shape factors and its azimuthal phase.
+
+    The shape (linear or cubic) is given by the width of the arrays `Sz`
+    and `Sr` (2 cells for linear shapes, 4 cells for cubic shapes).
+
+    Parameters
+    ----------
+    x, y, z : 1darray of floats (in meters)
+        The position of the particles
+
+    invdz, invdr : float (in meters^-1)
+        Inverse of the grid step along the considered direction
+
+    zmin, rmin : float (in meters)
+        Position of the edge of the simulation box,
+        along the considered direction
+
+    Nz, Nr : int
+        Number of gridpoints along the considered direction
+
+    nthreads : int
+        Number of CPU threads used with numba prange
+
+    ptcl_chunk_indices : array of int, of size nthreads+1
+        The indices (of the particle array) between which each thread
+        should loop. (i.e. divisions of particle array between threads)
+
+    beta_n_m_0, beta_n_m_higher : 1darrays of floats
+        Ruyten-corrected particle shape factor coefficients for mode 0
+        and for higher modes.
+
+    iz_cell, ir_cell : 1darrays of ints (modified by this function)
+        Index of the lowest cell of the threading buffers (which have
+        2 guard cells) that gets modified by each particle
+
+    n_flip : 1darray of ints (modified by this function)
+        Number of cells (starting from `ir_cell`) that are below the axis,
+        and for which the shape factor in r should be multiplied by the
+        sign of the azimuthal mode
+
+    Sz : 2darray of floats (modified by this function)
+        Shape factors in z, of shape (Ntot, 2) or (Ntot, 4)
+
+    Sr : 3darray of floats (modified by this function)
+        Shape factors in r (without the sign flip below the axis),
+        of shape (Ntot, 2, 2) or (Ntot, 2, 4), where the second index
+        corresponds to the Ruyten coefficients of mode 0 and higher modes
+
+    phase : 1darray of complexs (modified by this function)
+        The azimuthal phase exp(i theta) of each particle
+    """
+    n_cells = Sz.shape[1]
+    for i_thread in prange( nthreads ):
         for i_ptcl in range( ptcl_chunk_indices[i_thread],
                              ptcl_chunk_indices[i_thread+1] ):
 
@@ -539,112 +922,260 @@ def deposit_J_numba_cubic(x, y, z, w, q,
             xj = x[i_ptcl]
             yj = y[i_ptcl]
             zj = z[i_ptcl]
-            # Velocity
-            uxj = ux[i_ptcl]
-            uyj = uy[i_ptcl]
-            uzj = uz[i_ptcl]
-            # Inverse gamma
-            inv_gammaj = inv_gamma[i_ptcl]
-            # Weights
-            wj = q * w[i_ptcl]
 
             # Cylindrical conversion
             rj = math.sqrt(xj**2 + yj**2)
             # Avoid division by 0.
             if (rj != 0.):
                 invr = 1./rj
-                cos = xj*invr  # Cosine
-                sin = yj*invr  # Sine
+                phase[i_ptcl] = xj*invr + 1.j*yj*invr
             else:
-                cos = 1.
-                sin = 0.
-            # Calculate contribution from this particle to each mode
-            jr_scal[0] = wj * c * inv_gammaj * (cos*uxj + sin*uyj)
-            jt_scal[0] = wj * c * inv_gammaj * (cos*uyj - sin*uxj)
-            jz_scal[0] = wj * c * inv_gammaj * uzj
-            for m in range(1,Nm):
-                jr_scal[m] = (cos + 1.j*sin) * jr_scal[m-1]
-                jt_scal[m] = (cos + 1.j*sin) * jt_scal[m-1]
-                jz_scal[m] = (cos + 1.j*sin) * jz_scal[m-1]
+                phase[i_ptcl] = 1.
 
             # Positions of the particles, in the cell unit
             r_cell = invdr*(rj - rmin) - 0.5
             z_cell = invdz*(zj - zmin) - 0.5
-            # Index of the lowest cell of `global_array` that gets modified
-            # by this particle (note: `global_array` has 2 guard cells)
-            # (`min` function avoids out-of-bounds access at high r)
-            ir_cell = min( int(math.ceil(r_cell)), Nr )
-            iz_cell = int(math.ceil( z_cell ))
-
             ir = min( int(math.ceil(r_cell)), Nr )
+            bn_0 = beta_n_m_0[ir]
+            bn_higher = beta_n_m_higher[ir]
+
+            # Same indices and shape factors as in the deposition kernels
+            # (with flip=1: the sign flip is applied during the deposition)
+            if n_cells == 2:
+                ir_cell[i_ptcl] = min( int(math.ceil(r_cell))+1, Nr+2 )
+                iz_cell[i_ptcl] = int(math.ceil( z_cell )) + 1
+                n_flip[i_ptcl] = min( max( 1-int(math.ceil(r_cell)), 0 ), 2 )
+                for i in range(2):
+                    Sz[i_ptcl, i] = Sz_linear(z_cell, i)
+                    Sr[i_ptcl, 0, i] = Sr_linear(r_cell, i, 1., bn_0)
+                    Sr[i_ptcl, 1, i] = Sr_linear(r_cell, i, 1., bn_higher)
+            else:
+                ir_cell[i_ptcl] = min( int(math.ceil(r_cell)), Nr )
+                iz_cell[i_ptcl] = int(math.ceil( z_cell ))
+                n_flip[i_ptcl] = min( max( 2-int(math.ceil(r_cell)), 0 ), 4 )
+                for i in range(4):
+                    Sz[i_ptcl, i] = Sz_cubic(z_cell, i)
+                    Sr[i_ptcl, 0, i] = Sr_cubic(r_cell, i, 1., bn_0)
+                    Sr[i_ptcl, 1, i] = Sr_cubic(r_cell, i, 1., bn_higher)
+
+@njit_parallel
+def deposit_rho_numba_cached( w, q, iz_cell, ir_cell, n_flip, Sz, Sr, phase,
+                              Nz, Nr, rho_global, Nm,
+                              nthreads, ptcl_chunk_indices, deposit_bounds ):
+    """
+    Deposition of the charge density rho using numba prange on the CPU,
+    using the indices, shape factors and phase of the particles that were
+    computed by `compute_shape_factors_numba`.
+
+    This gives the same result as `deposit_rho_numba_linear` or
+    `deposit_rho_numba_cubic` (see the docstrings of these functions
+    and of `compute_shape_factors_numba` for the parameters).
+    """
+    n_cells = Sz.shape[1]
+    for i_thread in prange( nthreads ):
+
+        # Allocate thread-local array
+        rho_scal = np.zeros( Nm, dtype=np.complex128 )
+        # Region of the global arrays that is modified by this thread
+        iz_start = Nz+4
+        iz_end = 0
+        ir_start = Nr+4
+        ir_end = 0
+
+        # Loop over all particles in thread chunk
+        for i_ptcl in range( ptcl_chunk_indices[i_thread],
+                             ptcl_chunk_indices[i_thread+1] ):
+
+            # Calculate contribution from this particle to each mode
+            rho_scal[0] = q * w[i_ptcl]
+            for m in range(1,Nm):
+                rho_scal[m] = phase[i_ptcl]*rho_scal[m-1]
+
+            # Extend the modified region
+            iz = iz_cell[i_ptcl]
+            ir = ir_cell[i_ptcl]
+            iz_start = min( iz_start, iz )
+            iz_end = max( iz_end, iz+n_cells )
+            ir_start = min( ir_start, ir )
+            ir_end = max( ir_end, ir+n_cells )
 
             # Add contribution of this particle to the global array
             for m in range(Nm):
+                i_coef = min( m, 1 )
+                for i_r in range(n_cells):
+                    S_r = Sr[i_ptcl, i_coef, i_r]
+                    if i_r < n_flip[i_ptcl]:
+                        S_r *= (-1)**m
+                    for i_z in range(n_cells):
+                        rho_global[i_thread,m,iz+i_z,ir+i_r] += \
+                            Sz[i_ptcl, i_z]*S_r * rho_scal[m]
+
+        # Record the region modified by this thread
+        update_deposit_bounds( deposit_bounds, i_thread,
+            iz_start, iz_end, ir_start, ir_end, Nz, Nr )
 
-                # Ruyten-corrected shape factor coefficient
-                if m == 0:
-                    bn = beta_n_m_0[ir]
-                else:
-                    bn = beta_n_m_higher[ir]
-
-                j_r_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+0,ir_cell+2] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+0,ir_cell+3] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jr_scal[m]
-
-                j_r_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+1,ir_cell+2] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+1,ir_cell+3] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jr_scal[m]
-
-                j_r_global[i_thread,m,iz_cell+2,ir_cell+0] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+2,ir_cell+1] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+2,ir_cell+2] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+2,ir_cell+3] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jr_scal[m]
-
-                j_r_global[i_thread,m,iz_cell+3,ir_cell+0] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+3,ir_cell+1] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+3,ir_cell+2] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jr_scal[m]
-                j_r_global[i_thread,m,iz_cell+3,ir_cell+3] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jr_scal[m]
-
-                j_t_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+0,ir_cell+2] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+0,ir_cell+3] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jt_scal[m]
-
-                j_t_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+1,ir_cell+2] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+1,ir_cell+3] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jt_scal[m]
-
-                j_t_global[i_thread,m,iz_cell+2,ir_cell+0] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+2,ir_cell+1] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+2,ir_cell+2] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+2,ir_cell+3] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jt_scal[m]
-
-                j_t_global[i_thread,m,iz_cell+3,ir_cell+0] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 0, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+3,ir_cell+1] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 1, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+3,ir_cell+2] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 2, -(-1)**m, bn)*jt_scal[m]
-                j_t_global[i_thread,m,iz_cell+3,ir_cell+3] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 3, -(-1)**m, bn)*jt_scal[m]
-
-                j_z_global[i_thread,m,iz_cell+0,ir_cell+0] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 0, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+0,ir_cell+1] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 1, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+0,ir_cell+2] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 2, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+0,ir_cell+3] += Sz_cubic(z_cell, 0)*Sr_cubic(r_cell, 3, (-1)**m, bn)*jz_scal[m]
-
-                j_z_global[i_thread,m,iz_cell+1,ir_cell+0] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 0, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+1,ir_cell+1] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 1, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+1,ir_cell+2] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 2, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+1,ir_cell+3] += Sz_cubic(z_cell, 1)*Sr_cubic(r_cell, 3, (-1)**m, bn)*jz_scal[m]
-
-                j_z_global[i_thread,m,iz_cell+2,ir_cell+0] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 0, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+2,ir_cell+1] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 1, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+2,ir_cell+2] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 2, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+2,ir_cell+3] += Sz_cubic(z_cell, 2)*Sr_cubic(r_cell, 3, (-1)**m, bn)*jz_scal[m]
-
-                j_z_global[i_thread,m,iz_cell+3,ir_cell+0] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 0, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+3,ir_cell+1] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 1, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+3,ir_cell+2] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 2, (-1)**m, bn)*jz_scal[m]
-                j_z_global[i_thread,m,iz_cell+3,ir_cell+3] += Sz_cubic(z_cell, 3)*Sr_cubic(r_cell, 3, (-1)**m, bn)*jz_scal[m]
+    return
+
+@njit_parallel
+def deposit_J_numba_cached( w, q, ux, uy, uz, inv_gamma,
+                            iz_cell, ir_cell, n_flip, Sz, Sr, phase,
+                            Nz, Nr, j_r_global, j_t_global, j_z_global, Nm,
+                            nthreads, ptcl_chunk_indices, deposit_bounds ):
+    """
+    Deposition of the current density J using numba prange on the CPU,
+    using the indices, shape factors and phase of the particles that were
+    computed by `compute_shape_factors_numba`.
+
+    This gives the same result as `deposit_J_numba_linear` or
+    `deposit_J_numba_cubic` (see the docstrings of these functions
+    and of `compute_shape_factors_numba` for the parameters).
+    """
+    n_cells = Sz.shape[1]
+    for i_thread in prange( nthreads ):
+
+        # Allocate thread-local array
+        jr_scal = np.zeros( Nm, dtype=np.complex128 )
+        jt_scal = np.zeros( Nm, dtype=np.complex128 )
+        jz_scal = np.zeros( Nm, dtype=np.complex128 )
+        # Region of the global arrays that is modified by this thread
+        iz_start = Nz+4
+        iz_end = 0
+        ir_start = Nr+4
+        ir_end = 0
+
+        # Loop over all particles in thread chunk
+        for i_ptcl in range( ptcl_chunk_indices[i_thread],
+                             ptcl_chunk_indices[i_thread+1] ):
+
+            # Weights and velocity
+            wj = q * w[i_ptcl]
+            inv_gammaj = inv_gamma[i_ptcl]
+            cos = phase[i_ptcl].real
+            sin = phase[i_ptcl].imag
+            # Calculate contribution from this particle to each mode
+            jr_scal[0] = wj * c * inv_gammaj * (cos*ux[i_ptcl] + sin*uy[i_ptcl])
+            jt_scal[0] = wj * c * inv_gammaj * (cos*uy[i_ptcl] - sin*ux[i_ptcl])
+            jz_scal[0] = wj * c * inv_gammaj * uz[i_ptcl]
+            for m in range(1,Nm):
+                jr_scal[m] = phase[i_ptcl] * jr_scal[m-1]
+                jt_scal[m] = phase[i_ptcl] * jt_scal[m-1]
+                jz_scal[m] = phase[i_ptcl] * jz_scal[m-1]
+
+            # Extend the modified region
+            iz = iz_cell[i_ptcl]
+            ir = ir_cell[i_ptcl]
+            iz_start = min( iz_start, iz )
+            iz_end = max( iz_end, iz+n_cells )
+            ir_start = min( ir_start, ir )
+            ir_end = max( ir_end, ir+n_cells )
+
+            # Add contribution of this particle to the global array
+            for m in range(Nm):
+                i_coef = min( m, 1 )
+                for i_r in range(n_cells):
+                    S_r = Sr[i_ptcl, i_coef, i_r]
+                    # Sign flip below the axis (opposite for Jr and Jt)
+                    S_rt = S_r
+                    if i_r < n_flip[i_ptcl]:
+                        S_r *= (-1)**m
+                        S_rt *= -(-1)**m
+                    for i_z in range(n_cells):
+                        j_r_global[i_thread,m,iz+i_z,ir+i_r] += \
+                            Sz[i_ptcl, i_z]*S_rt * jr_scal[m]
+                        j_t_global[i_thread,m,iz+i_z,ir+i_r] += \
+                            Sz[i_ptcl, i_z]*S_rt * jt_scal[m]
+                        j_z_global[i_thread,m,iz+i_z,ir+i_r] += \
+                            Sz[i_ptcl, i_z]*S_r * jz_scal[m]
+
+        # Record the region modified by this thread
+        update_deposit_bounds( deposit_bounds, i_thread,
+            iz_start, iz_end, ir_start, ir_end, Nz, Nr )
 
     return
+
+# -------------------------------------------
+# Deposition of several species in one region
+# -------------------------------------------
+
+def deposit_species_numba( fld, fieldtype, particle_shape, sources ):
+    """
+    Deposit the charge or current of several sets of macroparticles
+    (e.g. several species, and the virtual particles of an antenna) into
+    the threading buffers of `fld`, in a single parallel region.
+
+    The particles of all the sets are divided between the threads
+    as a single combined set, so that all threads get the same
+    number of particles (independently of the size of each species).
+
+    Parameters
+    ----------
+    fld : a Fields object
+        Contains the threading buffers and the InterpolationGrid objects
+
+    fieldtype : string
+        Indicates which field to deposit (either 'J' or 'rho')
+
+    particle_shape : string
+        The shape of the particles of all the sets
+        (either 'linear' or 'cubic')
+
+    sources : list of tuples
+        One tuple per set of macroparticles, of the form
+        (x, y, z, w, q, ux, uy, uz, inv_gamma), where q is a float
+        and the other elements are 1darrays of floats
+        (see e.g. `Particles.get_deposition_arrays`)
+    """
+    if len(sources) == 0:
+        return
+    grid = fld.interp
+
+    # Indices that bound each set of particles in the combined set,
+    # and division of the combined set between threads
+    species_indices = np.zeros( len(sources)+1, dtype=np.uint64 )
+    species_indices[1:] = np.cumsum([ len(source[0]) for source in sources ])
+    ptcl_chunk_indices = get_chunk_indices( int(species_indices[-1]), nthreads )
+    # Gather the arrays of the different sets into tuples
+    x, y, z, w = [ tuple( source[i] for source in sources ) for i in range(4) ]
+    q = np.array([ source[4] for source in sources ], dtype=np.float64 )
+
+    # The set of Ruyten shape coefficients to use for higher modes.
+    # For Nm > 1, the set from mode 1 is used, since all higher modes have the
+    # same coefficients. For Nm == 1, the coefficients from mode 0 are
+    # passed twice to satisfy the argument types for Numba JIT.
+    if fld.Nm > 1:
+        ruyten_m = 1
+    else:
+        ruyten_m = 0
+    if particle_shape == 'linear':
+        ruyten_coefs = ( grid[0].ruyten_linear_coef,
+                         grid[ruyten_m].ruyten_linear_coef )
+    elif particle_shape == 'cubic':
+        ruyten_coefs = ( grid[0].ruyten_cubic_coef,
+                         grid[ruyten_m].ruyten_cubic_coef )
+
+    if fieldtype == 'rho':
+        if particle_shape == 'linear':
+            deposit_rho = deposit_rho_numba_linear
+        elif particle_shape == 'cubic':
+            deposit_rho = deposit_rho_numba_cubic
+        deposit_rho( x, y, z, w, q,
+            grid[0].invdz, grid[0].zmin, grid[0].Nz,
+            grid[0].invdr, grid[0].rmin, grid[0].Nr,
+            fld.rho_global, fld.Nm,
+            nthreads, ptcl_chunk_indices, species_indices,
+            fld.rho_deposit_bounds, *ruyten_coefs )
+
+    elif fieldtype == 'J':
+        ux, uy, uz, inv_gamma = [ tuple( source[i] for source in sources )
+                                  for i in range(5, 9) ]
+        if particle_shape == 'linear':
+            deposit_J = deposit_J_numba_linear
+        elif particle_shape == 'cubic':
+            deposit_J = deposit_J_numba_cubic
+        deposit_J( x, y, z, w, q,
+            ux, uy, uz, inv_gamma,
+            grid[0].invdz, grid[0].zmin, grid[0].Nz,
+            grid[0].invdr, grid[0].rmin, grid[0].Nr,
+            fld.Jr_global, fld.Jt_global, fld.Jz_global, fld.Nm,
+            nthreads, ptcl_chunk_indices, species_indices,
+            fld.J_deposit_bounds, *ruyten_coefs )
@@ -122,6 +122,8 @@ def reallocate_and_copy_old( species, use_cuda, old_Ntot, new_Ntot ):
 
     # Modify the total number of particles
     species.Ntot = new_Ntot
+    # The cached shape factors are not valid anymore
+    species.shape_factor_cache = None
 
 def generate_new_ids( species, old_Ntot, new_Ntot ):
     """
@@ -21,9 +21,9 @@ from .gathering.threading_methods import gather_field_numba_linear, \
         gather_field_numba_cubic
 from .gathering.threading_methods_one_mode import erase_eb_numba, \
     gather_field_numba_linear_one_mode, gather_field_numba_cubic_one_mode
-from .deposition.threading_methods import \
-        deposit_rho_numba_linear, deposit_rho_numba_cubic, \
-        deposit_J_numba_linear, deposit_J_numba_cubic
+from .deposition.threading_methods import deposit_species_numba, \
+        compute_shape_factors_numba, deposit_rho_numba_cached, \
+        deposit_J_numba_cached
 
 # Check if threading is enabled
 from fbpic.utils.threading import nthreads, get_chunk_indices
@@ -207,6 +207,13 @@ class Particles(object) :
         # (gets modified during the main PIC loop, on GPU)
         self.keep_fields_sorted = False
 
+        # Cache of the shape factors of the particles, for the deposition
+        # on CPU (see `get_shape_factor_cache`). This is disabled by default,
+        # since the cache is only useful when the particles deposit several
+        # times at the same positions.
+        self.use_shape_factor_cache = False
+        self.shape_factor_cache = None
+
         # Allocate arrays and register variables when using CUDA
         if self.use_cuda:
             if grid_shape is None:
@@ -296,6 +303,8 @@ class Particles(object) :
             self.uz = self.uz.get()
             self.inv_gamma = self.inv_gamma.get()
             self.w = self.w.get()
+            # The cached shape factors (if any) are not valid anymore
+            self.shape_factor_cache = None
 
             # Copy arrays on the CPU for the field
             # gathering and the particle push
@@ -663,6 +672,8 @@ class Particles(object) :
                 self.ux, self.uy, self.uz,
                 self.inv_gamma, self.Ntot,
                 dt, x_push, y_push, z_push )
+            # The cached shape factors are not valid anymore
+            self.shape_factor_cache = None
 
     def gather( self, grid, comm ) :
         """
@@ -978,66 +989,134 @@ class Particles(object) :
                                 self.cell_idx, self.prefix_sum,
                                 grid[m].d_ruyten_cubic_coef)
 
+        # CPU version, with cached shape factors
+        elif self.use_shape_factor_cache:
+            self.deposit_from_shape_factor_cache( fld, fieldtype, weight )
+
         # CPU version
         else:
-            # Divide particles in chunks (each chunk is handled by a different
-            # thread) and register the indices that bound each chunks
-            ptcl_chunk_indices = get_chunk_indices(self.Ntot, nthreads)
-
-            # The set of Ruyten shape coefficients to use for higher modes. 
-            # For Nm > 1, the set from mode 1 is used, since all higher modes have the
-            # same coefficients. For Nm == 1, the coefficients from mode 0 are 
-            # passed twice to satisfy the argument types for Numba JIT.
-            if fld.Nm > 1:
-                ruyten_m = 1
-            else: 
-                ruyten_m = 0
-
             # Multithreading functions for the deposition of rho or J
             # All modes at once.
-            if fieldtype == 'rho':
-                # Deposit rho using CPU threading
-                if self.particle_shape == 'linear':
-                    deposit_rho_numba_linear(
-                        self.x, self.y, self.z, weight, self.q,
-                        grid[0].invdz, grid[0].zmin, grid[0].Nz,
-                        grid[0].invdr, grid[0].rmin, grid[0].Nr,
-                        fld.rho_global, fld.Nm,
-                        nthreads, ptcl_chunk_indices,
-                        grid[0].ruyten_linear_coef,
-                        grid[ruyten_m].ruyten_linear_coef )
-                elif self.particle_shape == 'cubic':
-                    deposit_rho_numba_cubic(
-                        self.x, self.y, self.z, weight, self.q,
-                        grid[0].invdz, grid[0].zmin, grid[0].Nz,
-                        grid[0].invdr, grid[0].rmin, grid[0].Nr,
-                        fld.rho_global, fld.Nm,
-                        nthreads, ptcl_chunk_indices,
-                        grid[0].ruyten_cubic_coef,
-                        grid[ruyten_m].ruyten_cubic_coef )
+            deposit_species_numba( fld, fieldtype, self.particle_shape,
+                                   [ self.get_deposition_arrays() ] )
 
-            elif fieldtype == 'J':
-                # Deposit J using CPU threading
-                if self.particle_shape == 'linear':
-                    deposit_J_numba_linear(
-                        self.x, self.y, self.z, weight, self.q,
-                        self.ux, self.uy, self.uz, self.inv_gamma,
-                        grid[0].invdz, grid[0].zmin, grid[0].Nz,
-                        grid[0].invdr, grid[0].rmin, grid[0].Nr,
-                        fld.Jr_global, fld.Jt_global, fld.Jz_global, fld.Nm,
-                        nthreads, ptcl_chunk_indices,
-                        grid[0].ruyten_linear_coef,
-                        grid[ruyten_m].ruyten_linear_coef )
-                elif self.particle_shape == 'cubic':
-                    deposit_J_numba_cubic(
-                        self.x, self.y, self.z, weight, self.q,
-                        self.ux, self.uy, self.uz, self.inv_gamma,
-                        grid[0].invdz, grid[0].zmin, grid[0].Nz,
-                        grid[0].invdr, grid[0].rmin, grid[0].Nr,
-                        fld.Jr_global, fld.Jt_global, fld.Jz_global, fld.Nm,
-                        nthreads, ptcl_chunk_indices,
-                        grid[0].ruyten_cubic_coef,
-                        grid[ruyten_m].ruyten_cubic_coef )
+
+    def get_shape_factor_cache( self, fld ):
+        """
+        Return the cached indices, shape factors and azimuthal phase of
+        the particles (as a dictionary), for the deposition on the
+        interpolation grid of `fld`, on CPU.
+
+        The cache is computed at the first deposition after the particles
+        have moved, and is then reused by the following depositions
+        (e.g. of rho and J) at the same positions. It is invalidated
+        (i.e. `shape_factor_cache` is set to None) by `push_x`, and by
+        the functions that replace the particle arrays (e.g. when particles
+        are exchanged, injected or loaded from a checkpoint). It is also
+        recomputed if the grid has moved (e.g. with the moving window).
+        (If the positions of the particles are modified in another way,
+        `shape_factor_cache` should be set to None.)
+
+        Parameter
+        ----------
+        fld : a Field object
+             Contains the list of InterpolationGrid objects
+        """
+        grid = fld.interp
+        # Identify the grid (the cache is set to None whenever
+        # the particle arrays are modified)
+        key = ( self.Ntot, self.particle_shape,
+                grid[0].zmin, grid[0].invdz, grid[0].Nz,
+                grid[0].rmin, grid[0].invdr, grid[0].Nr, fld.Nm )
+        if self.shape_factor_cache is not None and \
+                self.shape_factor_cache['key'] == key:
+            return( self.shape_factor_cache )
+
+        # Allocate the cache (2 cells per direction for linear shapes,
+        # 4 cells per direction for cubic shapes)
+        if self.particle_shape == 'linear':
+            n_cells = 2
+            ruyten_coef = 'ruyten_linear_coef'
+        else:
+            n_cells = 4
+            ruyten_coef = 'ruyten_cubic_coef'
+        cache = { 'key': key,
+            'iz_cell': np.empty( self.Ntot, dtype=np.int32 ),
+            'ir_cell': np.empty( self.Ntot, dtype=np.int32 ),
+            'n_flip': np.empty( self.Ntot, dtype=np.int8 ),
+            'Sz': np.empty( (self.Ntot, n_cells), dtype=np.float64 ),
+            'Sr': np.empty( (self.Ntot, 2, n_cells), dtype=np.float64 ),
+            'phase': np.empty( self.Ntot, dtype=np.complex128 ) }
+        # Compute the shape factors (see `deposit` for the Ruyten coefficients)
+        ruyten_m = min( fld.Nm-1, 1 )
+        ptcl_chunk_indices = get_chunk_indices(self.Ntot, nthreads)
+        compute_shape_factors_numba( self.x, self.y, self.z,
+            grid[0].invdz, grid[0].zmin, grid[0].Nz,
+            grid[0].invdr, grid[0].rmin, grid[0].Nr,
+            nthreads, ptcl_chunk_indices,
+            getattr( grid[0], ruyten_coef ),
+            getattr( grid[ruyten_m], ruyten_coef ),
+            cache['iz_cell'], cache['ir_cell'], cache['n_flip'],
+            cache['Sz'], cache['Sr'], cache['phase'] )
+
+        self.shape_factor_cache = cache
+        return( cache )
+
+
+    def deposit_from_shape_factor_cache( self, fld, fieldtype, weight ):
+        """
+        Deposit the particles charge or current onto the threading buffers
+        of `fld` (on CPU), using the cached shape factors
+        (see `get_shape_factor_cache`)
+
+        Parameter
+        ----------
+        fld : a Field object
+             Contains the list of InterpolationGrid objects
+
+        fieldtype : string
+             Indicates which field to deposit
+             Either 'J' or 'rho'
+
+        weight : 1darray of floats
+            The effective weights of the particles
+        """
+        cache = self.get_shape_factor_cache( fld )
+        grid = fld.interp
+        ptcl_chunk_indices = get_chunk_indices(self.Ntot, nthreads)
+
+        if fieldtype == 'rho':
+            deposit_rho_numba_cached( weight, self.q,
+                cache['iz_cell'], cache['ir_cell'], cache['n_flip'],
+                cache['Sz'], cache['Sr'], cache['phase'],
+                grid[0].Nz, grid[0].Nr, fld.rho_global, fld.Nm,
+                nthreads, ptcl_chunk_indices, fld.rho_deposit_bounds )
+        elif fieldtype == 'J':
+            deposit_J_numba_cached( weight, self.q,
+                self.ux, self.uy, self.uz, self.inv_gamma,
+                cache['iz_cell'], cache['ir_cell'], cache['n_flip'],
+                cache['Sz'], cache['Sr'], cache['phase'],
+                grid[0].Nz, grid[0].Nr,
+                fld.Jr_global, fld.Jt_global, fld.Jz_global, fld.Nm,
+                nthreads, ptcl_chunk_indices, fld.J_deposit_bounds )
+
+
+    def get_deposition_arrays( self ):
+        """
+        Return the arrays of the particles that are used by the deposition
+        on CPU, as a tuple (x, y, z, w, q, ux, uy, uz, inv_gamma), where
+        w is the effective weight (i.e. the weight times the ionization level
+        for ionizable atoms)
+
+        This allows to deposit several species at once
+        (see `deposit_species_numba`)
+        """
+        if self.ionizer is not None:
+            weight = self.ionizer.w_times_level
+        else:
+            weight = self.w
+        return( ( self.x, self.y, self.z, weight, self.q,
+                  self.ux, self.uy, self.uz, self.inv_gamma ) )
 
 
     def sort_particles(self, fld):
@@ -199,10 +199,10 @@ def print_simulation_setup( sim, verbose_level=1 ):
                     message += '\nThreads: %s' %sim.cpu_threads
                 else:
                     message += '\nCPU multi-threading enabled: No'
-                if sim.fld.trans[0].fft.use_mkl:
-                    message += '\nFFT library: MKL'
-                else:
-                    message += '\nFFT library: pyFFTW'
+                fft = sim.fld.trans[0].fft
+                message += '\nFFT library: %s' %fft.library_name
+                if fft.autotuned:
+                    message += ' (fastest for this grid)'
                 node_message = get_cpu_message()
             # Gather the information about where each node runs
             if sim.comm.size > 1:
@@ -90,3 +90,32 @@ def get_chunk_indices( Ntot, nthreads ):
     ptcl_chunk_indices[-1] = Ntot
 
     return( ptcl_chunk_indices )
+
+
+def get_threading_layer():
+    """
+    Return the name of the threading layer used by numba for the
+    parallel functions (e.g. `tbb`, `omp` or `workqueue`), or None if it
+    is not known yet (i.e. before the first call to a parallel function)
+    """
+    try:
+        return( numba.threading_layer() )
+    except (ValueError, AttributeError):
+        return( None )
+
+
+def concurrent_calls_supported():
+    """
+    Return whether the parallel numba functions can be called from several
+    Python threads at the same time (True or False), or None if this is
+    not known yet (before the first call to a parallel function).
+
+    This is only the case for the `tbb` and `omp` threading layers: the
+    `workqueue` layer aborts the program when it is used concurrently.
+    """
+    if not threading_enabled:
+        return( True )
+    threading_layer = get_threading_layer()
+    if threading_layer is None:
+        return( None )
+    return( threading_layer in ['tbb', 'omp'] )
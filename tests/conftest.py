@@ -0,0 +1,18 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This file is part of FB-PIC (Fourier-Bessel Particle-In-Cell).
+
+It is loaded by pytest before the tests, and makes sure that the tests
+(including the scripts that they launch) do not write the results of the
+FFT benchmark to the cache directory of the user.
+"""
+import os
+import atexit
+import shutil
+import tempfile
+
+if 'FBPIC_CACHE_DIR' not in os.environ:
+    cache_dir = tempfile.mkdtemp( prefix='fbpic_cache_' )
+    os.environ['FBPIC_CACHE_DIR'] = cache_dir
+    atexit.register( shutil.rmtree, cache_dir, ignore_errors=True )
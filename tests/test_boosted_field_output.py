@@ -0,0 +1,83 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This test file is part of FB-PIC (Fourier-Bessel Particle-In-Cell).
+
+It tests the back-transformed (lab-frame) field diagnostics with several
+MPI ranks, by checking that the lab-frame output of a boosted-frame
+simulation is the same with one and two MPI ranks (i.e. that the slices
+of the different ranks are correctly extracted and gathered).
+
+Usage:
+This file is meant to be run from the top directory of fbpic,
+by any of the following commands
+$ python tests/test_boosted_field_output.py
+$ py.test -q tests/test_boosted_field_output.py
+"""
+import os
+import shutil
+import numpy as np
+from openpmd_viewer import OpenPMDTimeSeries
+
+temporary_dir = './tests/tmp_test_dir'
+origin_dir = './tests/unautomated'
+script_file = 'test_boosted_field_output.py'
+
+def test_boosted_field_output_parallel():
+    """Run the script `script_file` from the `unautomated` directory
+    with one and two MPI ranks, and compare the lab-frame fields."""
+    # Create a temporary directory for the simulation
+    # and copy the testing script into this directory
+    if os.path.exists( temporary_dir ):
+        shutil.rmtree( temporary_dir )
+    os.mkdir( temporary_dir )
+    shutil.copy( os.path.join(origin_dir, script_file),
+                 os.path.join(temporary_dir, script_file) )
+
+    # Launch the script from the OS, in serial
+    response = os.system(
+        'cd %s; python %s' %(temporary_dir, script_file) )
+    assert response==0
+    shutil.move( os.path.join(temporary_dir, 'lab_diags/'),
+                 os.path.join(temporary_dir, 'lab_diags_serial/') )
+
+    # Launch the script from the OS, in parallel
+    response = os.system(
+        'cd %s; mpirun -np 2 python %s' %(temporary_dir, script_file) )
+    assert response==0
+    shutil.move( os.path.join(temporary_dir, 'lab_diags/'),
+                 os.path.join(temporary_dir, 'lab_diags_parallel/') )
+
+    # Check that the lab-frame fields are identical (up to round-off)
+    ts1 = OpenPMDTimeSeries(
+        os.path.join(temporary_dir, 'lab_diags_serial/hdf5/') )
+    ts2 = OpenPMDTimeSeries(
+        os.path.join(temporary_dir, 'lab_diags_parallel/hdf5/') )
+    assert np.array_equal( ts1.iterations, ts2.iterations )
+    # (The tolerance is relative to the largest component of each field,
+    # since some components are zero up to numerical noise)
+    for iteration in ts1.iterations:
+        for field in [ 'E', 'B' ]:
+            fields1 = []
+            fields2 = []
+            for coord in [ 'r', 't', 'z' ]:
+                field1, info1 = ts1.get_field( field, coord,
+                                        iteration=iteration, m='all' )
+                field2, info2 = ts2.get_field( field, coord,
+                                        iteration=iteration, m='all' )
+                assert np.allclose( info1.z, info2.z )
+                fields1.append( field1 )
+                fields2.append( field2 )
+            field_max = max( abs(f).max() for f in fields1 )
+            for field1, field2 in zip( fields1, fields2 ):
+                assert np.allclose( field1, field2,
+                                    rtol=0, atol=1.e-10*field_max )
+    # Check that the laser has been recorded in the snapshots
+    field, _ = ts1.get_field( 'E', 'x', iteration=ts1.iterations[-1] )
+    assert abs(field).max() > 0
+
+    # Suppress the temporary directory
+    shutil.rmtree( temporary_dir )
+
+if __name__ == '__main__':
+    test_boosted_field_output_parallel()
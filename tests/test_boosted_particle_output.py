@@ -14,12 +14,14 @@ they are all retrieved by the boosted-frame diagnostics.
 # -------
 import os, shutil
 import numpy as np
-from scipy.constants import c
+from scipy.constants import c, e, m_e, m_p
 # Import the relevant structures in FBPIC
 from fbpic.main import Simulation
 from fbpic.lpa_utils.boosted_frame import BoostConverter
 from fbpic.lpa_utils.bunch import add_elec_bunch_gaussian
 from fbpic.openpmd_diag import BackTransformedParticleDiagnostic
+from fbpic.openpmd_diag.boosted_particle_diag import LabSnapshot, \
+    ParticleCatcher
 # Import openPMD-viewer for checking output files
 from openpmd_viewer import OpenPMDTimeSeries
 
@@ -28,7 +30,7 @@ from openpmd_viewer import OpenPMDTimeSeries
 # ----------
 use_cuda = True
 
-def test_boosted_output( gamma_boost=10. ):
+def test_boosted_output( gamma_boost=10., buffer_memory_budget=None ):
     """
     # TODO
 
@@ -36,6 +38,9 @@ def test_boosted_output( gamma_boost=10. ):
     ----------
     gamma_boost: float
         The Lorentz factor of the frame in which the simulation is carried out.
+
+    buffer_memory_budget: int or None
+        The memory budget of each snapshot of the diagnostic
     """
     # The simulation box
     Nz = 500         # Number of gridpoints along z
@@ -79,7 +84,8 @@ def test_boosted_output( gamma_boost=10. ):
         BackTransformedParticleDiagnostic( zmin_lab, zmax_lab, v_lab=c,
             dt_snapshots_lab=T_sim_lab/3., Ntot_snapshots_lab=3,
             gamma_boost=gamma_boost, period=diag_period, fldobject=sim.fld,
-            species={"bunch": sim.ptcl[0]}, comm=sim.comm) ]
+            species={"bunch": sim.ptcl[0]}, comm=sim.comm,
+            buffer_memory_budget=buffer_memory_budget ) ]
 
     # Run the simulation
     sim.step( N_steps )
@@ -93,11 +99,76 @@ def test_boosted_output( gamma_boost=10. ):
         pid = np.sort( pid )
         assert len(pid) == N_particles
         assert np.all( ref_pid == pid )
+    # Check that the staging files have been removed after being written
+    if os.path.exists( './lab_diags/staging' ):
+        assert os.listdir( './lab_diags/staging' ) == []
 
     # Remove openPMD files
     shutil.rmtree('./lab_diags/')
     os.chdir('../')
 
+def test_boosted_output_staging():
+    """
+    Check that all the particles are retrieved, when the buffered slices
+    are moved to staging files (small memory budget)
+    """
+    test_boosted_output( buffer_memory_budget=10000 )
+
+def test_extract_slices( gamma_boost=5. ):
+    """
+    Check that the single-pass extraction of the slices of several
+    snapshots (`extract_slices`) gives the same particles as the
+    extraction of each slice separately (`extract_slice`)
+    """
+    # Simulation box and ionizable, tracked ions with a thermal spread
+    # (so that particles cross the output planes in both directions)
+    Nz = 100
+    zmin = -20.e-6
+    zmax = 0.
+    dt = (zmax-zmin)/Nz/c
+    sim = Simulation( Nz, zmax, 16, 10.e-6, 2, dt, zmin=zmin,
+                      n_e=None, use_cuda=False )
+    np.random.seed(0)
+    ions = sim.add_new_species( q=e, m=14*m_p, n=1.e24,
+        p_nz=2, p_nr=2, p_nt=4, p_zmin=zmin, p_zmax=zmax, p_rmax=10.e-6,
+        ux_th=0.5, uy_th=0.5, uz_th=1. )
+    elec = sim.add_new_species( q=-e, m=m_e )
+    ions.make_ionizable( 'N', target_species=elec, level_start=2 )
+    ions.track( sim.comm )
+
+    # Lab snapshots, among which several have their output
+    # plane in the simulation box
+    beta_boost = np.sqrt( 1. - 1./gamma_boost**2 )
+    time = 100*dt
+    species_dict = {'ions': ions}
+    snapshots = [ LabSnapshot( i*gamma_boost*2.e-6/c, -np.inf, np.inf, dt,
+                               '.', i, species_dict ) for i in range(20) ]
+    for snapshot in snapshots:
+        snapshot.update_current_output_positions( time,
+            1./gamma_boost, 1./beta_boost )
+    snapshots = [ snapshot for snapshot in snapshots if \
+        (snapshot.current_z_boost >= zmin) and \
+        (snapshot.current_z_boost < zmax - 1.e-6) ]
+    assert len(snapshots) > 2
+
+    catcher = ParticleCatcher( gamma_boost, beta_boost, sim.fld )
+    for select in [ None, {'uz': [-0.3, None], 'x': [None, 5.e-6]} ]:
+        slice_dicts = catcher.extract_slices( ions, snapshots, time, select )
+        assert len(slice_dicts) == len(snapshots)
+        for snapshot, slice_dict in zip( snapshots, slice_dicts ):
+            ref_dict = catcher.extract_slice( ions,
+                snapshot.current_z_boost, snapshot.prev_z_boost, time, select )
+            assert len( ref_dict['w'] ) > 0
+            assert sorted( slice_dict.keys() ) == sorted( ref_dict.keys() )
+            for quantity in ref_dict:
+                assert np.allclose( slice_dict[quantity], ref_dict[quantity],
+                                    rtol=1.e-14, atol=0. )
+            assert np.all( slice_dict['id'] == ref_dict['id'] )
+            # The slices do not share memory with the other snapshots
+            assert slice_dict['x'].base is None
+
 # Run the tests
 if __name__ == '__main__':
     test_boosted_output()
+    test_boosted_output_staging()
+    test_extract_slices()
@@ -0,0 +1,374 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This test file is part of FB-PIC (Fourier-Bessel Particle-In-Cell).
+
+It tests the options of the openPMD diagnostics, by writing the same
+simulation data with different options, and comparing the files with
+openPMD-viewer.
+
+Usage :
+-------
+In order to run the tests:
+$ python -m pytest tests/test_diag_output.py
+"""
+import os, shutil
+import h5py
+import pytest
+import numpy as np
+from scipy.constants import c, e, m_e, epsilon_0
+from fbpic.main import Simulation
+from fbpic.lpa_utils.laser import add_laser
+from fbpic.openpmd_diag import FieldDiagnostic, ParticleDiagnostic, \
+    ReducedParticleDiagnostic, ReducedFieldDiagnostic
+from openpmd_viewer import OpenPMDTimeSeries
+
+# Parameters
+# ----------
+temporary_dir = './tests/tmp_test_dir'
+Nz = 64
+zmin = -10.e-6
+zmax = 10.e-6
+Nr = 32
+rmax = 20.e-6
+Nm = 2
+dt = (zmax-zmin)/Nz/c
+N_step = 3
+
+def run_simulation_with_diags( write_dir, field_kw={}, particle_kw={} ):
+    """
+    Run a short simulation of a plasma, with field and particle diagnostics
+    that use the storage options `field_kw` and `particle_kw`
+    """
+    np.random.seed(0)
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, dt,
+        p_zmin=zmin, p_zmax=zmax, p_rmin=0, p_rmax=5.e-6,
+        p_nz=2, p_nr=2, p_nt=4, n_e=1.e18, zmin=zmin, use_cuda=False )
+    sim.ptcl[0].track( sim.comm )
+    sim.diags = [
+        FieldDiagnostic( 1, sim.fld, sim.comm, write_dir=write_dir,
+                         **field_kw ),
+        ParticleDiagnostic( 1, {'electrons': sim.ptcl[0]}, sim.comm,
+                            write_dir=write_dir, **particle_kw ) ]
+    sim.step( N_step, show_progress=False )
+
+def test_compressed_output():
+    """
+    Check that chunked/compressed output is identical to the default output,
+    and that the lossy modes are accurate to the requested precision.
+    """
+    if os.path.exists( temporary_dir ):
+        shutil.rmtree( temporary_dir )
+    ref_dir = os.path.join( temporary_dir, 'reference' )
+    run_simulation_with_diags( ref_dir )
+    ts_ref = OpenPMDTimeSeries( os.path.join( ref_dir, 'hdf5' ) )
+
+    cases = [
+        ( 'gzip', dict(chunks=(1,16,32), compression='gzip', shuffle=True),
+            dict(chunks=(64,), compression='gzip', shuffle=True), 0. ),
+        ( 'float32', dict(compression='lzf', precision='float32'),
+            dict(precision='float32'), 2.**-23 ),
+        ( 'rounded', dict(chunks=True, compression='gzip', precision=12),
+            dict(compression='gzip', precision=12), 2.**-12 ) ]
+    for name, field_kw, particle_kw, rtol in cases:
+        write_dir = os.path.join( temporary_dir, name )
+        run_simulation_with_diags( write_dir, field_kw, particle_kw )
+        ts = OpenPMDTimeSeries( os.path.join( write_dir, 'hdf5' ) )
+        for iteration in ts_ref.iterations:
+            for field, coord in [ ('E', 'r'), ('B', 't'), ('rho', None) ]:
+                ref, _ = ts_ref.get_field( field, coord,
+                                           iteration=iteration, m='all' )
+                data, _ = ts.get_field( field, coord,
+                                        iteration=iteration, m='all' )
+                assert np.allclose( data, ref, rtol=0,
+                                    atol=rtol*abs(ref).max() )
+            for quantity in [ 'x', 'uz', 'w', 'id' ]:
+                ref, = ts_ref.get_particle( [quantity], iteration=iteration )
+                data, = ts.get_particle( [quantity], iteration=iteration )
+                assert np.allclose( data, ref, rtol=rtol, atol=0 )
+
+    shutil.rmtree( temporary_dir )
+
+def test_invalid_precision():
+    """
+    Check that invalid values of `precision` are rejected
+    (including booleans, which are instances of `int`)
+    """
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, dt, zmin=zmin, use_cuda=False )
+    for precision in [ True, False, np.bool_(True), 0, 53, 'float16' ]:
+        with pytest.raises( ValueError ):
+            FieldDiagnostic( 1, sim.fld, sim.comm, precision=precision,
+                             write_dir=temporary_dir )
+
+def test_field_output_region():
+    """
+    Check that the fields written in a sub-region, with decimation and
+    a subset of modes, correspond to the fields of the full output.
+    """
+    if os.path.exists( temporary_dir ):
+        shutil.rmtree( temporary_dir )
+    region = dict( zmin_output=-5.e-6, zmax_output=3.e-6, rmax_output=8.e-6 )
+    cases = {
+        'full': ( {}, 1, 1 ),
+        'region': ( dict(modes=[1], **region), 1, 1 ),
+        'stride': ( dict(decimation=(3,2), **region), 3, 2 ),
+        'average': ( dict(decimation=(3,2), decimation_method='average',
+                          **region), 3, 2 ) }
+    # Write all the diagnostics in the same simulation
+    np.random.seed(0)
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, dt,
+        p_zmin=zmin, p_zmax=zmax, p_rmin=0, p_rmax=5.e-6,
+        p_nz=2, p_nr=2, p_nt=4, n_e=1.e24, zmin=zmin, use_cuda=False )
+    sim.diags = [ FieldDiagnostic( N_step, sim.fld, sim.comm,
+                    write_dir=os.path.join( temporary_dir, name ), **kw )
+                  for name, (kw, _, _) in cases.items() ]
+    sim.step( N_step+1, show_progress=False )
+
+    ts_full = OpenPMDTimeSeries( os.path.join(temporary_dir, 'full', 'hdf5') )
+    for name, (kw, nz, nr) in cases.items():
+        ts = OpenPMDTimeSeries( os.path.join(temporary_dir, name, 'hdf5') )
+        for m in range(Nm):
+            full, info = ts_full.get_field( 'rho', iteration=N_step, m=m )
+            data, data_info = ts.get_field( 'rho', iteration=N_step, m=m )
+            # Only keep the upper half (r>0) of the arrays
+            full = full[ Nr: ]
+            data = data[ data.shape[0]//2: ]
+            if ('modes' in kw) and (m not in kw['modes']):
+                assert np.all( data == 0 )
+                continue
+            # Find the left end of the first output cell of the region
+            dz = info.dz
+            if kw.get('decimation_method') == 'average':
+                position = 0.5
+            else:
+                position = (nz//2 + 0.5)/nz
+            z_start = data_info.z[0] - position*nz*dz
+            iz0 = int(round( (z_start - info.z[0])/dz + 0.5 ))
+            Nz_out, Nr_out = data.shape[1], data.shape[0]
+            if name != 'full':
+                assert z_start <= region['zmin_output'] + 1.e-12
+                assert z_start + (Nz_out+1)*nz*dz > region['zmax_output']
+            block = full[ :Nr_out*nr, iz0:iz0+Nz_out*nz ]
+            if kw.get('decimation_method') == 'average':
+                expected = block.reshape(Nr_out, nr, Nz_out, nz).mean(
+                                                                axis=(1,3))
+            else:
+                expected = block[ nr//2::nr, nz//2::nz ]
+            assert np.allclose( data, expected, atol=1.e-12*abs(full).max() )
+
+    shutil.rmtree( temporary_dir )
+
+def test_particle_selection():
+    """
+    Check that the single-pass selection of the particle diagnostic
+    gives the same particles as the selection rules applied with numpy,
+    and that the random subsampling is reproducible.
+    """
+    if os.path.exists( temporary_dir ):
+        shutil.rmtree( temporary_dir )
+    np.random.seed(0)
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, dt,
+        p_zmin=zmin, p_zmax=zmax, p_rmin=0, p_rmax=5.e-6,
+        p_nz=2, p_nr=2, p_nt=4, n_e=1.e24, zmin=zmin, use_cuda=False )
+    species = sim.ptcl[0]
+    species.track( sim.comm )
+    species.uz[:] = np.random.normal( size=species.Ntot )
+    species.inv_gamma[:] = 1./np.sqrt( 1 + species.uz**2 )
+    species.Ez[:] = np.random.normal( size=species.Ntot )
+    select = { 'x': [ None, 3.e-6 ], 'uz': [ -0.5, None ],
+               'gamma': [ None, 1.5 ], 'Ez': [ -1., 1. ] }
+    ref_select = ( species.x < 3.e-6 ) & ( species.uz > -0.5 ) & \
+        ( 1./species.inv_gamma < 1.5 ) & \
+        ( species.Ez > -1. ) & ( species.Ez < 1. )
+
+    diag = ParticleDiagnostic( 1, {'electrons': species}, sim.comm,
+        select=select, write_dir=temporary_dir )
+    selected_indices = diag.apply_selection( species )
+    assert np.all( selected_indices == np.nonzero( ref_select )[0] )
+
+    # Subsampling: reproducible, and independent of the particle order
+    diag = ParticleDiagnostic( 1, {'electrons': species}, sim.comm,
+        select=select, subsampling_fraction=0.3, write_dir=temporary_dir )
+    subsampled = diag.apply_selection( species, seed=1 )
+    assert np.all( diag.apply_selection( species, seed=1 ) == subsampled )
+    assert not np.array_equal( diag.apply_selection( species, seed=2 ),
+                               subsampled )
+    assert np.all( ref_select[ subsampled ] )
+    assert abs( len(subsampled) - 0.3*ref_select.sum() ) \
+        < 5*np.sqrt( ref_select.sum() )
+    subsampled_id = species.tracker.id[ subsampled ]
+    permutation = np.random.permutation( species.Ntot )
+    for attr in [ 'x', 'y', 'z', 'ux', 'uy', 'uz', 'w', 'inv_gamma', 'Ez' ]:
+        setattr( species, attr, getattr( species, attr )[permutation] )
+    species.tracker.id = species.tracker.id[permutation]
+    permuted_id = species.tracker.id[ diag.apply_selection( species, seed=1 ) ]
+    assert np.all( np.sort( permuted_id ) == np.sort( subsampled_id ) )
+
+    # For tracked species, the subsampling does not depend on the MPI rank
+    # (i.e. a particle is kept whichever rank contains it)
+    seed_rank0 = diag.get_subsampling_seed( 10, 'electrons' )
+    diag.rank = 1
+    seed_rank1 = diag.get_subsampling_seed( 10, 'electrons' )
+    assert seed_rank0 == seed_rank1
+    # (Move the second half of the particles to another "rank")
+    ids_rank0 = species.tracker.id[
+        diag.apply_selection( species, seed=seed_rank0 ) ]
+    half = species.Ntot//2
+    for attr in [ 'x', 'y', 'z', 'ux', 'uy', 'uz', 'w', 'inv_gamma', 'Ez' ]:
+        setattr( species, attr, getattr( species, attr )[half:] )
+    species.tracker.id = species.tracker.id[half:]
+    species.Ntot = species.Ntot - half
+    ids_rank1 = species.tracker.id[
+        diag.apply_selection( species, seed=seed_rank1 ) ]
+    assert len( ids_rank1 ) > 0
+    assert np.array_equal( np.sort( ids_rank1 ), np.sort(
+        ids_rank0[ np.isin( ids_rank0, species.tracker.id ) ] ) )
+    # For untracked species, the seed is different on each rank
+    species.tracker = None
+    diag.rank = 0
+    seed_rank0 = diag.get_subsampling_seed( 10, 'electrons' )
+    diag.rank = 1
+    assert diag.get_subsampling_seed( 10, 'electrons' ) != seed_rank0
+
+    shutil.rmtree( temporary_dir )
+
+def test_reduced_particle_diag():
+    """
+    Check that the moments, emittances and histograms of the reduced
+    particle diagnostic correspond to those of the full particle output.
+    """
+    if os.path.exists( temporary_dir ):
+        shutil.rmtree( temporary_dir )
+    select = { 'uz': [ -0.1, None ], 'x': [ None, 3.e-6 ] }
+    histograms = { 'z': (20, zmin, zmax),
+                   ('x', 'uz'): ((10, -5.e-6, 5.e-6), (8, -0.1, 0.1)) }
+    np.random.seed(0)
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, dt,
+        p_zmin=zmin, p_zmax=zmax, p_rmin=0, p_rmax=5.e-6,
+        p_nz=2, p_nr=2, p_nt=4, n_e=1.e24, zmin=zmin, use_cuda=False )
+    sim.ptcl[0].ux[:] = 0.01*np.random.normal( size=sim.ptcl[0].Ntot )
+    sim.ptcl[0].uz[:] = 0.03*np.random.normal( size=sim.ptcl[0].Ntot )
+    sim.ptcl[0].inv_gamma[:] = 1./np.sqrt( 1 + sim.ptcl[0].ux**2 + \
+                            sim.ptcl[0].uy**2 + sim.ptcl[0].uz**2 )
+    sim.diags = [
+        ParticleDiagnostic( 1, {'electrons': sim.ptcl[0]}, sim.comm,
+            select=select, write_dir=temporary_dir ),
+        ReducedParticleDiagnostic( 1, {'electrons': sim.ptcl[0]}, sim.comm,
+            select=select, histograms=histograms, write_dir=temporary_dir ) ]
+    sim.step( N_step, show_progress=False )
+
+    ts = OpenPMDTimeSeries( os.path.join( temporary_dir, 'hdf5' ) )
+    with h5py.File( os.path.join( temporary_dir,
+                                  'reduced_particles.h5' ), 'r' ) as f:
+        grp = f['electrons']
+        assert list( grp['iteration'][:] ) == list( ts.iterations )
+        for i, iteration in enumerate( ts.iterations ):
+            x, y, z, ux, uy, uz, w = ts.get_particle(
+                ['x', 'y', 'z', 'ux', 'uy', 'uz', 'w'], iteration=iteration )
+            gamma = np.sqrt( 1 + ux**2 + uy**2 + uz**2 )
+            q = np.array([ x, y, z, ux, uy, uz, gamma ])
+            assert grp['n_macroparticles'][i] == len(w)
+            assert np.isclose( grp['charge'][i], -e*w.sum() )
+            mean = np.average( q, weights=w, axis=1 )
+            assert np.allclose( grp['mean'][i], mean, rtol=1.e-10, atol=0 )
+            cov = np.cov( q, aweights=w, bias=True )
+            assert np.allclose( grp['covariance'][i], cov,
+                rtol=1.e-8, atol=1.e-8*abs(np.diag(cov)).max() )
+            emit_x = np.sqrt( cov[0,0]*cov[3,3] - cov[0,3]**2 )
+            assert np.isclose( grp['emittance_x'][i], emit_x, rtol=1.e-6 )
+            hist, _ = np.histogram( z, bins=20, range=(zmin, zmax),
+                                    weights=w )
+            assert np.allclose( grp['histograms/z'][i], hist )
+            hist, _, _ = np.histogram2d( x, uz, bins=(10, 8),
+                range=((-5.e-6, 5.e-6), (-0.1, 0.1)), weights=w )
+            assert np.allclose( grp['histograms/x_uz'][i], hist )
+
+    shutil.rmtree( temporary_dir )
+
+def test_reduced_particle_diag_offset_and_restart():
+    """
+    Check that the rms of the reduced particle diagnostic is accurate
+    for a beam with a large mean momentum and a small spread, and that
+    the time-series file is truncated at the first output (except when
+    the simulation is restarted)
+    """
+    if os.path.exists( temporary_dir ):
+        shutil.rmtree( temporary_dir )
+    np.random.seed(0)
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, dt,
+        p_zmin=zmin, p_zmax=zmax, p_rmin=0, p_rmax=5.e-6,
+        p_nz=2, p_nr=2, p_nt=4, n_e=1.e24, zmin=zmin, use_cuda=False )
+    species = sim.ptcl[0]
+    species.uz[:] = 1.e5 + 1.e-3*np.random.normal( size=species.Ntot )
+    species.inv_gamma[:] = 1./np.sqrt( 1 + species.ux**2 + \
+                                       species.uy**2 + species.uz**2 )
+    filename = os.path.join( temporary_dir, 'reduced_particles.h5' )
+
+    def write_iterations( iterations ):
+        diag = ReducedParticleDiagnostic( 1, {'electrons': species},
+                                    sim.comm, write_dir=temporary_dir )
+        for iteration in iterations:
+            diag.write( iteration )
+        with h5py.File( filename, 'r' ) as f:
+            return( list( f['electrons/iteration'][:] ),
+                    f['electrons/rms'][-1] )
+
+    iterations, rms = write_iterations( [0, 1, 2, 3] )
+    assert iterations == [0, 1, 2, 3]
+    uz_rms = np.sqrt( np.cov( species.uz, aweights=species.w, bias=True ) )
+    assert np.isclose( rms[5], uz_rms, rtol=1.e-6 )
+    # A new simulation overwrites the file
+    iterations, _ = write_iterations( [0, 1] )
+    assert iterations == [0, 1]
+    # A restarted simulation keeps the outputs before the restart
+    write_iterations( [0, 1, 2, 3] )
+    iterations, _ = write_iterations( [2, 3] )
+    assert iterations == [0, 1, 2, 3]
+
+    shutil.rmtree( temporary_dir )
+
+def test_reduced_field_diag():
+    """
+    Check the reduced field quantities of a Gaussian laser pulse in vacuum
+    against their analytical values, and the on-axis lineout against
+    the full field output.
+    """
+    if os.path.exists( temporary_dir ):
+        shutil.rmtree( temporary_dir )
+    a0 = 0.5
+    w0 = 5.e-6
+    ctau = 3.e-6
+    z0 = 0.
+    lambda0 = 0.8e-6
+    sim = Simulation( 800, zmax, 64, rmax, Nm, (zmax-zmin)/800/c,
+                      zmin=zmin, use_cuda=False )
+    add_laser( sim, a0, w0, ctau, z0, lambda0=lambda0 )
+    sim.diags = [
+        FieldDiagnostic( 1, sim.fld, sim.comm, fieldtypes=['E'],
+                         write_dir=temporary_dir ),
+        ReducedFieldDiagnostic( 1, sim.fld, sim.comm, lambda0=lambda0,
+                                write_dir=temporary_dir ) ]
+    sim.step( 2, show_progress=False )
+
+    ts = OpenPMDTimeSeries( os.path.join( temporary_dir, 'hdf5' ) )
+    with h5py.File( os.path.join( temporary_dir,
+                                  'reduced_fields.h5' ), 'r' ) as f:
+        assert list( f['iteration'][:] ) == list( ts.iterations )
+        E0 = a0 * m_e*c**2*2*np.pi/(e*lambda0)
+        for i, iteration in enumerate( ts.iterations ):
+            t = iteration * sim.dt
+            assert np.isclose( f['a0'][i], a0, rtol=0.02 )
+            assert np.isclose( f['max_E_perp'][i], E0, rtol=0.02 )
+            assert np.isclose( f['laser_centroid_z'][i], z0+c*t,
+                               rtol=0, atol=0.05e-6 )
+            assert np.isclose( f['laser_rms_z'][i], ctau/2, rtol=0.02 )
+            assert np.isclose( f['laser_waist'][i], w0, rtol=0.02 )
+            energy = epsilon_0 * E0**2 * np.pi*w0**2/2 * \
+                ctau*np.sqrt(np.pi/2)/2
+            assert np.isclose( f['energy'][i, 1], energy, rtol=0.02 )
+            assert f['energy'][i, 0] < 1.e-6 * energy
+            Ez, info = ts.get_field( 'E', 'z', iteration=iteration, m=0 )
+            assert np.allclose( f['Ez_axis'][i], Ez[Ez.shape[0]//2] )
+            assert np.isclose( f['Ez_axis_zmin'][i], info.z[0] )
+
+    shutil.rmtree( temporary_dir )
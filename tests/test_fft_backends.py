@@ -0,0 +1,75 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This test file is part of FB-PIC (Fourier-Bessel Particle-In-Cell).
+
+It checks that the different CPU backends of the FFT object give the same
+result as numpy, and that the automatic selection of the backend is
+cached on disk.
+
+Usage :
+-------
+In order to run the tests:
+$ python -m pytest tests/test_fft_backends.py
+"""
+import os
+import json
+import shutil
+import numpy as np
+import pytest
+from fbpic.fields.spectral_transform import fourier
+from fbpic.fields.spectral_transform.fourier import FFT, \
+    available_backends, select_fft_backend
+
+Nz = 48
+Nr = 20
+temporary_dir = './tests/tmp_test_dir'
+
+@pytest.mark.parametrize( 'backend', available_backends )
+def test_fft_backend( backend ):
+    """Check the forward and inverse transform of each backend"""
+    fft = FFT( Nr, Nz, backend=backend )
+    array_in = np.random.rand( Nz, Nr ) + 1.j*np.random.rand( Nz, Nr )
+    array_out = np.zeros( (Nz, Nr), dtype=np.complex128 )
+    array_back = np.zeros( (Nz, Nr), dtype=np.complex128 )
+    fft.transform( array_in, array_out )
+    assert np.allclose( array_out, np.fft.fft( array_in, axis=0 ) )
+    fft.inverse_transform( array_out, array_back )
+    assert np.allclose( array_back, array_in )
+
+def test_fft_backend_selection():
+    """Check that the selected backend is cached on disk, and reused"""
+    if os.path.exists( temporary_dir ):
+        shutil.rmtree( temporary_dir )
+    fourier.selected_backends.clear()
+    # The benchmark should not modify the state of the global random
+    # generator (otherwise, the simulation would depend on the cache)
+    np.random.seed( 0 )
+    backend = select_fft_backend( Nz, Nr, 1, cache_dir=temporary_dir )
+    assert backend in available_backends
+    random_draw = np.random.rand()
+    np.random.seed( 0 )
+    assert np.random.rand() == random_draw
+
+    # Check the cache file
+    with open( os.path.join( temporary_dir, 'fft_backends.json' ) ) as f:
+        cached_backends = json.load( f )
+    assert list( cached_backends.values() ) == [ backend ]
+
+    # Modify the cache, and check that it is used (instead of a benchmark)
+    key = list( cached_backends.keys() )[0]
+    other_backend = available_backends[-1]
+    cached_backends[key] = other_backend
+    with open( os.path.join( temporary_dir, 'fft_backends.json' ), 'w' ) as f:
+        json.dump( cached_backends, f )
+    fourier.selected_backends.clear()
+    assert select_fft_backend( Nz, Nr, 1, cache_dir=temporary_dir ) \
+        == other_backend
+
+    fourier.selected_backends.clear()
+    shutil.rmtree( temporary_dir )
+
+if __name__ == '__main__':
+    for backend in available_backends:
+        test_fft_backend( backend )
+    test_fft_backend_selection()
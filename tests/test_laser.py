@@ -35,11 +35,16 @@ or
 $ python setup.py test
 """
 import numpy as np
+import pytest
 from scipy.constants import c, m_e, e
 from scipy.optimize import curve_fit
 from fbpic.main import Simulation
 from fbpic.lpa_utils.laser import add_laser_pulse, \
-    GaussianLaser, LaguerreGaussLaser, DonutLikeLaguerreGaussLaser
+    GaussianLaser, LaguerreGaussLaser, DonutLikeLaguerreGaussLaser, \
+    FlattenedGaussianLaser, FewCycleLaser
+from fbpic.lpa_utils.laser import direct_injection
+from fbpic.lpa_utils.laser.numba_methods import make_E_field_evaluator
+from fbpic.lpa_utils.boosted_frame import BoostConverter
 
 # Parameters
 # ----------
@@ -129,6 +134,92 @@ def test_laser_galilean(show=False):
 
     print('')
 
+# Laser profiles which provide a compiled kernel
+kernel_profiles = {
+    'gaussian': lambda: GaussianLaser( 1., w0, ctau/c, 0., zf=5.e-6,
+                                       theta_pol=0.3, cep_phase=0.5 ),
+    'chirped_gaussian': lambda: GaussianLaser( 1., w0, ctau/c, 0.,
+                                               phi2_chirp=200.e-30 ),
+    'laguerre_gauss': lambda: LaguerreGaussLaser( 1, 2, 1., w0, ctau/c, 0.,
+                                                  zf=5.e-6, theta0=0.2 ),
+    'donut_laguerre_gauss': lambda: DonutLikeLaguerreGaussLaser(
+                                    1, -1, 1., w0, ctau/c, 0., zf=5.e-6 ),
+    'flattened_gaussian': lambda: FlattenedGaussianLaser( 1., w0, ctau/c,
+                                                          0., N=4 ),
+    'few_cycle': lambda: FewCycleLaser( 1., w0, 5.e-15, 0., zf=5.e-6 ),
+    'summed': lambda: GaussianLaser( 1., w0, ctau/c, 0., theta_pol=0.3 ) \
+              + DonutLikeLaguerreGaussLaser( 0, -1, 0.5, w0, ctau/c, 0. ) }
+
+@pytest.mark.parametrize( 'gamma_boost', [ None, 5. ] )
+@pytest.mark.parametrize( 'profile_name', sorted( kernel_profiles.keys() ) )
+def test_laser_numba_kernel( profile_name, gamma_boost ):
+    """
+    Check that the compiled kernel of the laser profiles, and the
+    evaluator built from it (with or without boost), give the same
+    fields as the method `E_field`
+    """
+    laser_profile = kernel_profiles[profile_name]()
+    kernel = laser_profile.get_numba_kernel()
+    assert kernel is not None
+
+    # Random points of the simulation frame, at a fixed time
+    np.random.seed(0)
+    N = 1000
+    x = 2*w0*np.random.uniform( -1, 1, N )
+    y = 2*w0*np.random.uniform( -1, 1, N )
+    z = 2*ctau*np.random.uniform( -1, 1, N )
+    t = 1.e-15
+    if gamma_boost is None:
+        gamma0, beta0 = 1., 0.
+    else:
+        gamma0 = gamma_boost
+        beta0 = np.sqrt( 1 - 1./gamma0**2 )
+    zlab = gamma0*( z + beta0*c*t )
+    tlab = gamma0*( t + beta0*z/c )
+    Ex_ref, Ey_ref = laser_profile.E_field( x, y, zlab, tlab )
+    E_max = max( abs(Ex_ref).max(), abs(Ey_ref).max() )
+    assert E_max > 0
+
+    # Scalar kernel, evaluated in the lab frame
+    Ex = np.empty( N )
+    Ey = np.empty( N )
+    for i in range(N):
+        Ex[i], Ey[i] = kernel( x[i], y[i], zlab[i], tlab[i] )
+    assert np.allclose( Ex, Ex_ref, rtol=1.e-10, atol=1.e-10*E_max )
+    assert np.allclose( Ey, Ey_ref, rtol=1.e-10, atol=1.e-10*E_max )
+
+    # Evaluator, which performs the conversion to the lab frame
+    for parallel in [ True, False ]:
+        evaluate = make_E_field_evaluator( kernel, parallel=parallel )
+        evaluate( x, y, z, t, gamma0, beta0, 2., Ex, Ey )
+        assert np.allclose( Ex, 2*Ex_ref, rtol=1.e-10, atol=1.e-10*E_max )
+        assert np.allclose( Ey, 2*Ey_ref, rtol=1.e-10, atol=1.e-10*E_max )
+
+@pytest.mark.parametrize( 'gamma_boost', [ None, 5. ] )
+def test_laser_direct_chunks( monkeypatch, gamma_boost ):
+    """
+    Check that evaluating the laser fields by chunks, in several threads,
+    gives the same fields as evaluating them in a single chunk
+    """
+    sim = Simulation( Nz, zmax, Nr, Lr, 3, (zmax-zmin)/Nz/c, zmin=zmin,
+                      use_cuda=False )
+    laser_profile = GaussianLaser( 1., w0, ctau/c, 0., theta_pol=0.3 ) \
+        + LaguerreGaussLaser( 1, 1, 0.5, w0, ctau/c, 0., theta0=0.2 )
+    boost = None if gamma_boost is None else BoostConverter( gamma_boost )
+
+    Er_ref, Et_ref = direct_injection.get_laser_Er_Et( sim,
+                        laser_profile, boost, chunk_size=Nz )
+    # Use several threads, even if only one CPU is available
+    monkeypatch.setattr( direct_injection, 'nthreads', 4 )
+    Er, Et = direct_injection.get_laser_Er_Et( sim,
+                        laser_profile, boost, chunk_size=7 )
+
+    assert len(Er) == len(Et) == 3
+    for m in range(3):
+        assert Er[m].shape == (Nz, Nr)
+        assert np.array_equal( Er[m], Er_ref[m] )
+        assert np.array_equal( Et[m], Et_ref[m] )
+
 def propagate_pulse( Nz, Nr, Nm, zmin, zmax, Lr, L_prop, zf, dt,
         N_diag, w0, ctau, k0, E0, m, N_show, n_order, rtol,
         boundaries, v_window=0, use_galilean=False, v_comoving=0, show=False ):
@@ -25,11 +25,14 @@ $ py.test -q tests/test_laser_antenna.py
 or
 $ python setup.py test
 """
+import warnings
 import numpy as np
 from scipy.optimize import curve_fit
 from scipy.constants import c, m_e, e
 from fbpic.main import Simulation
-from fbpic.lpa_utils.laser import add_laser
+from fbpic.lpa_utils.laser import add_laser, GaussianLaser, \
+    LaguerreGaussLaser, FlattenedGaussianLaser, DonutLikeLaguerreGaussLaser
+from fbpic.lpa_utils.laser.antenna_injection import LaserAntenna
 from fbpic.openpmd_diag import FieldDiagnostic
 from fbpic.lpa_utils.boosted_frame import BoostConverter
 
@@ -84,6 +87,42 @@ def test_antenna_boostedframe(show=False, write_files=False):
     run_and_check_laser_antenna(gamma_boost, show, write_files,
                                 z0=z0_antenna-ctau)
 
+def test_antenna_separable_cache():
+    """
+    Function that is run by py.test, when doing `python setup.py test`
+    Check that the velocities of the antenna particles are unchanged
+    when the transverse profile of a separable laser is cached
+    (and that the cache is not used for a summed profile, which
+    is not separable)
+    """
+    for profile, separable in [
+        (GaussianLaser( a0, w0, ctau/c, z0_antenna-ctau, zf=20.e-6 ), True),
+        (LaguerreGaussLaser( 1, 1, a0, w0, ctau/c, z0_antenna-ctau ), True),
+        (FlattenedGaussianLaser( a0, w0, ctau/c, z0_antenna-ctau, N=4 ),
+            True),
+        (DonutLikeLaguerreGaussLaser( 1, -1, a0, w0, ctau/c,
+            z0_antenna-ctau, zf=20.e-6 ), True),
+        (GaussianLaser( a0, w0, ctau/c, z0_antenna-ctau ) + \
+         DonutLikeLaguerreGaussLaser( 0, 1, a0, w0, ctau/c,
+            z0_antenna-ctau ), False) ]:
+        with warnings.catch_warnings( record=True ) as caught:
+            warnings.simplefilter( 'always' )
+            antennas = [ LaserAntenna( profile, z0_antenna, 0, rmax/Nr,
+                            Nr, Nm, None, use_separable_cache=use_cache )
+                         for use_cache in [True, False] ]
+        assert antennas[0].use_separable_cache == separable
+        cache_warnings = [ w for w in caught
+                           if 'separable cache' in str(w.message) ]
+        assert ( len(cache_warnings) == 0 ) == separable
+        for t in np.linspace( 0, 2*ctau/c, 5 ):
+            for antenna in antennas:
+                antenna.update_v( t )
+            vmax = abs( antennas[1].vx ).max()
+            assert np.allclose( antennas[0].vx, antennas[1].vx,
+                                atol=1.e-10*vmax )
+            assert np.allclose( antennas[0].vy, antennas[1].vy,
+                                atol=1.e-10*vmax )
+
 def run_and_check_laser_antenna(gamma_b, show, write_files,
                             z0, v=0, forward_propagating=True ):
     """
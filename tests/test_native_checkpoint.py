@@ -0,0 +1,140 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This test file is part of FB-PIC (Fourier-Bessel Particle-In-Cell).
+
+It verifies the native checkpoint format, by comparing a simulation
+(laser in a plasma, with a moving window, continuous injection and
+tracked particles) that runs without interruption, with a simulation
+that is restarted from a native checkpoint half-way through.
+
+Usage :
+-------
+In order to run the tests:
+$ python -m pytest tests/test_native_checkpoint.py
+"""
+import os, shutil, time
+import numpy as np
+import pytest
+from scipy.constants import c
+from fbpic.main import Simulation
+from fbpic.lpa_utils.laser import add_laser
+from fbpic.openpmd_diag import set_periodic_checkpoint, \
+    restart_from_checkpoint
+
+# Parameters
+# ----------
+temporary_dir = './tests/tmp_test_dir'
+checkpoint_dir = os.path.join( temporary_dir, 'checkpoints' )
+Nz = 100
+zmin = -20.e-6
+zmax = 0.
+Nr = 32
+rmax = 20.e-6
+Nm = 2
+dt = (zmax-zmin)/Nz/c
+
+def create_simulation():
+    """
+    Create a simulation with a plasma, a laser and a moving window
+    """
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, dt, zmin=zmin,
+        n_e=1.e24, p_zmin=-15.e-6, p_rmax=10.e-6, p_nz=2, p_nr=2, p_nt=4,
+        boundaries={'z':'open', 'r':'reflective'}, use_cuda=False )
+    sim.ptcl[0].track( sim.comm )
+    return( sim )
+
+def test_native_checkpoint():
+    """
+    Check that a restart from a native checkpoint exactly reproduces
+    the uninterrupted simulation
+    """
+    if os.path.exists( temporary_dir ):
+        shutil.rmtree( temporary_dir )
+
+    # Uninterrupted simulation, with a checkpoint half-way through
+    np.random.seed(0)
+    sim = create_simulation()
+    add_laser( sim, 1., 5.e-6, 3.e-6, -10.e-6 )
+    sim.set_moving_window( v=c )
+    # Checkpoint at an iteration where particles are exchanged (since
+    # particles are always exchanged at the first iteration after a restart)
+    period = sim.comm.exchange_period
+    N_step = 2*period
+    set_periodic_checkpoint( sim, period, checkpoint_dir=checkpoint_dir,
+                             checkpoint_format='native' )
+    sim.step( N_step, show_progress=False )
+
+    # Restarted simulation
+    np.random.seed(1)
+    restarted_sim = create_simulation()
+    restart_from_checkpoint( restarted_sim, checkpoint_dir=checkpoint_dir,
+                             checkpoint_format='native' )
+    assert restarted_sim.iteration == N_step
+    restart_from_checkpoint( restarted_sim, iteration=period,
+        checkpoint_dir=checkpoint_dir, checkpoint_format='native' )
+    assert restarted_sim.iteration == period
+    assert restarted_sim.comm.moving_win is not None
+    restarted_sim.step( period, show_progress=False )
+
+    # Compare the two simulations
+    assert restarted_sim.iteration == sim.iteration
+    assert restarted_sim.time == sim.time
+    for m in range(Nm):
+        assert restarted_sim.fld.interp[m].zmin == sim.fld.interp[m].zmin
+        for field in [ 'Er', 'Et', 'Ez', 'Br', 'Bt', 'Bz' ]:
+            ref = getattr( sim.fld.interp[m], field )
+            data = getattr( restarted_sim.fld.interp[m], field )
+            assert np.all( data == ref )
+    species = sim.ptcl[0]
+    restarted_species = restarted_sim.ptcl[0]
+    assert restarted_species.Ntot == species.Ntot
+    assert np.all( restarted_species.tracker.id == species.tracker.id )
+    for attr in [ 'x', 'y', 'z', 'ux', 'uy', 'uz', 'w', 'inv_gamma' ]:
+        ref = getattr( species, attr )
+        data = getattr( restarted_species, attr )
+        assert np.all( data == ref )
+
+    shutil.rmtree( temporary_dir )
+
+@pytest.mark.parametrize( 'use_deadline', [ False, True ] )
+def test_async_checkpoint_retention( use_deadline ):
+    """
+    Check that the asynchronous checkpoints are complete, that only the
+    newest ones are kept, and that the wall-clock trigger (with either
+    a duration or an absolute deadline) writes a single additional
+    checkpoint
+    """
+    if os.path.exists( temporary_dir ):
+        shutil.rmtree( temporary_dir )
+    np.random.seed(0)
+    sim = create_simulation()
+    if use_deadline:
+        walltime = { 'walltime_deadline': time.time() }
+    else:
+        walltime = { 'walltime_limit': 0. }
+    set_periodic_checkpoint( sim, 3, checkpoint_dir=checkpoint_dir,
+        checkpoint_format='native', asynchronous=True, keep_last=2,
+        walltime_margin=0., **walltime )
+    # (The last checkpoint is waited for at the end of `step`)
+    sim.step( 10, show_progress=False )
+    assert sim.checkpoints[0].thread is None
+
+    # The checkpoints of iteration 1 (wall-clock trigger) and 3
+    # have been deleted
+    proc_dir = os.path.join( checkpoint_dir, 'proc0' )
+    assert sorted( os.listdir( proc_dir ) ) == \
+        [ 'native00000006', 'native00000009' ]
+
+    # Check that the latest checkpoint is complete
+    restarted_sim = create_simulation()
+    restart_from_checkpoint( restarted_sim, checkpoint_dir=checkpoint_dir,
+                             checkpoint_format='native' )
+    assert restarted_sim.iteration == 9
+
+    shutil.rmtree( temporary_dir )
+
+if __name__ == '__main__':
+    test_native_checkpoint()
+    test_async_checkpoint_retention( False )
+    test_async_checkpoint_retention( True )
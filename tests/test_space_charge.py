@@ -31,11 +31,12 @@ temporary_dir = './tests/tmp_test_dir'
 origin_dir = './tests/unautomated'
 
 def run_sim_serial_and_parallel( script_file, data_file=None,
-                                 check_gaussian=False ):
+                                 check_gaussian=False, atol=1.e-8 ):
     """Copy the script `script_file` from the `unautomated directory`
     and run the simulation both in serial and paralllel.
 
-    Then compare the results."""
+    Then compare the results (with the absolute tolerance `atol`,
+    relative to the maximum of each field)."""
 
     # Create a temporary directory for the simulation
     # and copy the testing script into this directory
@@ -68,7 +69,7 @@ def run_sim_serial_and_parallel( script_file, data_file=None,
     # calculation are identical
     check_identical_fields(
         os.path.join(temporary_dir, 'diags_serial/hdf5/'),
-        os.path.join(temporary_dir, 'diags_parallel/hdf5/') )
+        os.path.join(temporary_dir, 'diags_parallel/hdf5/'), atol )
 
     # Check the validity
     if check_gaussian:
@@ -77,7 +78,7 @@ def run_sim_serial_and_parallel( script_file, data_file=None,
     # Suppress the temporary directory
     shutil.rmtree( temporary_dir )
 
-def check_identical_fields( folder1, folder2 ):
+def check_identical_fields( folder1, folder2, atol=1.e-8 ):
     ts1 = OpenPMDTimeSeries( folder1 )
     ts2 = OpenPMDTimeSeries( folder2 )
     # Check the vector fields
@@ -89,13 +90,14 @@ def check_identical_fields( folder1, folder2 ):
         if abs(field1).max() == 0:
             assert abs(field2).max() == 0
         else:
-            assert np.allclose(
-                field1/abs(field1).max(), field2/abs(field2).max() )
+            assert np.allclose( field1/abs(field1).max(),
+                                field2/abs(field2).max(), atol=atol )
     # Check the rho field
     print("Checking rho")
     field1, info = ts1.get_field("rho", iteration=0)
     field2, info = ts2.get_field("rho", iteration=0)
-    assert np.allclose( field1/abs(field1).max(), field2/abs(field2).max() )
+    assert np.allclose( field1/abs(field1).max(),
+                        field2/abs(field2).max(), atol=atol )
 
 
 def check_theory_gaussian():
@@ -116,6 +118,81 @@ def check_theory_gaussian():
     assert np.allclose( Ex, Eth, atol=0.1*Eth.max() )
     assert np.allclose( By, Bth, atol=0.1*Bth.max() )
 
+def test_bunch_chunked_loading():
+    """Check that loading a bunch by chunks (from a text file and from an
+    openPMD file, with and without a boost) gives the same particles
+    as a full load."""
+    from fbpic.main import Simulation
+    from fbpic.openpmd_diag import ParticleDiagnostic
+    from fbpic.lpa_utils.boosted_frame import BoostConverter
+    from fbpic.lpa_utils.bunch import add_particle_bunch_file, \
+        add_particle_bunch_openPMD
+    from scipy.constants import m_e, e
+
+    if os.path.exists( temporary_dir ):
+        shutil.rmtree( temporary_dir )
+    os.mkdir( temporary_dir )
+    data_file = os.path.join( origin_dir, 'test_space_charge_file_data.txt' )
+    boost = BoostConverter( 2. )
+    sim = Simulation( 200, 40.e-6, 20, 100.e-6, 2, 40.e-6/200/c,
+                      zmin=-20.e-6, n_order=32, boundaries='open' )
+    sim.ptcl = []
+
+    # Text file: the chunked loading should give the same particles
+    kw = dict( z_off=0., boost=boost, initialize_self_field=False )
+    ref = add_particle_bunch_file( sim, -e, m_e, data_file, 1.e7, **kw )
+    chunked = add_particle_bunch_file( sim, -e, m_e, data_file, 1.e7,
+                                       chunk_size=7, **kw )
+    check_identical_particles( ref, chunked )
+
+    # openPMD file: write the bunch and reload it
+    sim.ptcl = [ add_particle_bunch_file( sim, -e, m_e, data_file, 1.e7,
+                                          initialize_self_field=False ) ]
+    diag = ParticleDiagnostic( 1, {'bunch': sim.ptcl[0]},
+                write_dir=os.path.join(temporary_dir, 'bunch_diag') )
+    diag.write_hdf5( 0 )
+    ts_path = os.path.join( temporary_dir, 'bunch_diag/hdf5' )
+    # (The positions in `select` are in meters, for both ways of loading)
+    for bunch_boost in [ boost, None ]:
+        kw = dict( z_off=5.e-6, boost=bunch_boost, iteration=0,
+                   select={'uz':[0., None], 'x':[-2.e-6, None]},
+                   initialize_self_field=False )
+        ref = add_particle_bunch_openPMD( sim, -e, m_e, ts_path, **kw )
+        assert ref.Ntot < sim.ptcl[0].Ntot
+        chunked = add_particle_bunch_openPMD( sim, -e, m_e, ts_path,
+                                              chunk_size=7, **kw )
+        check_identical_particles( ref, chunked )
+
+    shutil.rmtree( temporary_dir )
+
+def check_identical_particles( ptcl1, ptcl2 ):
+    assert ptcl1.Ntot > 0
+    assert ptcl1.Ntot == ptcl2.Ntot
+    for attr in ['x', 'y', 'z', 'ux', 'uy', 'uz', 'inv_gamma', 'w']:
+        assert np.allclose( getattr(ptcl1, attr), getattr(ptcl2, attr) )
+
+def test_distributed_space_charge():
+    """Check that the space charge fields calculated on the local grid
+    agree with those calculated on the global grid (single proc)."""
+    from fbpic.main import Simulation
+    from fbpic.lpa_utils.bunch import add_particle_bunch_gaussian
+    from scipy.constants import m_e, e
+
+    fields = []
+    for distributed in [False, True]:
+        np.random.seed(0)
+        sim = Simulation( 200, 40.e-6, 50, 30.e-6, 2, 40.e-6/200/c,
+                          zmin=-20.e-6, n_order=32,
+                          boundaries={'z':'open', 'r':'reflective'} )
+        sim.ptcl = []
+        add_particle_bunch_gaussian( sim, -e, m_e, sig_r, sig_z, 1.e-6,
+                                     gamma0, 0., Q/e, 5000,
+                                     distributed_self_field=distributed )
+        fields.append( [ getattr(sim.fld.interp[m], field).copy()
+            for m in range(2) for field in ['Er', 'Ez', 'Bt'] ] )
+    for field1, field2 in zip( *fields ):
+        assert np.allclose( field1, field2, atol=1.e-6*abs(field1).max() )
+
 def test_bunch_from_file():
     run_sim_serial_and_parallel( 'test_space_charge_file.py',
                                 'test_space_charge_file_data.txt')
@@ -124,6 +201,18 @@ def test_bunch_gaussian():
     run_sim_serial_and_parallel( 'test_space_charge_gaussian.py',
                                  check_gaussian=True )
 
+def test_bunch_gaussian_distributed():
+    """Check that the space charge fields calculated on the local grid
+    of two MPI ranks agree with those of the global solve (single proc),
+    for a bunch which is centered on the boundary between the ranks.
+    (The local solve is approximate near the boundary: the fields differ
+    by about 1.e-3 of their maximum.)"""
+    run_sim_serial_and_parallel( 'test_space_charge_distributed.py',
+                                 atol=5.e-3 )
+
 if __name__ == '__main__':
+    test_bunch_chunked_loading()
+    test_distributed_space_charge()
     test_bunch_gaussian()
     test_bunch_from_file()
+    test_bunch_gaussian_distributed()
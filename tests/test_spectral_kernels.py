@@ -0,0 +1,247 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This test file is part of FB-PIC (Fourier-Bessel Particle-In-Cell).
+
+It checks that the optimized spectral-space kernels give the same
+results as the reference kernels, by running the same simulation
+(laser in a plasma, with PML) with and without these optimizations.
+
+Usage :
+-------
+In order to run the tests:
+$ python -m pytest tests/test_spectral_kernels.py
+"""
+import numpy as np
+import pytest
+from scipy.constants import c
+from fbpic.main import Simulation
+from fbpic.lpa_utils.laser import add_laser
+from fbpic.fields.numba_methods import get_psatd_coefs_standard
+from fbpic.boundaries.moving_window import shift_spect_array_cpu
+from fbpic.fields.spectral_transform.hankel import DHT
+from fbpic.fields import Fields
+from fbpic.utils.threading import concurrent_calls_supported
+
+# Parameters
+# ----------
+Nz = 64
+zmin = -20.e-6
+zmax = 0.
+Nr = 32
+rmax = 20.e-6
+Nm = 2
+dt = (zmax-zmin)/Nz/c
+N_step = 10
+
+def run_simulation( v_comoving=None, psatd_coefs_on_the_fly=False,
+                    **options ):
+    """
+    Run a short simulation of a laser in a plasma, where the
+    attributes `options` of the Fields object are modified
+    """
+    np.random.seed(0)
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, dt, zmin=zmin,
+        n_e=1.e24, p_zmin=-15.e-6, p_rmax=10.e-6, p_nz=2, p_nr=2, p_nt=4,
+        boundaries={'z':'open', 'r':'open'}, current_correction='curl-free',
+        v_comoving=v_comoving, use_galilean=(v_comoving is not None),
+        psatd_coefs_on_the_fly=psatd_coefs_on_the_fly, use_cuda=False )
+    add_laser( sim, 1., 5.e-6, 3.e-6, -10.e-6 )
+    for key, value in options.items():
+        setattr( sim.fld, key, value )
+    sim.step( N_step, show_progress=False )
+    return( sim )
+
+@pytest.mark.parametrize( 'v_comoving', [ None, -0.9*c ] )
+def test_fused_spectral_kernel( v_comoving ):
+    """
+    Check that the fused filter/current-correction/push kernel gives
+    the same fields as the separate kernels
+    """
+    ref_sim = run_simulation( v_comoving, use_fused_spectral_kernel=False )
+    sim = run_simulation( v_comoving, use_fused_spectral_kernel=True )
+    for m in range(Nm):
+        for field in [ 'Ep', 'Em', 'Ez', 'Bp', 'Bm', 'Bz', 'Jp', 'Jz',
+                       'rho_prev', 'Ep_pml', 'Bm_pml' ]:
+            ref = getattr( ref_sim.fld.spect[m], field )
+            data = getattr( sim.fld.spect[m], field )
+            assert np.allclose( data, ref, rtol=1.e-12,
+                                atol=1.e-12*abs(ref).max() )
+
+def test_psatd_coefs_values():
+    """
+    Check that the psatd coefficients computed on the fly are the same
+    as the stored coefficients (including at w=0)
+    """
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, dt, zmin=zmin, use_cuda=False )
+    for m in range(Nm):
+        ps = sim.fld.psatd[m]
+        kz = sim.fld.spect[m].kz
+        kr = sim.fld.spect[m].kr
+        coefs = np.zeros( (5, Nz, Nr) )
+        for iz in range(Nz):
+            for ir in range(Nr):
+                coefs[:, iz, ir] = get_psatd_coefs_standard(
+                                        kz[iz, ir], kr[iz, ir], dt )
+        for i, ref in enumerate([ ps.C, ps.S_w, ps.j_coef,
+                                  ps.rho_prev_coef, ps.rho_next_coef ]):
+            assert np.allclose( coefs[i], ref, rtol=1.e-12,
+                                atol=1.e-12*abs(ref).max() )
+    # Check the special value at w=0
+    assert np.allclose( get_psatd_coefs_standard( 0., 0., dt ),
+        ( ps.C[0,0], ps.S_w[0,0], ps.j_coef[0,0],
+          ps.rho_prev_coef[0,0], ps.rho_next_coef[0,0] ), rtol=1.e-14 )
+
+@pytest.mark.parametrize( 'use_fused_spectral_kernel', [ True, False ] )
+def test_psatd_coefs_on_the_fly( use_fused_spectral_kernel ):
+    """
+    Check that recomputing the psatd coefficients inside the push kernels
+    gives the same fields as using the stored coefficients
+    """
+    ref_sim = run_simulation(
+        use_fused_spectral_kernel=use_fused_spectral_kernel )
+    sim = run_simulation( psatd_coefs_on_the_fly=True,
+        use_fused_spectral_kernel=use_fused_spectral_kernel )
+    for m in range(Nm):
+        # Check that the coefficient arrays were not allocated
+        assert sim.fld.psatd[m].C.size == 1
+        for field in [ 'Ep', 'Em', 'Ez', 'Bp', 'Bm', 'Bz',
+                       'Ep_pml', 'Bm_pml' ]:
+            ref = getattr( ref_sim.fld.spect[m], field )
+            data = getattr( sim.fld.spect[m], field )
+            assert np.allclose( data, ref, rtol=1.e-10,
+                                atol=1.e-10*abs(ref).max() )
+
+def test_mode_parallel_transforms():
+    """
+    Check that transforming the azimuthal modes concurrently gives
+    the same fields as transforming them sequentially
+    """
+    ref_sim = run_simulation( use_mode_parallel_transforms=False )
+    sim = run_simulation( use_mode_parallel_transforms=True )
+    # The pool of threads is only used if the threading layer of numba
+    # supports concurrent calls (otherwise, the modes are processed serially)
+    if concurrent_calls_supported():
+        assert sim.fld.transform_pool is not None
+    else:
+        assert sim.fld.transform_pool is None
+    for m in range(Nm):
+        for field in [ 'Er', 'Et', 'Ez', 'Br', 'Bt', 'Bz', 'Jr', 'Jz', 'rho' ]:
+            ref = getattr( ref_sim.fld.interp[m], field )
+            data = getattr( sim.fld.interp[m], field )
+            assert np.allclose( data, ref, rtol=1.e-12,
+                                atol=1.e-12*abs(ref).max() )
+
+@pytest.mark.parametrize( 'n_move', [ 3, -2 ] )
+def test_fused_moving_window_shift( n_move ):
+    """
+    Check that shifting a spectral grid in a single pass gives the same
+    fields as shifting each field separately
+    """
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, dt, zmin=zmin,
+        boundaries={'z':'open', 'r':'open'}, use_cuda=False )
+    sim.set_moving_window( v=c )
+    grid = sim.fld.spect[1]
+    fields = [ 'Ep', 'Em', 'Ez', 'Bp', 'Bm', 'Bz', 'Ep_pml', 'Em_pml',
+               'Bp_pml', 'Bm_pml', 'rho_prev', 'Jp', 'Jm', 'Jz' ]
+    shape = grid.Ep.shape
+    for field in fields:
+        getattr( grid, field )[:,:] = np.random.rand( *shape ) \
+                                   + 1.j*np.random.rand( *shape )
+    # Reference: shift each field separately
+    ref = { field: getattr( grid, field ).copy() for field in fields }
+    for field in fields:
+        shift_spect_array_cpu( ref[field], grid.field_shift, n_move )
+    # Shift the whole grid in a single pass
+    sim.comm.moving_win.shift_spect_grid( grid, n_move, shift_rho=True,
+                                          shift_currents=True )
+    for field in fields:
+        assert np.array_equal( getattr( grid, field ), ref[field] )
+
+@pytest.mark.parametrize( 'm', [ 0, 1 ] )
+def test_compressed_dht( m ):
+    """
+    Check that the compressed Hankel transform agrees with the dense
+    Hankel transform, within the requested accuracy (amplified by the
+    condition number of the matrices, which is of the order of 1.e3)
+    """
+    Nr_dht = 512
+    Nz_dht = 4
+    for p in [ m-1, m, m+1 ]:
+        dense = DHT( p, m, Nr_dht, Nz_dht, rmax )
+        compressed = DHT( p, m, Nr_dht, Nz_dht, rmax, tolerance=1.e-10 )
+        assert compressed.compressed_M.compression < 1.
+        F = np.random.rand( Nz_dht, Nr_dht ) \
+            + 1.j*np.random.rand( Nz_dht, Nr_dht )
+        G_ref = np.zeros_like( F )
+        G = np.zeros_like( F )
+        # Forward transform
+        dense.transform( F, G_ref )
+        compressed.transform( F, G )
+        assert np.allclose( G, G_ref, rtol=0, atol=1.e-7*abs(G_ref).max() )
+        # Inverse transform
+        dense.inverse_transform( G_ref, F )
+        compressed.inverse_transform( G_ref, G )
+        assert np.allclose( G, F, rtol=0, atol=1.e-7*abs(F).max() )
+
+def test_skip_zero_sources():
+    """
+    Check that skipping the zero rows and zero modes of the sources
+    gives the same spectral sources as transforming the full arrays
+    """
+    fld = Fields( Nz, zmax, Nr, rmax, 3, dt, zmin=zmin )
+    # Mode 0: sources only in a few slices ; mode 1: zero sources ;
+    # mode 2: sources everywhere (Jt is zero)
+    for m, (iz_min, iz_max) in enumerate([ (10, 20), (0, 0), (0, Nz) ]):
+        for field in [ 'Jr', 'Jz', 'rho' ]:
+            array = getattr( fld.interp[m], field )
+            array[:,:] = 0.
+            n_rows = iz_max - iz_min
+            array[iz_min:iz_max] = np.random.rand( n_rows, Nr ) \
+                                 + 1.j*np.random.rand( n_rows, Nr )
+        fld.interp[m].Jt[:,:] = 0.
+
+    results = {}
+    for skip_zero_sources in [ False, True ]:
+        fld.skip_zero_sources = skip_zero_sources
+        fld.interp2spect( 'J' )
+        fld.interp2spect( 'rho_next' )
+        results[skip_zero_sources] = [
+            [ getattr( fld.spect[m], field ).copy() for field in
+              [ 'Jp', 'Jm', 'Jz', 'rho_next' ] ] for m in range(3) ]
+
+    for m in range(3):
+        for ref, data in zip( results[False][m], results[True][m] ):
+            assert np.allclose( data, ref, rtol=1.e-12,
+                                atol=1.e-12*abs(ref).max() )
+    # The spectral sources of mode 1 are exactly zero
+    for data in results[True][1]:
+        assert np.all( data == 0 )
+
+def test_skip_zero_sources_simulation():
+    """
+    Check that skipping the zero rows of the sources does not modify
+    the result of a simulation (where the plasma does not fill the box)
+    """
+    ref_sim = run_simulation( skip_zero_sources=False )
+    sim = run_simulation( skip_zero_sources=True )
+    for m in range(Nm):
+        for field in [ 'Ep', 'Ez', 'Bm', 'Jp', 'Jz', 'rho_prev' ]:
+            ref = getattr( ref_sim.fld.spect[m], field )
+            data = getattr( sim.fld.spect[m], field )
+            assert np.allclose( data, ref, rtol=1.e-10,
+                                atol=1.e-10*abs(ref).max() )
+
+if __name__ == '__main__':
+    test_fused_spectral_kernel( None )
+    test_fused_spectral_kernel( -0.9*c )
+    test_psatd_coefs_values()
+    test_psatd_coefs_on_the_fly( True )
+    test_psatd_coefs_on_the_fly( False )
+    test_mode_parallel_transforms()
+    test_fused_moving_window_shift( 3 )
+    test_fused_moving_window_shift( -2 )
+    test_compressed_dht( 0 )
+    test_compressed_dht( 1 )
+    test_skip_zero_sources()
+    test_skip_zero_sources_simulation()
@@ -10,15 +10,24 @@ It verifies the validity of the charge density deposition by:
   (i.e. this confirms that no Verboncoeur-type correction is needed)
 - Shifting this plasma by a small amount in r, and still verifying
   that the deposited density is uniform
+- Checking that erasing and reducing only the region of the deposition
+  buffers that was modified (on CPU) gives the same density as
+  erasing and reducing the full buffers
+- Checking that depositing several species at once (on CPU) gives the
+  same charge and current as depositing the species one by one
+- Checking that the deposition with cached shape factors (on CPU) gives
+  the same charge and current as the regular deposition
  The tests are performed with different particle shapes: linear, cubic
 
 Usage :
 from the top-level directory of FBPIC run
 $ python tests/test_uniform_rho_deposition.py
 """
-from scipy.constants import c, e
+from scipy.constants import c, e, m_e
 from fbpic.main import Simulation
 from fbpic.utils.cuda import GpuMemoryManager
+from fbpic.particles.elementary_process.cuda_numba_utils import \
+    reallocate_and_copy_old
 import numpy as np
 
 # Parameters
@@ -141,7 +150,132 @@ def neutral_plasma_shifted(shape, show=False):
         plt.colorbar()
         plt.show()
 
+def test_deposition_bounds():
+    "Function that is run by py.test, when doing `python setup.py test`"
+    for shape in ['linear', 'cubic']:
+        deposition_bounds( shape )
+
+def deposition_bounds(shape):
+    # Initialize a uniform plasma, and a small species near the axis
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, zmax/Nz/c,
+        0, zmax, 0, p_rmax, p_nz, p_nr, p_nt, n,
+        initialize_ions=False, particle_shape=shape, use_cuda=False )
+    small = sim.add_new_species( q=-e, m=m_e, n=n, p_nz=2, p_nr=2, p_nt=4,
+                        p_zmin=8.e-6, p_zmax=9.e-6, p_rmax=2.e-6 )
+    small.x += 0.1*rmax/Nr
+
+    # Deposit all species, so that the whole buffer is modified
+    sim.fld.erase('rho')
+    for species in sim.ptcl :
+        species.deposit( sim.fld, 'rho')
+    sim.fld.sum_reduce_deposition_array('rho')
+
+    # Deposit only the small species: erase and reduce the modified region
+    sim.fld.erase('rho')
+    small.deposit( sim.fld, 'rho' )
+    bounds = sim.fld.rho_deposit_bounds.copy()
+    sim.fld.sum_reduce_deposition_array('rho')
+    rho = [ sim.fld.interp[m].rho.copy() for m in range(Nm) ]
+    # Check that the modified region is small
+    assert np.all( bounds[:,1] - bounds[:,0] <= 20 )
+    assert np.all( bounds[:,3] - bounds[:,2] <= 10 )
+
+    # Deposit the small species again, with erase and reduce
+    # of the full buffers
+    sim.fld.rho_deposit_bounds[:] = [ 0, Nz+4, 0, Nr+4 ]
+    sim.fld.erase('rho')
+    sim.fld.rho_deposit_bounds[:] = [ 0, Nz+4, 0, Nr+4 ]
+    small.deposit( sim.fld, 'rho' )
+    sim.fld.sum_reduce_deposition_array('rho')
+    for m in range(Nm):
+        assert np.array_equal( sim.fld.interp[m].rho, rho[m] )
+        assert np.any( rho[m] != 0 )
+
+def test_multi_species_deposition():
+    "Function that is run by py.test, when doing `python setup.py test`"
+    # Initialize electrons and ions, and a small species with cubic shape
+    sim = Simulation( Nz, zmax, Nr, rmax, Nm, zmax/Nz/c,
+        0, zmax, 0, p_rmax, p_nz, p_nr, p_nt, n,
+        initialize_ions=True, use_cuda=False )
+    small = sim.add_new_species( q=-e, m=m_e, n=n, p_nz=2, p_nr=2, p_nt=4,
+                        p_zmin=8.e-6, p_zmax=9.e-6, p_rmax=2.e-6 )
+    small.particle_shape = 'cubic'
+    for species in sim.ptcl:
+        species.x += 0.1*rmax/Nr
+        for u in [ species.ux, species.uy, species.uz ]:
+            u[:] = np.random.normal( size=species.Ntot )
+        species.inv_gamma[:] = 1./np.sqrt( 1 + species.ux**2 + \
+            species.uy**2 + species.uz**2 )
+
+    for fieldtype, fields in [ ('rho', ['rho']), ('J', ['Jr', 'Jt', 'Jz']) ]:
+        # Deposit the species one by one
+        sim.fld.erase( fieldtype )
+        for species in sim.ptcl:
+            species.deposit( sim.fld, fieldtype )
+        sim.fld.sum_reduce_deposition_array( fieldtype )
+        ref = [ getattr( sim.fld.interp[m], field ).copy()
+                for m in range(Nm) for field in fields ]
+        # Deposit all species at once
+        sim.fld.erase( fieldtype )
+        sim.deposit_species( fieldtype, sim.ptcl, [] )
+        sim.fld.sum_reduce_deposition_array( fieldtype )
+        data = [ getattr( sim.fld.interp[m], field )
+                 for m in range(Nm) for field in fields ]
+        for array, ref_array in zip( data, ref ):
+            assert np.allclose( array, ref_array,
+                                rtol=1.e-12, atol=1.e-12*abs(ref_array).max() )
+
+def test_shape_factor_cache():
+    "Function that is run by py.test, when doing `python setup.py test`"
+    for shape in ['linear', 'cubic']:
+        shape_factor_cache( shape )
+
+def shape_factor_cache(shape):
+    # Initialize a plasma with random momenta (with 3 modes, in order
+    # to test the sign of the shape factors below the axis for all modes)
+    sim = Simulation( Nz, zmax, Nr, rmax, 3, zmax/Nz/c,
+        0, zmax, 0, p_rmax, p_nz, p_nr, p_nt, n,
+        initialize_ions=False, particle_shape=shape, use_cuda=False )
+    species = sim.ptcl[0]
+    species.x += 0.1*rmax/Nr
+    for u in [ species.ux, species.uy, species.uz ]:
+        u[:] = np.random.normal( size=species.Ntot )
+    species.inv_gamma[:] = 1./np.sqrt( 1 + species.ux**2 + \
+        species.uy**2 + species.uz**2 )
+
+    def deposit( fieldtype ):
+        sim.fld.erase( fieldtype )
+        species.deposit( sim.fld, fieldtype )
+        sim.fld.sum_reduce_deposition_array( fieldtype )
+        return( [ getattr( sim.fld.interp[m], field ).copy() for m in range(3)
+            for field in { 'rho':['rho'], 'J':['Jr', 'Jt', 'Jz'] }[fieldtype] ] )
+
+    for i_push in range(2):
+        # Regular deposition
+        species.use_shape_factor_cache = False
+        ref = { fieldtype: deposit( fieldtype ) for fieldtype in ['rho', 'J'] }
+        # Deposition with cached shape factors
+        species.use_shape_factor_cache = True
+        for fieldtype in ['rho', 'J', 'rho']:
+            for array, ref_array in zip( deposit(fieldtype), ref[fieldtype] ):
+                assert np.allclose( array, ref_array, rtol=1.e-12,
+                                    atol=1.e-12*abs(ref_array).max() )
+        # Check that the cache was reused, and is invalidated by push_x
+        assert species.shape_factor_cache is not None
+        species.push_x( 0.3*sim.dt )
+        assert species.shape_factor_cache is None
+
+    # Check that the cache is invalidated when the particle arrays are
+    # reallocated (even if the number of particles does not change)
+    deposit( 'rho' )
+    assert species.shape_factor_cache is not None
+    reallocate_and_copy_old( species, False, species.Ntot, species.Ntot )
+    assert species.shape_factor_cache is None
+
 if __name__ == '__main__' :
 
     test_uniform_electron_plasma(show)
     test_neutral_plasma_shifted(show)
+    test_deposition_bounds()
+    test_multi_species_deposition()
+    test_shape_factor_cache()
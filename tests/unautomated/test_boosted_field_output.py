@@ -0,0 +1,57 @@
+# Copyright 2024, FBPIC contributors
+# License: 3-Clause-BSD-LBNL
+"""
+This file runs a short boosted-frame simulation of a laser in vacuum,
+with back-transformed (lab-frame) field diagnostics.
+
+This file is used by the automated test `test_boosted_field_output.py`,
+which runs it with one and two MPI ranks, and compares the lab-frame output.
+(Without plasma, the fields do not depend on the domain decomposition,
+up to round-off errors.)
+"""
+from scipy.constants import c
+# Import the relevant structures in FBPIC
+from fbpic.main import Simulation
+from fbpic.lpa_utils.laser import add_laser
+from fbpic.lpa_utils.boosted_frame import BoostConverter
+from fbpic.openpmd_diag import BackTransformedFieldDiagnostic
+
+# The simulation box (in the boosted frame)
+Nz = 200
+zmax = 0.e-6
+zmin = -20.e-6
+Nr = 32
+rmax = 20.e-6
+Nm = 2
+n_order = 32
+# The laser (in the lab frame)
+a0 = 1.
+w0 = 5.e-6
+ctau = 3.e-6
+z0 = -10.e-6
+# Boosted frame
+gamma_boost = 5.
+boost = BoostConverter( gamma_boost )
+# The simulation timestep (in the boosted frame)
+dt = (zmax-zmin)/Nz/c
+# Lab-frame diagnostics
+v_window = c
+N_lab_diag = 5
+dt_lab_diag_period = 10.e-6/c
+write_period = 20
+N_step = 100
+
+# Initialize the simulation object
+sim = Simulation( Nz, zmax, Nr, rmax, Nm, dt, zmin=zmin,
+    gamma_boost=gamma_boost, n_order=n_order, use_cuda=False,
+    boundaries={'z':'open', 'r':'reflective'} )
+# Add a laser and a moving window
+add_laser( sim, a0, w0, ctau, z0, gamma_boost=gamma_boost )
+v_window_boosted, = boost.velocity( [ v_window ] )
+sim.set_moving_window( v=v_window_boosted )
+# Set the lab-frame diagnostics
+sim.diags = [ BackTransformedFieldDiagnostic( zmin, zmax, v_window,
+    dt_lab_diag_period, N_lab_diag, gamma_boost, period=write_period,
+    fieldtypes=['E', 'B'], fldobject=sim.fld, comm=sim.comm ) ]
+# Run the simulation
+sim.step( N_step )